@@ -0,0 +1,155 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of the indexed datasets, the NLP datasets and the samplers.
+"""
+
+import itertools
+import os
+
+import numpy as np
+import oneflow as flow
+from common import SEED, measure, register
+
+from libai.data.data_utils import compile_helper
+from libai.data.data_utils.indexed_dataset import (
+    MMapIndexedDataset,
+    MMapIndexedDatasetBuilder,
+    data_file_path,
+    index_file_path,
+)
+from libai.data.datasets import BertDataset, GPT2Dataset
+from libai.data.samplers import CyclicSampler, SingleRoundSampler
+from libai.tokenizer import BertTokenizer
+
+VOCAB_SIZE = 8000
+NUM_SPECIAL_TOKENS = 5
+
+
+def build_corpus(ctx):
+    """
+    Write a corpus of random tokens as a mmap indexed dataset, with documents
+    of 1 to 8 sentences of 8 to 64 tokens.
+    """
+    prefix = os.path.join(ctx.work_dir, "corpus")
+    rng = np.random.RandomState(SEED)
+    builder = MMapIndexedDatasetBuilder(data_file_path(prefix), dtype=np.uint16)
+    for _ in range(ctx.size(20000, 1000)):
+        for _ in range(rng.randint(1, 9)):
+            sentence = rng.randint(NUM_SPECIAL_TOKENS, VOCAB_SIZE, size=rng.randint(8, 65))
+            builder.add_item(flow.tensor(sentence))
+        builder.end_document()
+    builder.finalize(index_file_path(prefix))
+    return prefix
+
+
+def build_bert_tokenizer(ctx):
+    vocab_file = os.path.join(ctx.work_dir, "bert_vocab.txt")
+    with open(vocab_file, "w") as f:
+        tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+        tokens += [f"tok{i}" for i in range(NUM_SPECIAL_TOKENS, VOCAB_SIZE)]
+        f.write("\n".join(tokens) + "\n")
+    return BertTokenizer(vocab_file)
+
+
+def _corpus(ctx):
+    compile_helper()
+    prefix = ctx.cached("corpus", lambda: build_corpus(ctx))
+    return prefix, MMapIndexedDataset(prefix, skip_warmup=True)
+
+
+@register("data/mmap_random_read")
+def bench_mmap_random_read(ctx):
+    _, indexed_dataset = _corpus(ctx)
+    num_reads = ctx.size(20000, 2000)
+    indices = np.random.RandomState(SEED).randint(0, len(indexed_dataset), size=num_reads)
+
+    def read():
+        for i in indices.tolist():
+            # touch the data, np.frombuffer alone does not read it
+            indexed_dataset[i].sum()
+
+    return {"sentences": measure(read, num_reads, ctx.repeat, unit="sentences")}
+
+
+def _bench_dataset_getitem(ctx, dataset):
+    num_samples = min(len(dataset), ctx.size(2000, 200))
+    indices = np.random.RandomState(SEED).randint(0, len(dataset), size=num_samples)
+
+    def get():
+        for i in indices.tolist():
+            dataset[i]
+
+    return measure(get, num_samples, ctx.repeat, unit="samples")
+
+
+@register("data/gpt2_dataset_getitem")
+def bench_gpt2_dataset(ctx):
+    prefix, indexed_dataset = _corpus(ctx)
+    results = {}
+    for seq_length in (128, 512):
+        dataset = GPT2Dataset(
+            "bench",
+            None,
+            prefix,
+            indexed_dataset,
+            max_num_samples=ctx.size(10000, 500),
+            max_seq_length=seq_length,
+            seed=SEED,
+        )
+        results[f"seq{seq_length}"] = _bench_dataset_getitem(ctx, dataset)
+    return results
+
+
+@register("data/bert_dataset_getitem")
+def bench_bert_dataset(ctx):
+    prefix, indexed_dataset = _corpus(ctx)
+    tokenizer = ctx.cached("bert_tokenizer", lambda: build_bert_tokenizer(ctx))
+    results = {}
+    for seq_length in (128, 512):
+        dataset = BertDataset(
+            "bench",
+            tokenizer,
+            indexed_dataset,
+            prefix,
+            max_num_samples=ctx.size(10000, 500),
+            mask_lm_prob=0.15,
+            max_seq_length=seq_length,
+            short_seq_prob=0.1,
+            seed=SEED,
+        )
+        results[f"seq{seq_length}"] = _bench_dataset_getitem(ctx, dataset)
+    return results
+
+
+@register("data/sampler_iteration")
+def bench_samplers(ctx):
+    dataset = list(range(ctx.size(1000000, 20000)))
+    micro_batch_size = 32
+    num_batches = ctx.size(5000, 200)
+    results = {}
+    for shuffle in (False, True):
+        cyclic = CyclicSampler(dataset, micro_batch_size, shuffle=shuffle, seed=SEED)
+        single_round = SingleRoundSampler(dataset, micro_batch_size, shuffle=shuffle, seed=SEED)
+        for name, sampler in (("cyclic", cyclic), ("single_round", single_round)):
+
+            def iterate():
+                for _ in itertools.islice(iter(sampler), num_batches):
+                    pass
+
+            case = "{}_{}".format(name, "shuffle" if shuffle else "sequential")
+            results[case] = measure(iterate, num_batches, ctx.repeat, unit="batches")
+    return results
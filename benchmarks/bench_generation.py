@@ -0,0 +1,306 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Latency benchmark of `Generator.generate`, on tiny randomly initialized GPT2, Llama and T5
+models, over a grid of batch sizes, prompt lengths and output lengths, e.g.
+
+    python benchmarks/bench_generation.py --output baseline.json
+    python benchmarks/bench_generation.py --compare baseline.json --threshold 0.1
+
+With `--compare`, the script exits with status 1 if any case regressed by more than
+`--threshold` relative to the baseline.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(1, os.path.dirname(BENCHMARK_DIR))
+
+import numpy as np  # noqa: E402
+import oneflow as flow  # noqa: E402
+from common import ROOT_DIR, SEED, set_seed, setup_cpu_dist, sync  # noqa: E402
+from run_benchmarks import environment  # noqa: E402
+
+from libai.config import LazyConfig, instantiate  # noqa: E402
+from libai.inference.generator.generation_logits_processor import LogitsProcessorList  # noqa: E402
+from libai.utils import distributed as dist  # noqa: E402
+
+VOCAB_SIZE = 1024
+
+# config file, model key and the overrides making it tiny
+MODELS = {
+    "gpt2": (
+        "projects/MagicPrompt/configs/gpt2_inference.py",
+        "model",
+        dict(
+            hidden_layers=2,
+            hidden_size=64,
+            ffn_hidden_size=256,
+            num_attention_heads=4,
+            max_seq_length=1024,
+            vocab_size=VOCAB_SIZE,
+            eos_token_id=VOCAB_SIZE - 1,
+            bos_token_id=VOCAB_SIZE - 1,
+        ),
+    ),
+    "llama": (
+        "projects/Llama/configs/llama_config.py",
+        "model",
+        dict(
+            hidden_layers=2,
+            hidden_size=64,
+            intermediate_size=256,
+            num_attention_heads=4,
+            num_key_value_heads=4,
+            max_position_embeddings=1024,
+            vocab_size=VOCAB_SIZE,
+            amp_enabled=False,
+        ),
+    ),
+    "t5": (
+        "projects/MT5/configs/t5_inference.py",
+        "model",
+        dict(
+            hidden_layers=2,
+            hidden_size=64,
+            head_size=16,
+            intermediate_size=256,
+            num_attention_heads=4,
+            vocab_size=VOCAB_SIZE,
+            hidden_dropout_prob=0.0,
+            attention_probs_dropout_prob=0.0,
+            embedding_dropout_prob=0.0,
+        ),
+    ),
+}
+
+METHODS = {
+    "greedy_search": dict(do_sample=False, num_beams=1),
+    "multinomial_sample": dict(do_sample=True, num_beams=1, top_k=50, top_p=1.0),
+    "beam_search": dict(do_sample=False, num_beams=2),
+}
+
+# metric -> +1 if higher is better, -1 if lower is better
+GATED_METRICS = {
+    "ttft_seconds": -1,
+    "token_latency_p50_seconds": -1,
+    "tokens_per_second": 1,
+}
+
+
+class TokenTimer:
+    """
+    A logits processor leaving the scores unchanged, which records when the logits of every
+    new token are ready. Logits processors run at every step, including the last one, unlike
+    stopping criteria, which are skipped after the one checking `max_length`.
+    """
+
+    def __init__(self):
+        self.timestamps = []
+
+    def __call__(self, input_ids, scores):
+        sync()
+        self.timestamps.append(time.perf_counter())
+        return scores
+
+
+def build_model(name):
+    config_file, model_key, overrides = MODELS[name]
+    config = LazyConfig.load(os.path.join(ROOT_DIR, config_file))
+    config.cfg.update(overrides)
+    set_seed()
+    model = instantiate(config[model_key])
+    model.eval()
+    return model
+
+
+def peak_memory_mb():
+    """The peak resident set size of the process so far, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(model, method, batch_size, prompt_length, output_length, repeat):
+    rng = np.random.RandomState(SEED)
+    # no pad token in the prompts, `min_length` below keeps eos from ending them early
+    prompt = rng.randint(2, VOCAB_SIZE - 1, size=(batch_size, prompt_length))
+    input_ids = flow.tensor(
+        prompt,
+        dtype=flow.long,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+    if model.cfg.is_encoder_decoder:
+        max_length = output_length + 1  # the decoder start token
+    else:
+        max_length = prompt_length + output_length
+
+    ttfts, token_latencies, totals = [], [], []
+    for i in range(repeat + 1):
+        set_seed()
+        timer = TokenTimer()
+        sync()
+        start = time.perf_counter()
+        model.generate(
+            input_ids,
+            max_length=max_length,
+            min_length=max_length,
+            logits_processor=LogitsProcessorList([timer]),
+            **METHODS[method],
+        )
+        sync()
+        end = time.perf_counter()
+        if i == 0:
+            # warmup
+            continue
+        ttfts.append(timer.timestamps[0] - start)
+        token_latencies.extend(np.diff(timer.timestamps).tolist())
+        totals.append(end - start)
+
+    num_tokens = batch_size * output_length
+    total = statistics.median(totals)
+    latencies = np.array(token_latencies) if token_latencies else np.zeros(1)
+    return {
+        "ttft_seconds": statistics.median(ttfts),
+        "token_latency_p50_seconds": float(np.percentile(latencies, 50)),
+        "token_latency_p90_seconds": float(np.percentile(latencies, 90)),
+        "token_latency_p99_seconds": float(np.percentile(latencies, 99)),
+        "total_seconds": total,
+        "tokens_per_second": num_tokens / total,
+        "peak_memory_mb": peak_memory_mb(),
+        "repeat": repeat,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns:
+        list[str]: the regressions of the gated metrics larger than `threshold`.
+    """
+    regressions = []
+    for case, result in results.items():
+        base = baseline.get(case)
+        if base is None or "skipped" in result or "skipped" in base:
+            continue
+        for metric, direction in GATED_METRICS.items():
+            if base[metric] <= 0:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            if -direction * change > threshold:
+                regressions.append(
+                    f"{case} {metric}: {base[metric]:.6g} -> {result[metric]:.6g} "
+                    f"({change:+.1%})"
+                )
+    return regressions
+
+
+def print_results(results):
+    rows = [("case", "ttft ms", "p50 ms", "p90 ms", "p99 ms", "tokens/s", "peak MB")]
+    for case, result in results.items():
+        if "skipped" in result:
+            rows.append((case, "skipped: " + result["skipped"], "", "", "", "", ""))
+            continue
+        rows.append(
+            (
+                case,
+                "{:.2f}".format(result["ttft_seconds"] * 1000),
+                "{:.2f}".format(result["token_latency_p50_seconds"] * 1000),
+                "{:.2f}".format(result["token_latency_p90_seconds"] * 1000),
+                "{:.2f}".format(result["token_latency_p99_seconds"] * 1000),
+                "{:.1f}".format(result["tokens_per_second"]),
+                "{:.0f}".format(result["peak_memory_mb"]),
+            )
+        )
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def _int_list(value):
+    return [int(x) for x in value.split(",")]
+
+
+def default_argument_parser():
+    parser = argparse.ArgumentParser(description="LiBai generation latency benchmark")
+    parser.add_argument("--models", default=",".join(MODELS), help="comma separated")
+    parser.add_argument("--methods", default=",".join(METHODS), help="comma separated")
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 4])
+    parser.add_argument("--prompt-lengths", type=_int_list, default=[16, 128])
+    parser.add_argument("--output-lengths", type=_int_list, default=[16, 64])
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of every case")
+    parser.add_argument("--quick", action="store_true", help="a single small case per method")
+    parser.add_argument("--output", default="", help="path of the json file to write")
+    parser.add_argument("--compare", default="", help="a previous json output to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative change of a gated metric counted as a regression",
+    )
+    return parser
+
+
+def main(args):
+    if args.quick:
+        args.batch_sizes, args.prompt_lengths, args.output_lengths = [1], [8], [4]
+        args.repeat = 1
+
+    setup_cpu_dist()
+    results = {}
+    for name in args.models.split(","):
+        model = build_model(name)
+        grid = itertools.product(
+            args.methods.split(","), args.batch_sizes, args.prompt_lengths, args.output_lengths
+        )
+        for method, batch_size, prompt_length, output_length in grid:
+            case = f"{name}/{method}/bs{batch_size}_in{prompt_length}_out{output_length}"
+            print(f"running {case}", flush=True)
+            try:
+                results[case] = run_case(
+                    model, method, batch_size, prompt_length, output_length, args.repeat
+                )
+            except NotImplementedError as e:
+                # e.g. beam search of a model without `_reorder_cache`
+                results[case] = {"skipped": str(e).split("\n")[0]}
+        del model
+    print_results(results)
+
+    if args.output:
+        output = {"environment": environment(), "results": results}
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}:")
+            print("\n".join(regressions))
+            sys.exit(1)
+        print(f"no regression above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main(default_argument_parser().parse_args())
@@ -0,0 +1,59 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of the layers.
+"""
+
+import oneflow as flow
+from common import measure, register, set_seed
+
+from libai.layers import MultiheadAttention
+from libai.utils import distributed as dist
+
+
+@register("layers/attention_forward_backward")
+def bench_attention(ctx):
+    hidden_size, num_heads, batch_size = 256, 8, 4
+    sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+    placement = dist.get_layer_placement(0)
+    results = {}
+    for seq_length in ctx.size((128, 512, 1024), (64, 128)):
+        set_seed()
+        attention = MultiheadAttention(hidden_size, num_heads)
+        hidden_states = flow.randn(
+            batch_size, seq_length, hidden_size, sbp=sbp, placement=placement
+        ).requires_grad_()
+        # causal mask, 1 for the positions to attend
+        mask = flow.tril(flow.ones(seq_length, seq_length)).expand(
+            batch_size, 1, seq_length, seq_length
+        )
+        mask = mask.to_global(sbp=sbp, placement=placement)
+
+        def forward():
+            with flow.no_grad():
+                attention(hidden_states, attention_mask=mask)
+
+        def forward_backward():
+            attention(hidden_states, attention_mask=mask).sum().backward()
+
+        num_tokens = batch_size * seq_length
+        results[f"forward_seq{seq_length}"] = measure(
+            forward, num_tokens, ctx.repeat, unit="tokens"
+        )
+        results[f"forward_backward_seq{seq_length}"] = measure(
+            forward_backward, num_tokens, ctx.repeat, unit="tokens"
+        )
+    return results
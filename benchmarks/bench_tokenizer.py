@@ -0,0 +1,121 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of the encoding rate of the tokenizers, on the sample text of the test fixtures.
+The vocabularies are built from the same text, so that no token is unknown.
+"""
+
+import json
+import os
+from collections import Counter
+
+from common import FIXTURES_DIR, measure, register
+
+from libai.tokenizer import BertTokenizer, GPT2Tokenizer, RobertaTokenizer, T5Tokenizer
+from libai.tokenizer.tokenization_bert import BasicTokenizer
+from libai.tokenizer.tokenization_gpt2 import bytes_to_unicode
+
+NUM_MERGES = 500
+
+
+def _sample_lines():
+    with open(os.path.join(FIXTURES_DIR, "sample_text.txt"), encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _write_bert_vocab(path, lines):
+    words = Counter()
+    basic_tokenizer = BasicTokenizer(do_lower_case=True)
+    for line in lines:
+        words.update(basic_tokenizer.tokenize(line))
+    tokens = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + sorted(words)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(tokens) + "\n")
+
+
+def _write_bpe_files(vocab_file, merges_file, lines):
+    """
+    Learn `NUM_MERGES` byte level BPE merges from `lines`.
+    """
+    byte_encoder = bytes_to_unicode()
+    words = Counter()
+    for line in lines:
+        for i, word in enumerate(line.split(" ")):
+            word = (" " if i > 0 else "") + word
+            words[tuple(byte_encoder[b] for b in word.encode("utf-8"))] += 1
+
+    vocab = list(byte_encoder.values())
+    merges = []
+    for _ in range(NUM_MERGES):
+        pairs = Counter()
+        for word, count in words.items():
+            for pair in zip(word, word[1:]):
+                pairs[pair] += count
+        if not pairs:
+            break
+        best = max(pairs, key=lambda pair: (pairs[pair], pair))
+        merges.append(best)
+        vocab.append(best[0] + best[1])
+        merged_words = Counter()
+        for word, count in words.items():
+            merged, i = [], 0
+            while i < len(word):
+                if i + 1 < len(word) and (word[i], word[i + 1]) == best:
+                    merged.append(word[i] + word[i + 1])
+                    i += 2
+                else:
+                    merged.append(word[i])
+                    i += 1
+            merged_words[tuple(merged)] += count
+        words = merged_words
+
+    vocab += ["<s>", "<pad>", "</s>", "<unk>", "<mask>", "<|endoftext|>"]
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        json.dump({token: i for i, token in enumerate(vocab)}, f)
+    with open(merges_file, "w", encoding="utf-8") as f:
+        f.write("#version: 0.2\n" + "\n".join(" ".join(merge) for merge in merges) + "\n")
+
+
+def _build_tokenizers(ctx):
+    lines = _sample_lines()
+    bert_vocab = os.path.join(ctx.work_dir, "tokenizer_bert_vocab.txt")
+    _write_bert_vocab(bert_vocab, lines)
+    bpe_vocab = os.path.join(ctx.work_dir, "tokenizer_bpe_vocab.json")
+    bpe_merges = os.path.join(ctx.work_dir, "tokenizer_bpe_merges.txt")
+    _write_bpe_files(bpe_vocab, bpe_merges, lines)
+    return {
+        "bert": BertTokenizer(bert_vocab),
+        "gpt2": GPT2Tokenizer(bpe_vocab, bpe_merges),
+        "roberta": RobertaTokenizer(bpe_vocab, bpe_merges),
+        "t5": T5Tokenizer(os.path.join(FIXTURES_DIR, "test_sentencepiece.model")),
+    }
+
+
+@register("tokenizer/encode")
+def bench_tokenizers(ctx):
+    lines = _sample_lines() * ctx.size(20, 2)
+    results = {}
+    for name, tokenizer in _build_tokenizers(ctx).items():
+        num_tokens = sum(len(tokenizer.encode(line)) for line in lines)
+
+        def encode():
+            for line in lines:
+                tokenizer.encode(line)
+
+        result = measure(encode, len(lines), ctx.repeat, unit="lines")
+        result["tokens_per_second"] = num_tokens / result["median_seconds"]
+        results[name] = result
+    return results
@@ -0,0 +1,119 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks of the eager training step of tiny BERT and GPT models on random tokens.
+"""
+
+import os
+
+import numpy as np
+import oneflow as flow
+from common import ROOT_DIR, SEED, measure, register, set_seed
+
+from libai.config import LazyConfig, instantiate
+from libai.data.structures import DistTensorData, Instance
+from libai.engine import DefaultTrainer
+from libai.engine.trainer import EagerTrainer
+from libai.optim import build_optimizer
+from libai.utils.events import EventStorage
+
+VOCAB_SIZE = 1024
+TINY_MODEL = dict(
+    hidden_layers=2,
+    hidden_size=128,
+    num_attention_heads=4,
+    vocab_size=VOCAB_SIZE,
+    bias_gelu_fusion=False,
+    bias_dropout_fusion=False,
+    scale_mask_softmax_fusion=False,
+)
+
+
+def _gpt_batches(batch_size, seq_length):
+    rng = np.random.RandomState(SEED)
+    while True:
+        tokens = rng.randint(0, VOCAB_SIZE, size=(batch_size, seq_length + 1))
+        yield Instance(
+            input_ids=DistTensorData(flow.tensor(tokens[:, :-1])),
+            labels=DistTensorData(flow.tensor(tokens[:, 1:]), placement_idx=-1),
+        )
+
+
+def _bert_batches(batch_size, seq_length):
+    rng = np.random.RandomState(SEED)
+    while True:
+        tokens = rng.randint(0, VOCAB_SIZE, size=(batch_size, seq_length))
+        loss_mask = rng.rand(batch_size, seq_length) < 0.15
+        yield Instance(
+            input_ids=DistTensorData(flow.tensor(tokens)),
+            attention_mask=DistTensorData(flow.tensor(np.ones_like(tokens, dtype=bool))),
+            tokentype_ids=DistTensorData(flow.tensor(np.zeros_like(tokens))),
+            ns_labels=DistTensorData(
+                flow.tensor(rng.randint(0, 2, size=batch_size)), placement_idx=-1
+            ),
+            lm_labels=DistTensorData(flow.tensor(tokens), placement_idx=-1),
+            loss_mask=DistTensorData(flow.tensor(loss_mask), placement_idx=-1),
+        )
+
+
+def _build_trainer(model_config, model_overrides, batches):
+    set_seed()
+    model_cfg = LazyConfig.load(os.path.join(ROOT_DIR, "configs/common/models", model_config))
+    model_cfg.cfg.update(TINY_MODEL)
+    model_cfg.cfg.update(model_overrides)
+    model = instantiate(model_cfg.pretrain_model)
+    optim_cfg = LazyConfig.load(os.path.join(ROOT_DIR, "configs/common/optim.py")).optim
+    optimizer = build_optimizer(optim_cfg, model)
+    return EagerTrainer(model, batches, optimizer)
+
+
+def _bench_trainer(ctx, trainer, batch_size):
+    num_steps = ctx.size(20, 3)
+
+    def train():
+        for _ in range(num_steps):
+            trainer.run_step(DefaultTrainer.get_batch, "cpu")
+            trainer.iter += 1
+        trainer.flush_metrics()
+
+    with EventStorage():
+        result = measure(train, num_steps, ctx.repeat, unit="steps")
+    result["samples_per_second"] = result["items_per_second"] * batch_size
+    return result
+
+
+@register("trainer/eager_steps")
+def bench_eager_trainer(ctx):
+    batch_size, seq_length = 8, 128
+    gpt = _build_trainer(
+        "gpt.py",
+        dict(ffn_hidden_size=512, max_seq_length=seq_length),
+        _gpt_batches(batch_size, seq_length),
+    )
+    bert = _build_trainer(
+        "bert.py",
+        dict(
+            intermediate_size=512,
+            max_position_embeddings=seq_length,
+            hidden_dropout_prob=0.0,
+            attention_probs_dropout_prob=0.0,
+        ),
+        _bert_batches(batch_size, seq_length),
+    )
+    return {
+        "gpt_tiny": _bench_trainer(ctx, gpt, batch_size),
+        "bert_tiny": _bench_trainer(ctx, bert, batch_size),
+    }
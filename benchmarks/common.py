@@ -0,0 +1,135 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Registry and timing helpers shared by the benchmarks.
+"""
+
+import os
+import random
+import statistics
+import time
+from collections import OrderedDict
+
+import numpy as np
+import oneflow as flow
+from omegaconf import DictConfig
+
+from libai.utils import distributed as dist
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+FIXTURES_DIR = os.path.join(ROOT_DIR, "tests", "fixtures")
+SEED = 1234
+
+# name -> function(ctx) returning a dict of case name -> result dict
+BENCHMARKS = OrderedDict()
+
+
+def register(name):
+    """
+    Register a benchmark function under `name`, e.g. "data/mmap_random_read".
+    The function takes a :class:`BenchmarkContext` and returns a dict mapping
+    the name of every measured case to the result of :func:`measure`.
+    """
+
+    def decorator(fn):
+        assert name not in BENCHMARKS, f"benchmark {name} is registered twice"
+        BENCHMARKS[name] = fn
+        return fn
+
+    return decorator
+
+
+class BenchmarkContext:
+    """
+    Args:
+        work_dir (str): a temporary directory for the generated files.
+        quick (bool): run smaller sizes with fewer repeats, e.g. as a smoke test.
+        repeat (int): the number of timed runs of every case.
+    """
+
+    def __init__(self, work_dir, quick=False, repeat=5):
+        self.work_dir = work_dir
+        self.quick = quick
+        self.repeat = 2 if quick else repeat
+        self._cache = {}
+
+    def size(self, full, quick):
+        return quick if self.quick else full
+
+    def cached(self, key, build):
+        """
+        Build a fixture, e.g. a corpus, once for all the benchmarks using it.
+        """
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+
+def set_seed(seed=SEED):
+    random.seed(seed)
+    np.random.seed(seed)
+    flow.manual_seed(seed)
+
+
+def setup_cpu_dist():
+    dist.setup_dist_util(
+        DictConfig(
+            dict(
+                data_parallel_size=1,
+                tensor_parallel_size=1,
+                pipeline_parallel_size=1,
+                device_type="cpu",
+            )
+        )
+    )
+
+
+def sync():
+    """Wait for the asynchronously launched oneflow ops."""
+    flow._oneflow_internal.eager.Sync()
+
+
+def measure(fn, num_items=1, repeat=5, warmup=1, unit="items"):
+    """
+    Time `fn` `repeat` times after `warmup` untimed runs.
+
+    Args:
+        fn (callable): runs the workload once, and processes `num_items` items.
+        num_items (int): the number of items processed by one run of `fn`.
+        unit (str): the name of the items, e.g. "samples" or "tokens".
+
+    Returns:
+        dict: the median and min seconds per run, and the items per second of the
+            median run.
+    """
+    for _ in range(warmup):
+        fn()
+    sync()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        sync()
+        times.append(time.perf_counter() - start)
+    median = statistics.median(times)
+    return {
+        "median_seconds": median,
+        "min_seconds": min(times),
+        "repeat": repeat,
+        "num_items": num_items,
+        "unit": unit,
+        "items_per_second": num_items / median if median > 0 else float("inf"),
+    }
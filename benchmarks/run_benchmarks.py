@@ -0,0 +1,129 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Run the CPU benchmarks and write the results as JSON, e.g.
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --filter data/ --compare results.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARK_DIR)
+sys.path.insert(1, os.path.dirname(BENCHMARK_DIR))
+
+import bench_data  # noqa: E402, F401
+import bench_layers  # noqa: E402, F401
+import bench_tokenizer  # noqa: E402, F401
+import bench_trainer  # noqa: E402, F401
+import oneflow as flow  # noqa: E402
+from common import BENCHMARKS, ROOT_DIR, BenchmarkContext, set_seed, setup_cpu_dist  # noqa: E402
+
+
+def default_argument_parser():
+    parser = argparse.ArgumentParser(description="LiBai CPU benchmarks")
+    parser.add_argument(
+        "--filter", default="", help="only run the benchmarks whose name contains this string"
+    )
+    parser.add_argument("--quick", action="store_true", help="small sizes, for a smoke test")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs of every case")
+    parser.add_argument("--output", default="", help="path of the json file to write")
+    parser.add_argument("--compare", default="", help="a previous json output to compare with")
+    parser.add_argument("--list", action="store_true", help="list the benchmarks and exit")
+    return parser
+
+
+def environment():
+    try:
+        git_rev = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        )
+        git_rev = git_rev.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        git_rev = None
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_rev": git_rev,
+        "python": platform.python_version(),
+        "oneflow": flow.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _flatten(results):
+    for name, cases in results.items():
+        for case, result in cases.items():
+            yield f"{name}:{case}", result
+
+
+def print_results(results, baseline=None):
+    baseline = dict(_flatten(baseline)) if baseline else {}
+    rows = [("case", "median s", "rate", "vs baseline")]
+    for key, result in _flatten(results):
+        rate = "{:.1f} {}/s".format(result["items_per_second"], result["unit"])
+        change = ""
+        if key in baseline and baseline[key]["items_per_second"] > 0:
+            ratio = result["items_per_second"] / baseline[key]["items_per_second"]
+            change = "{:+.1%}".format(ratio - 1)
+        rows.append((key, "{:.4f}".format(result["median_seconds"]), rate, change))
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def main(args):
+    names = [name for name in BENCHMARKS if args.filter in name]
+    if args.list:
+        print("\n".join(names))
+        return
+
+    setup_cpu_dist()
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="libai_bench_") as work_dir:
+        ctx = BenchmarkContext(work_dir, quick=args.quick, repeat=args.repeat)
+        for name in names:
+            print(f"running {name}", flush=True)
+            set_seed()
+            results[name] = BENCHMARKS[name](ctx)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        output = {
+            "environment": environment(),
+            "quick": args.quick,
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main(default_argument_parser().parse_args())
@@ -22,6 +22,7 @@ cfg = dict(
     apply_query_key_layer_scaling=True,
     apply_residual_post_layernorm=False,
     amp_enabled=False,
+    attention_block_size=None,
 )
 
 cfg = DictConfig(cfg)
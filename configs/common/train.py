@@ -23,6 +23,11 @@ train = dict(
     train_micro_batch_size=32,
     global_batch_size=None,
     num_accumulation_steps=None,
+    # Before training, try the micro-batch sizes dividing `global_batch_size // data_parallel_size`
+    # up to `max_micro_batch_size` with `trial_steps` eager steps each, stopping at the first
+    # one running out of memory, and set `train_micro_batch_size` and `num_accumulation_steps`
+    # to the fastest combination for `global_batch_size`.
+    auto_batch_size=dict(enabled=False, max_micro_batch_size=None, trial_steps=3),
 
     # The total training iterations
     train_iter=10000,
@@ -68,7 +73,11 @@ train = dict(
 
     # Save a model checkpoint after every this number of iterations,
     # and maximum number of checkpoint will be kept.
-    checkpointer=dict(period=5000, max_to_keep=100, save_model_after_n_epoch=None),
+    # If `async_save` is True, every rank writes its own shard in the background,
+    # `output_dir` must be shared by all ranks.
+    checkpointer=dict(
+        period=5000, max_to_keep=100, save_model_after_n_epoch=None, async_save=False
+    ),
 
     # Options for evaluation
 
@@ -92,6 +101,16 @@ train = dict(
         # Metrics to be used for best model checkpoint.
         eval_metric="Acc@1",
         eval_mode="max",
+
+        # Evaluate snapshots of the weights in an eval worker launched on spare devices with
+        # `tools/eval_worker.py`, instead of pausing the training every `eval_period`.
+        # The results are collected every `poll_period` iterations, and up to
+        # `final_timeout` seconds after training.
+        background=dict(
+            enabled=False,
+            poll_period=20,
+            final_timeout=600,
+        ),
     ),
 
     # Path to a checkpoint file to be loaded to the model for training or evaluation.
@@ -99,6 +118,20 @@ train = dict(
 
     # Output log to console after every this number of iterations.
     log_period=20,
+    # Serve the latest metrics at http://<rank0 host>:`port`/metrics for Prometheus,
+    # set `tokens_per_sample` to export the throughput in tokens/s.
+    open_metrics=dict(enabled=False, port=9400, tokens_per_sample=None),
+    # Write the metrics json file and tensorboard events in a background thread,
+    # from a snapshot of the metrics, instead of in the training loop.
+    async_log_write=False,
+
+    # Sample the time of the phases of training steps (data fetching, forward, backward,
+    # optimizer step, hooks...) and of the forward of every module in eager mode.
+    # `num_steps` steps are recorded every `period` steps after `warmup` steps,
+    # the device is synchronized in these steps only.
+    # The events are exported to `output_dir/profile_trace.json` in the chrome trace format,
+    # and summarized in the log every `log_period` iterations.
+    profiler=dict(enabled=False, period=1000, num_steps=3, warmup=10, record_modules=True),
 
     # lr_scheduler arguments
     # See libai/scheduler/lr_scheduler.py for definition.
@@ -13,16 +13,20 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import oneflow as flow
 from omegaconf import OmegaConf
-from oneflow.utils.data import DataLoader
+from oneflow.utils.data import DataLoader, Dataset
 from oneflow.utils.data.dataset import ConcatDataset
 
 from libai.config import LazyCall, instantiate
 from libai.utils import distributed as dist
 
 from .data_utils import get_train_valid_test_split_
-from .samplers import CyclicSampler, SingleRoundSampler
-from .structures import Instance
+from .samplers import CyclicSampler, PaddingIndex, SingleRoundSampler
+from .structures import DistTensorData, Instance
+
+# the field of the test batches marking their real samples, see `ValidMaskDataset`
+VALID_MASK_FIELD = "valid_mask"
 
 
 def build_nlp_train_val_test_loader(
@@ -33,7 +37,7 @@ def build_nlp_train_val_test_loader(
     train_batch_size,
     test_batch_size,
     train_sampler=LazyCall(CyclicSampler)(shuffle=True),
-    test_sampler=LazyCall(SingleRoundSampler)(shuffle=False, drop_last=False),
+    test_sampler=LazyCall(SingleRoundSampler)(shuffle=False, drop_last=False, pad_last_batch=True),
     num_workers=4,
     consumed_samples=0,
     seed=0,
@@ -222,7 +226,7 @@ def build_nlp_train_loader(
 def build_nlp_test_loader(
     dataset,
     test_batch_size,
-    sampler=LazyCall(SingleRoundSampler)(shuffle=False, drop_last=False),
+    sampler=LazyCall(SingleRoundSampler)(shuffle=False, drop_last=False, pad_last_batch=True),
     num_workers=4,
     seed=0,
     collate_fn=None,
@@ -260,7 +264,7 @@ def build_nlp_test_loader(
     sampler = instantiate(sampler)
 
     test_loader = DataLoader(
-        dataset,
+        ValidMaskDataset(dataset),
         batch_sampler=sampler,
         num_workers=num_workers,
         persistent_workers=True if num_workers > 0 else False,
@@ -348,7 +352,7 @@ def build_image_train_loader(
 def build_image_test_loader(
     dataset,
     test_batch_size,
-    sampler=LazyCall(SingleRoundSampler)(shuffle=True, drop_last=False),
+    sampler=LazyCall(SingleRoundSampler)(shuffle=True, drop_last=False, pad_last_batch=True),
     num_workers=4,
     seed=0,
     collate_fn=None,
@@ -386,7 +390,7 @@ def build_image_test_loader(
     sampler = instantiate(sampler)
 
     return DataLoader(
-        dataset,
+        ValidMaskDataset(dataset),
         batch_sampler=sampler,
         num_workers=num_workers,
         persistent_workers=True if num_workers > 0 else False,
@@ -395,6 +399,34 @@ def build_image_test_loader(
     )
 
 
+class ValidMaskDataset(Dataset):
+    """
+    Wrap the dataset of a test loader, to add to every :class:`Instance` sample a bool
+    field ``VALID_MASK_FIELD``, False for the :class:`PaddingIndex` samples completing the
+    last batches of the sampler. ``inference_on_dataset`` uses this mask, laid out like the
+    other fields of the batch, to leave the padding samples out of the evaluation.
+
+    Other samples are returned unchanged, so their loaders should use a sampler without
+    ``pad_last_batch``, whose short last batches ``inference_on_dataset`` pads itself.
+    The mask is only used with the samplers setting ``pad_last_batch`` or
+    ``variable_batch_size``, as the other ones complete their batches with real samples.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        sample = self.dataset[idx]
+        if not isinstance(sample, Instance):
+            return sample
+        # a new instance, as the dataset may return the same one for the padding samples
+        valid = DistTensorData(flow.tensor(not isinstance(idx, PaddingIndex), dtype=flow.bool))
+        return Instance(**sample.get_fields(), **{VALID_MASK_FIELD: valid})
+
+
 def trivial_batch_collator(batch):
     assert isinstance(batch[0], Instance), "batch[0] must be `instance` for trivial batch collator"
     batch = Instance.stack(batch)
@@ -13,4 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .samplers import CyclicSampler, SingleRoundSampler
+from .samplers import (
+    CyclicSampler,
+    PaddingIndex,
+    SingleRoundSampler,
+    TokenBudgetSampler,
+    token_budget_batches,
+)
@@ -106,6 +106,17 @@ class CyclicSampler(Sampler):
         self.epoch = epoch
 
 
+class PaddingIndex(int):
+    """
+    The index of a sample completing the last batch of a single round sampler, which must
+    be left out of the evaluation. Being an int, datasets load it as any other index, and
+    the test loaders mark the loaded sample as invalid.
+    """
+
+    def __repr__(self):
+        return "PaddingIndex({})".format(int(self))
+
+
 class SingleRoundSampler(Sampler):
     """
     This sampler supports single round sampling, and it is also compatible with
@@ -120,6 +131,12 @@ class SingleRoundSampler(Sampler):
         data_parallel_size: the size of data parallelism.
         seed: random seed, used for reproducing experiments (default: ``0``).
         drop_last: whether to drop the remaining data (default: ``False``).
+        pad_last_batch: whether to complete the last batch of every rank with
+            :class:`PaddingIndex` samples when the remaining data is kept (default: ``False``).
+            Only for the loaders marking these samples, as the ones of
+            :func:`libai.data.build_nlp_test_loader` and
+            :func:`libai.data.build_image_test_loader`, otherwise ``inference_on_dataset``
+            cannot tell them apart.
     """
 
     def __init__(
@@ -131,6 +148,7 @@ class SingleRoundSampler(Sampler):
         data_parallel_size=1,
         seed=0,
         drop_last=False,
+        pad_last_batch=False,
     ):
         self.dataset = dataset
         self.data_size = len(self.dataset)
@@ -142,6 +160,7 @@ class SingleRoundSampler(Sampler):
 
         self.seed = seed
         self.drop_last = drop_last
+        self.pad_last_batch = pad_last_batch
 
     def __iter__(self):
         bucket_size = self.data_size // self.data_parallel_size
@@ -171,7 +190,13 @@ class SingleRoundSampler(Sampler):
                 yield batch
                 batch = []
 
-        if not self.drop_last:
+        if not self.drop_last and self.pad_last_batch:
+            # every rank completes its last batch to `micro_batch_size` with padding samples,
+            # so that the global batches keep a fixed size and an even layout
+            num_batches = (len(indices) + self.micro_batch_size - 1) // self.micro_batch_size
+            if len(batch) > 0 or num_batches < len(self):
+                yield batch + [PaddingIndex(0)] * (self.micro_batch_size - len(batch))
+        elif not self.drop_last:
             if self.data_parallel_rank >= remain and remain > 0:
                 batch.append(0)
             if len(batch) > 0:
@@ -183,3 +208,87 @@ class SingleRoundSampler(Sampler):
             return self.data_size // global_batch_size
         else:
             return (self.data_size + global_batch_size - 1) // global_batch_size
+
+
+def token_budget_batches(lengths, max_tokens, multiple_of=1):
+    """
+    Group the indices of ``lengths`` by descending length into batches of at most
+    ``max_tokens`` tokens once padded to their first, i.e. longest, length.
+
+    Every batch has a multiple of ``multiple_of`` indices, at least ``multiple_of`` even
+    over the budget, except the last one, which has the remaining indices.
+
+    Returns:
+        list[list[int]]: the indices of every batch.
+    """
+    order = sorted(range(len(lengths)), key=lambda idx: (-lengths[idx], idx))
+    batches = []
+    start = 0
+    while start < len(order):
+        padded_length = max(lengths[order[start]], 1)
+        num_rows = max(max_tokens // padded_length // multiple_of, 1) * multiple_of
+        batches.append(order[start : start + num_rows])
+        start += num_rows
+    return batches
+
+
+class TokenBudgetSampler(Sampler):
+    """
+    This sampler supports single round sampling of batches holding about ``max_tokens``
+    tokens on each data parallel rank instead of a fixed number of samples. The samples
+    are visited by descending length, so that the batches of short samples hold more of
+    them when the collate function pads to the longest sample of the batch.
+
+    Every data parallel rank gets the same number of samples, the last batch being completed
+    with :class:`PaddingIndex` samples after the end of the dataset.
+    As the batch size varies, it should only be used to evaluate eager models.
+
+    Arguments:
+        dataset: dataset to be sampled.
+        max_tokens: the number of tokens per batch of a model instance.
+        lengths: the number of tokens of every sample, defaults to ``dataset.lengths``.
+        data_parallel_rank: local rank for data parallelism.
+        data_parallel_size: the size of data parallelism.
+        micro_batch_size: no use, the batch size follows ``max_tokens``.
+        seed: no use, the samples are ordered by length.
+    """
+
+    variable_batch_size = True
+
+    def __init__(
+        self,
+        dataset,
+        max_tokens,
+        lengths=None,
+        data_parallel_rank=0,
+        data_parallel_size=1,
+        micro_batch_size=None,
+        seed=0,
+    ):
+        self.dataset = dataset
+        self.max_tokens = max_tokens
+        self.lengths = dataset.lengths if lengths is None else lengths
+        assert len(self.lengths) == len(dataset), "lengths must have one entry per sample"
+        self.data_parallel_rank = data_parallel_rank
+        self.data_parallel_size = data_parallel_size
+        self.batches = token_budget_batches(
+            self.lengths, max_tokens * data_parallel_size, multiple_of=data_parallel_size
+        )
+
+    def num_samples(self, num_batches):
+        """
+        Returns:
+            int: the number of samples of the first ``num_batches`` batches on all ranks.
+        """
+        return sum(len(batch) for batch in self.batches[:num_batches])
+
+    def __iter__(self):
+        for batch in self.batches:
+            num_rows = (len(batch) + self.data_parallel_size - 1) // self.data_parallel_size
+            start_idx = self.data_parallel_rank * num_rows
+            local_batch = batch[start_idx : start_idx + num_rows]
+            # the padding is at the end of the global batch
+            yield local_batch + [PaddingIndex(0)] * (num_rows - len(local_batch))
+
+    def __len__(self):
+        return len(self.batches)
@@ -0,0 +1,175 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Evaluation of training snapshots by a separate process, see ``tools/eval_worker.py``.
+
+The training run saves the weights to ``snapshot_dir`` with an asynchronous
+:class:`Checkpointer`, so that the training steps only wait for the copy of the weights
+to host memory. An eval worker, launched on spare devices or nodes, evaluates every
+committed snapshot and writes its results to ``results_dir``, from where
+:class:`libai.engine.hooks.BackgroundEvalHook` posts them to the training run.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+from libai.utils import distributed as dist
+from libai.utils.sharded_checkpoint import is_sharded_checkpoint
+
+logger = logging.getLogger(__name__)
+
+# written to the snapshot dir once the last snapshot of the training run is committed
+TRAINING_DONE_FILE = "training_done"
+
+_SNAPSHOT_PATTERN = re.compile(r"^model_(\d+)$")
+
+
+def snapshot_name(iteration):
+    return "model_{:07d}".format(iteration)
+
+
+def committed_snapshots(snapshot_dir):
+    """
+    Returns:
+        list[tuple[int, str]]: the iteration and the name of every snapshot in
+            ``snapshot_dir`` whose manifest is committed, in increasing iteration order.
+    """
+    if not os.path.isdir(snapshot_dir):
+        return []
+    snapshots = []
+    for name in os.listdir(snapshot_dir):
+        match = _SNAPSHOT_PATTERN.match(name)
+        if match and is_sharded_checkpoint(os.path.join(snapshot_dir, name)):
+            snapshots.append((int(match.group(1)), name))
+    return sorted(snapshots)
+
+
+def write_results(results_dir, name, iteration, results):
+    """
+    Atomically write the flattened ``results`` of the snapshot ``name`` to
+    ``results_dir/name.json``, so that readers never see a partial file.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, name + ".json")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"iteration": iteration, "results": results}, f)
+    os.replace(tmp_path, path)
+
+
+def read_results(results_dir):
+    """
+    Returns:
+        list[tuple[str, int, dict]]: the snapshot name, the iteration and the flattened
+            results of every results file in ``results_dir``, in increasing iteration order.
+    """
+    if not os.path.isdir(results_dir):
+        return []
+    found = []
+    for filename in os.listdir(results_dir):
+        name, ext = os.path.splitext(filename)
+        if ext != ".json":
+            continue
+        with open(os.path.join(results_dir, filename), "r") as f:
+            content = json.load(f)
+        found.append((name, content["iteration"], content["results"]))
+    return sorted(found, key=lambda result: result[1])
+
+
+def remove_results(results_dir, name):
+    """Remove the results of the snapshot ``name`` once they are collected."""
+    path = os.path.join(results_dir, name + ".json")
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def clear_stale_files(snapshot_dir, results_dir):
+    """
+    Remove the snapshots, the results and the done marker left by an earlier training run,
+    e.g. before a resume, so that the results of its snapshots are not taken for the ones
+    of the new snapshots of the same iterations.
+    """
+    done_file = os.path.join(snapshot_dir, TRAINING_DONE_FILE)
+    if os.path.exists(done_file):
+        os.remove(done_file)
+    if os.path.isdir(snapshot_dir):
+        for name in os.listdir(snapshot_dir):
+            if _SNAPSHOT_PATTERN.match(name):
+                shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+    if os.path.isdir(results_dir):
+        for filename in os.listdir(results_dir):
+            if filename.endswith((".json", ".json.tmp")):
+                os.remove(os.path.join(results_dir, filename))
+
+
+class BackgroundEvaluator:
+    """
+    Evaluate the snapshots of a training run as they are committed, until the run is done.
+
+    All the ranks of the eval worker load the same snapshot, the listing of ``snapshot_dir``
+    and ``results_dir`` being done by the main process only.
+    """
+
+    def __init__(self, checkpointer, eval_function, snapshot_dir, results_dir, poll_seconds=10):
+        """
+        Args:
+            checkpointer (Checkpointer): loads the snapshots into the evaluated model.
+            eval_function (callable): a function which takes no arguments, and
+                returns a flat dict of evaluation metrics.
+            poll_seconds (float): the seconds to wait between two listings of ``snapshot_dir``.
+        """
+        self.checkpointer = checkpointer
+        self.eval_function = eval_function
+        self.snapshot_dir = snapshot_dir
+        self.results_dir = results_dir
+        self.poll_seconds = poll_seconds
+
+    def _pending(self):
+        pending, done = None, None
+        if dist.is_main_process():
+            done = os.path.exists(os.path.join(self.snapshot_dir, TRAINING_DONE_FILE))
+            evaluated = {name for name, _, _ in read_results(self.results_dir)}
+            pending = [
+                snapshot
+                for snapshot in committed_snapshots(self.snapshot_dir)
+                if snapshot[1] not in evaluated
+            ]
+        return dist.broadcast_py_object((pending, done))
+
+    def evaluate(self, iteration, name):
+        logger.info("Evaluating snapshot {} of iteration {}".format(name, iteration))
+        self.checkpointer.load(os.path.join(self.snapshot_dir, name), checkpointables=[])
+        results = self.eval_function()
+        if dist.is_main_process():
+            write_results(self.results_dir, name, iteration, results)
+        dist.synchronize()
+        return results
+
+    def run(self):
+        while True:
+            # the done marker is read before listing, so that no last snapshot is missed
+            pending, done = self._pending()
+            if pending:
+                self.evaluate(*pending[0])
+            elif done:
+                logger.info("Training is done and all its snapshots are evaluated")
+                return
+            else:
+                time.sleep(self.poll_seconds)
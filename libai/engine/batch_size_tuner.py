@@ -0,0 +1,163 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import gc
+import logging
+import time
+
+import numpy as np
+import oneflow as flow
+
+from libai.utils import distributed as dist
+from libai.utils.memory import is_out_of_memory
+
+logger = logging.getLogger(__name__)
+
+
+def _sync():
+    flow._oneflow_internal.eager.Sync()
+
+
+class BatchSizeTuner:
+    """
+    Choose the micro-batch size and the number of accumulation steps giving the highest
+    training throughput for a fixed global batch size.
+
+    Every candidate micro-batch size, i.e. every divisor of
+    ``global_batch_size // data_parallel_size`` up to ``max_micro_batch_size``, is tried in
+    increasing order by running ``trial_steps`` eager training steps of ``model`` on the
+    first samples of ``dataset``. The first candidate running out of memory ends the search.
+    As the global batch is ``num_accumulation_steps`` micro-batches, the throughput of a
+    candidate is its micro-batch size divided by the time of one micro-batch step.
+
+    The trial steps update ``model`` and ``optimizer``, so they should be built for tuning only.
+    """
+
+    def __init__(
+        self,
+        model,
+        optimizer,
+        dataset,
+        collate_fn,
+        get_batch,
+        global_batch_size,
+        data_parallel_size=1,
+        *,
+        max_micro_batch_size=None,
+        trial_steps=3,
+        input_placement_device="cuda",
+    ):
+        """
+        Args:
+            model (nn.Module): takes a batch and returns a dict of losses.
+            dataset: the training dataset, whose samples are batched with ``collate_fn``.
+            get_batch (callable): converts a collated batch to the model inputs,
+                like :meth:`DefaultTrainer.get_batch`.
+            global_batch_size (int): the number of samples per iteration on all ranks.
+            max_micro_batch_size (int, optional): the largest micro-batch size to try.
+            trial_steps (int): the number of timed steps per candidate, after a warmup step.
+        """
+        assert global_batch_size % data_parallel_size == 0, (
+            f"global_batch_size {global_batch_size} must be divisible by "
+            f"data_parallel_size {data_parallel_size}"
+        )
+        self.model = model
+        self.optimizer = optimizer
+        self.dataset = dataset
+        self.collate_fn = collate_fn
+        self.get_batch = get_batch
+        self.global_batch_size = global_batch_size
+        self.data_parallel_size = data_parallel_size
+        self.max_micro_batch_size = max_micro_batch_size
+        self.trial_steps = trial_steps
+        self.input_placement_device = input_placement_device
+
+    def candidates(self):
+        """
+        Returns:
+            list[int]: the micro-batch sizes dividing the batch of one rank, in increasing order.
+        """
+        per_rank = self.global_batch_size // self.data_parallel_size
+        limit = min(per_rank, self.max_micro_batch_size or per_rank)
+        return [size for size in range(1, limit + 1) if per_rank % size == 0]
+
+    def _step(self, micro_batch_size):
+        samples = [self.dataset[i % len(self.dataset)] for i in range(micro_batch_size)]
+        data = self.get_batch(self.collate_fn(samples), self.input_placement_device)
+        loss_dict = self.model(**data)
+        losses = sum(v for k, v in loss_dict.items() if "loss" in k)
+        losses.backward()
+        self.optimizer.step()
+        self.optimizer.zero_grad()
+
+    def trial(self, micro_batch_size):
+        """
+        Returns:
+            float or None: the seconds of one step of ``micro_batch_size`` samples per rank,
+                or None if a rank ran out of memory.
+        """
+        try:
+            self._step(micro_batch_size)
+            _sync()
+            start = time.perf_counter()
+            for _ in range(self.trial_steps):
+                self._step(micro_batch_size)
+            _sync()
+            seconds = (time.perf_counter() - start) / self.trial_steps
+        except Exception as e:
+            if not is_out_of_memory(e):
+                raise
+            seconds = None
+        self.optimizer.zero_grad()
+        gc.collect()
+        if flow.cuda.is_available():
+            flow.cuda.empty_cache()
+
+        # every rank must stop at the same candidate
+        seconds_of_ranks = dist.gather_to_rank0(np.array([np.nan if seconds is None else seconds]))
+        if dist.is_main_process():
+            seconds = None if np.isnan(seconds_of_ranks).any() else float(seconds_of_ranks.max())
+        return dist.broadcast_py_object(seconds)
+
+    def tune(self):
+        """
+        Returns:
+            tuple[int, int, list[dict]]: the micro-batch size and the number of accumulation
+                steps with the highest throughput, and the ``micro_batch_size`` and
+                ``samples_per_second`` (None when out of memory) of every tried candidate.
+        """
+        results = []
+        for micro_batch_size in self.candidates():
+            seconds = self.trial(micro_batch_size)
+            samples_per_second = (
+                None if seconds is None else micro_batch_size * self.data_parallel_size / seconds
+            )
+            results.append(
+                {"micro_batch_size": micro_batch_size, "samples_per_second": samples_per_second}
+            )
+            if seconds is None:
+                logger.info(f"Micro-batch size {micro_batch_size}: out of memory")
+                break
+            logger.info(f"Micro-batch size {micro_batch_size}: {samples_per_second:.2f} samples/s")
+
+        fitting = [result for result in results if result["samples_per_second"] is not None]
+        if not fitting:
+            raise RuntimeError("Even a micro-batch of 1 sample runs out of memory")
+        best = max(fitting, key=lambda result: result["samples_per_second"])
+        micro_batch_size = best["micro_batch_size"]
+        num_accumulation_steps = self.global_batch_size // (
+            micro_batch_size * self.data_parallel_size
+        )
+        return micro_batch_size, num_accumulation_steps, results
@@ -14,6 +14,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import gc
 import logging
 import math
 import os
@@ -27,7 +28,9 @@ from termcolor import colored
 
 from libai.config import LazyConfig, instantiate, try_get_key
 from libai.data import Instance
+from libai.data.build import ValidMaskDataset
 from libai.engine import hooks
+from libai.engine.batch_size_tuner import BatchSizeTuner
 from libai.engine.trainer import EagerTrainer, GraphTrainer, TrainerBase
 from libai.evaluation import inference_on_dataset, print_csv_format
 from libai.models import build_graph, build_model
@@ -38,6 +41,8 @@ from libai.utils import distributed as dist
 from libai.utils.checkpoint import Checkpointer
 from libai.utils.events import CommonMetricPrinter, JSONWriter, TensorboardXWriter
 from libai.utils.logger import setup_logger
+from libai.utils.open_metrics import OpenMetricsWriter
+from libai.utils.profiler import StepProfileWriter
 
 # --------------------------------------------------------
 # References:
@@ -261,6 +266,9 @@ class DefaultTrainer(TrainerBase):
         # Initialize tokenizer
         self.tokenizer = self.build_tokenizer(cfg)
 
+        if try_get_key(cfg, "train.auto_batch_size.enabled", default=False):
+            self.auto_tune_batch_size(cfg, self.tokenizer)
+
         self.start_iter = 0
         if cfg.train.resume:
             save_file = os.path.join(cfg.train.output_dir, "last_checkpoint")
@@ -332,6 +340,7 @@ class DefaultTrainer(TrainerBase):
 
         # Assume no other objects need to be checkpointed.
         # We can later make it checkpoint the stateful hooks
+        async_save = try_get_key(cfg, "train.checkpointer.async_save", default=False)
         if cfg.graph.enabled:
             self.checkpointer = Checkpointer(
                 # Assume you want to save checkpoints together with logs/statistics
@@ -343,6 +352,7 @@ class DefaultTrainer(TrainerBase):
                 # We print lr by `LRScheduler` hook, so we need to save/load eager lr_scheduler,
                 # otherwise, lr will be reset to initial state when resuming training.
                 lr_scheduler=self.lr_scheduler,
+                async_save=async_save,
             )
         else:
             self.checkpointer = Checkpointer(
@@ -351,6 +361,7 @@ class DefaultTrainer(TrainerBase):
                 cfg.train.output_dir,
                 optimizer=self.optimizer,
                 lr_scheduler=self.lr_scheduler,
+                async_save=async_save,
             )
 
         # Loading checkpoint before dataloader construction, because
@@ -371,6 +382,8 @@ class DefaultTrainer(TrainerBase):
             else cfg.train.global_batch_size // cfg.train.num_accumulation_steps
         )
         self.max_iter = cfg.train.train_iter
+        # metrics are written to the storage right before the writers run
+        self.metrics_flush_period = cfg.train.log_period
 
         self.register_hooks(self.build_hooks())
 
@@ -413,9 +426,23 @@ class DefaultTrainer(TrainerBase):
             list[HookBase]:
         """
 
+        profiler = None
+        if try_get_key(self.cfg, "train.profiler.enabled", default=False):
+            profiler = hooks.StepProfiler(
+                period=self.cfg.train.profiler.period,
+                num_steps=self.cfg.train.profiler.num_steps,
+                warmup=self.cfg.train.profiler.warmup,
+                # module hooks do not run in static graph mode
+                model=None
+                if self.cfg.graph.enabled or not self.cfg.train.profiler.record_modules
+                else self.model,
+            )
+
         ret = [
             hooks.IterationTimer(),
+            profiler,
             hooks.LRScheduler(),  # for beauty lr scheduler printer in `nn.Graph` mode
+            hooks.PeakMemoryMonitor(),
             hooks.PeriodicCheckpointer(
                 self.checkpointer,
                 self.cfg.train.checkpointer.period,
@@ -423,7 +450,9 @@ class DefaultTrainer(TrainerBase):
             ),
         ]
 
-        if self.cfg.train.evaluation.enabled:
+        if try_get_key(self.cfg, "train.evaluation.background.enabled", default=False):
+            ret.extend(self.build_background_eval_hooks())
+        elif self.cfg.train.evaluation.enabled:
             assert self.cfg.train.evaluation.eval_iter > 0, "run_iter must be positive number"
 
             def test_and_save_results():
@@ -445,9 +474,72 @@ class DefaultTrainer(TrainerBase):
 
         if dist.is_main_process():
             # run writers in the end, so that evaluation metrics are written
-            ret.append(hooks.PeriodicWriter(self.build_writers(), self.cfg.train.log_period))
+            writers = self.build_writers()
+            if profiler is not None:
+                writers.append(
+                    StepProfileWriter(
+                        profiler, os.path.join(self.cfg.train.output_dir, "profile_trace.json")
+                    )
+                )
+            if try_get_key(self.cfg, "train.open_metrics.enabled", default=False):
+                writers.append(
+                    OpenMetricsWriter(
+                        port=self.cfg.train.open_metrics.port,
+                        batch_size=self.global_batch_size,
+                        tokens_per_sample=self.cfg.train.open_metrics.tokens_per_sample,
+                        gauges={"libai_data_loader_queue_depth": self._data_loader_queue_depth},
+                    )
+                )
+            ret.append(
+                hooks.PeriodicWriter(
+                    writers,
+                    self.cfg.train.log_period,
+                    async_write=try_get_key(self.cfg, "train.async_log_write", default=False),
+                )
+            )
         return ret
 
+    def build_background_eval_hooks(self):
+        """
+        Returns:
+            list[HookBase]: the hooks snapshotting the model for the eval worker of
+                ``tools/eval_worker.py`` and checkpointing the best snapshot.
+        """
+        evaluation = self.cfg.train.evaluation
+        snapshot_dir, results_dir = self.background_eval_dirs(self.cfg)
+        best_checkpointer = hooks.BestCheckpointer(
+            evaluation.eval_period,
+            self.checkpointer,
+            val_metric=try_get_key(self.cfg, "train.evaluation.eval_metric", default="Acc@1"),
+            mode=try_get_key(self.cfg, "train.evaluation.eval_mode", default="max"),
+            from_snapshots=True,
+        )
+        eval_hook = hooks.BackgroundEvalHook(
+            evaluation.eval_period,
+            Checkpointer(self.model, snapshot_dir, async_save=True),
+            results_dir,
+            poll_period=evaluation.background.poll_period,
+            final_timeout=evaluation.background.final_timeout,
+            on_results=best_checkpointer.check_snapshot,
+        )
+        return [eval_hook, best_checkpointer]
+
+    @staticmethod
+    def background_eval_dirs(cfg):
+        """
+        Returns:
+            tuple[str, str]: the directories of the snapshots and of their evaluation results
+                shared by the training run and its eval worker.
+        """
+        return (
+            os.path.join(cfg.train.output_dir, "eval_snapshots"),
+            os.path.join(cfg.train.output_dir, "eval_results"),
+        )
+
+    def _data_loader_queue_depth(self):
+        # number of batches requested to the workers of a multi-process data loader
+        return getattr(self._trainer._data_loader_iter, "_tasks_outstanding", 0)
+
     def build_writers(self):
         """
         Build a list of writers to be used. By default it contains
@@ -490,6 +582,9 @@ class DefaultTrainer(TrainerBase):
         self._trainer.iter = self.iter
         self._trainer.run_step(self.get_batch, self.cfg.train.input_placement_device)
 
+    def flush_metrics(self):
+        self._trainer.flush_metrics()
+
     @classmethod
     def get_batch(
         cls,
@@ -692,6 +787,51 @@ class DefaultTrainer(TrainerBase):
         test_loader = instantiate(cfg.dataloader.test, _recursive_=False)
         return test_loader
 
+    @classmethod
+    def auto_tune_batch_size(cls, cfg, tokenizer=None):
+        """
+        Set ``train.train_micro_batch_size`` and ``train.num_accumulation_steps`` to the
+        combination with the highest throughput for ``train.global_batch_size``, found by
+        :class:`libai.engine.batch_size_tuner.BatchSizeTuner` with a model, an optimizer and
+        a data loader built for the trials only.
+        """
+        logger = logging.getLogger(__name__)
+        logger.info(
+            "Auto-tuning the micro-batch size for global_batch_size={}".format(
+                cfg.train.global_batch_size
+            )
+        )
+        train_loader, _, _ = cls.build_train_loader(cfg, tokenizer)
+        model = cls.build_model(cfg)
+        optimizer = cls.build_optimizer(cfg, model)
+        tuner = BatchSizeTuner(
+            model,
+            optimizer,
+            train_loader.dataset,
+            train_loader.collate_fn,
+            cls.get_batch,
+            cfg.train.global_batch_size,
+            dist.get_data_parallel_size(),
+            max_micro_batch_size=try_get_key(cfg, "train.auto_batch_size.max_micro_batch_size"),
+            trial_steps=try_get_key(cfg, "train.auto_batch_size.trial_steps", default=3),
+            input_placement_device=cfg.train.input_placement_device,
+        )
+        micro_batch_size, num_accumulation_steps, _ = tuner.tune()
+        del tuner, optimizer, model, train_loader
+        gc.collect()
+        if flow.cuda.is_available():
+            flow.cuda.empty_cache()
+
+        cfg.train.train_micro_batch_size = micro_batch_size
+        cfg.train.num_accumulation_steps = num_accumulation_steps
+        logger.info(
+            "Auto-tuned the config to train.train_micro_batch_size={}, "
+            "train.num_accumulation_steps={}".format(micro_batch_size, num_accumulation_steps)
+        )
+        output_dir = try_get_key(cfg, "train.output_dir")
+        if dist.is_main_process() and output_dir:
+            LazyConfig.save(cfg, os.path.join(output_dir, "config.yaml"))
+
     @classmethod
     def auto_scale_hyperparams(cls, cfg, data_loader):
         logger = logging.getLogger(__name__)
@@ -806,7 +946,10 @@ class DefaultTrainer(TrainerBase):
         for idx, data_loader in enumerate(test_loaders):
             # When evaluators are passed in as arguments,
             # implicitly assume that evaluators can be created before data_loader.
-            dataset_name = type(data_loader.dataset).__name__
+            dataset = data_loader.dataset
+            if isinstance(dataset, ValidMaskDataset):
+                dataset = dataset.dataset
+            dataset_name = type(dataset).__name__
             # TODO: support multi evaluator
             # if evaluators is not None:
             #     evaluator = evaluators[idx]
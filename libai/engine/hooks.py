@@ -14,10 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import concurrent.futures
 import datetime
 import logging
 import math
 import operator
+import os
+import shutil
 import time
 from collections import Counter
 
@@ -27,9 +30,18 @@ from libai.evaluation import flatten_results_dict
 from libai.utils import distributed as dist
 from libai.utils.checkpoint import Checkpointer
 from libai.utils.checkpoint import PeriodicCheckpointer as _PeriodicCheckpointer
-from libai.utils.events import EventWriter
+from libai.utils.events import EventWriter, use_event_storage
+from libai.utils.memory import get_memory_used_mb
+from libai.utils.profiler import StepProfiler as _StepProfiler
 from libai.utils.timer import Timer
 
+from .background_eval import (
+    TRAINING_DONE_FILE,
+    clear_stale_files,
+    read_results,
+    remove_results,
+    snapshot_name,
+)
 from .trainer import HookBase
 
 # --------------------------------------------------------
@@ -127,6 +139,17 @@ class IterationTimer(HookBase):
                 str(datetime.timedelta(seconds=int(hook_time))),
             )
         )
+        hook_times = {
+            name[len("hook_time/") :]: history.global_avg()
+            for name, history in self.trainer.storage.histories().items()
+            if name.startswith("hook_time/")
+        }
+        if len(hook_times) > 0:
+            logger.info(
+                "Average time of hooks per iteration: {}".format(
+                    ", ".join("{}: {:.4f} s".format(k, v) for k, v in hook_times.items())
+                )
+            )
 
     def before_step(self):
         self._step_timer.reset()
@@ -151,27 +174,106 @@ class PeriodicWriter(HookBase):
     It is executed every ``period`` iterations and after the last iteration.
     """
 
-    def __init__(self, writers, period=20):
+    def __init__(self, writers, period=20, async_write=False):
         """
         Args:
             writers (list[EventWriter]): a list of EventWriter objects
             period (int):
+            async_write (bool): if True, the writers whose `async_safe` is True
+                write a snapshot of the storage in a background thread,
+                and the others write in the training loop.
         """
         self._writers = writers
         for w in writers:
             assert isinstance(w, EventWriter), w
         self._period = period
+        self._sync_writers = [w for w in writers if not (async_write and w.async_safe)]
+        self._async_writers = [w for w in writers if async_write and w.async_safe]
+        self._executor = None
+        self._pending_write = None
 
     def after_step(self):
         if (self.trainer.iter + 1) % self._period == 0 or (
             self.trainer.iter == self.trainer.max_iter - 1
         ):
-            for writer in self._writers:
+            for writer in self._sync_writers:
                 writer.write()
+            if len(self._async_writers) > 0:
+                self._write_async()
+
+    def _write_async(self):
+        # one write at a time, which keeps the writes in order
+        self._wait()
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="PeriodicWriter"
+            )
+        snapshot = self.trainer.storage.snapshot()
+
+        def write():
+            with use_event_storage(snapshot):
+                for writer in self._async_writers:
+                    writer.write()
+
+        self._pending_write = self._executor.submit(write)
+
+    def _wait(self):
+        if self._pending_write is not None:
+            pending_write, self._pending_write = self._pending_write, None
+            # raise the error of the writers in the training loop
+            pending_write.result()
 
     def after_train(self):
-        for writer in self._writers:
-            writer.close()
+        try:
+            self._wait()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+            for writer in self._writers:
+                writer.close()
+
+
+class StepProfiler(_StepProfiler, HookBase):
+    """
+    Same as :class:`libai.utils.profiler.StepProfiler`, but as a hook.
+    It should be placed at the beginning of the list of hooks, like
+    :class:`IterationTimer`, so that the time of a recorded step covers the other hooks.
+    Use :class:`libai.utils.profiler.StepProfileWriter` to export the recorded events.
+    """
+
+    def before_train(self):
+        self.activate(self.trainer.start_iter)
+
+    def before_step(self):
+        self.step(self.trainer.iter)
+
+    def after_train(self):
+        self.deactivate()
+
+
+class PeakMemoryMonitor(HookBase):
+    """
+    Put the peak memory of every step of this rank, in MB, into the storage as
+    ``max_mem_mb``, which is printed by :class:`libai.utils.events.CommonMetricPrinter`.
+    On cuda, the peak allocated memory is reset after every step when OneFlow supports it,
+    otherwise the memory used on the device is reported. On cpu, the peak resident memory
+    of the process is reported.
+    """
+
+    def __init__(self, device_type=None):
+        self._device_type = device_type
+
+    def before_train(self):
+        if self._device_type is None:
+            self._device_type = dist.get_dist_util().device_type
+
+    def after_step(self):
+        memory_mb = get_memory_used_mb(self._device_type)
+        if memory_mb is None:
+            return
+        self.trainer.storage.put_scalar("max_mem_mb", memory_mb, smoothing_hint=False)
+        if self._device_type == "cuda" and hasattr(flow.cuda, "reset_peak_memory_stats"):
+            flow.cuda.reset_peak_memory_stats()
 
 
 class PeriodicCheckpointer(_PeriodicCheckpointer, HookBase):
@@ -189,6 +291,10 @@ class PeriodicCheckpointer(_PeriodicCheckpointer, HookBase):
     def after_step(self):
         self.step(self.trainer.iter)
 
+    def after_train(self):
+        # make sure the last asynchronous save is committed before exiting
+        self.checkpointer.wait()
+
 
 class BestCheckpointer(HookBase):
     """
@@ -204,6 +310,7 @@ class BestCheckpointer(HookBase):
         val_metric: str,
         mode: str = "max",
         file_prefix: str = "model_best",
+        from_snapshots: bool = False,
     ) -> None:
         """
         Args:
@@ -213,8 +320,12 @@ class BestCheckpointer(HookBase):
             mode (str): one of {'max', 'min'}. controls whether the chosen val metric should be
                 maximized or minimized, e.g. for "acc@1" it should be "max"
             file_prefix (str): the prefix of checkpoint's filename, defaults to "model_best"
+            from_snapshots (bool): if True, the metric is checked by :meth:`check_snapshot`
+                when `BackgroundEvalHook` posts the results of a snapshot, which becomes the
+                best checkpoint instead of the current weights.
         """
         self._period = eval_period
+        self._from_snapshots = from_snapshots
         self._val_metric = val_metric
         assert mode in [
             "max",
@@ -236,7 +347,7 @@ class BestCheckpointer(HookBase):
         self.best_iter = iteration
         return True
 
-    def _best_checking(self):
+    def _is_best(self, metric_iter=None):
         metric_tuple = self.trainer.storage.latest().get(self._val_metric)
         flag = flow.zeros(1)
         if dist.is_main_process():
@@ -246,7 +357,9 @@ class BestCheckpointer(HookBase):
                     "Will not be checkpointed based on that."
                 )
             else:
-                latest_metric, metric_iter = metric_tuple
+                latest_metric, stored_iter = metric_tuple
+                if metric_iter is None:
+                    metric_iter = stored_iter
 
                 if self.best_metric is None:
                     if self._update_best(latest_metric, metric_iter):
@@ -274,14 +387,36 @@ class BestCheckpointer(HookBase):
         flag = flag.to_global(
             sbp=flow.sbp.broadcast, placement=flow.env.all_device_placement("cpu")
         )
-        if flag.to_local().item() == 1:
+        return flag.to_local().item() == 1
+
+    def _best_checking(self):
+        if self._is_best():
             self._checkpointer.save(f"{self._file_prefix}")
 
+    def check_snapshot(self, iteration, snapshot_dir):
+        """
+        Copy ``snapshot_dir`` to the best checkpoint if the latest stored metric, computed
+        on the snapshot of ``iteration``, is the best one.
+        The snapshot holds the model weights only.
+        """
+        if self._is_best(iteration):
+            if dist.is_main_process():
+                best_dir = os.path.join(self._checkpointer.save_dir, self._file_prefix)
+                tmp_dir = best_dir + ".tmp"
+                if os.path.exists(tmp_dir):
+                    shutil.rmtree(tmp_dir)
+                shutil.copytree(snapshot_dir, tmp_dir)
+                if os.path.exists(best_dir):
+                    shutil.rmtree(best_dir)
+                os.rename(tmp_dir, best_dir)
+            dist.synchronize()
+
     def after_step(self):
         # same conditions as `EvalHook`
         next_iter = self.trainer.iter + 1
         if (
-            self._period > 0
+            not self._from_snapshots
+            and self._period > 0
             and next_iter % self._period == 0
             and next_iter != self.trainer.max_iter
         ):
@@ -289,7 +424,7 @@ class BestCheckpointer(HookBase):
 
     def after_train(self):
         # same conditions as `EvalHook`
-        if self.trainer.iter + 1 >= self.trainer.max_iter:
+        if not self._from_snapshots and self.trainer.iter + 1 >= self.trainer.max_iter:
             self._best_checking()
 
 
@@ -354,6 +489,116 @@ class EvalHook(HookBase):
         del self._func
 
 
+class BackgroundEvalHook(HookBase):
+    """
+    Evaluate the model in a separate eval worker (see ``tools/eval_worker.py``) instead of
+    pausing the training, every ``eval_period`` iterations and after the last iteration.
+
+    The weights are saved to ``snapshot_dir`` with an asynchronous ``checkpointer``,
+    so that the training only waits for their copy to host memory. Every ``poll_period``
+    iterations the results written by the worker to ``results_dir`` are put to the storage
+    at the current iteration, the snapshots being a few iterations behind, and passed with
+    the iteration and the directory of their snapshot to ``on_results``, e.g.
+    :meth:`BestCheckpointer.check_snapshot`. The snapshot and its results are deleted
+    afterwards, and the ones left by an earlier run are deleted before training.
+    """
+
+    def __init__(
+        self,
+        eval_period,
+        checkpointer,
+        results_dir,
+        poll_period=20,
+        final_timeout=600,
+        on_results=None,
+    ):
+        """
+        Args:
+            eval_period (int): the period to snapshot the weights.
+            checkpointer (Checkpointer): an asynchronous checkpointer of the model
+                saving to the snapshot dir watched by the eval worker.
+            results_dir (str): the directory the eval worker writes its results to.
+            poll_period (int): the period to collect the results of the eval worker.
+            final_timeout (float): the seconds to wait after training for the results
+                of the pending snapshots, 0 not to wait.
+            on_results (callable, optional): called with the iteration and the directory of
+                a snapshot after its results are put to the storage.
+        Note:
+            This hook must be enabled in all or none workers.
+        """
+        assert checkpointer.async_save, "snapshots must be saved asynchronously"
+        self._period = eval_period
+        self._checkpointer = checkpointer
+        self._results_dir = results_dir
+        self._poll_period = poll_period
+        self._final_timeout = final_timeout
+        self._on_results = on_results
+        self._snapshot_dir = checkpointer.save_dir
+        self._pending = set()
+
+    def _snapshot(self):
+        name = snapshot_name(self.trainer.iter)
+        self._checkpointer.save(name)
+        self._pending.add(name)
+
+    def _collect(self):
+        results = None
+        if dist.is_main_process():
+            results = [
+                result for result in read_results(self._results_dir) if result[0] in self._pending
+            ]
+        results = dist.broadcast_py_object(results)
+
+        for name, iteration, flattened_results in results:
+            logger.info(f"Results of the snapshot of iteration {iteration}: {flattened_results}")
+            self.trainer.storage.put_scalars(**flattened_results, smoothing_hint=False)
+            snapshot_dir = os.path.join(self._snapshot_dir, name)
+            if self._on_results is not None:
+                self._on_results(iteration, snapshot_dir)
+            if dist.is_main_process():
+                # the snapshot first, so that the eval worker does not evaluate it again
+                shutil.rmtree(snapshot_dir, ignore_errors=True)
+                remove_results(self._results_dir, name)
+            self._pending.discard(name)
+
+    def before_train(self):
+        if dist.is_main_process():
+            clear_stale_files(self._snapshot_dir, self._results_dir)
+        dist.synchronize()
+
+    def after_step(self):
+        next_iter = self.trainer.iter + 1
+        if self._period > 0 and next_iter % self._period == 0:
+            # do the last snapshot in after_train
+            if next_iter != self.trainer.max_iter:
+                self._snapshot()
+        if self._poll_period > 0 and next_iter % self._poll_period == 0:
+            self._collect()
+
+    def after_train(self):
+        # This condition is to prevent the eval from running after a failed training
+        if self.trainer.iter + 1 >= self.trainer.max_iter:
+            self._snapshot()
+        self._checkpointer.wait()
+        if dist.is_main_process():
+            os.makedirs(self._snapshot_dir, exist_ok=True)
+            open(os.path.join(self._snapshot_dir, TRAINING_DONE_FILE), "w").close()
+
+        deadline = time.time() + self._final_timeout
+        while True:
+            self._collect()
+            # all ranks must stop collecting together
+            waiting = bool(self._pending) and time.time() < deadline
+            if not dist.broadcast_py_object(waiting):
+                break
+            time.sleep(5)
+        if self._pending:
+            logger.warning(
+                f"Snapshots {sorted(self._pending)} were not evaluated "
+                f"within {self._final_timeout}s after training"
+            )
+
+
 class LRScheduler(HookBase):
     """
     A hook which executes a oneflow builtin LR scheduler and summarizes the LR.
@@ -18,10 +18,12 @@ import time
 import weakref
 from typing import Callable, List, Mapping
 
+import numpy as np
 import oneflow as flow
 
 from libai.utils import distributed as dist
 from libai.utils.events import EventStorage, get_event_storage
+from libai.utils.profiler import profile_phase
 
 # --------------------------------------------------------
 # References:
@@ -100,6 +102,9 @@ class TrainerBase:
             By convention the minimum possible value is 0.
         max_iter(int): The iteration to end training.
         storage(EventStorage): An EventStorage that's opened during the course of training.
+        metrics_flush_period(int): The period (in iterations) to write the metrics buffered
+            by :meth:`write_metrics` to the storage. It should divide the period of the
+            writers, so that they see the metrics of the latest iteration.
     """
 
     def __init__(self):
@@ -108,6 +113,9 @@ class TrainerBase:
         self.start_iter: int = 0
         self.max_iter: int
         self.storage: EventStorage
+        self.metrics_flush_period: int = 1
+        self._metrics_buffer = []
+        self._metrics_keys = None
 
     def register_hooks(self, hooks):
         """
@@ -144,7 +152,8 @@ class TrainerBase:
                 for self.iter in range(start_iter, max_iter):
                     self.before_step()
                     self.run_step()
-                    self.after_step()
+                    with profile_phase("hooks"):
+                        self.after_step()
                 # self.iter == max_iter can be used by `after_train` to
                 # tell whether the training successfully finished or failed
                 # due to exceptions.
@@ -170,53 +179,88 @@ class TrainerBase:
 
     def after_step(self):
         self.storage.samples = (self.iter + 1) * self.cfg.train.global_batch_size
+        if (self.iter + 1) % self.metrics_flush_period == 0 or self.iter == self.max_iter - 1:
+            # all ranks take part in the flush, which gathers the metrics to rank0
+            self.flush_metrics()
+        # the time of every hook is recorded, to find the hooks that slow down the training
+        hook_times = {}
         for h in self._hooks:
+            start = time.perf_counter()
             h.after_step()
+            name = "hook_time/{}".format(type(h).__name__)
+            hook_times[name] = hook_times.get(name, 0.0) + time.perf_counter() - start
+        for name, hook_time in hook_times.items():
+            self.storage.put_scalar(name, hook_time)
 
     def run_step(self):
         raise NotImplementedError
 
-    @staticmethod
     def write_metrics(
+        self,
         loss_dict: Mapping[str, flow.Tensor],
         data_time: float,
         prefix: str = "",
     ) -> None:
         """
+        Buffer the metrics of the current iteration. The losses stay on device until
+        :meth:`flush_metrics` copies the whole buffer to rank0 at once, so that logging
+        does not synchronize the host with the device in every iteration.
+
         Args:
             loss_dict (dict): dict of scalar losses
             data_time (float): time taken by the dataloader iteration
             prefix (str): prefix for logging keys
         """
-        # get metric value, remove it to rank0 cause logger.info only work in rank0
-        metrics_dict = {
-            k: dist.tensor_to_rank0(v, device="cpu", to_local=True) for k, v in loss_dict.items()
-        }
-        metrics_dict["data_time"] = data_time
-
-        # TODO: Gather metrics among all workers for logging
-        # all_metrics_dict = dist.gather(metrics_dict)
-        all_metrics_dict = metrics_dict
+        metrics_keys = (prefix, tuple(loss_dict.keys()))
+        if self._metrics_buffer and metrics_keys != self._metrics_keys:
+            self.flush_metrics()
+        self._metrics_keys = metrics_keys
+
+        values = [v.detach().to(flow.float32) for v in loss_dict.values()]
+        if len(values) > 0 and values[0].is_global:
+            placement = values[0].placement
+            values = [
+                v if v.placement == placement else v.to_global(placement=placement) for v in values
+            ]
+        metrics = flow.stack(values) if len(values) > 0 else None
+        self._metrics_buffer.append((self.iter, metrics, data_time))
+
+    def flush_metrics(self) -> None:
+        """
+        Write the metrics buffered by :meth:`write_metrics` to the storage of rank0,
+        with one transfer of the losses and one gather of the data time among all workers.
+        It must be called on all ranks.
+        """
+        if len(self._metrics_buffer) == 0:
+            return
+        prefix, keys = self._metrics_keys
+        iters, metrics, data_times = zip(*self._metrics_buffer)
+        self._metrics_buffer = []
+
+        # losses are global tensors, which are already reduced among data parallel workers
+        if len(keys) > 0:
+            metrics = dist.tensor_to_rank0(flow.stack(metrics), device="cpu", to_local=True)
+        # data_time among workers can have high variance. The actual latency
+        # caused by data_time is the maximum among workers.
+        data_times = dist.gather_to_rank0(np.array(data_times, dtype=np.float64))
 
         if dist.is_main_process():
             storage = get_event_storage()
-
-            # data_time among workers can have high variance. The actual latency
-            # caused by data_time is the maximum among workers.
-            # data_time = np.max([x.pop("data_time") for x in all_metrics_dict])
-            data_time = all_metrics_dict.pop("data_time")
-            storage.put_scalar("data_time", data_time)
-
-            # average the rest metrics
-            # metrics_dict = {
-            #     k: np.mean([x[k] for x in all_metrics_dict]) for k in all_metrics_dict[0].keys()
-            # }
-            metrics_dict = all_metrics_dict
-            total_losses_reduced = sum(v for k, v in metrics_dict.items() if "loss" in k)
-
-            storage.put_scalar("{}total_loss".format(prefix), total_losses_reduced)
-            if len(metrics_dict) > 1:
-                storage.put_scalars(**metrics_dict)
+            metrics = metrics.numpy() if len(keys) > 0 else np.zeros((len(iters), 0))
+            data_times = data_times.max(axis=0)
+            current_iter = storage.iter
+            try:
+                for i, it in enumerate(iters):
+                    storage.iter = it
+                    storage.put_scalar("data_time", data_times[i])
+                    metrics_dict = dict(zip(keys, metrics[i].tolist()))
+                    total_losses_reduced = sum(v for k, v in metrics_dict.items() if "loss" in k)
+
+                    storage.put_scalar("{}total_loss".format(prefix), total_losses_reduced)
+                    if len(metrics_dict) > 1:
+                        storage.put_scalars(**metrics_dict)
+            finally:
+                storage.iter = current_iter
 
 
 class EagerTrainer(TrainerBase):
@@ -268,22 +312,28 @@ class EagerTrainer(TrainerBase):
         start = time.perf_counter()
 
         # If you want to do something with the data, you can wrap the dataloader.
-        data = next(self._data_loader_iter)
-        data = get_batch(
-            data, input_placement_device, getattr(self.data_loader, "mixup_func", None)
-        )
+        with profile_phase("fetch"):
+            data = next(self._data_loader_iter)
+        with profile_phase("get_batch"):
+            data = get_batch(
+                data, input_placement_device, getattr(self.data_loader, "mixup_func", None)
+            )
         data_time = time.perf_counter() - start
 
-        loss_dict = self.model(**data)
-        losses = sum(v for k, v in loss_dict.items() if "loss" in k) / self.grad_acc_steps
+        with profile_phase("forward"):
+            loss_dict = self.model(**data)
+            losses = sum(v for k, v in loss_dict.items() if "loss" in k) / self.grad_acc_steps
 
-        losses.backward()
+        with profile_phase("backward"):
+            losses.backward()
         self.write_metrics(loss_dict, data_time)
 
         if (self.iter + 1) % self.grad_acc_steps == 0:
-            self.optimizer.clip_grad()
-            self.optimizer.step()
-            self.optimizer.zero_grad()
+            with profile_phase("clip_grad"):
+                self.optimizer.clip_grad()
+            with profile_phase("optimizer"):
+                self.optimizer.step()
+                self.optimizer.zero_grad()
 
 
 class GraphTrainer(TrainerBase):
@@ -311,7 +361,8 @@ class GraphTrainer(TrainerBase):
 
         while self._temp_count != self.grad_acc_steps:
             # If you want to do something with the data, you can wrap the dataloader.
-            data = next(self._data_loader_iter)
+            with profile_phase("fetch"):
+                data = next(self._data_loader_iter)
 
             self._temp_count += 1
             if self._temp_data is None:
@@ -329,14 +380,17 @@ class GraphTrainer(TrainerBase):
         self._temp_count = 0
         self._temp_data = None
 
-        data = get_batch(
-            data, input_placement_device, getattr(self.data_loader, "mixup_func", None)
-        )
+        with profile_phase("get_batch"):
+            data = get_batch(
+                data, input_placement_device, getattr(self.data_loader, "mixup_func", None)
+            )
 
         data_time = time.perf_counter() - start
 
         # If you want to do something with the losses, you can wrap the model.
-        loss_dict = self.graph(**data)
+        # forward, backward and optimizer step run as one phase in static graph mode
+        with profile_phase("graph"):
+            loss_dict = self.graph(**data)
         # Add this because when set up gradient accumulations, graph will return
         # an unpacked n-d tensor whose size is accumulation step
         for key, value in loss_dict.items():
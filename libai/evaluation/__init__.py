@@ -13,9 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .evaluator import DatasetEvaluator, inference_on_dataset
-from .utils import print_csv_format, flatten_results_dict
+from .bleu_evaluator import BLEUEvaluator
 from .cls_evaluator import ClsEvaluator
+from .evaluator import DatasetEvaluator, StreamingEvaluator, inference_on_dataset
 from .ppl_evaluator import PPLEvaluator
 from .reg_evaluator import RegEvaluator
-from .bleu_evaluator import BLEUEvaluator
+from .utils import flatten_results_dict, print_csv_format
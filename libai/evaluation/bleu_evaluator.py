@@ -14,51 +14,208 @@
 # limitations under the License.
 
 import copy
+import math
+import sys
 from collections import OrderedDict
 
-from nltk.translate.bleu_score import corpus_bleu
+import numpy as np
+import oneflow as flow
+from numpy.lib.stride_tricks import sliding_window_view
 
-from libai.utils import distributed as dist
+from .evaluator import StreamingEvaluator
 
-from .evaluator import DatasetEvaluator
 
-
-class BLEUEvaluator(DatasetEvaluator):
+def ngram_statistics(hypotheses, hyp_lengths, references, ref_lengths, max_order=4):
+    """
+    Compute the sufficient statistics of corpus BLEU for a batch of token ids.
+
+    Every n-gram is keyed by its sample and its tokens, so that the n-grams of a batch are
+    counted at once with a single sort, without any python loop over the samples.
+
+    Args:
+        hypotheses (np.ndarray): int array of shape ``[batch, hyp_len]``.
+        hyp_lengths (np.ndarray): the number of tokens of every hypothesis, of shape ``[batch]``.
+        references (np.ndarray): int array of shape ``[batch, num_refs, ref_len]``.
+        ref_lengths (np.ndarray): the number of tokens of every reference, of shape
+            ``[batch, num_refs]``, and -1 for the missing references of a sample.
+        max_order (int): the maximum n-gram order.
+
+    Returns:
+        np.ndarray: int64 array of shape ``[2 + 2 * max_order]``, holding the total
+            hypothesis length, the total closest reference length, the clipped n-gram
+            matches and the n-gram counts of the hypotheses of every order, as summed
+            by :func:`nltk.translate.bleu_score.corpus_bleu`.
+    """
+    hypotheses = np.asarray(hypotheses, dtype=np.int64)
+    references = np.asarray(references, dtype=np.int64)
+    hyp_lengths = np.asarray(hyp_lengths, dtype=np.int64)
+    ref_lengths = np.asarray(ref_lengths, dtype=np.int64)
+    num_refs = references.shape[1]
+
+    statistics = np.zeros(2 + 2 * max_order, dtype=np.int64)
+    if hypotheses.shape[0] == 0:
+        return statistics
+    statistics[0] = hyp_lengths.sum()
+    # the closest reference length, the shorter one on ties
+    distance = np.abs(ref_lengths - hyp_lengths[:, None])
+    key = np.where(
+        ref_lengths >= 0,
+        distance * (ref_lengths.max() + 1) + ref_lengths,
+        np.iinfo(np.int64).max,
+    )
+    closest = np.take_along_axis(ref_lengths, key.argmin(1)[:, None], 1)
+    statistics[1] = closest.sum()
+
+    for n in range(1, max_order + 1):
+        # at least 1 n-gram per hypothesis, to avoid a division by 0
+        statistics[1 + max_order + n] = np.maximum(1, hyp_lengths - n + 1).sum()
+        if hypotheses.shape[1] < n or references.shape[2] < n:
+            continue
+
+        hyp_ngrams = sliding_window_view(hypotheses, n, axis=1)
+        hyp_mask = np.arange(hyp_ngrams.shape[1]) + n <= hyp_lengths[:, None]
+        hyp_sample = np.nonzero(hyp_mask)[0]
+        if len(hyp_sample) == 0:
+            continue
+        ref_ngrams = sliding_window_view(references, n, axis=2)
+        ref_mask = np.arange(ref_ngrams.shape[2]) + n <= ref_lengths[:, :, None]
+        ref_sample, ref_index, _ = np.nonzero(ref_mask)
+
+        keys = np.concatenate(
+            [
+                np.concatenate([hyp_sample[:, None], hyp_ngrams[hyp_mask]], axis=1),
+                np.concatenate([ref_sample[:, None], ref_ngrams[ref_mask]], axis=1),
+            ]
+        )
+        _, ngram_ids = np.unique(keys, axis=0, return_inverse=True)
+        ngram_ids = ngram_ids.reshape(-1)
+        num_ngrams = ngram_ids.max() + 1
+        hyp_ids, ref_ids = ngram_ids[: len(hyp_sample)], ngram_ids[len(hyp_sample) :]
+
+        hyp_counts = np.bincount(hyp_ids, minlength=num_ngrams)
+        # the count of an n-gram is clipped to its maximum count in a single reference
+        ref_counts = np.bincount(ref_ids * num_refs + ref_index, minlength=num_ngrams * num_refs)
+        max_ref_counts = ref_counts.reshape(num_ngrams, num_refs).max(1)
+        statistics[1 + n] = np.minimum(hyp_counts, max_ref_counts).sum()
+    return statistics
+
+
+def corpus_bleu_statistics(list_of_references, hypotheses, max_order=4):
+    """
+    Same as :func:`ngram_statistics`, for the arguments of
+    :func:`nltk.translate.bleu_score.corpus_bleu`: lists of tokens of any hashable type.
+    """
+    assert len(list_of_references) == len(hypotheses), (
+        "The number of hypotheses and their reference(s) should be the " "same "
+    )
+    vocab = {}
+
+    def encode(tokens):
+        return [vocab.setdefault(token, len(vocab)) for token in tokens]
+
+    batch = len(hypotheses)
+    hyp_lengths = np.array([len(hypothesis) for hypothesis in hypotheses], dtype=np.int64)
+    num_refs = max([len(references) for references in list_of_references], default=1)
+    ref_lengths = np.full((batch, num_refs), -1, dtype=np.int64)
+    for i, references in enumerate(list_of_references):
+        ref_lengths[i, : len(references)] = [len(reference) for reference in references]
+
+    hyp_ids = np.zeros((batch, max(hyp_lengths.max(initial=0), 1)), dtype=np.int64)
+    ref_ids = np.zeros((batch, num_refs, max(ref_lengths.max(initial=0), 1)), dtype=np.int64)
+    for i, (references, hypothesis) in enumerate(zip(list_of_references, hypotheses)):
+        hyp_ids[i, : len(hypothesis)] = encode(hypothesis)
+        for j, reference in enumerate(references):
+            ref_ids[i, j, : len(reference)] = encode(reference)
+    return ngram_statistics(hyp_ids, hyp_lengths, ref_ids, ref_lengths, max_order)
+
+
+def bleu_from_statistics(statistics, max_order=4):
+    """
+    Returns:
+        float: the corpus BLEU of the summed ``statistics`` of :func:`ngram_statistics`,
+            equal to the one of :func:`nltk.translate.bleu_score.corpus_bleu` with its
+            default uniform weights and no smoothing.
+    """
+    statistics = [int(value) for value in statistics]
+    hyp_length, ref_length = statistics[0], statistics[1]
+    numerators = statistics[2 : 2 + max_order]
+    denominators = statistics[2 + max_order :]
+    if numerators[0] == 0:
+        return 0
+
+    if hyp_length > ref_length:
+        brevity_penalty = 1
+    elif hyp_length == 0:
+        brevity_penalty = 0
+    else:
+        brevity_penalty = math.exp(1 - ref_length / hyp_length)
+
+    # without smoothing, an order without any match zeroes the geometric mean
+    precisions = [
+        numerator / denominator if numerator != 0 else sys.float_info.min
+        for numerator, denominator in zip(numerators, denominators)
+    ]
+    weight = 1 / max_order
+    return brevity_penalty * math.exp(
+        math.fsum(weight * math.log(precision) for precision in precisions)
+    )
+
+
+class BLEUEvaluator(StreamingEvaluator):
     """
     Evaluate BLEU(Bilingual Evaluation Understudy) score.
 
     BLEU is a score for comparing a candidate translation
     of text to one or more reference translations.
-    """
 
-    def __init__(self):
-        super().__init__()
-        self._predictions = []
+    The clipped n-gram matches and the lengths are counted for every batch on the ranks
+    holding its samples, and only these sums are reduced after the last batch, to the same
+    score as :func:`nltk.translate.bleu_score.corpus_bleu`.
 
-    def reset(self):
-        self._predictions = []
-
-    def process(self, inputs, outputs):
-        candidate = outputs["candidate"]
-        reference = inputs["reference"]
-
-        self._predictions.append({"candidate": candidate, "reference": reference})
-
-    def evaluate(self):
-        if not dist.is_main_process():
-            return {}
-        else:
-            predictions = self._predictions
-
-        candidates = []
-        references = []
-        for pred in predictions:
-            candidates.append(pred["candidate"])
-            references.append(pred["reference"])
+    ``outputs["candidate"]`` holds the generated token ids of shape ``[batch, length]``,
+    and ``inputs["reference"]`` the reference ids of shape ``[batch, length]``, or
+    ``[batch, num_refs, length]`` for several references per sample, both right-padded with
+    ``pad_token_id``. The empty references but the first of a sample are ignored, which
+    allows a varying number of references.
+    """
 
-        bleu_score = corpus_bleu(references, candidates)
+    def __init__(self, pad_token_id=0, max_order=4):
+        self.pad_token_id = pad_token_id
+        self.max_order = max_order
+        self.reset()
 
+    def process(self, inputs, outputs, valid):
+        candidate = outputs["candidate"]
+        placement, sbp = candidate.placement, candidate.sbp
+        # lay out the samples of the references like the ones of the candidates
+        reference = inputs["reference"].to_global(placement=placement, sbp=sbp)
+        valid = valid.to_global(placement=placement, sbp=sbp).to_local().numpy()
+
+        hypotheses = candidate.to_local().numpy()[valid]
+        references = reference.to_local().numpy()[valid]
+        if references.ndim == 2:
+            references = references[:, None]
+        hyp_lengths = (hypotheses != self.pad_token_id).sum(-1)
+        ref_lengths = (references != self.pad_token_id).sum(-1)
+        ref_lengths[:, 1:][ref_lengths[:, 1:] == 0] = -1
+        statistics = ngram_statistics(
+            hypotheses, hyp_lengths, references, ref_lengths, self.max_order
+        )
+
+        # the statistics of the samples split among ranks are summed up by the reduction
+        sum_sbp = [
+            flow.sbp.partial_sum if s == flow.sbp.split(0) else flow.sbp.broadcast for s in sbp
+        ]
+        self.accumulate(
+            bleu_statistics=flow.tensor(statistics, device=placement.type).to_global(
+                sbp=sum_sbp, placement=placement
+            )
+        )
+
+    def summarize(self, states):
         self._results = OrderedDict()
-        self._results["bleu_score"] = bleu_score
+        self._results["bleu_score"] = bleu_from_statistics(
+            states["bleu_statistics"], self.max_order
+        )
 
         return copy.deepcopy(self._results)
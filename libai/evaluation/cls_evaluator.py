@@ -16,9 +16,10 @@
 import copy
 from collections import OrderedDict
 
-from libai.utils import distributed as dist
+import numpy as np
+import oneflow as flow
 
-from .evaluator import DatasetEvaluator
+from .evaluator import StreamingEvaluator
 
 
 def accuracy(output, target, topk=(1,)):
@@ -33,52 +34,41 @@ def accuracy(output, target, topk=(1,)):
     ]
 
 
-class ClsEvaluator(DatasetEvaluator):
+class ClsEvaluator(StreamingEvaluator):
     """
     Evaluate accuracy for classification.
     The metrics range from 0 to 100 (instead of 0 to 1).
     We support evaluate different topk accuracy.
     You can reset `cfg.train.topk=(1, 5, N)` according to your needs.
+
+    The number of samples whose label is the k-th prediction is counted on the
+    devices for every k, and reduced among ranks after the last batch.
     """
 
     def __init__(self, topk=(1, 5)):
         self.topk = topk
-        self._predictions = []
-
-    def reset(self):
-        self._predictions = []
+        self.reset()
 
-    def process(self, inputs, outputs):
+    def process(self, inputs, outputs, valid):
         pred_logits = outputs["prediction_scores"]
-        labels = inputs["labels"]
-
-        # measure accuracy
-        topk_acc = accuracy(pred_logits, labels, topk=self.topk)
-        num_correct_acc_topk = [acc * labels.size(0) / 100 for acc in topk_acc]
-
-        self._predictions.append(
-            {"num_correct_topk": num_correct_acc_topk, "num_samples": labels.size(0)}
+        labels = inputs["labels"].to_global(placement=pred_logits.placement)
+        valid = valid.to_global(placement=pred_logits.placement)
+
+        maxk = min(max(self.topk), pred_logits.size()[1])
+        _, pred = pred_logits.topk(maxk, 1, True, True)
+        # [batch, maxk], a sample is correct at a single rank of its predictions at most
+        correct = pred.eq(labels.reshape(-1, 1).expand_as(pred)) & valid.reshape(-1, 1)
+        self.accumulate(
+            num_correct_at=correct.to(flow.int64).sum(0), num_samples=valid.to(flow.int64).sum()
         )
 
-    def evaluate(self):
-        if not dist.is_main_process():
-            return {}
-        else:
-            predictions = self._predictions
-
-        total_correct_num = OrderedDict()
-        for top_k in self.topk:
-            total_correct_num["Acc@" + str(top_k)] = 0
-
-        total_samples = 0
-        for prediction in predictions:
-            for top_k, num_correct_n in zip(self.topk, prediction["num_correct_topk"]):
-                total_correct_num["Acc@" + str(top_k)] += int(num_correct_n)
-
-            total_samples += int(prediction["num_samples"])
+    def summarize(self, states):
+        num_correct_topk = np.cumsum(states["num_correct_at"])
+        total_samples = int(states["num_samples"])
 
         self._results = OrderedDict()
-        for top_k, topk_correct_num in total_correct_num.items():
-            self._results[top_k] = topk_correct_num / total_samples * 100
+        for top_k in self.topk:
+            num_correct = int(num_correct_topk[min(top_k, len(num_correct_topk)) - 1])
+            self._results["Acc@" + str(top_k)] = num_correct / total_samples * 100
 
         return copy.deepcopy(self._results)
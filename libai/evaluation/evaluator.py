@@ -23,10 +23,11 @@ from typing import Callable, List, Union
 
 import oneflow as flow
 
+from libai.data.build import VALID_MASK_FIELD
 from libai.utils import distributed as dist
 from libai.utils.logger import log_every_n_seconds
 
-from .utils import pad_batch
+from .utils import pad_batch, valid_sample_mask
 
 # --------------------------------------------------------
 # References:
@@ -80,6 +81,79 @@ class DatasetEvaluator:
         """
 
 
+class StreamingEvaluator(DatasetEvaluator):
+    """
+    Base class for an evaluator reducing the samples to statistics accumulated on the
+    devices, e.g. counts, sums, confusion matrices or n-gram statistics.
+
+    Unlike for a :class:`DatasetEvaluator`, :func:`inference_on_dataset` calls :meth:`process`
+    on every rank with the global inputs and outputs of the batch as they are, padding
+    samples included, and a global bool tensor ``valid`` of shape ``[batch]`` marking the
+    real samples. The statistics passed to :meth:`accumulate` are global tensors, so that
+    the sum over a sample dimension split among data parallel ranks stays a local
+    ``partial_sum`` on each rank, and is only all-reduced once by :meth:`evaluate`.
+    Per-sample values, which cannot be reduced, are passed to :meth:`collect` and
+    concatenated once by :meth:`evaluate`.
+    """
+
+    def reset(self):
+        self._sums = OrderedDict()
+        self._collected = OrderedDict()
+
+    def accumulate(self, **statistics):
+        """
+        Add the global tensors or numbers ``statistics`` to the sums of the same names.
+        """
+        for name, value in statistics.items():
+            if name in self._sums:
+                value = self._sums[name] + value
+            self._sums[name] = value
+
+    def collect(self, **values):
+        """
+        Keep the global tensors ``values``, to be concatenated along the first dimension
+        with the values of the same names of the other batches.
+        """
+        for name, value in values.items():
+            self._collected.setdefault(name, []).append(value)
+
+    def process(self, inputs, outputs, valid):
+        """
+        Args:
+            inputs (dict): the inputs that's used to call the model.
+            outputs (dict): the return dict of `model(**inputs)`
+            valid (flow.Tensor): whether each sample of the batch is a real sample.
+        """
+        raise NotImplementedError
+
+    def evaluate(self):
+        # all the ranks take part in the reductions, but only the main process gets them
+        states = OrderedDict()
+        for name, value in self._sums.items():
+            if isinstance(value, flow.Tensor):
+                value = dist.tensor_to_rank0(value, device=value.placement.type, to_local=True)
+                value = value.numpy()
+            states[name] = value
+        for name, values in self._collected.items():
+            value = flow.cat(values, dim=0)
+            value = dist.tensor_to_rank0(value, device=value.placement.type, to_local=True)
+            states[name] = value.numpy()
+        if not dist.is_main_process():
+            return {}
+        return self.summarize(states)
+
+    def summarize(self, states):
+        """
+        Args:
+            states (dict): the numpy arrays or numbers of the sums of :meth:`accumulate`
+                and of the concatenations of :meth:`collect`, by name.
+
+        Returns:
+            dict: the results, as returned by :meth:`DatasetEvaluator.evaluate`.
+        """
+        raise NotImplementedError
+
+
 class DatasetEvaluators(DatasetEvaluator):
     """
     Wrapper class to combine multiple :class:`DatasetEvaluator` instances.
@@ -136,9 +210,11 @@ def inference_on_dataset(
             If it's an nn.Module, it will be temporarily set to `eval` mode.
             If you wish to evaluate a model in `training` mode instead, you can
             wrap the given model and override its behavior of `.eval()` and `.train()`.
-        batch_size: batch size for inference
+        batch_size: batch size for inference, unused when the batch sampler of
+            `data_loader` has a `variable_batch_size` attribute set to True.
         data_loader: an iterable object with a length.
-            The elements it generates will be the inputs to the model.
+            The elements it generates will be the inputs to the model. A ``valid_mask`` field
+            of the batches marks their real samples, see :class:`libai.data.build.ValidMaskDataset`.
         eval_iter: running steps for evaluation
         get_batch: a Callable function for getting data from dataloader
         input_placement_device: used in get_batch, set it to `cuda` or `cpu`.
@@ -159,6 +235,12 @@ def inference_on_dataset(
     if isinstance(evaluator, abc.MutableSequence):
         evaluator = DatasetEvaluators(evaluator)
     evaluator.reset()
+    evaluators = evaluator._evaluators if isinstance(evaluator, DatasetEvaluators) else [evaluator]
+    streaming_evaluators = [e for e in evaluators if isinstance(e, StreamingEvaluator)]
+    # only the other evaluators need the valid samples on rank 0 after every batch
+    rank0_evaluator = DatasetEvaluators(
+        [e for e in evaluators if not isinstance(e, StreamingEvaluator)]
+    )
 
     num_warmup = min(5, len(data_loader) - 1)
     start_time = time.perf_counter()
@@ -168,10 +250,17 @@ def inference_on_dataset(
     consumed_samples = 0
     dps = dist.get_data_parallel_size()
     last_batch_lack = (dps - (total_samples % dps)) % dps
+    # batches of a varying number of samples, e.g. from `TokenBudgetSampler`
+    batch_sampler = getattr(data_loader, "batch_sampler", None)
+    variable_batch_size = getattr(batch_sampler, "variable_batch_size", False)
+    pad_last_batch = getattr(batch_sampler, "pad_last_batch", False)
 
     # reset total samples
     real_eval_iter = min(eval_iter, len(data_loader))
-    total_samples = min(real_eval_iter * batch_size, len(data_loader.dataset))
+    if variable_batch_size:
+        total_samples = min(batch_sampler.num_samples(real_eval_iter), total_samples)
+    else:
+        total_samples = min(real_eval_iter * batch_size, len(data_loader.dataset))
     logger.info(
         f"with eval_iter {eval_iter}, "
         f"reset total samples {len(data_loader.dataset)} to {total_samples}"
@@ -197,31 +286,67 @@ def inference_on_dataset(
             start_compute_time = time.perf_counter()
             # model forward
             data = get_batch(inputs, input_placement_device)
-            is_last_batch = idx == len(data_loader) - 1
-            paded_data, valid_sample = pad_batch(data, batch_size, last_batch_lack, is_last_batch)
+            # the test loaders mark the padding samples of their sampler, see `ValidMaskDataset`
+            valid = data.pop(VALID_MASK_FIELD, None)
+            if not (pad_last_batch or variable_batch_size):
+                # other samplers complete their last batches with real samples, e.g. sample 0
+                # for `SingleRoundSampler` without `pad_last_batch`, which the mask keeps
+                valid = None
+            if valid is not None or variable_batch_size:
+                # the batches have their final layout, with padding samples in the last one only
+                paded_data = data
+                valid_sample = min(
+                    list(data.values())[0].shape[0], total_samples - consumed_samples
+                )
+            elif pad_last_batch:
+                raise ValueError(
+                    f"The batches of a sampler with `pad_last_batch=True` need a "
+                    f"`{VALID_MASK_FIELD}` field marking their padding samples, "
+                    f"see `libai.data.build.ValidMaskDataset`"
+                )
+            else:
+                is_last_batch = idx == len(data_loader) - 1
+                paded_data, valid_sample = pad_batch(
+                    data, batch_size, last_batch_lack, is_last_batch, device=input_placement_device
+                )
+            if valid is None and evaluators:
+                valid = valid_sample_mask(list(paded_data.values())[0], valid_sample)
             outputs = model(**paded_data)
 
-            # get valid sample
-            valid_data = {
-                key: dist.tensor_to_rank0(value, device=value.placement.type, to_local=True)[:valid_sample]
-                for key, value in data.items()
-            }
-            valid_outputs = {}
-            for key, value in outputs.items():
-                value = dist.tensor_to_rank0(value, device=value.placement.type, to_local=True)
-                if value.ndim > 1:
-                    valid_outputs[key] = value[:valid_sample]  # Slice if it's batched output
-                else:
-                    valid_outputs[key] = value
-
-            if flow.cuda.is_available():
-                dist.synchronize()
+            if rank0_evaluator._evaluators:
+                # get valid sample
+                valid_rank0 = dist.tensor_to_rank0(
+                    valid, device=valid.placement.type, to_local=True
+                )
+                valid_data = {
+                    key: dist.tensor_to_rank0(value, device=value.placement.type, to_local=True)
+                    for key, value in paded_data.items()
+                }
+                valid_outputs = {
+                    key: dist.tensor_to_rank0(value, device=value.placement.type, to_local=True)
+                    for key, value in outputs.items()
+                }
+
+                if flow.cuda.is_available():
+                    dist.synchronize()
             total_compute_time += time.perf_counter() - start_compute_time
 
             start_eval_time = time.perf_counter()
-            if dist.is_main_process():
-                evaluator.process(valid_data, valid_outputs)
-            dist.synchronize()
+            for streaming_evaluator in streaming_evaluators:
+                streaming_evaluator.process(paded_data, outputs, valid)
+            if rank0_evaluator._evaluators:
+                if dist.is_main_process():
+                    valid_data = {
+                        key: value[valid_rank0.to(value.device)]
+                        for key, value in valid_data.items()
+                    }
+                    valid_outputs = {
+                        # select the samples of batched outputs only
+                        key: value[valid_rank0.to(value.device)] if value.ndim > 1 else value
+                        for key, value in valid_outputs.items()
+                    }
+                    rank0_evaluator.process(valid_data, valid_outputs)
+                dist.synchronize()
             total_eval_time += time.perf_counter() - start_eval_time
 
             consumed_samples += valid_sample
@@ -232,7 +357,7 @@ def inference_on_dataset(
             total_seconds_per_iter = (time.perf_counter() - start_time) / iters_after_start
             if idx >= num_warmup * 2 or compute_seconds_per_iter > 5:
                 eta = datetime.timedelta(
-                    seconds=int(total_seconds_per_iter * (total_samples // batch_size - idx - 1))
+                    seconds=int(total_seconds_per_iter * (real_eval_iter - idx - 1))
                 )
                 log_every_n_seconds(
                     logging.INFO,
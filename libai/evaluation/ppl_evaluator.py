@@ -14,47 +14,36 @@
 # limitations under the License.
 
 import copy
-import math
 from collections import OrderedDict
 
-from libai.utils import distributed as dist
+import oneflow as flow
 
-from .evaluator import DatasetEvaluator
+from .evaluator import StreamingEvaluator
 
 
-class PPLEvaluator(DatasetEvaluator):
+class PPLEvaluator(StreamingEvaluator):
     """
     Evaluate perplexity for Language Model.
 
     Perplexity is a measurement of how well a probability distribution or
     probability model predicts a sample.
+
+    The perplexities of the batches are summed on the devices.
     """
 
     def __init__(self):
-        self._predictions = []
-
-    def reset(self):
-        self._predictions = []
+        self.reset()
 
-    def process(self, inputs, outputs):
+    def process(self, inputs, outputs, valid):
         for k, v in outputs.items():
-            ppl = math.exp(min(20, v.item()))
-            self._predictions.append({f"{k}_PPL": ppl})
-
-    def evaluate(self):
-        if not dist.is_main_process():
-            return {}
-        else:
-            predictions = self._predictions
+            ppl = flow.exp(flow.clamp(v.to(flow.float64), max=20))
+            self.accumulate(**{f"{k}_PPL": ppl})
+        self.accumulate(num_batches=1)
 
+    def summarize(self, states):
+        num_batches = states.pop("num_batches", 0)
         self._results = OrderedDict()
-        for prediction in predictions:
-            for k, v in prediction.items():
-                if k not in self._results:
-                    self._results[k] = 0
-                self._results[k] += v
-
-        for k in self._results.keys():
-            self._results[k] /= len(predictions)
+        for k, v in states.items():
+            self._results[k] = float(v) / num_batches
 
         return copy.deepcopy(self._results)
@@ -20,41 +20,38 @@ from collections import OrderedDict
 import numpy as np
 from scipy.stats import pearsonr, spearmanr
 
-from libai.utils import distributed as dist
-
-from .evaluator import DatasetEvaluator
+from .evaluator import StreamingEvaluator
 
 logger = logging.getLogger(__name__)
 
 
-class RegEvaluator(DatasetEvaluator):
-    def __init__(self):
-        self._predictions = []
+class RegEvaluator(StreamingEvaluator):
+    """
+    Evaluate the Pearson and Spearman correlations of the predictions and the labels.
 
-    def reset(self):
-        self._predictions = []
+    The rank correlation needs all the samples, so the predictions and the labels are
+    kept on the devices and gathered once after the last batch.
+    """
+
+    def __init__(self):
+        self.reset()
 
-    def process(self, inputs, outputs):
+    def process(self, inputs, outputs, valid):
         pred_logits = outputs["prediction_scores"]
-        labels = inputs["labels"]
+        labels = inputs["labels"].to_global(placement=pred_logits.placement)
 
         # measure accuracy
-        preds = pred_logits.cpu().topk(1)[1].squeeze(1).numpy()
-        labels = labels.cpu().numpy()
-
-        self._predictions.append({"preds": preds, "labels": labels})
-
-    def evaluate(self):
-        if not dist.is_main_process():
-            return {}
-        else:
-            predictions = self._predictions
-
-        preds = np.array([])
-        labels = np.array([])
-        for prediction in predictions:
-            preds = np.concatenate((preds, prediction["preds"]))
-            labels = np.concatenate((labels, prediction["labels"]))
+        preds = pred_logits.topk(1)[1].squeeze(1)
+        self.collect(
+            preds=preds,
+            labels=labels,
+            valid=valid.to_global(placement=pred_logits.placement),
+        )
+
+    def summarize(self, states):
+        valid = states["valid"]
+        preds = states["preds"][valid].astype(np.float64)
+        labels = states["labels"][valid].astype(np.float64)
 
         pearson_corr = pearsonr(preds, labels)[0]
         spearman_corr = spearmanr(preds, labels)[0]
@@ -22,6 +22,12 @@ from libai.utils import distributed as dist
 
 
 def pad_batch(x_dict, batch_size, last_batch_lack, is_last_batch, device="cuda"):
+    """
+    Pad the short last batch of a loader to ``batch_size``, moving its valid samples first.
+    Only used for the loaders whose sampler does not set ``pad_last_batch``, as the ones of
+    :func:`libai.data.build_nlp_test_loader` and :func:`libai.data.build_image_test_loader`
+    are already padded by their default sampler.
+    """
     x = list(x_dict.values())[0]
     tensor_batch = x.shape[0]
     assert tensor_batch <= batch_size
@@ -51,6 +57,25 @@ def pad_batch(x_dict, batch_size, last_batch_lack, is_last_batch, device="cuda")
     return padded_dict, valid_sample
 
 
+def valid_sample_mask(x, valid_sample):
+    """
+    Returns:
+        flow.Tensor: a global bool tensor of shape ``[x.shape[0]]`` laid out like the
+            first dimension of ``x``, True for the first ``valid_sample`` samples.
+    """
+    mask = (
+        flow.arange(
+            x.shape[0],
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=x.placement,
+        )
+        < valid_sample
+    )
+    # slicing the broadcast mask to the layout of the samples needs no communication
+    sbp = [sbp if sbp == flow.sbp.split(0) else flow.sbp.broadcast for sbp in x.sbp]
+    return mask.to_global(sbp=sbp)
+
+
 def print_csv_format(results):
     """
     Print main metrics in a particular format
@@ -14,6 +14,7 @@
 # limitations under the License.
 
 import logging
+import time
 from abc import ABCMeta, abstractmethod
 from pathlib import Path
 from typing import Any, Dict
@@ -24,6 +25,7 @@ from libai.config import LazyConfig, try_get_key
 from libai.engine import DefaultTrainer
 from libai.utils import distributed as dist
 from libai.utils.logger import setup_logger
+from libai.utils.open_metrics import get_metrics_registry
 
 logger = setup_logger(distributed_rank=dist.get_rank())
 logger = logging.getLogger("libai.inference")
@@ -172,6 +174,7 @@ class BasePipeline(metaclass=ABCMeta):
         forward_params = {**self._forward_params, **forward_params}
         postprocess_params = {**self._postprocess_params, **postprocess_params}
 
+        start = time.perf_counter()
         with flow.no_grad():
             model_inputs_dict = self.preprocess(inputs, **preprocess_params)
             model_outputs_dict = self.forward(model_inputs_dict, **forward_params)
@@ -181,6 +184,13 @@ class BasePipeline(metaclass=ABCMeta):
             else:
                 outputs_dict = {}
             dist.synchronize()
+        # served by `libai.utils.open_metrics.OpenMetricsServer` if one is running
+        get_metrics_registry().observe(
+            "libai_inference_request_latency_seconds",
+            time.perf_counter() - start,
+            labels={"pipeline": type(self).__name__},
+            help="Latency of the pipeline calls.",
+        )
         return outputs_dict
 
     def to_local(self, model_outputs_dict):
@@ -15,6 +15,7 @@
 
 from libai.inference.basic import BasePipeline
 from libai.utils import distributed as dist
+from libai.utils.open_metrics import get_metrics_registry
 
 
 class TextGenerationPipeline(BasePipeline):
@@ -79,6 +80,28 @@ class TextGenerationPipeline(BasePipeline):
 
     def forward(self, encoder_input_dict, **kwargs) -> dict:
         outputs = self.model.generate(encoder_input_dict["encoder_ids"], **kwargs)
+        # the key/value cache of the decoder holds every generated position
+        max_length = kwargs.get("max_length")
+        if max_length is None and kwargs.get("max_new_tokens") is not None:
+            # `generate` counts the new tokens after the input of the decoder
+            if self.model.cfg.is_encoder_decoder:
+                decoder_input_ids = kwargs.get("decoder_input_ids")
+                input_length = 1 if decoder_input_ids is None else decoder_input_ids.shape[-1]
+            else:
+                input_length = encoder_input_dict["encoder_ids"].shape[-1]
+            max_length = kwargs["max_new_tokens"] + input_length
+        max_length = max_length or self.model.cfg.max_length
+        registry = get_metrics_registry()
+        registry.set_gauge(
+            "libai_generation_kv_cache_utilization",
+            outputs.shape[-1] / max_length,
+            help="Fraction of the max_length positions held by the key/value cache.",
+        )
+        registry.inc_counter(
+            "libai_generation_tokens",
+            outputs.shape[0] * outputs.shape[-1],
+            help="Number of generated tokens.",
+        )
         return {"return_ids": outputs}
 
     def postprocess(self, model_output_dict, **kwargs) -> dict:
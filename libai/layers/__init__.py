@@ -14,21 +14,38 @@
 # limitations under the License.
 
 from .activation import build_activation
-from .cross_entropy import ParallelCrossEntropyLoss
-from .embedding import Embedding, SinePositionalEmbedding, VocabEmbedding, PatchEmbedding
+from .attention import MultiheadAttention
+from .attention_mask import (
+    AttentionMask,
+    BlockSparseAttentionMask,
+    CausalAttentionMask,
+    DocumentAttentionMask,
+    SlidingWindowAttentionMask,
+)
+from .blockwise_attention import blockwise_attention
+from .conv import Conv1D
+from .cross_entropy import ParallelCrossEntropyLoss, fused_lm_head_cross_entropy
+from .droppath import DropPath, drop_path
+from .embedding import (
+    Embedding,
+    PatchEmbedding,
+    RotaryEmbedding,
+    SinePositionalEmbedding,
+    VocabEmbedding,
+    apply_rotary_pos_emb,
+)
 from .layer_norm import LayerNorm, RMSLayerNorm
 from .linear import Linear, Linear1D
-from .conv import Conv1D
 from .lm_logits import LMLogits
 from .mlp import MLP
 from .transformer_layer import TransformerLayer
-from .attention import MultiheadAttention
-from .droppath import DropPath, drop_path
 
 __all__ = [
     "Embedding",
     "VocabEmbedding",
     "SinePositionalEmbedding",
+    "RotaryEmbedding",
+    "apply_rotary_pos_emb",
     "PatchEmbedding",
     "build_activation",
     "Linear",
@@ -39,7 +56,14 @@ __all__ = [
     "RMSLayerNorm",
     "TransformerLayer",
     "MultiheadAttention",
+    "blockwise_attention",
+    "AttentionMask",
+    "CausalAttentionMask",
+    "SlidingWindowAttentionMask",
+    "BlockSparseAttentionMask",
+    "DocumentAttentionMask",
     "ParallelCrossEntropyLoss",
+    "fused_lm_head_cross_entropy",
     "LMLogits",
     "drop_path",
     "DropPath",
@@ -20,6 +20,10 @@ from typing import Tuple
 import oneflow as flow
 from oneflow import nn
 
+from libai.utils import distributed as dist
+
+from .attention_mask import AttentionMask
+from .blockwise_attention import blockwise_attention
 from .linear import Linear
 
 
@@ -49,6 +53,14 @@ class MultiheadAttention(nn.Module):
             Defaults to False.
         apply_query_key_layer_scaling: if `True`, scaling the attention score by layer index.
             Defaults to False.
+        num_key_value_heads: number of key/value heads. Query heads are evenly divided into
+            ``num_key_value_heads`` groups and every group shares one key/value head, which is
+            grouped-query attention (multi-query attention when it is 1). It must be divisible
+            by the tensor parallel size. If None, use ``num_attention_heads``. Defaults to None.
+        attention_block_size: if set, compute attention blockwise with an online softmax over
+            blocks of this many positions instead of materializing the full attention score
+            matrix, see :func:`libai.layers.blockwise_attention`. The fused softmax kernels
+            are not used in this mode. Defaults to None.
         layer_idx: a layer_idx sign which determines the placements.
             It will be used in pipeline parallelism. Defaults to 0.
     """
@@ -67,7 +79,9 @@ class MultiheadAttention(nn.Module):
         apply_query_key_layer_scaling=False,
         attn_mask_type=AttnMaskType.padding,
         *,
-        layer_idx=0
+        num_key_value_heads=None,
+        attention_block_size=None,
+        layer_idx=0,
     ):
         super().__init__()
         self.hidden_size = hidden_size
@@ -82,6 +96,20 @@ class MultiheadAttention(nn.Module):
         self.head_size = hidden_size // num_attention_heads
         self.attn_mask_type = attn_mask_type
 
+        if num_key_value_heads is None:
+            num_key_value_heads = num_attention_heads
+        assert (
+            num_attention_heads % num_key_value_heads == 0
+        ), "num_attention_heads must be divisible by num_key_value_heads."
+        assert num_key_value_heads % dist.get_tensor_parallel_size() == 0, (
+            "num_key_value_heads must be divisible by tensor_parallel_size, "
+            f"but got {num_key_value_heads} and {dist.get_tensor_parallel_size()}."
+        )
+        self.num_key_value_heads = num_key_value_heads
+        self.num_key_value_groups = num_attention_heads // num_key_value_heads
+        self.kv_hidden_size = self.num_key_value_heads * self.head_size
+        self.attention_block_size = attention_block_size
+
         self.attention_dropout_prob = attention_dropout_prob
         self.dropout = nn.Dropout(p=attention_dropout_prob)
         self.norm_factor = 1.0 / math.sqrt(float(self.head_size))
@@ -109,15 +137,18 @@ class MultiheadAttention(nn.Module):
             )
             self.key_value = Linear(
                 self.hidden_size,
-                self.hidden_size * 2,
+                self.kv_hidden_size * 2,
                 parallel="col",
                 init_method=init_method,
                 layer_idx=layer_idx,
             )
         else:
+            # Fused projection of query, key and value. Output features are laid out per key/value
+            # head as [q_0, ..., q_{groups-1}, k, v], so column parallelism keeps every group
+            # on a single rank.
             self.query_key_value = Linear(
                 self.hidden_size,
-                self.hidden_size * 3,
+                self.hidden_size + self.kv_hidden_size * 2,
                 parallel="col",
                 init_method=init_method,
                 layer_idx=layer_idx,
@@ -146,15 +177,18 @@ class MultiheadAttention(nn.Module):
             hidden_states (flow.Tensor): shape is [bsz, tgt_len, hidden_size].
             encoder_states (flow.Tensor, optional): shape is [bsz, src_len, hidden_size].
                 Defaults to None.
-            attention_mask (flow.Tensor, optional): shape is [bsz, 1, tgt_len, src_len].
+            attention_mask (flow.Tensor or AttentionMask, optional): shape is
+                [bsz, 1, tgt_len, src_len].
                 It should be the combination of padding mask and casual mask.
                 It is the padding mask of source input when used with self-attention in encoder.
                 And it is the combination of padding mask of target input and casual mask when
                 used with self-attention in decoder. It is the padding mask of source input when
                 used with cross-attention in decoder.
+                A structured :class:`~libai.layers.AttentionMask` is computed blockwise when
+                ``attention_block_size`` is set, otherwise it is materialized.
                 Defaults to None.
             past_key_value (Tuple[flow.Tensor, flow.Tensor], optional): tuple of key and value,
-                each shape is [bsz, num_heads, src_len, head_size]. Defaults to None.
+                each shape is [bsz, num_key_value_heads, src_len, head_size]. Defaults to None.
             use_cache (bool, optional): it will be set to True, when the model is in the inference
                 phase and used for incremental decoding. Defaults to False.
         """
@@ -180,7 +214,7 @@ class MultiheadAttention(nn.Module):
                 key, value = past_key_value
             elif encoder_states is not None:
                 key_value = self.key_value(encoder_states)
-                key_value = key_value.view(bsz, -1, self.num_heads, 2 * self.head_size)
+                key_value = key_value.view(bsz, -1, self.num_key_value_heads, 2 * self.head_size)
                 key_value = key_value.permute(0, 2, 1, 3)
                 key, value = flow.chunk(key_value, chunks=2, dim=-1)
             else:
@@ -193,22 +227,91 @@ class MultiheadAttention(nn.Module):
             # hidden_states is the last-added state,
             # the full key and value could be obtained by concatenating with past_key_value.
             query_key_value = self.query_key_value(hidden_states)
-            query_key_value = query_key_value.view(bsz, -1, self.num_heads, 3 * self.head_size)
+            query_key_value = query_key_value.view(
+                bsz, -1, self.num_key_value_heads, (self.num_key_value_groups + 2) * self.head_size
+            )
             query_key_value = query_key_value.permute(
                 0, 2, 1, 3
-            )  # [bsz, num_heads, src_len, 3 * head_size]
-            query, key, value = flow.chunk(query_key_value, chunks=3, dim=-1)
+            )  # [bsz, num_kv_heads, src_len, (num_kv_groups + 2) * head_size]
+            if self.num_key_value_groups == 1:
+                query, key, value = flow.chunk(query_key_value, chunks=3, dim=-1)
+            else:
+                query, key, value = flow.split(
+                    query_key_value,
+                    [self.num_key_value_groups * self.head_size, self.head_size, self.head_size],
+                    dim=-1,
+                )
+                # [bsz, num_kv_heads, tgt_len, num_kv_groups * head_size]
+                # -> [bsz, num_heads, tgt_len, head_size]
+                query = (
+                    query.reshape(
+                        bsz, self.num_key_value_heads, -1, self.num_key_value_groups, self.head_size
+                    )
+                    .permute(0, 1, 3, 2, 4)
+                    .reshape(bsz, self.num_heads, -1, self.head_size)
+                )
             if past_key_value is not None:
                 past_key, past_value = past_key_value
                 key = flow.cat((past_key.type_as(key), key), dim=2)
                 value = flow.cat((past_value.type_as(value), value), dim=2)
 
-        # query, key, value: [S(0), S(1)], shape: [bsz, num_heads, seq_length, head_size]
+        # query: [S(0), S(1)], shape: [bsz, num_heads, seq_length, head_size]
+        # key, value: [S(0), S(1)], shape: [bsz, num_kv_heads, seq_length, head_size]
         if use_cache:
             past_key_value = (key, value)
 
+        if self.attention_block_size is not None:
+            context = blockwise_attention(
+                query,
+                key,
+                value,
+                attention_mask=attention_mask,
+                causal=self.attn_mask_type == AttnMaskType.causal and not self.is_cross_attention,
+                scale=self.norm_factor * self.coeff if self.coeff is not None else self.norm_factor,
+                block_size=self.attention_block_size,
+                dropout_prob=self.attention_dropout_prob,
+                training=self.training,
+            )
+        else:
+            context = self._attention(query, key, value, attention_mask, use_cache)
+
+        # Change shape: [bsz, num_heads, tgt_len, head_size] -> [bsz, tgt_len, num_heads, head_size]
+        context = context.transpose(1, 2)
+
+        # Concat multi-head results from
+        # [bsz, tgt_len, num_heads, head_size] -> [bsz, tgt_len, num_heads * head_size]
+        # SBP sign: [S(0), S(2)]
+        # [S(0), S(2)] x [B, S(0)] = [S(0), P] -> [S(0), B]
+        output = self.dense(context.flatten(2))
+
+        if self.bias_dropout_fusion:
+            output, bias = output
+            output = flow._C.fused_bias_add_dropout(
+                output, bias, p=self.output_dropout_prob, axis=output.ndim - 1
+            )
+        else:
+            output = self.output_dropout(output)
+
+        if use_cache:
+            output = (output, past_key_value)
+
+        return output
+
+    def _attention(self, query, key, value, attention_mask=None, use_cache=False):
+        bsz, _, tgt_len = query.size()[:3]
+
         # [bsz, num_heads, tgt_len, src_len] with [S(0), S(1)]
-        attention_scores = flow.matmul(query, key, transpose_b=True, alpha=self.norm_factor)
+        if self.num_key_value_groups == 1:
+            attention_scores = flow.matmul(query, key, transpose_b=True, alpha=self.norm_factor)
+        else:
+            # Query heads of the same group attend to a shared key, so fold the group into the
+            # sequence dim instead of repeating key and value for every query head.
+            attention_scores = flow.matmul(
+                self._group_heads(query), key, transpose_b=True, alpha=self.norm_factor
+            ).view(bsz, self.num_heads, tgt_len, -1)
+
+        if isinstance(attention_mask, AttentionMask):
+            attention_mask = attention_mask.to_dense(tgt_len, key.size(2), attention_scores)
 
         # [S(0), S(1)] x [S(0), B] = [S(0), S(1)]
         if attention_mask is not None:
@@ -250,32 +353,24 @@ class MultiheadAttention(nn.Module):
                 attention_weights = self.dropout(attention_weights)
 
         # Context shape: [bsz, num_heads, tgt_len, head_size] with [S(0), S(1)]
-        context = flow.matmul(attention_weights, value)
-        # Change shape: [bsz, num_heads, tgt_len, head_size] -> [bsz, tgt_len, num_heads, head_size]
-        context = context.transpose(1, 2)
-
-        # Concat multi-head results from
-        # [bsz, tgt_len, num_heads, head_size] -> [bsz, tgt_len, num_heads * head_size]
-        # SBP sign: [S(0), S(2)]
-        # [S(0), S(2)] x [B, S(0)] = [S(0), P] -> [S(0), B]
-        output = self.dense(context.flatten(2))
-
-        if self.bias_dropout_fusion:
-            output, bias = output
-            output = flow._C.fused_bias_add_dropout(
-                output, bias, p=self.output_dropout_prob, axis=output.ndim - 1
-            )
+        if self.num_key_value_groups == 1:
+            context = flow.matmul(attention_weights, value)
         else:
-            output = self.output_dropout(output)
+            context = flow.matmul(self._group_heads(attention_weights), value).view(
+                bsz, self.num_heads, tgt_len, self.head_size
+            )
 
-        if use_cache:
-            output = (output, past_key_value)
+        return context
 
-        return output
+    def _group_heads(self, x):
+        # [bsz, num_heads, seq_length, dim] -> [bsz, num_kv_heads, num_kv_groups * seq_length, dim]
+        bsz, _, seq_length, dim = x.size()
+        return x.reshape(bsz, self.num_key_value_heads, self.num_key_value_groups * seq_length, dim)
 
     def extra_repr(self) -> str:
-        return "hidden_size={}, num_heads={}, is_cross_attention={}".format(
+        return "hidden_size={}, num_heads={}, num_key_value_heads={}, is_cross_attention={}".format(
             self.hidden_size,
             self.num_heads,
+            self.num_key_value_heads,
             self.is_cross_attention,
         )
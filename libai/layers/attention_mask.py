@@ -0,0 +1,246 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import copy
+
+import numpy as np
+import oneflow as flow
+
+from libai.utils import distributed as dist
+
+
+def _ones(q_len, k_len, like):
+    return flow.ones(
+        (q_len, k_len),
+        dtype=like.dtype,
+        placement=like.placement,
+        sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+    )
+
+
+def _causal_block(q_start, q_end, k_start, k_end, offset, like):
+    """Causal pattern of a block, None if the block is fully visible."""
+    if k_end - 1 <= q_start + offset:
+        return None
+    return _ones(q_end - q_start, k_end - k_start, like).tril(q_start + offset - k_start)
+
+
+def _causal_block_empty(q_end, k_start, offset):
+    return k_start > q_end - 1 + offset
+
+
+def _mul(lhs, rhs):
+    if lhs is None:
+        return rhs
+    if rhs is None:
+        return lhs
+    return lhs * rhs
+
+
+class AttentionMask(object):
+    """Base class of structured attention masks, which describe the attention pattern instead
+    of materializing a dense ``[bsz, 1, tgt_len, src_len]`` mask.
+
+    Masks are queried block by block: :meth:`is_block_empty` tells whether a block is fully
+    masked so that it can be skipped, and :meth:`block_mask` builds the mask of a single block.
+    Positions follow the kv cache layout, query row ``i`` is the key position
+    ``i + offset`` where ``offset = src_len - tgt_len``.
+
+    Args:
+        key_padding_mask (flow.Tensor, optional): padding mask of keys with shape
+            [bsz, src_len], 1 for tokens to attend and 0 for padding tokens. Defaults to None.
+    """
+
+    _tensor_attrs = ("key_padding_mask",)
+
+    def __init__(self, key_padding_mask=None):
+        self.key_padding_mask = key_padding_mask
+
+    def _pattern_block_empty(self, q_start, q_end, k_start, k_end, offset):
+        return False
+
+    def _pattern_block(self, q_start, q_end, k_start, k_end, offset, like):
+        return None
+
+    def is_block_empty(self, q_start, q_end, k_start, k_end, offset=0):
+        """Whether every query row in ``[q_start, q_end)`` is masked for every key in
+        ``[k_start, k_end)``."""
+        return self._pattern_block_empty(q_start, q_end, k_start, k_end, offset)
+
+    def block_mask(self, q_start, q_end, k_start, k_end, offset=0, like=None):
+        """Mask of a block with 1 for positions to attend, which is broadcastable to
+        [bsz, num_heads, q_end - q_start, k_end - k_start]. Returns None if the block is fully
+        visible.
+
+        Args:
+            like (flow.Tensor): the mask has the dtype and placement of this tensor.
+        """
+        mask = self._pattern_block(q_start, q_end, k_start, k_end, offset, like)
+        if self.key_padding_mask is not None:
+            padding = self.key_padding_mask[:, k_start:k_end].to(like.dtype)
+            mask = _mul(mask, padding.unsqueeze(1).unsqueeze(2))
+        return mask
+
+    def to_dense(self, tgt_len, src_len, like):
+        """Materialize the mask with shape broadcastable to [bsz, 1, tgt_len, src_len].
+        It is only used by attention implementations which can not work blockwise."""
+        mask = self.block_mask(0, tgt_len, 0, src_len, src_len - tgt_len, like)
+        if mask is None:
+            mask = _ones(tgt_len, src_len, like)
+        while mask.ndim < 4:
+            mask = mask.unsqueeze(0)
+        return mask
+
+    def to_global(self, placement=None, sbp=None):
+        """Move the tensors held by the mask, so that the mask can be passed wherever a dense
+        mask tensor is moved between pipeline stages."""
+        mask = copy.copy(self)
+        for name in self._tensor_attrs:
+            tensor = getattr(self, name)
+            if tensor is not None:
+                setattr(mask, name, tensor.to_global(placement=placement, sbp=sbp))
+        return mask
+
+
+class CausalAttentionMask(AttentionMask):
+    """Causal mask, query ``i`` attends to keys up to position ``i + offset``."""
+
+    def _pattern_block_empty(self, q_start, q_end, k_start, k_end, offset):
+        return _causal_block_empty(q_end, k_start, offset)
+
+    def _pattern_block(self, q_start, q_end, k_start, k_end, offset, like):
+        return _causal_block(q_start, q_end, k_start, k_end, offset, like)
+
+
+class SlidingWindowAttentionMask(AttentionMask):
+    """Causal mask restricted to a local window, query at position ``p`` attends to the keys
+    in ``(p - window_size, p]``.
+
+    Args:
+        window_size (int): number of keys each query attends to, including itself.
+        key_padding_mask (flow.Tensor, optional): see :class:`AttentionMask`.
+    """
+
+    def __init__(self, window_size, key_padding_mask=None):
+        super().__init__(key_padding_mask)
+        assert window_size > 0, "window_size must be positive."
+        self.window_size = window_size
+
+    def _pattern_block_empty(self, q_start, q_end, k_start, k_end, offset):
+        return _causal_block_empty(q_end, k_start, offset) or (
+            k_end - 1 <= q_start + offset - self.window_size
+        )
+
+    def _pattern_block(self, q_start, q_end, k_start, k_end, offset, like):
+        mask = _causal_block(q_start, q_end, k_start, k_end, offset, like)
+        if k_start <= q_end - 1 + offset - self.window_size:
+            # keys at or before `p - window_size` are out of the window
+            out_of_window = _ones(q_end - q_start, k_end - k_start, like).tril(
+                q_start + offset - self.window_size - k_start
+            )
+            window = 1 - out_of_window
+            mask = _mul(mask, window)
+        return mask
+
+
+class BlockSparseAttentionMask(AttentionMask):
+    """Block-sparse mask defined by a block layout.
+
+    Args:
+        layout (np.ndarray): boolean array with shape [num_query_blocks, num_key_blocks],
+            ``layout[i, j]`` tells whether queries of block ``i`` attend to keys of block ``j``.
+        sparse_block_size (int): number of positions of a layout block.
+        causal (bool, optional): whether to combine the layout with a causal mask.
+            Defaults to False.
+        key_padding_mask (flow.Tensor, optional): see :class:`AttentionMask`.
+    """
+
+    def __init__(self, layout, sparse_block_size, causal=False, key_padding_mask=None):
+        super().__init__(key_padding_mask)
+        self.layout = np.asarray(layout, dtype=bool)
+        assert self.layout.ndim == 2, "layout must be a 2D array."
+        self.sparse_block_size = sparse_block_size
+        self.causal = causal
+
+    def _sub_layout(self, q_start, q_end, k_start, k_end, offset):
+        size = self.sparse_block_size
+        return self.layout[
+            (q_start + offset) // size : (q_end - 1 + offset) // size + 1,
+            k_start // size : (k_end - 1) // size + 1,
+        ]
+
+    def _pattern_block_empty(self, q_start, q_end, k_start, k_end, offset):
+        if self.causal and _causal_block_empty(q_end, k_start, offset):
+            return True
+        return not self._sub_layout(q_start, q_end, k_start, k_end, offset).any()
+
+    def _pattern_block(self, q_start, q_end, k_start, k_end, offset, like):
+        mask = None
+        if not self._sub_layout(q_start, q_end, k_start, k_end, offset).all():
+            q_blocks = np.arange(q_start + offset, q_end + offset) // self.sparse_block_size
+            k_blocks = np.arange(k_start, k_end) // self.sparse_block_size
+            pattern = self.layout[np.ix_(q_blocks, k_blocks)].astype(np.float32)
+            mask = flow.tensor(
+                pattern,
+                placement=like.placement,
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            ).to(like.dtype)
+        if self.causal:
+            mask = _mul(mask, _causal_block(q_start, q_end, k_start, k_end, offset, like))
+        return mask
+
+
+class DocumentAttentionMask(AttentionMask):
+    """Mask of packed sequences, tokens only attend to tokens of the same document.
+
+    Args:
+        document_ids (flow.Tensor): document index of every token with shape [bsz, src_len].
+        causal (bool, optional): whether to combine with a causal mask. Defaults to True.
+        host_document_ids (np.ndarray, optional): host copy of ``document_ids`` whose
+            documents are contiguous, e.g. kept by the data loader. If given, blocks which only
+            cross document boundaries are skipped. Defaults to None.
+        key_padding_mask (flow.Tensor, optional): see :class:`AttentionMask`.
+    """
+
+    _tensor_attrs = ("key_padding_mask", "document_ids")
+
+    def __init__(self, document_ids, causal=True, host_document_ids=None, key_padding_mask=None):
+        super().__init__(key_padding_mask)
+        self.document_ids = document_ids
+        self.causal = causal
+        self.host_document_ids = (
+            None if host_document_ids is None else np.asarray(host_document_ids)
+        )
+
+    def _pattern_block_empty(self, q_start, q_end, k_start, k_end, offset):
+        if self.causal and _causal_block_empty(q_end, k_start, offset):
+            return True
+        if self.host_document_ids is None:
+            return False
+        query_docs = self.host_document_ids[:, q_start + offset : q_end + offset]
+        key_docs = self.host_document_ids[:, k_start:k_end]
+        # documents are contiguous, so two ranges share no document iff they do not overlap
+        disjoint = (key_docs.max(axis=1) < query_docs.min(axis=1)) | (
+            key_docs.min(axis=1) > query_docs.max(axis=1)
+        )
+        return bool(disjoint.all())
+
+    def _pattern_block(self, q_start, q_end, k_start, k_end, offset, like):
+        query_docs = self.document_ids[:, q_start + offset : q_end + offset]
+        key_docs = self.document_ids[:, k_start:k_end]
+        mask = (query_docs.unsqueeze(2) == key_docs.unsqueeze(1)).to(like.dtype).unsqueeze(1)
+        if self.causal:
+            mask = _mul(mask, _causal_block(q_start, q_end, k_start, k_end, offset, like))
+        return mask
@@ -0,0 +1,291 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+
+import oneflow as flow
+
+from libai.utils import distributed as dist
+
+from .attention_mask import AttentionMask
+
+
+def _group(x, num_groups):
+    # [bsz, num_heads, seq_length, dim] -> [bsz, num_kv_heads, num_groups * seq_length, dim]
+    if num_groups == 1:
+        return x
+    bsz, num_heads, seq_length, dim = x.size()
+    return x.reshape(bsz, num_heads // num_groups, num_groups * seq_length, dim)
+
+
+def _ungroup(x, num_heads):
+    # [bsz, num_kv_heads, num_groups * seq_length, dim] -> [bsz, num_heads, seq_length, dim]
+    bsz, num_kv_heads, length, dim = x.size()
+    if num_kv_heads == num_heads:
+        return x
+    return x.view(bsz, num_heads, length * num_kv_heads // num_heads, dim)
+
+
+def _key_blocks(q_start, q_end, src_len, block_size, causal, offset, attention_mask=None):
+    """Yield the key blocks which are visible to the query rows ``[q_start, q_end)``,
+    key blocks which are fully masked by the causal mask or a structured mask are skipped."""
+    for k_start in range(0, src_len, block_size):
+        if causal and k_start > q_end - 1 + offset:
+            break
+        k_end = min(k_start + block_size, src_len)
+        if isinstance(attention_mask, AttentionMask) and attention_mask.is_block_empty(
+            q_start, q_end, k_start, k_end, offset
+        ):
+            continue
+        yield k_start, k_end
+
+
+def _block_mask(attention_mask, causal, q_start, q_end, k_start, k_end, offset, like):
+    mask = None
+    if isinstance(attention_mask, AttentionMask):
+        mask = attention_mask.block_mask(q_start, q_end, k_start, k_end, offset, like)
+    elif attention_mask is not None:
+        if attention_mask.size(-2) > 1:
+            mask = attention_mask[..., q_start:q_end, k_start:k_end]
+        else:
+            mask = attention_mask[..., k_start:k_end]
+        mask = mask.to(like.dtype)
+
+    # The causal mask is built per block and only for blocks crossing the diagonal.
+    if causal and k_end - 1 > q_start + offset:
+        tril = flow.ones(
+            (q_end - q_start, k_end - k_start),
+            dtype=like.dtype,
+            placement=like.placement,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        ).tril(q_start + offset - k_start)
+        mask = tril if mask is None else mask * tril
+    return mask
+
+
+def _block_scores(query, key, mask, scale):
+    bsz, num_heads, q_len, _ = query.size()
+    num_groups = num_heads // key.size(1)
+    scores = flow.matmul(_group(query, num_groups), key, transpose_b=True, alpha=scale)
+    scores = _ungroup(scores, num_heads)
+    if mask is not None:
+        # same masking as the dense path of MultiheadAttention
+        scores = flow.mul(scores, mask) - 10000.0 * (1 - mask)
+    return scores
+
+
+def _blockwise_attention_forward(
+    query, key, value, attention_mask, scale, causal, block_size, dropout_prob=0.0
+):
+    """Online-softmax attention, which returns the output and the log-sum-exp of every row."""
+    num_heads, tgt_len = query.size(1), query.size(2)
+    num_groups = num_heads // key.size(1)
+    src_len = key.size(2)
+    # query row `i` is the key position `i + offset` when a kv cache is used.
+    offset = src_len - tgt_len
+
+    outputs, lses = [], []
+    for q_start in range(0, tgt_len, block_size):
+        q_end = min(q_start + block_size, tgt_len)
+        query_block = query[:, :, q_start:q_end]
+        row_max, row_sum, acc = None, None, None
+        for k_start, k_end in _key_blocks(
+            q_start, q_end, src_len, block_size, causal, offset, attention_mask
+        ):
+            mask = _block_mask(
+                attention_mask, causal, q_start, q_end, k_start, k_end, offset, query
+            )
+            scores = _block_scores(query_block, key[:, :, k_start:k_end], mask, scale)
+
+            block_max = flow.amax(scores, dim=-1, keepdim=True)
+            new_max = block_max if row_max is None else flow.maximum(row_max, block_max)
+            probs = flow.exp(scores - new_max)
+            block_sum = probs.sum(dim=-1, keepdim=True)
+            if dropout_prob > 0.0:
+                # dropout commutes with the per-row normalization applied at the end
+                probs = flow.nn.functional.dropout(probs, p=dropout_prob, training=True)
+            block_out = _ungroup(
+                flow.matmul(_group(probs, num_groups), value[:, :, k_start:k_end]), num_heads
+            )
+
+            if row_max is None:
+                row_sum, acc = block_sum, block_out
+            else:
+                correction = flow.exp(row_max - new_max)
+                row_sum = row_sum * correction + block_sum
+                acc = acc * correction + block_out
+            row_max = new_max
+
+        if acc is None:
+            # every key is masked for these queries
+            outputs.append(flow.zeros_like(query_block))
+            lses.append(flow.zeros_like(query_block[..., :1]))
+            continue
+        outputs.append(acc / row_sum)
+        lses.append(row_max + flow.log(row_sum))
+
+    return flow.cat(outputs, dim=2), flow.cat(lses, dim=2)
+
+
+class BlockwiseAttentionFunction(flow.autograd.Function):
+    """Only the output and the per-row log-sum-exp are saved, attention probabilities
+    are recomputed block by block in the backward pass."""
+
+    @staticmethod
+    def forward(ctx, query, key, value, attention_mask, scale, causal, block_size):
+        output, lse = _blockwise_attention_forward(
+            query, key, value, attention_mask, scale, causal, block_size
+        )
+        ctx.scale, ctx.causal, ctx.block_size = scale, causal, block_size
+        if isinstance(attention_mask, flow.Tensor):
+            ctx.attention_mask = None
+            ctx.save_for_backward(query, key, value, output, lse, attention_mask)
+        else:
+            # None or a structured mask, which is not a tensor
+            ctx.attention_mask = attention_mask
+            ctx.save_for_backward(query, key, value, output, lse)
+        return output
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        query, key, value, output, lse, *attention_mask = ctx.saved_tensors
+        mask = attention_mask[0] if len(attention_mask) > 0 else ctx.attention_mask
+        scale, causal, block_size = ctx.scale, ctx.causal, ctx.block_size
+
+        num_heads, tgt_len = query.size(1), query.size(2)
+        num_groups = num_heads // key.size(1)
+        src_len = key.size(2)
+        offset = src_len - tgt_len
+
+        delta = (grad_output * output).sum(dim=-1, keepdim=True)
+        grad_query = []
+        grad_key, grad_value = {}, {}
+        for q_start in range(0, tgt_len, block_size):
+            q_end = min(q_start + block_size, tgt_len)
+            query_block = query[:, :, q_start:q_end]
+            grad_output_block = grad_output[:, :, q_start:q_end]
+            grouped_query = _group(query_block, num_groups)
+            grouped_grad_output = _group(grad_output_block, num_groups)
+            grad_query_block = None
+            for k_start, k_end in _key_blocks(
+                q_start, q_end, src_len, block_size, causal, offset, mask
+            ):
+                key_block = key[:, :, k_start:k_end]
+                value_block = value[:, :, k_start:k_end]
+                block_mask = _block_mask(
+                    mask, causal, q_start, q_end, k_start, k_end, offset, query
+                )
+                scores = _block_scores(query_block, key_block, block_mask, scale)
+                probs = flow.exp(scores - lse[:, :, q_start:q_end])
+
+                grad_probs = _ungroup(
+                    flow.matmul(grouped_grad_output, value_block, transpose_b=True),
+                    num_heads,
+                )
+                grad_scores = probs * (grad_probs - delta[:, :, q_start:q_end])
+                if block_mask is not None:
+                    grad_scores = grad_scores * block_mask
+                grouped_probs = _group(probs, num_groups)
+                grouped_grad_scores = _group(grad_scores, num_groups)
+
+                dq = _ungroup(flow.matmul(grouped_grad_scores, key_block), num_heads) * scale
+                dk = flow.matmul(grouped_grad_scores, grouped_query, transpose_a=True) * scale
+                dv = flow.matmul(grouped_probs, grouped_grad_output, transpose_a=True)
+
+                grad_query_block = dq if grad_query_block is None else grad_query_block + dq
+                if k_start in grad_key:
+                    grad_key[k_start] = grad_key[k_start] + dk
+                    grad_value[k_start] = grad_value[k_start] + dv
+                else:
+                    grad_key[k_start], grad_value[k_start] = dk, dv
+            if grad_query_block is None:
+                grad_query_block = flow.zeros_like(query_block)
+            grad_query.append(grad_query_block)
+
+        grad_key_blocks, grad_value_blocks = [], []
+        for k_start in range(0, src_len, block_size):
+            if k_start not in grad_key:
+                # no query attends to this key block
+                key_block = key[:, :, k_start : k_start + block_size]
+                grad_key[k_start] = flow.zeros_like(key_block)
+                grad_value[k_start] = flow.zeros_like(key_block)
+            grad_key_blocks.append(grad_key[k_start])
+            grad_value_blocks.append(grad_value[k_start])
+        grads = (
+            flow.cat(grad_query, dim=2),
+            flow.cat(grad_key_blocks, dim=2),
+            flow.cat(grad_value_blocks, dim=2),
+        )
+        # no gradient for the mask and the settings
+        return grads + (None,) * 4
+
+
+def blockwise_attention(
+    query,
+    key,
+    value,
+    attention_mask=None,
+    causal=False,
+    scale=None,
+    block_size=128,
+    dropout_prob=0.0,
+    training=False,
+):
+    """Memory-efficient attention which never materializes the full
+    ``[bsz, num_heads, tgt_len, src_len]`` score matrix.
+
+    Queries and keys are processed in blocks of ``block_size`` with an online softmax, so the
+    activation memory grows linearly in the sequence length. Attention probabilities are
+    recomputed blockwise in the backward pass. When dropout is enabled in training, the block
+    probabilities are kept by autograd instead, because dropout masks can not be regenerated.
+
+    Args:
+        query (flow.Tensor): shape is [bsz, num_heads, tgt_len, head_size].
+        key (flow.Tensor): shape is [bsz, num_kv_heads, src_len, head_size],
+            ``num_heads`` must be divisible by ``num_kv_heads``.
+        value (flow.Tensor): shape is [bsz, num_kv_heads, src_len, head_size].
+        attention_mask (flow.Tensor or AttentionMask, optional): mask with 1 for positions to
+            attend and 0 for masked positions, shape is [bsz, 1, tgt_len, src_len] or
+            [bsz, 1, 1, src_len]. A structured :class:`~libai.layers.AttentionMask` is built
+            block by block and its fully masked blocks are skipped. Defaults to None.
+        causal (bool, optional): whether to apply causal masking. Query ``i`` attends to keys up
+            to ``i + src_len - tgt_len``, which is the incremental decoding layout of the kv
+            cache. Key blocks which are fully masked are skipped. Defaults to False.
+        scale (float, optional): scale of attention scores. If None, use ``1 / sqrt(head_size)``.
+        block_size (int, optional): number of query and key positions of a block.
+            Defaults to 128.
+        dropout_prob (float, optional): dropout probability of attention weights.
+            Defaults to 0.0.
+        training (bool, optional): whether to apply dropout. Defaults to False.
+
+    Returns:
+        flow.Tensor: context with shape [bsz, num_heads, tgt_len, head_size].
+    """
+    if scale is None:
+        scale = 1.0 / math.sqrt(float(query.size(-1)))
+
+    if dropout_prob > 0.0 and training:
+        return _blockwise_attention_forward(
+            query, key, value, attention_mask, scale, causal, block_size, dropout_prob
+        )[0]
+
+    if not (query.requires_grad or key.requires_grad or value.requires_grad):
+        return _blockwise_attention_forward(
+            query, key, value, attention_mask, scale, causal, block_size
+        )[0]
+
+    return BlockwiseAttentionFunction.apply(
+        query, key, value, attention_mask, float(scale), bool(causal), int(block_size)
+    )
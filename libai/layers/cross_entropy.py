@@ -14,6 +14,8 @@
 # limitations under the License.
 
 
+import functools
+
 import oneflow as flow
 from oneflow import nn
 
@@ -46,3 +48,148 @@ class ParallelCrossEntropyLoss(nn.Module):
             target.view(-1),
         )
         return lm_loss
+
+
+def _vocab_one_hot(target, weight, like):
+    # The vocab index is split like the rows of `weight`, so the one-hot mask is sharded the
+    # same way as the logits under tensor parallelism.
+    vocab = flow._C.global_arange(
+        start=0,
+        end=weight.size(0),
+        placement=like.placement,
+        sbp=weight.sbp,
+        dtype=target.dtype,
+    )
+    return (target.unsqueeze(-1) == vocab).to(like.dtype)
+
+
+def _chunk_logits(hidden_states, weight, bias):
+    logits = flow.matmul(hidden_states, weight, transpose_b=True)
+    if bias is not None:
+        logits = logits + bias
+    return logits.to(flow.float32)
+
+
+def _chunk_cross_entropy(hidden_states, weight, bias, target, ignore_index):
+    logits = _chunk_logits(hidden_states, weight, bias)
+    lse = flow.logsumexp(logits, dim=-1)
+    target_logits = (logits * _vocab_one_hot(target, weight, logits)).sum(dim=-1)
+    valid = (target != ignore_index).to(flow.float32)
+    return (lse - target_logits) * valid, lse
+
+
+def _fused_lm_head_cross_entropy_forward(
+    hidden_states, weight, bias, target, ignore_index, chunk_size
+):
+    losses, lses = [], []
+    for start in range(0, hidden_states.size(1), chunk_size):
+        end = start + chunk_size
+        loss, lse = _chunk_cross_entropy(
+            hidden_states[:, start:end], weight, bias, target[:, start:end], ignore_index
+        )
+        losses.append(loss)
+        lses.append(lse)
+    return flow.cat(losses, dim=1), flow.cat(lses, dim=1)
+
+
+@functools.lru_cache(maxsize=None)
+def _fused_lm_head_cross_entropy_function(ignore_index, chunk_size):
+    class FusedLMHeadCrossEntropyFunction(flow.autograd.Function):
+        """Only the log-sum-exp of every token is saved, logits are recomputed chunk by chunk
+        in the backward pass."""
+
+        @staticmethod
+        def forward(ctx, hidden_states, weight, target, *bias):
+            loss, lse = _fused_lm_head_cross_entropy_forward(
+                hidden_states, weight, bias[0] if bias else None, target, ignore_index, chunk_size
+            )
+            ctx.save_for_backward(hidden_states, weight, target, lse, *bias)
+            return loss
+
+        @staticmethod
+        def backward(ctx, grad_loss):
+            hidden_states, weight, target, lse, *bias = ctx.saved_tensors
+            bias = bias[0] if bias else None
+            grad_loss = grad_loss * (target != ignore_index).to(grad_loss.dtype)
+
+            grad_hidden_states = []
+            grad_weight, grad_bias = None, None
+            for start in range(0, hidden_states.size(1), chunk_size):
+                end = start + chunk_size
+                hidden_chunk = hidden_states[:, start:end]
+                logits = _chunk_logits(hidden_chunk, weight, bias)
+                # d(loss) / d(logits) = softmax(logits) - one_hot(target)
+                grad_logits = flow.exp(logits - lse[:, start:end].unsqueeze(-1))
+                grad_logits = grad_logits - _vocab_one_hot(target[:, start:end], weight, logits)
+                grad_logits = (grad_logits * grad_loss[:, start:end].unsqueeze(-1)).to(
+                    hidden_states.dtype
+                )
+
+                grad_hidden_states.append(flow.matmul(grad_logits, weight))
+                flat_grad_logits = grad_logits.flatten(0, 1)
+                chunk_grad_weight = flow.matmul(
+                    flat_grad_logits, hidden_chunk.flatten(0, 1), transpose_a=True
+                )
+                grad_weight = (
+                    chunk_grad_weight if grad_weight is None else grad_weight + chunk_grad_weight
+                )
+                if bias is not None:
+                    chunk_grad_bias = flat_grad_logits.sum(dim=0)
+                    grad_bias = (
+                        chunk_grad_bias if grad_bias is None else grad_bias + chunk_grad_bias
+                    )
+
+            grads = (flow.cat(grad_hidden_states, dim=1), grad_weight.to(weight.dtype), None)
+            if bias is not None:
+                grads = grads + (grad_bias.to(bias.dtype),)
+            return grads
+
+    return FusedLMHeadCrossEntropyFunction
+
+
+def fused_lm_head_cross_entropy(
+    hidden_states, weight, target, bias=None, ignore_index=-100, chunk_size=1024
+):
+    """Cross entropy of the LM head ``hidden_states x weight^T + bias`` which never materializes
+    the ``[batch_size, seq_length, vocab_size]`` logits.
+
+    The sequence is processed in chunks of ``chunk_size``, and only the log-sum-exp of every
+    token is kept for the backward pass, where the logits of a chunk are recomputed to get the
+    gradients. Under tensor parallelism ``weight`` is split by vocab with sbp [B, S(0)], and
+    each rank only computes the logits of its vocab shard.
+
+    Args:
+        hidden_states (flow.Tensor): shape is (batch_size, seq_length, hidden_size) and sbp
+            signature is [S(0), B].
+        weight (flow.Tensor): LM head weight with shape (vocab_size, hidden_size).
+        target (flow.Tensor): target with shape (batch_size, seq_length) and
+            sbp signature is [S(0), B].
+        bias (flow.Tensor, optional): LM head bias with shape (vocab_size,). Defaults to None.
+        ignore_index (int, optional): target value whose loss and gradient are 0.
+            Defaults to -100.
+        chunk_size (int, optional): number of sequence positions of a chunk. Defaults to 1024.
+
+    Returns:
+        flow.Tensor: float32 loss of every token with shape (batch_size, seq_length).
+    """
+    assert hidden_states.ndim == 3
+    assert target.ndim == 2
+    assert hidden_states.shape[0:2] == target.shape
+
+    weight = weight.to_global(placement=hidden_states.placement)
+    target = target.to_global(placement=hidden_states.placement)
+    if bias is not None:
+        bias = bias.to_global(placement=hidden_states.placement)
+
+    requires_grad = hidden_states.requires_grad or weight.requires_grad
+    if bias is not None:
+        requires_grad = requires_grad or bias.requires_grad
+    if not requires_grad:
+        return _fused_lm_head_cross_entropy_forward(
+            hidden_states, weight, bias, target, ignore_index, chunk_size
+        )[0]
+
+    function = _fused_lm_head_cross_entropy_function(int(ignore_index), int(chunk_size))
+    if bias is None:
+        return function.apply(hidden_states, weight, target)
+    return function.apply(hidden_states, weight, target, bias)
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import logging
 import math
 import os
 
@@ -22,6 +23,8 @@ from oneflow.nn import init
 
 from libai.utils import distributed as dist
 
+logger = logging.getLogger(__name__)
+
 
 class Embedding(nn.Module):
     """Construct the trainable embedding module, which does not support parallelization.
@@ -234,6 +237,165 @@ class SinePositionalEmbedding(nn.Module):
         return s.format(**self.__dict__)
 
 
+class RotaryEmbedding(nn.Module):
+    """Construct the rotary positional embeddings, whose cos/sin table is shared by all
+    attention layers of a model.
+
+    The table is built once on the placement of ``layer_idx`` and extended on demand when a
+    longer sequence is seen, except for ``"dynamic"`` scaling, whose table is rebuilt for the
+    length of every sequence longer than ``max_position_embeddings``. Embeddings are gathered
+    by position ids, and the sign of the rotation is folded into the sin table, see
+    :func:`apply_rotary_pos_emb`.
+
+    Arguments:
+        dim: rotary dimension of each attention head.
+        max_position_embeddings: initial length of the table. Defaults to 2048.
+        base: base of the rotary frequencies. Defaults to 10000.
+        scaling_type: position interpolation, one of ``None``, ``"linear"`` (positions are
+            divided by ``scaling_factor``), ``"ntk"`` (base is enlarged by NTK-aware
+            scaling) and ``"dynamic"`` (NTK-aware scaling applied once the sequence is longer
+            than ``max_position_embeddings``). Defaults to None.
+        scaling_factor: factor of position interpolation. Defaults to 1.0.
+        layer_idx: the table is placed on the stage of this layer. Defaults to 0.
+    """
+
+    def __init__(
+        self,
+        dim,
+        max_position_embeddings=2048,
+        base=10000,
+        scaling_type=None,
+        scaling_factor=1.0,
+        *,
+        layer_idx=0,
+    ):
+        super().__init__()
+        assert scaling_type in (
+            None,
+            "linear",
+            "ntk",
+            "dynamic",
+        ), f"Unsupported rotary scaling type: {scaling_type}"
+        self.dim = dim
+        self.max_position_embeddings = max_position_embeddings
+        self.base = base
+        self.scaling_type = scaling_type
+        self.scaling_factor = scaling_factor
+        self.layer_idx = layer_idx
+
+        self._set_cos_sin_cache(max_position_embeddings)
+
+    @staticmethod
+    def scaling_from_config(rope_scaling):
+        """Returns the ``scaling_type`` and ``scaling_factor`` arguments for the
+        ``rope_scaling`` dict of a transformers config, whose type is under ``"type"`` or
+        ``"rope_type"``. Unsupported types fall back to no scaling with a warning.
+        """
+        if rope_scaling is None:
+            return None, 1.0
+        scaling_type = rope_scaling.get("type", rope_scaling.get("rope_type"))
+        if scaling_type in (None, "default"):
+            return None, 1.0
+        if scaling_type not in ("linear", "ntk", "dynamic"):
+            logger.warning(
+                f"Unsupported rotary scaling type {scaling_type}, "
+                f"rotary embeddings are not scaled."
+            )
+            return None, 1.0
+        return scaling_type, rope_scaling.get("factor", 1.0)
+
+    @staticmethod
+    def drop_legacy_cache(state_dict, prefix):
+        """Drop the cos/sin tables which the models saved under ``prefix`` as persistent
+        buffers before using this module, whose tables are rebuilt instead of being saved.
+        Called from ``_load_from_state_dict`` of these models, so that their old checkpoints
+        load without unexpected keys.
+        """
+        for name in ("cos_cached", "sin_cached"):
+            if prefix + name in state_dict:
+                del state_dict[prefix + name]
+
+    def _get_base(self, seq_len):
+        if self.scaling_type == "ntk" or (
+            self.scaling_type == "dynamic" and seq_len > self.max_position_embeddings
+        ):
+            factor = self.scaling_factor
+            if self.scaling_type == "dynamic":
+                factor = factor * seq_len / self.max_position_embeddings - (factor - 1)
+            return self.base * factor ** (self.dim / (self.dim - 2))
+        return self.base
+
+    def _set_cos_sin_cache(self, seq_len):
+        self.cached_seq_len = seq_len
+        placement = dist.get_layer_placement(self.layer_idx)
+        sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+
+        position = flow._C.global_arange(
+            start=0, end=self.dim, step=2, placement=placement, sbp=sbp, dtype=flow.float32
+        )
+        inv_freq = 1.0 / (self._get_base(seq_len) ** (position / self.dim))
+        t = flow._C.global_arange(
+            start=0, end=seq_len, placement=placement, sbp=sbp, dtype=flow.float32
+        )
+        if self.scaling_type == "linear":
+            t = t / self.scaling_factor
+
+        freqs = flow.einsum("i,j->ij", t, inv_freq)
+        # [seq_len, dim], the sin table is [-sin, sin] to match rotating half of the dims
+        self.register_buffer("cos_cached", flow.cat((freqs, freqs), dim=-1).cos(), persistent=False)
+        self.register_buffer(
+            "sin_cached", flow.cat((-freqs.sin(), freqs.sin()), dim=-1), persistent=False
+        )
+
+    def forward(self, position_ids, seq_len=None, dtype=None):
+        """Gather cos/sin embeddings of positions.
+
+        Args:
+            position_ids (flow.LongTensor): shape is [bsz, seq_length] or [1, seq_length].
+            seq_len (int, optional): the largest position plus one, which is known from the
+                input shapes. The table is extended if it is longer than the table.
+                Defaults to None.
+            dtype (flow.dtype, optional): dtype of the returned embeddings. Defaults to None.
+
+        Returns:
+            Tuple[flow.Tensor, flow.Tensor]: cos and sin, each shape is
+            [bsz, 1, seq_length, dim] and can be broadcast to the heads of query and key.
+        """
+        if seq_len is not None and self.scaling_type == "dynamic":
+            # the base depends on the sequence length, so the table is rebuilt at the exact
+            # length of every longer sequence, and back at the initial one for shorter ones
+            seq_len = max(seq_len, self.max_position_embeddings)
+            if seq_len != self.cached_seq_len:
+                self._set_cos_sin_cache(seq_len)
+        elif seq_len is not None and seq_len > self.cached_seq_len:
+            self._set_cos_sin_cache(max(seq_len, 2 * self.cached_seq_len))
+
+        position_ids = position_ids.to_global(placement=self.cos_cached.placement)
+        cos = flow._C.gather(self.cos_cached, position_ids, axis=0).unsqueeze(1)
+        sin = flow._C.gather(self.sin_cached, position_ids, axis=0).unsqueeze(1)
+        if dtype is not None:
+            cos, sin = cos.to(dtype), sin.to(dtype)
+        return cos, sin
+
+    def extra_repr(self) -> str:
+        s = "dim={dim}, max_position_embeddings={max_position_embeddings}, base={base}"
+        if self.scaling_type is not None:
+            s += ", scaling_type={scaling_type}, scaling_factor={scaling_factor}"
+        return s.format(**self.__dict__)
+
+
+def apply_rotary_pos_emb(x, cos, sin):
+    """Apply rotary embeddings to ``x`` with shape [bsz, num_heads, seq_length, dim], where
+    ``cos`` and ``sin`` are returned by :class:`RotaryEmbedding`.
+
+    Rotating half of the dims is a roll of the last dim, whose sign is already folded into
+    ``sin``, so no slice and concat of ``x`` is needed.
+    """
+    cos = cos.to_global(placement=x.placement)
+    sin = sin.to_global(placement=x.placement)
+    return x * cos + flow.roll(x, shifts=x.size(-1) // 2, dims=-1) * sin
+
+
 class PatchEmbedding(nn.Module):
     """2D Image to Patch Embedding
 
@@ -52,6 +52,10 @@ class TransformerLayer(nn.Module):
             is more stable when scaling model size introduced in
             https://arxiv.org/pdf/1909.08053.pdf.
             Default: ``False``.
+        num_key_value_heads: number of key/value heads used by grouped-query attention.
+            If None, use `num_attention_heads`. Default: ``None``.
+        attention_block_size: if set, attention is computed blockwise with blocks of this size,
+            which keeps activation memory linear in sequence length. Default: ``None``.
         layer_idx: the layer index, which determines the placement.
     """
 
@@ -74,12 +78,16 @@ class TransformerLayer(nn.Module):
         apply_residual_post_layernorm=False,
         attn_mask_type=AttnMaskType.padding,
         *,
+        num_key_value_heads=None,
+        attention_block_size=None,
         layer_idx=0
     ):
         super().__init__()
         self.hidden_size = hidden_size
         self.ffn_hidden_size = ffn_hidden_size
         self.num_attention_heads = num_attention_heads
+        self.num_key_value_heads = num_key_value_heads
+        self.attention_block_size = attention_block_size
         self.attention_dropout_prob = attention_dropout_prob
         self.output_dropout_prob = output_dropout_prob
         self.layernorm_epsilon = layernorm_epsilon
@@ -244,5 +252,7 @@ class TransformerLayer(nn.Module):
             scale_mask_softmax_fusion=self.scale_mask_softmax_fusion,
             apply_query_key_layer_scaling=self.apply_query_key_layer_scaling,
             attn_mask_type=self.attn_mask_type,
+            num_key_value_heads=self.num_key_value_heads,
+            attention_block_size=self.attention_block_size,
             layer_idx=self.layer_idx,
         )
@@ -17,7 +17,7 @@ import oneflow as flow
 from oneflow import nn
 from oneflow.nn import init
 
-from libai.config import configurable
+from libai.config import configurable, try_get_key
 from libai.layers import (
     Embedding,
     LayerNorm,
@@ -112,6 +112,9 @@ class GPTModel(nn.Module):
             Default: ``False``.
         amp_enabled (bool, optional):
             Whether or not to set fp16 for embedding weight in T5 model. Defaults to ``False``.
+        attention_block_size (int, optional):
+            If set, attention layers compute attention blockwise with blocks of this size,
+            so that activation memory grows linearly in sequence length. Defaults to None.
     """
 
     @configurable
@@ -135,6 +138,7 @@ class GPTModel(nn.Module):
         apply_query_key_layer_scaling=False,
         apply_residual_post_layernorm=False,
         amp_enabled=False,
+        attention_block_size=None,
     ):
         super().__init__()
         init_method = init_method_normal(sigma=initializer_range)
@@ -167,6 +171,7 @@ class GPTModel(nn.Module):
             scale_mask_softmax_fusion=scale_mask_softmax_fusion,
             apply_query_key_layer_scaling=apply_query_key_layer_scaling,
             apply_residual_post_layernorm=apply_residual_post_layernorm,
+            attention_block_size=attention_block_size,
         )
 
         self.lm_head = LMLogits(vocab_size, bias=False)
@@ -192,6 +197,7 @@ class GPTModel(nn.Module):
             "apply_query_key_layer_scaling": cfg.apply_query_key_layer_scaling,
             "apply_residual_post_layernorm": cfg.apply_residual_post_layernorm,
             "amp_enabled": cfg.amp_enabled,
+            "attention_block_size": try_get_key(cfg, "attention_block_size", default=None),
         }
 
     def forward(self, input_ids):
@@ -272,6 +278,7 @@ class Transformer(nn.Module):
         scale_mask_softmax_fusion=False,
         apply_query_key_layer_scaling=False,
         apply_residual_post_layernorm=False,
+        attention_block_size=None,
     ):
         super().__init__()
         self.hidden_layers = hidden_layers
@@ -292,6 +299,7 @@ class Transformer(nn.Module):
                 apply_query_key_layer_scaling=apply_query_key_layer_scaling,
                 apply_residual_post_layernorm=apply_residual_post_layernorm,
                 attn_mask_type=AttnMaskType.causal,
+                attention_block_size=attention_block_size,
                 layer_idx=layer_number,
             )
 
@@ -14,10 +14,14 @@
 # limitations under the License.
 
 import collections
+import concurrent.futures
+import contextlib
 import copy
+import functools
 import logging
 import os
 
+import numpy as np
 import omegaconf
 import oneflow as flow
 from safetensors import safe_open
@@ -26,6 +30,14 @@ from termcolor import colored
 import libai.utils.distributed as dist
 from libai.config import LazyCall
 from libai.models.build import build_model
+from libai.utils.sharded_checkpoint import ShardedCheckpointReader, is_sharded_checkpoint
+
+from .weights_cache import (
+    has_weights_cache,
+    load_weights_cache,
+    save_weights_cache,
+    weights_cache_key,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +78,221 @@ def _load_state_dict_into_model(model_to_load, state_dict, start_prefix):
     return error_msgs
 
 
+class _LazyValue(object):
+    """A value read by ``load``, which is thread-safe, and then passed through ``transforms``
+    on the thread accessing it."""
+
+    __slots__ = ("load", "transforms")
+
+    def __init__(self, load, transforms=()):
+        self.load = load
+        self.transforms = transforms
+
+    def apply(self, value):
+        for transform in self.transforms:
+            value = transform(value)
+        return value
+
+
+class _Prefetcher(object):
+    """Read lazy values in a thread pool ahead of their accesses in the given order,
+    with at most ``max_in_flight`` values read but not accessed yet."""
+
+    def __init__(self, entries, keys, num_workers, max_in_flight):
+        self._entries = entries
+        self._keys = collections.deque(keys)
+        self._max_in_flight = max_in_flight
+        self._in_flight = collections.OrderedDict()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+        self._fill()
+
+    def _fill(self):
+        while self._keys and len(self._in_flight) < self._max_in_flight:
+            key = self._keys.popleft()
+            entry = self._entries.get(key)
+            if isinstance(entry, _LazyValue) and key not in self._in_flight:
+                self._in_flight[key] = (entry, self._executor.submit(entry.load))
+        if not self._keys and not self._in_flight:
+            self._executor.shutdown(wait=False)
+
+    def read(self, key, entry):
+        if key in self._in_flight and self._in_flight[key][0] is entry:
+            value = self._in_flight.pop(key)[1].result()
+            self._fill()
+            return value
+        return entry.load()
+
+    def discard(self, key):
+        """Release the slot of ``key``, whose entry is removed before being accessed."""
+        if key in self._in_flight:
+            self._in_flight.pop(key)[1].cancel()
+            self._fill()
+
+    def close(self):
+        self._keys.clear()
+        for _, future in self._in_flight.values():
+            future.cancel()
+        self._in_flight.clear()
+        self._executor.shutdown(wait=True)
+
+
+class LazyStateDict(collections.abc.MutableMapping):
+    """An ordered state dict whose tensors are only loaded when they are accessed.
+
+    Lazy entries are loaded every time they are accessed and are not kept in memory,
+    values which are assigned are stored as in a dict. :meth:`rename`, :meth:`fuse_lazy` and
+    ``del`` never load an entry. Renaming an entry with
+    ``state_dict[new_key] = state_dict.pop(key)`` keeps it lazy too, but loads it once in
+    :meth:`pop`.
+
+    Args:
+        loaders (dict, optional): maps keys to functions which load the values.
+    """
+
+    def __init__(self, loaders=None):
+        self._entries = collections.OrderedDict(
+            (key, _LazyValue(load)) for key, load in (loaders or {}).items()
+        )
+        self._popped = None
+        self._prefetcher = None
+        self._exit_stack = contextlib.ExitStack()
+
+    def _load(self, key, entry):
+        if self._prefetcher is not None:
+            return entry.apply(self._prefetcher.read(key, entry))
+        return entry.apply(entry.load())
+
+    def _discard(self, key):
+        if self._prefetcher is not None:
+            self._prefetcher.discard(key)
+
+    def __getitem__(self, key):
+        entry = self._entries[key]
+        if not isinstance(entry, _LazyValue):
+            return entry
+        return self._load(key, entry)
+
+    def __setitem__(self, key, value):
+        if self._popped is not None and value is self._popped[0]:
+            value = self._popped[1]
+        self._popped = None
+        self._entries[key] = value
+
+    def __delitem__(self, key):
+        del self._entries[key]
+        self._discard(key)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def pop(self, key, *default):
+        if key not in self._entries:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        entry = self._entries.pop(key)
+        if not isinstance(entry, _LazyValue):
+            return entry
+        value = self._load(key, entry)
+        self._popped = (value, entry)
+        return value
+
+    def rename(self, key, new_key):
+        """Move the entry of ``key`` to ``new_key``, at the end of the order."""
+        self._popped = None
+        self._entries[new_key] = self._entries.pop(key)
+        self._discard(key)
+
+    def fuse_lazy(self, new_key, keys, fn):
+        """Replace the entries of ``keys`` with the entry ``new_key``, whose value is ``fn``
+        applied to their values. Their values are read when ``new_key`` is read, and ``fn``
+        runs on the thread accessing ``new_key``."""
+        entries = [self._entries.pop(key) for key in keys]
+        self._popped = None
+        for key in keys:
+            self._discard(key)
+
+        def load():
+            return [entry.load() if isinstance(entry, _LazyValue) else entry for entry in entries]
+
+        def fuse(values):
+            return fn(
+                *[
+                    entry.apply(value) if isinstance(entry, _LazyValue) else value
+                    for entry, value in zip(entries, values)
+                ]
+            )
+
+        self._entries[new_key] = _LazyValue(load, (fuse,))
+
+    def set_lazy(self, key, load):
+        """Set the value of ``key`` to be loaded by ``load`` when it is accessed."""
+        self._popped = None
+        self._entries[key] = _LazyValue(load)
+
+    def map_lazy(self, key, fn):
+        """Lazily apply ``fn`` to the value of ``key`` on the thread accessing it."""
+        entry = self._entries[key]
+        self._popped = None
+        if isinstance(entry, _LazyValue):
+            self._entries[key] = _LazyValue(entry.load, entry.transforms + (fn,))
+        else:
+            self._entries[key] = _LazyValue(lambda: entry, (fn,))
+
+    def prefetch(self, keys, num_workers=4, max_in_flight=None):
+        """Read the lazy values of ``keys`` in a thread pool, ahead of accessing them in
+        this order. At most ``max_in_flight`` values, which defaults to ``2 * num_workers``,
+        are read and not accessed yet, which bounds the memory of prefetching."""
+        if max_in_flight is None:
+            max_in_flight = 2 * num_workers
+        self._close_prefetcher()
+        self._prefetcher = _Prefetcher(self._entries, keys, num_workers, max_in_flight)
+
+    def enter_context(self, cm):
+        """Enter the context manager ``cm``, e.g. a file the lazy values are read from,
+        which is exited by :meth:`close`."""
+        return self._exit_stack.enter_context(cm)
+
+    def _close_prefetcher(self):
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+
+    def close(self):
+        """Stop prefetching, shut its thread pool down, and close the files of the lazy
+        values. It's called once the state dict is consumed."""
+        self._close_prefetcher()
+        self._exit_stack.close()
+
+    def copy(self):
+        state_dict = LazyStateDict()
+        state_dict._entries = self._entries.copy()
+        state_dict._prefetcher = self._prefetcher
+        state_dict._exit_stack = self._exit_stack
+        return state_dict
+
+
+def _tensor_to_global(tensor, like, mode):
+    if mode == "pytorch":
+        # the tensor is only loaded on the main process
+        tensor = flow.to_global(
+            tensor if dist.is_main_process() else flow.Tensor(None),
+            sbp=flow.sbp.broadcast,
+            placement=flow.placement("cpu", ranks=[0]),
+        )
+    return flow.to_global(
+        tensor,
+        sbp=like.sbp,
+        placement=flow.placement("cpu", ranks=list(like.placement.ranks)),
+    )
+
+
 class ModelLoader(object):
     def __init__(self, model, libai_cfg, pretrained_model_path, **kwargs):
         """Class used to load the [`transformers`](https://huggingface.co/models) pretrained model
@@ -80,12 +307,32 @@ class ModelLoader(object):
             output_loading_info (`bool`, *optional*, defaults to `False`):
                 Whether to return a dictionary containing missing keys, unexpected keys
                 and error messages.
+            num_loading_workers (`int`, *optional*, defaults to 4):
+                Number of threads reading and converting weights ahead of loading them.
         """
         self.model = model
         self.libai_cfg = libai_cfg
         self.pretrained_model_path = pretrained_model_path
         self.kwargs = kwargs
         self.output_loading_info = kwargs.pop("output_loading_info", False)
+        self.num_loading_workers = kwargs.pop("num_loading_workers", 4)
+
+    def _rename_key(self, state_dict, key, new_key):
+        """``state_dict[new_key] = state_dict.pop(key)``, without reading a lazy value."""
+        if isinstance(state_dict, LazyStateDict):
+            state_dict.rename(key, new_key)
+        else:
+            state_dict[new_key] = state_dict.pop(key)
+
+    def _fuse_keys(self, state_dict, new_key, keys, fn):
+        """Replace the values of ``keys`` with ``fn`` applied to them under ``new_key``. For a
+        :class:`LazyStateDict`, the values are only read and fused when ``new_key`` is loaded
+        into the model, so that the fused weights of all the layers are never in memory.
+        """
+        if isinstance(state_dict, LazyStateDict):
+            state_dict.fuse_lazy(new_key, keys, fn)
+        else:
+            state_dict[new_key] = fn(*[state_dict.pop(key) for key in keys])
 
     def _state_dict_to_global(self, flow_state_dict=None, mode="libai"):
         """Tensor in OneFlow state dict to global according to model's sbp and placement.
@@ -94,6 +341,9 @@ class ModelLoader(object):
             flow_state_dict (OrderedDict): State dict of OneFlow's pretrained model.
         """
         assert mode in ["libai", "pytorch"], f"not support for mode {mode}"
+        lazy = isinstance(flow_state_dict, LazyStateDict)
+        if mode == "pytorch":
+            lazy = dist.broadcast_py_object(lazy, src=0)
         if mode == "libai" or dist.is_main_process():
             prefix = self.base_model_prefix_2
 
@@ -110,7 +360,7 @@ class ModelLoader(object):
             loaded_keys = [start_prefix + key for key in flow_state_dict.keys()]
         else:
             prefix, has_prefix_module, expects_prefix_module, loaded_keys = [None] * 4
-            flow_state_dict = collections.OrderedDict()
+            flow_state_dict = LazyStateDict() if lazy else collections.OrderedDict()
 
         prefix = dist.broadcast_py_object(prefix, src=0)
         has_prefix_module = dist.broadcast_py_object(has_prefix_module, src=0)
@@ -118,6 +368,7 @@ class ModelLoader(object):
         loaded_keys = dist.broadcast_py_object(loaded_keys, src=0)
 
         # to global
+        load_order = []
         for key, value in self.model.state_dict().items():
             if not expects_prefix_module:
                 key = prefix + "." + key
@@ -125,18 +376,19 @@ class ModelLoader(object):
                 if not has_prefix_module:
                     key = ".".join(key.split(".")[1:])
 
-                if mode == "pytorch":
-                    flow_state_dict[key] = flow.to_global(
-                        flow_state_dict[key] if dist.is_main_process() else flow.Tensor(None),
-                        sbp=flow.sbp.broadcast,
-                        placement=flow.placement("cpu", ranks=[0]),
-                    )
-
-                flow_state_dict[key] = flow.to_global(
-                    flow_state_dict[key],
-                    sbp=value.sbp,
-                    placement=flow.placement("cpu", ranks=list(value.placement.ranks)),
-                )
+                to_global = functools.partial(_tensor_to_global, like=value, mode=mode)
+                if not lazy:
+                    flow_state_dict[key] = to_global(flow_state_dict.get(key))
+                    continue
+                # tensors are moved to their placement one by one when the model loads them
+                if key not in flow_state_dict:
+                    flow_state_dict.set_lazy(key, lambda: None)
+                flow_state_dict.map_lazy(key, to_global)
+                load_order.append(key)
+
+        if lazy and dist.is_main_process():
+            # the model loads its weights in the order of its state dict
+            flow_state_dict.prefetch(load_order, num_workers=self.num_loading_workers)
         return flow_state_dict
 
     def _load_pretrained_model(
@@ -296,7 +548,9 @@ class ModelLoaderLiBai(ModelLoader):
         model (libai.models): Model to be loaded in Libai.
         libai_cfg (dict): The config of model in LiBai, you can import it from
             `libai.config.configs.common.models`.
-        pretrained_model_path (str): The file path of pretrained model.
+        pretrained_model_path (str): The file path of pretrained model. For a sharded
+            checkpoint, the checkpoint directory or its `model` entry, which is loaded
+            directly in the parallel layout of the model.
         output_loading_info (`bool`, *optional*, defaults to `False`):
             Whether to return a dictionary containing missing keys, unexpected keys
             and error messages.
@@ -311,6 +565,21 @@ class ModelLoaderLiBai(ModelLoader):
         state_dict = flow.load(state_dict_file, global_src_rank=0)
         return state_dict
 
+    def _sharded_checkpoint(self):
+        """Returns the directory and key of the model in a sharded checkpoint, which is
+        either the checkpoint directory or its `model` entry, None for other formats."""
+        path = self.pretrained_model_path.rstrip("/")
+        if is_sharded_checkpoint(path):
+            return path, "model"
+        if is_sharded_checkpoint(os.path.dirname(path)):
+            return os.path.dirname(path), os.path.basename(path)
+        return None
+
+    def _load_sharded_state_dict(self, checkpoint_dir, key):
+        # every rank only reads the slices of the weights in the layout of the built model
+        reader = ShardedCheckpointReader(checkpoint_dir)
+        return reader.load(key, self.model.state_dict(), device_type="cpu")
+
     def load(self):
         """Load model.
 
@@ -331,7 +600,9 @@ class ModelLoaderLiBai(ModelLoader):
 
         """
 
-        flow_state_dict = self._load_flow_state_dict(self.pretrained_model_path)
+        sharded_checkpoint = self._sharded_checkpoint()
+        if sharded_checkpoint is None:
+            flow_state_dict = self._load_flow_state_dict(self.pretrained_model_path)
 
         # Instance model
         if isinstance(self.model, omegaconf.dictconfig.DictConfig):
@@ -340,6 +611,9 @@ class ModelLoaderLiBai(ModelLoader):
         else:
             self.model = build_model(LazyCall(self.model)(cfg=self.libai_cfg))
 
+        if sharded_checkpoint is not None:
+            flow_state_dict = self._load_sharded_state_dict(*sharded_checkpoint)
+
         # State_dict to global
         self._state_dict_to_global(flow_state_dict, mode="libai")
 
@@ -366,6 +640,11 @@ class ModelLoaderLiBai(ModelLoader):
 class ModelLoaderHuggerFace(ModelLoader):
     """Class used to load the [`transformers`](https://huggingface.co/models)
     pretrained model.
+
+    The converted weights are cached in the directory given by the `weights_cache_dir`
+    kwarg, or the `LIBAI_WEIGHTS_CACHE_DIR` environment variable, if set. Later loads of
+    the same checkpoint files with the same loader and config memory-map the cached
+    weights instead of converting them with torch again.
     """
 
     def __init__(self, model, libai_cfg, pretrained_model_path, **kwargs):
@@ -374,6 +653,10 @@ class ModelLoaderHuggerFace(ModelLoader):
         self.base_model_prefix_2 = None  # prefix in LiBai
         self.origin_libai_cfg = copy.deepcopy(self.libai_cfg)
         self.changed_keys = set()  # Store the changed configuration
+        # Directory caching converted weights, disabled if None.
+        self.weights_cache_dir = self.kwargs.pop(
+            "weights_cache_dir", os.getenv("LIBAI_WEIGHTS_CACHE_DIR")
+        )
 
     def _convert_tensor(self, tensor):
         """Convert PyTorch tensor to OneFlow tensor.
@@ -384,12 +667,14 @@ class ModelLoaderHuggerFace(ModelLoader):
         Returns:
             flow.Tensor: The target tensor.
         """
+        return flow.Tensor(self._tensor_to_numpy(tensor))
+
+    def _tensor_to_numpy(self, tensor):
         import torch
 
         if tensor.dtype == torch.bfloat16:
-            data = tensor.detach().half().cpu().numpy()
-            return flow.Tensor(data)
-        return flow.Tensor(tensor.detach().cpu().numpy())
+            return tensor.detach().half().cpu().numpy()
+        return tensor.detach().cpu().numpy()
 
     def _convert_tensors(self, torch_state_dict):
 
@@ -419,15 +704,38 @@ class ModelLoaderHuggerFace(ModelLoader):
                 old_keys.append(key)
                 new_keys.append(new_key)
         for old_key, new_key in zip(old_keys, new_keys):
-            state_dict[new_key] = state_dict.pop(old_key)
+            self._rename_key(state_dict, old_key, new_key)
         return state_dict
 
+    def _concat_qkv(
+        self, q, k, v, head_size, num_heads, hidden_size=None, num_key_value_heads=None
+    ):
+        """Concatenate the separate query, key and value projections into the fused
+        ``query_key_value`` of LiBai, see :meth:`_fix_qkv_ordering`."""
+        return self._fix_qkv_ordering(
+            flow.cat([q, k, v], dim=0),
+            head_size,
+            num_heads,
+            hidden_size,
+            num_key_value_heads=num_key_value_heads,
+        )
+
     def _fix_qkv_ordering(
-        self, qkv, head_size, num_heads, hidden_size=None, checkpoint_version=0.0
+        self,
+        qkv,
+        head_size,
+        num_heads,
+        hidden_size=None,
+        checkpoint_version=0.0,
+        num_key_value_heads=None,
     ):
         # TODO(xzp): Different versions checkpoint
 
         hidden_size = (head_size * num_heads) if hidden_size is None else hidden_size
+        if num_key_value_heads is not None and num_key_value_heads != num_heads:
+            return self._fix_grouped_qkv_ordering(
+                qkv, head_size, num_heads, num_key_value_heads, hidden_size
+            )
         num_of_qkv = qkv.shape[0] // (head_size * num_heads)
         mode = "weight" if qkv.ndim > 1 else "bias"
         if mode == "weight":
@@ -442,6 +750,27 @@ class ModelLoaderHuggerFace(ModelLoader):
             qkv = qkv.permute(1, 0, 2).contiguous().view(-1)
         return qkv
 
+    def _fix_grouped_qkv_ordering(
+        self, qkv, head_size, num_heads, num_key_value_heads, hidden_size
+    ):
+        """Reorder a concatenated ``[q; k; v]`` of grouped-query attention into the fused layout
+        of :class:`libai.layers.MultiheadAttention`, which is ``[q_0, ..., q_{groups-1}, k, v]``
+        for every key/value head.
+        """
+        num_groups = num_heads // num_key_value_heads
+        q_size = head_size * num_heads
+        kv_size = head_size * num_key_value_heads
+        q, k, v = flow.split(qkv, [q_size, kv_size, kv_size], dim=0)
+        if qkv.ndim > 1:
+            q = q.view(num_key_value_heads, num_groups * head_size, hidden_size)
+            k = k.view(num_key_value_heads, head_size, hidden_size)
+            v = v.view(num_key_value_heads, head_size, hidden_size)
+            return flow.cat([q, k, v], dim=1).view(-1, hidden_size)
+        q = q.view(num_key_value_heads, num_groups * head_size)
+        k = k.view(num_key_value_heads, head_size)
+        v = v.view(num_key_value_heads, head_size)
+        return flow.cat([q, k, v], dim=1).view(-1)
+
     def _convert_state_dict(self, flow_state_dict, cfg):
         """A function used to convert the checkpoint file of Huggingface to LiBai.
 
@@ -498,6 +827,85 @@ class ModelLoaderHuggerFace(ModelLoader):
                 merged_state_dict.update(state_dict)
             return merged_state_dict
 
+    def _lazy_torch_state_dict(self, state_dict_files, use_safetensors=False):
+        """Index the tensors of the checkpoint files without loading them.
+
+        Safetensors files are memory-mapped by `safe_open`, and `pytorch_model.bin` files are
+        memory-mapped by `torch.load` if supported. Every tensor is read and converted to a
+        OneFlow tensor when it is accessed, so the converted state dict is never held in memory
+        as a whole.
+
+        Returns:
+            LazyStateDict: state dict of OneFlow tensors.
+        """
+        try:
+            import torch
+        except ImportError:
+            raise ImportError("Load torch state dict need torch.")
+
+        def load(tensors, key):
+            # only reads with torch, so that it can run in the prefetching threads
+            tensor = tensors.get_tensor(key) if use_safetensors else tensors[key]
+            if use_safetensors and tensor.dtype == torch.bfloat16:
+                tensor = tensor.float()
+            return self._tensor_to_numpy(tensor)
+
+        state_dict = LazyStateDict()
+        for file in state_dict_files:
+            if use_safetensors:
+                # the memory maps are closed with the state dict
+                tensors = state_dict.enter_context(safe_open(file, framework="pt"))
+            else:
+                try:
+                    tensors = torch.load(file, map_location="cpu", mmap=True)
+                except (TypeError, RuntimeError):
+                    # `mmap` needs torch>=2.1 and the zipfile serialization
+                    tensors = torch.load(file, map_location="cpu")
+            for key in tensors.keys():
+                state_dict.set_lazy(key, functools.partial(load, tensors, key))
+                state_dict.map_lazy(key, flow.Tensor)
+        return state_dict
+
+    def _load_converted_state_dict(self, model_files, use_safetensors=False):
+        """Convert the checkpoint files to a state dict of LiBai, which is cached in
+        `weights_cache_dir` if it is set.
+
+        Returns:
+            LazyStateDict: state dict of OneFlow tensors.
+        """
+        cache_path = None
+        if self.weights_cache_dir:
+            cfg = dict(self.libai_cfg.items())
+            key = weights_cache_key(
+                model_files, type(self).__qualname__, cfg, cache_dir=self.weights_cache_dir
+            )
+            cache_path = os.path.join(self.weights_cache_dir, key)
+            if has_weights_cache(cache_path):
+                logger.info(f"loading converted weights from {cache_path}...")
+                return self._lazy_cached_state_dict(cache_path)
+
+        logger.info("indexing torch model...")
+        torch_state_dict = self._lazy_torch_state_dict(model_files, use_safetensors)
+        flow_state_dict = self._fix_key(torch_state_dict)
+        flow_state_dict = self._convert_state_dict(flow_state_dict, self.libai_cfg)
+        if cache_path is None:
+            return flow_state_dict
+
+        logger.info(f"caching converted weights to {cache_path}...")
+        try:
+            save_weights_cache(flow_state_dict, cache_path, lambda tensor: tensor.numpy())
+        finally:
+            # the checkpoint files are read from the cache from now on
+            torch_state_dict.close()
+        return self._lazy_cached_state_dict(cache_path)
+
+    def _lazy_cached_state_dict(self, cache_path):
+        state_dict = LazyStateDict()
+        for key, array in load_weights_cache(cache_path).items():
+            state_dict.set_lazy(key, functools.partial(np.asarray, array))
+            state_dict.map_lazy(key, flow.Tensor)
+        return state_dict
+
     def _update_cfg(self, keys_libai, value_target):
         """Update the libai_cfg according to target_cfg.
 
@@ -597,12 +1005,7 @@ class ModelLoaderHuggerFace(ModelLoader):
             else:
                 raise EnvironmentError(f"{self.pretrained_model_path} is not a directory.")
 
-            logger.info("loading torch model...")
-            torch_state_dict = self._load_torch_state_dict(model_files, use_safetensors)
-            torch_state_dict = self._fix_key(torch_state_dict)
-            logger.info("transfering torch model into oneflow model...")
-            flow_state_dict = self._convert_tensors(torch_state_dict)
-            flow_state_dict = self._convert_state_dict(torch_state_dict, self.libai_cfg)
+            flow_state_dict = self._load_converted_state_dict(model_files, use_safetensors)
         else:
             flow_state_dict = None
 
@@ -616,19 +1019,23 @@ class ModelLoaderHuggerFace(ModelLoader):
         else:
             self.model = build_model(LazyCall(self.model)(cfg=self.libai_cfg))
 
-        # State_dict to global
-        logger.info("transfering state_dict local to global...")
+        # State_dict to global, the weights are converted and placed one by one while loading
         flow_state_dict = self._state_dict_to_global(flow_state_dict, mode="pytorch")
 
         logger.info("loading model weights into LiBai...")
         # Load
-        (
-            model,
-            missing_keys,
-            unexpected_keys,
-            mismatched_keys,
-            error_msgs,
-        ) = self._load_pretrained_model(self.model, flow_state_dict, self.pretrained_model_path)
+        try:
+            (
+                model,
+                missing_keys,
+                unexpected_keys,
+                mismatched_keys,
+                error_msgs,
+            ) = self._load_pretrained_model(self.model, flow_state_dict, self.pretrained_model_path)
+        finally:
+            if isinstance(flow_state_dict, LazyStateDict):
+                # the weights which were prefetched but not loaded are released
+                flow_state_dict.close()
 
         if self.output_loading_info:
             loading_info = {
@@ -63,16 +63,16 @@ class BertLoaderHuggerFace(ModelLoaderHuggerFace):
             if "embeddings" in key:
                 if "word_embeddings" in key:
                     new_key = key.replace("word_embeddings", "vocab_embeddings")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "token_type_embeddings" in key:
                     new_key = key.replace("token_type_embeddings", "tokentype_embeddings")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "LayerNorm.weight" in key:
                     new_key = prefix + "encoders.0.input_layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "LayerNorm.bias" in key:
                     new_key = prefix + "encoders.0.input_layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 else:
                     oneflow_state_dict[key] = oneflow_state_dict[key]
 
@@ -126,21 +126,21 @@ class BertLoaderHuggerFace(ModelLoaderHuggerFace):
                     if "dense" in key:
                         if "weight" in key:
                             new_key = prefix + "encoders." + index + ".self_attention.dense.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif "bias" in key:
                             new_key = prefix + "encoders." + index + ".self_attention.dense.bias"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                     elif "LayerNorm" in key:
                         if "weight" in key:
                             new_key = (
                                 prefix + "encoders." + index + ".post_attention_layernorm.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif "bias" in key:
                             new_key = (
                                 prefix + "encoders." + index + ".post_attention_layernorm.bias"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert bert's intermediate layers
             elif "intermediate" in key:
@@ -154,9 +154,9 @@ class BertLoaderHuggerFace(ModelLoaderHuggerFace):
                     w = key
                     b = key.replace("weight", "bias")
                     new_key = prefix + "encoders." + index + ".mlp.dense_h_to_4h.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             # Convert bert's output layers
             elif "output" in key:
@@ -170,9 +170,9 @@ class BertLoaderHuggerFace(ModelLoaderHuggerFace):
                     w = key
                     b = w.replace("weight", "bias")
                     new_key = prefix + "encoders." + index + ".mlp.dense_4h_to_h.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
                 elif "LayerNorm.weight" in key:
                     if (
                         prefix + "encoders." + str(int(index) + 1) + ".input_layernorm.weight"
@@ -183,46 +183,46 @@ class BertLoaderHuggerFace(ModelLoaderHuggerFace):
                     b = w.replace("weight", "bias")
                     if index == str(layers - 1):
                         new_key = prefix + "final_layernorm.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                        self._rename_key(oneflow_state_dict, w, new_key)
                         new_key = new_key.replace("weight", "bias")
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                        self._rename_key(oneflow_state_dict, b, new_key)
                         continue
                     new_key = prefix + "encoders." + str(int(index) + 1) + ".input_layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             # Convert bert's pooler layers
             elif "pooler" in key:
                 if "weight" in key:
                     new_key = prefix + "pooler.dense.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = prefix + "pooler.dense.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert cls_head layers
             elif "cls" in key:
                 if "predictions.bias" in key:
                     new_key = "cls_head.lm_logits.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "dense.weight" in key:
                     new_key = "cls_head.predictions.dense.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "dense.bias" in key:
                     new_key = "cls_head.predictions.dense.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "LayerNorm.weight" in key:
                     new_key = "cls_head.predictions.layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "LayerNorm.bias" in key:
                     new_key = "cls_head.predictions.layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "seq_relationship" in key:
                     new_key = key.replace("cls", "cls_head")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
             else:
-                oneflow_state_dict[key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, key)
         return oneflow_state_dict
 
     def _load_config_from_json(self, config_file):
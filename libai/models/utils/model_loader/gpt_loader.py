@@ -55,11 +55,11 @@ class GPT2LoaderHuggerFace(ModelLoaderHuggerFace):
         # Convert Embedding layers.
         new_key = "GPT_model.embeddings.token_embeddings.weight"
         old_keys.remove(prefix1 + "wte.weight")
-        oneflow_state_dict[new_key] = oneflow_state_dict.pop(prefix1 + "wte.weight")
+        self._rename_key(oneflow_state_dict, prefix1 + "wte.weight", new_key)
 
         new_key = "GPT_model.embeddings.position_embeddings.weight"
         old_keys.remove(prefix1 + "wpe.weight")
-        oneflow_state_dict[new_key] = oneflow_state_dict.pop(prefix1 + "wpe.weight")
+        self._rename_key(oneflow_state_dict, prefix1 + "wpe.weight", new_key)
 
         for key in old_keys:
             keys = key.split(".")
@@ -73,13 +73,13 @@ class GPT2LoaderHuggerFace(ModelLoaderHuggerFace):
                         new_key = prefix2 + "layers." + layer + ".input_layernorm.weight"
                     else:
                         new_key = prefix2 + "layers." + layer + ".input_layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "ln_2" in key:
                     if "weight" in key:
                         new_key = prefix2 + "layers." + layer + ".post_attention_layernorm.weight"
                     else:
                         new_key = prefix2 + "layers." + layer + ".post_attention_layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "attn" in key:
                     if "c_attn" in key:
                         if "weight" in key:
@@ -131,7 +131,7 @@ class GPT2LoaderHuggerFace(ModelLoaderHuggerFace):
                     new_key = prefix2 + "layernorm_f.weight"
                 elif "bias" in key:
                     new_key = prefix2 + "layernorm_f.bias"
-                oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, new_key)
         return oneflow_state_dict
 
     def _load_config_from_json(self, config_file):
@@ -61,16 +61,16 @@ class RobertaLoaderHuggerFace(BertLoaderHuggerFace):
             if "embeddings" in key:
                 if "word_embeddings" in key:
                     new_key = key.replace("word_embeddings", "vocab_embeddings")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "token_type_embeddings" in key:
                     new_key = key.replace("token_type_embeddings", "tokentype_embeddings")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "LayerNorm.weight" in key:
                     new_key = prefix + "encoders.0.input_layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "LayerNorm.bias" in key:
                     new_key = prefix + "encoders.0.input_layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 else:
                     oneflow_state_dict[key] = oneflow_state_dict[key]
 
@@ -124,21 +124,21 @@ class RobertaLoaderHuggerFace(BertLoaderHuggerFace):
                     if "dense" in key:
                         if "weight" in key:
                             new_key = prefix + "encoders." + index + ".self_attention.dense.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif "bias" in key:
                             new_key = prefix + "encoders." + index + ".self_attention.dense.bias"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                     elif "LayerNorm" in key:
                         if "weight" in key:
                             new_key = (
                                 prefix + "encoders." + index + ".post_attention_layernorm.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif "bias" in key:
                             new_key = (
                                 prefix + "encoders." + index + ".post_attention_layernorm.bias"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert roberta's intermediate layers
             elif "intermediate" in key:
@@ -152,9 +152,9 @@ class RobertaLoaderHuggerFace(BertLoaderHuggerFace):
                     w = key
                     b = key.replace("weight", "bias")
                     new_key = prefix + "encoders." + index + ".mlp.dense_h_to_4h.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             # Convert roberta's output layers
             elif "output" in key:
@@ -168,9 +168,9 @@ class RobertaLoaderHuggerFace(BertLoaderHuggerFace):
                     w = key
                     b = w.replace("weight", "bias")
                     new_key = prefix + "encoders." + index + ".mlp.dense_4h_to_h.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
                 elif "LayerNorm.weight" in key:
                     if (
                         prefix + "encoders." + str(int(index) + 1) + ".input_layernorm.weight"
@@ -181,42 +181,42 @@ class RobertaLoaderHuggerFace(BertLoaderHuggerFace):
                     b = w.replace("weight", "bias")
                     if index == str(layers - 1):
                         new_key = prefix + "final_layernorm.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                        self._rename_key(oneflow_state_dict, w, new_key)
                         new_key = new_key.replace("weight", "bias")
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                        self._rename_key(oneflow_state_dict, b, new_key)
                         continue
                     new_key = prefix + "encoders." + str(int(index) + 1) + ".input_layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             # Convert roberta's pooler layers
             elif "pooler" in key:
                 if "weight" in key:
                     new_key = prefix + "pooler.dense.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = prefix + "pooler.dense.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert lm_head layers
             elif "lm_head" in key:
                 if "layer_norm.weight" in key:
                     new_key = "lm_head.layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "layer_norm.bias" in key:
                     new_key = "lm_head.layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "seq_relationship" in key:
                     new_key = key.replace("cls", "cls_head")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "lm_head.bias" in key:
                     new_key = "lm_head.lm_logits.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 else:
-                    oneflow_state_dict[key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, key)
             else:
-                oneflow_state_dict[key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, key)
         return oneflow_state_dict
 
 
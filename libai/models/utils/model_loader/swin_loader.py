@@ -58,17 +58,17 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                 if "patch_embeddings.projection" in key:
                     if "weight" in key:
                         new_key = "patch_embed.proj.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif "bias" in key:
                         new_key = "patch_embed.proj.bias"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                 elif "norm" in key:
                     if "weight" in key:
                         new_key = "patch_embed.norm.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif "bias" in key:
                         new_key = "patch_embed.norm.bias"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert swin's layernorm layers
             elif "layernorm_before" in key:
@@ -76,20 +76,20 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                 index_block = key.split(".")[index_idx_2]
                 if "weight" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm1.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm1.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "layernorm_after" in key:
                 index_layer = key.split(".")[index_idx_1]
                 index_block = key.split(".")[index_idx_2]
                 if "weight" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm2.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm2.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert swin's attention layers
             elif "attention" in key:
@@ -106,7 +106,7 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                             + index_block
                             + ".attn.relative_position_bias_table"
                         )
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif "relative_position_index" in key:
                         new_key = (
                             "layers."
@@ -115,7 +115,7 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                             + index_block
                             + ".attn.relative_position_index"
                         )
-                        oneflow_state_dict.pop(key)
+                        del oneflow_state_dict[key]
                     else:
                         if (
                             "layers." + index_layer + ".blocks." + index_block + ".attn.qkv.weight"
@@ -164,7 +164,7 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                                 + index_block
                                 + ".attn.proj.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         if "bias" in key:
                             new_key = (
                                 "layers."
@@ -173,7 +173,7 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                                 + index_block
                                 + ".attn.proj.bias"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "intermediate" in key:
                 index_layer = key.split(".")[index_idx_1]
@@ -197,9 +197,9 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                         + index_block
                         + ".mlp.dense_h_to_4h.weight"
                     )
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "output" in key:
                 index_layer = key.split(".")[index_idx_1]
@@ -223,15 +223,15 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                         + index_block
                         + ".mlp.dense_4h_to_h.weight"
                     )
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "downsample" in key:
                 index_layer = key.split(".")[index_idx_1]
                 if "reduction.weight" in key:
                     new_key = "layers." + index_layer + ".downsample.reduction.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "norm" in key:
                     if (
                         "layers." + index_layer + ".downsample.norm.weight"
@@ -241,27 +241,27 @@ class SwinLoaderHuggerFace(ModelLoaderHuggerFace):
                     w = key
                     b = w.replace("weight", "bias")
                     new_key = "layers." + index_layer + ".downsample.norm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "layernorm" in key:
                 if "weight" in key:
                     new_key = "norm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "norm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "classifier" in key:
                 if "weight" in key:
                     new_key = "head.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "head.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
             else:
-                oneflow_state_dict[key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, key)
 
         return oneflow_state_dict
 
@@ -56,17 +56,17 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                 if "patch_embeddings.projection" in key:
                     if "weight" in key:
                         new_key = "patch_embed.proj.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     if "bias" in key:
                         new_key = "patch_embed.proj.bias"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                 elif "norm" in key:
                     if "weight" in key:
                         new_key = "patch_embed.norm.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     if "bias" in key:
                         new_key = "patch_embed.norm.bias"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert swinv2's layernorm layers
             elif "layernorm_before" in key:
@@ -74,20 +74,20 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                 index_block = key.split(".")[index_idx_2]
                 if "weight" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm1.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm1.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "layernorm_after" in key:
                 index_layer = key.split(".")[index_idx_1]
                 index_block = key.split(".")[index_idx_2]
                 if "weight" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm2.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "layers." + index_layer + ".blocks." + index_block + ".norm2.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert swinv2's attention layers
             elif "attention" in key:
@@ -104,7 +104,7 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                             + index_block
                             + ".attn.relative_position_bias_table"
                         )
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif "relative_position_index" in key:
                         new_key = (
                             "layers."
@@ -113,7 +113,7 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                             + index_block
                             + ".attn.relative_position_index"
                         )
-                        oneflow_state_dict.pop(key)
+                        del oneflow_state_dict[key]
                     elif "continuous_position_bias_mlp" in key:
                         if (
                             "layers."
@@ -130,9 +130,9 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                         m_1_w = key
                         m_1_b = key.replace(".0.weight", ".0.bias")
                         m_2_w = key.replace(".0.weight", ".2.weight")
-                        oneflow_state_dict[new_key + ".0.weight"] = oneflow_state_dict.pop(m_1_w)
-                        oneflow_state_dict[new_key + ".0.bias"] = oneflow_state_dict.pop(m_1_b)
-                        oneflow_state_dict[new_key + ".2.weight"] = oneflow_state_dict.pop(m_2_w)
+                        self._rename_key(oneflow_state_dict, m_1_w, new_key + ".0.weight")
+                        self._rename_key(oneflow_state_dict, m_1_b, new_key + ".0.bias")
+                        self._rename_key(oneflow_state_dict, m_2_w, new_key + ".2.weight")
                     elif "logit_scale" in key:
                         new_key = (
                             "layers." + index_layer + ".blocks." + index_block + ".attn.logit_scale"
@@ -167,9 +167,9 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                         new_key = (
                             "layers." + index_layer + ".blocks." + index_block + ".attn.q_bias"
                         )
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(q_b)
+                        self._rename_key(oneflow_state_dict, q_b, new_key)
                         new_key = new_key.replace("q_bias", "v_bias")
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(v_b)
+                        self._rename_key(oneflow_state_dict, v_b, new_key)
 
                 elif "output" in key:
                     if "dense" in key:
@@ -181,7 +181,7 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                                 + index_block
                                 + ".attn.proj.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         if "bias" in key:
                             new_key = (
                                 "layers."
@@ -190,7 +190,7 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                                 + index_block
                                 + ".attn.proj.bias"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "intermediate" in key:
                 index_layer = key.split(".")[index_idx_1]
@@ -214,9 +214,9 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                         + index_block
                         + ".mlp.dense_h_to_4h.weight"
                     )
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "output" in key:
                 index_layer = key.split(".")[index_idx_1]
@@ -240,15 +240,15 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                         + index_block
                         + ".mlp.dense_4h_to_h.weight"
                     )
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "downsample" in key:
                 index_layer = key.split(".")[index_idx_1]
                 if "reduction.weight" in key:
                     new_key = "layers." + index_layer + ".downsample.reduction.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "norm" in key:
                     if (
                         "layers." + index_layer + ".downsample.norm.weight"
@@ -258,27 +258,27 @@ class SwinV2LoaderHuggerFace(ModelLoaderHuggerFace):
                     w = key
                     b = w.replace("weight", "bias")
                     new_key = "layers." + index_layer + ".downsample.norm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "layernorm" in key:
                 if "weight" in key:
                     new_key = "norm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "norm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "classifier" in key:
                 if "weight" in key:
                     new_key = "head.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "head.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
             else:
-                oneflow_state_dict[key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, key)
 
         return oneflow_state_dict
 
@@ -61,36 +61,36 @@ class ViTLoaderHuggerFace(ModelLoaderHuggerFace):
             if "embeddings" in key:
                 if "cls_token" in key:
                     new_key = "cls_token"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "position_embeddings" in key:
                     new_key = "pos_embed"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "patch_embeddings.projection" in key:
                     if "weight" in key:
                         new_key = "patch_embed.proj.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif "bias" in key:
                         new_key = "patch_embed.proj.bias"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert vit's layernorm layers
             elif "layernorm_before" in key:
                 index_block = key.split(".")[index_idx]
                 if "weight" in key:
                     new_key = "blocks." + index_block + ".input_layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "blocks." + index_block + ".input_layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "layernorm_after" in key:
                 index_block = key.split(".")[index_idx]
                 if "weight" in key:
                     new_key = "blocks." + index_block + ".post_attention_layernorm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "blocks." + index_block + ".post_attention_layernorm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert vit's attention layers
             elif "attention" in key:
@@ -138,10 +138,10 @@ class ViTLoaderHuggerFace(ModelLoaderHuggerFace):
                     if "dense" in key:
                         if "weight" in key:
                             new_key = "blocks." + index_block + ".self_attention.dense.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         if "bias" in key:
                             new_key = "blocks." + index_block + ".self_attention.dense.bias"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "intermediate" in key:
                 index_block = key.split(".")[index_idx]
@@ -154,9 +154,9 @@ class ViTLoaderHuggerFace(ModelLoaderHuggerFace):
                     w = key
                     b = key.replace("weight", "bias")
                     new_key = "blocks." + index_block + ".mlp.dense_h_to_4h.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "output" in key:
                 index_block = key.split(".")[index_idx]
@@ -169,27 +169,27 @@ class ViTLoaderHuggerFace(ModelLoaderHuggerFace):
                     w = key
                     b = w.replace("weight", "bias")
                     new_key = "blocks." + index_block + ".mlp.dense_4h_to_h.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(w)
+                    self._rename_key(oneflow_state_dict, w, new_key)
                     new_key = new_key.replace("weight", "bias")
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(b)
+                    self._rename_key(oneflow_state_dict, b, new_key)
 
             elif "layernorm" in key:
                 if "weight" in key:
                     new_key = "norm.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "norm.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
 
             elif "classifier" in key:
                 if "weight" in key:
                     new_key = "head.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
                 elif "bias" in key:
                     new_key = "head.bias"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                    self._rename_key(oneflow_state_dict, key, new_key)
             else:
-                oneflow_state_dict[key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, key)
 
         return oneflow_state_dict
 
@@ -0,0 +1,173 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+On-disk cache of HuggingFace weights converted by a `ModelLoaderHuggerFace`.
+
+A cache entry is a directory with the raw data of every converted tensor in
+``weights.bin`` and an ``index.json`` with their offsets, dtypes and shapes, so the
+weights are memory-mapped without torch when the entry is loaded again.
+"""
+
+import collections
+import functools
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Bump when the conversion of the loaders changes, to invalidate existing entries.
+WEIGHTS_CACHE_VERSION = 1
+
+_INDEX_NAME = "index.json"
+_DATA_NAME = "weights.bin"
+_DIGESTS_NAME = "digests.json"
+_ALIGNMENT = 64
+_HASH_CHUNK = 4 << 20
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(functools.partial(f.read, _HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _load_digests(cache_dir):
+    path = os.path.join(cache_dir, _DIGESTS_NAME)
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_digests(cache_dir, digests):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, _DIGESTS_NAME)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(digests, f)
+    os.replace(tmp_path, path)
+
+
+def _file_fingerprint(path, digests):
+    """Fingerprint the content of a checkpoint file.
+
+    Files of the HuggingFace hub cache are symlinks to blobs named by the sha256 of
+    their content, which is used when available. Otherwise the whole file is hashed once,
+    and its digest is kept in ``digests`` under its path, size, modification time and
+    inode, so that it is only hashed again once it is rewritten.
+    """
+    real_path = os.path.realpath(path)
+    blob = os.path.basename(real_path)
+    if os.path.basename(os.path.dirname(real_path)) == "blobs" and len(blob) == 64:
+        return blob
+
+    stat = os.stat(real_path)
+    stat_key = f"{real_path}:{stat.st_size}:{stat.st_mtime_ns}:{stat.st_ino}"
+    if stat_key not in digests:
+        digests[stat_key] = _hash_file(real_path)
+    return digests[stat_key]
+
+
+def weights_cache_key(model_files, loader_name, cfg, cache_dir=None):
+    """Key of the converted weights of ``model_files``, which also depends on the loader
+    doing the conversion and the model config, e.g. the number of heads and the dtype.
+    The digests of the files are kept in ``cache_dir`` if it is given."""
+    digests = _load_digests(cache_dir) if cache_dir else {}
+    num_digests = len(digests)
+    digest = hashlib.sha256()
+    digest.update(f"{WEIGHTS_CACHE_VERSION}:{loader_name}".encode("utf-8"))
+    for path in sorted(model_files, key=os.path.basename):
+        fingerprint = _file_fingerprint(path, digests)
+        digest.update(f"{os.path.basename(path)}:{fingerprint}".encode("utf-8"))
+    digest.update(json.dumps(cfg, sort_keys=True, default=str).encode("utf-8"))
+    if cache_dir and len(digests) > num_digests:
+        _save_digests(cache_dir, digests)
+    return digest.hexdigest()
+
+
+def has_weights_cache(cache_path):
+    return os.path.isfile(os.path.join(cache_path, _INDEX_NAME))
+
+
+def save_weights_cache(state_dict, cache_path, to_numpy):
+    """Write the tensors of ``state_dict`` one by one, and commit the entry by renaming
+    its directory, so that a partially written entry is never loaded.
+
+    Args:
+        state_dict (Mapping): converted state dict, whose values may be loaded lazily.
+        cache_path (str): directory of the cache entry.
+        to_numpy (callable): converts a value of ``state_dict`` to a np.ndarray.
+    """
+    tmp_path = f"{cache_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+    index = collections.OrderedDict()
+    offset = 0
+    try:
+        with open(os.path.join(tmp_path, _DATA_NAME), "wb") as f:
+            for key in list(state_dict.keys()):
+                array = np.ascontiguousarray(to_numpy(state_dict[key]))
+                index[key] = {"offset": offset, "dtype": array.dtype.str, "shape": array.shape}
+                f.write(array.reshape(-1).view(np.uint8))
+                padding = -array.nbytes % _ALIGNMENT
+                f.write(bytes(padding))
+                offset += array.nbytes + padding
+            f.flush()
+            os.fsync(f.fileno())
+        with open(os.path.join(tmp_path, _INDEX_NAME), "w") as f:
+            json.dump(index, f)
+        try:
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # another process committed the same entry first
+            if not has_weights_cache(cache_path):
+                raise
+            shutil.rmtree(tmp_path, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    logger.info(f"saved converted weights to {cache_path}")
+
+
+def load_weights_cache(cache_path):
+    """Memory-map the tensors of a cache entry.
+
+    Returns:
+        OrderedDict: maps keys to read-only np.ndarray views of the cache entry.
+    """
+    with open(os.path.join(cache_path, _INDEX_NAME), "r") as f:
+        index = json.load(f, object_pairs_hook=collections.OrderedDict)
+    data_file = os.path.join(cache_path, _DATA_NAME)
+    buffer = np.memmap(data_file, dtype=np.uint8, mode="r") if os.path.getsize(data_file) else None
+    return collections.OrderedDict(
+        (
+            key,
+            np.ndarray(
+                tuple(entry["shape"]),
+                dtype=np.dtype(entry["dtype"]),
+                buffer=buffer,
+                offset=entry["offset"],
+            ),
+        )
+        for key, entry in index.items()
+    )
@@ -14,9 +14,12 @@
 # limitations under the License.
 
 import copy
+import json
 import logging
 import os
 import shutil
+import threading
+import time
 from collections import defaultdict
 from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
 
@@ -27,6 +30,16 @@ from termcolor import colored
 
 import libai.utils.distributed as dist
 from libai.utils.file_io import HTTPURLHandler, PathManagerBase
+from libai.utils.sharded_checkpoint import (
+    SHARDED_CHECKPOINT_FORMAT,
+    SHARDED_CHECKPOINT_MANIFEST,
+    ShardedCheckpointReader,
+    has_tensor,
+    is_sharded_checkpoint,
+    shard_file_name,
+    snapshot_state,
+    write_shard,
+)
 
 
 class _IncompatibleKeys(
@@ -46,10 +59,52 @@ class _IncompatibleKeys(
     pass
 
 
+_ASYNC_COMMIT_TIMEOUT = 30 * 60
+
+
+class AsyncSaveState(object):
+    """
+    State of an asynchronous checkpoint save, which is in flight until the
+    shard of this rank is durable (and, on rank 0, until the manifest is committed).
+    """
+
+    def __init__(self, name: str, save_dir: str, shard_file: str):
+        self.name = name
+        self.save_dir = save_dir
+        self.shard_file = shard_file
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.error = None
+        self._done = threading.Event()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def elapsed(self) -> float:
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        return end_time - self.start_time
+
+    def _finish(self, error: Optional[BaseException] = None):
+        self.error = error
+        self.end_time = time.perf_counter()
+        self._done.set()
+
+    def __repr__(self):
+        status = "failed" if self.error is not None else "done" if self.done() else "in flight"
+        return f"AsyncSaveState(name={self.name}, status={status}, elapsed={self.elapsed:.2f}s)"
+
+
 class Checkpointer(object):
     """
     A checkpointer that can save/load model as well as extra checkpointable
     objects.
+
+    With ``async_save=True``, :meth:`save` snapshots the local shards of all
+    states to host memory and returns, each rank writes its own shard in a
+    background thread, and rank 0 commits the checkpoint by atomically writing
+    a manifest once the shards of all ranks are durable. ``save_dir`` must be
+    on a filesystem shared by all ranks in this mode.
     """
 
     # NOTE: only support data_parallel for saving model
@@ -61,6 +116,7 @@ class Checkpointer(object):
         save_dir: str = "",
         *,
         save_to_disk: bool = True,
+        async_save: bool = False,
         **checkpointables: object,
     ):
         """
@@ -69,6 +125,7 @@ class Checkpointer(object):
             save_dir (str): a directory to save and find checkpoints.
             save_to_disk (bool): if True, save checkpoint to disk, otherwise
                 disable saving for this checkpointer.
+            async_save (bool): if True, save sharded checkpoints asynchronously.
             checkpointables (object): any checkpointable objects, i.e., objects
                 that have the `state_dict()` and `load_state_dict()` method. For
                 example, it can be used like
@@ -79,6 +136,8 @@ class Checkpointer(object):
         self.logger = logging.getLogger(__name__)
         self.save_dir = save_dir
         self.save_to_disk = save_to_disk
+        self.async_save = async_save
+        self.pending_save: Optional[AsyncSaveState] = None
         # Default PathManager, support HTTP URLs
         # A user may want to use a different project-specific PathManagerBase'
         self.path_manager: PathManagerBase = PathManagerBase()
@@ -92,6 +151,8 @@ class Checkpointer(object):
             name (str): name of the file.
             kwargs (dict): extra arbitrary data to save.
         """
+        # only one checkpoint is in flight, which also bounds the host memory of snapshots
+        self.wait()
 
         data = {}
         data["model"] = self.model.state_dict()
@@ -106,6 +167,10 @@ class Checkpointer(object):
             self.path_manager.mkdirs(save_dir)
         self.logger.info("Saving checkpoint to {}".format(save_dir))
 
+        if self.async_save:
+            self._save_sharded_async(basename, save_dir, data)
+            return
+
         for save_name in data:
             if save_name == "iteration":
                 continue
@@ -119,6 +184,94 @@ class Checkpointer(object):
         if basename != "model_best":
             self.tag_last_checkpoint(basename)
 
+    def _save_sharded_async(self, basename: str, save_dir: str, data: Dict[str, Any]):
+        rank = dist.get_rank()
+        world_size = dist.get_world_size()
+        # the markers and the manifest of a previous save to this directory, e.g. of
+        # `model_best`, would commit the checkpoint before the new shards are written,
+        # so they are removed once the saves of all ranks are done, before any new marker
+        dist.synchronize()
+        if rank == 0:
+            stale_files = [SHARDED_CHECKPOINT_MANIFEST] + [
+                shard_file_name(i) + ".done" for i in range(world_size)
+            ]
+            for stale_file in stale_files:
+                if os.path.exists(os.path.join(save_dir, stale_file)):
+                    os.remove(os.path.join(save_dir, stale_file))
+        dist.synchronize()
+        # the snapshot must be taken on all ranks before any rank keeps training
+        snapshot = {
+            key: snapshot_state(value, rank)
+            for key, value in data.items()
+            if key != "iteration" and (rank == 0 or has_tensor(value))
+        }
+        shard_file = os.path.join(save_dir, shard_file_name(rank))
+        tmp_file = shard_file + ".tmp"
+        state = AsyncSaveState(basename, save_dir, shard_file)
+
+        def commit():
+            try:
+                # make the shard durable before it becomes visible
+                with open(tmp_file, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, shard_file)
+                _atomic_write(os.path.join(save_dir, shard_file_name(rank) + ".done"), "")
+                if rank == 0:
+                    self._commit_manifest(basename, save_dir, world_size, sorted(snapshot))
+            except BaseException as e:  # noqa
+                self.logger.exception("Failed to save checkpoint {}".format(save_dir))
+                state._finish(e)
+            else:
+                state._finish()
+
+        f = self.path_manager.opena(tmp_file, "wb", callback_after_file_close=commit)
+        write_shard(f, snapshot)
+        f.close()
+        self.pending_save = state
+
+    def _commit_manifest(self, basename: str, save_dir: str, world_size: int, keys: List[str]):
+        shard_files = [shard_file_name(rank) for rank in range(world_size)]
+        deadline = time.time() + _ASYNC_COMMIT_TIMEOUT
+        for shard_file in shard_files:
+            while not os.path.exists(os.path.join(save_dir, shard_file + ".done")):
+                if time.time() > deadline:
+                    raise TimeoutError(
+                        "Shard {} of checkpoint {} is not written in {}s".format(
+                            shard_file, save_dir, _ASYNC_COMMIT_TIMEOUT
+                        )
+                    )
+                time.sleep(1.0)
+        manifest = {
+            "format": SHARDED_CHECKPOINT_FORMAT,
+            "world_size": world_size,
+            "keys": keys,
+            "shards": shard_files,
+        }
+        _atomic_write(os.path.join(save_dir, SHARDED_CHECKPOINT_MANIFEST), json.dumps(manifest))
+        for shard_file in shard_files:
+            os.remove(os.path.join(save_dir, shard_file + ".done"))
+        if basename != "model_best":
+            _atomic_write(os.path.join(self.save_dir, "last_checkpoint"), basename)
+        self.logger.info("Committed checkpoint {}".format(save_dir))
+
+    def wait(self):
+        """
+        Block until the in-flight asynchronous save, if any, is complete.
+
+        Returns:
+            AsyncSaveState: state of the finished save, None if there is no save in flight.
+        """
+        state = self.pending_save
+        if state is None:
+            return None
+        self.path_manager.async_join(state.shard_file + ".tmp")
+        self.pending_save = None
+        if state.error is not None:
+            self.logger.error("Asynchronous save of {} failed: {}".format(state.name, state.error))
+        else:
+            self.logger.info("Saved checkpoint {} in {:.2f}s".format(state.name, state.elapsed))
+        return state
+
     def load(self, path: str, checkpointables: Optional[List[str]] = None) -> object:
         """
         Load from the given checkpoint. When path points to network file, this
@@ -223,19 +376,36 @@ class Checkpointer(object):
                 the checkpointer dict["model"] must be a dict which maps strings
                 to flow.Tensor or numpy arrays.
         """
+        if is_sharded_checkpoint(f):
+            data = self._load_sharded_file(f)
+        else:
+            data = self._load_consolidated_file(f)
+        try:
+            data["iter"] = int(f.split("_")[-1])
+        except:  # noqa
+            self.logger.info(f"iter info in {f} not found, set iter to 0")
+            data["iter"] = 0
+        return data
+
+    def _load_consolidated_file(self, f: str):
         data = {}
         keys = self.path_manager.ls(f)
         # broadcast checkpointer keys to other ranks
         keys = dist.broadcast_py_object(keys, src=0)
         for key in keys:
             data[key] = flow.load(os.path.join(f, key), global_src_rank=0)
-        try:
-            data["iter"] = int(f.split("_")[-1])
-        except:  # noqa
-            self.logger.info(f"iter info in {f} not found, set iter to 0")
-            data["iter"] = 0
         return data
 
+    def _load_sharded_file(self, f: str):
+        # tensors are loaded directly in the layout of the states to restore,
+        # which may differ from the parallel layout used for saving
+        reader = ShardedCheckpointReader(f)
+        targets = {"model": self.model.state_dict()}
+        for key, obj in self.checkpointables.items():
+            if hasattr(obj, "state_dict"):
+                targets[key] = obj.state_dict()
+        return {key: reader.load(key, targets.get(key)) for key in reader.keys}
+
     def _load_model(self, checkpoint: Any):
         """
         Load weights from a checkpoint.
@@ -358,7 +528,12 @@ class PeriodicCheckpointer:
             )
 
             if self.max_to_keep is not None:
-                self.recent_checkpoints.append(self.checkpointer.get_checkpoint_file())
+                # `last_checkpoint` is only tagged once an asynchronous save is committed
+                self.recent_checkpoints.append(
+                    os.path.join(
+                        self.checkpointer.save_dir, "{}_{:07d}".format(self.file_prefix, iteration)
+                    )
+                )
                 if len(self.recent_checkpoints) > self.max_to_keep:
                     file_to_delete = self.recent_checkpoints.pop(0)
                     if (
@@ -377,6 +552,14 @@ class PeriodicCheckpointer:
             if iteration >= self.max_iter - 1:
                 self.checkpointer.save(f"{self.file_prefix}_final", **additional_state)
 
+    @property
+    def in_flight_save(self) -> Optional[AsyncSaveState]:
+        """
+        AsyncSaveState: state of the asynchronous save which is not waited for yet,
+            None if there is none.
+        """
+        return self.checkpointer.pending_save
+
     def save(self, name: str, **kwargs: Any):
         """
         Same argument as :meth:`Checkpointer.save`.
@@ -390,6 +573,15 @@ class PeriodicCheckpointer:
         self.checkpointer.save(name, **kwargs)
 
 
+def _atomic_write(path: str, content: str) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
 def _filter_reused_missing_keys(model: nn.Module, keys: List[str]) -> List[str]:
     """
     Filter "missing keys" to not include keys that have been loaded with another name.
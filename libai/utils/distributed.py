@@ -33,6 +33,40 @@ def _merge_devices(devices):
     return node_devices
 
 
+def get_layer_stage_ids(pipeline_num_layers, pipeline_parallel_size):
+    """
+    Returns:
+        list[int]: the pipeline stage id of every layer, as assigned by LiBai when
+            ``custom_pipeline_stage_id`` is not set.
+    """
+    # change pipeline_num_layers to make the middle stages contain more layers
+    if (
+        pipeline_parallel_size >= 4
+        and pipeline_num_layers >= 8
+        and pipeline_num_layers % pipeline_parallel_size == 0
+    ):
+        temp_num_layers_per_stage = pipeline_num_layers // pipeline_parallel_size
+        actual_pipeline_num_layers = pipeline_num_layers + min(
+            pipeline_parallel_size - 1, temp_num_layers_per_stage
+        )
+    else:
+        actual_pipeline_num_layers = pipeline_num_layers
+
+    num_layers_per_stage = actual_pipeline_num_layers // pipeline_parallel_size
+    stage_offset = actual_pipeline_num_layers % pipeline_parallel_size
+
+    # stage_offset can make the later stages contain more layers when pipeline_num_layers
+    # cannot be divided by pipeline_parallel_size.
+    # This can make pipeline parallel more memory efficient.
+    layer_stage_ids = []
+    for i in range(0, actual_pipeline_num_layers - stage_offset, num_layers_per_stage):
+        stage_id = i // num_layers_per_stage
+        if stage_id >= (pipeline_parallel_size - stage_offset):
+            layer_stage_ids.append(stage_id)
+        layer_stage_ids.extend([stage_id] * num_layers_per_stage)
+    return layer_stage_ids[:pipeline_num_layers]
+
+
 class _DistributeUtil(object):
     def __init__(self, cfg):
 
@@ -158,32 +192,9 @@ class _DistributeUtil(object):
             for i in range(0, self.world_size, num_devices_per_stage)
         ]
 
-        # change pipeline_num_layers to make the middle stages contain more layers
-        if (
-            self._pipeline_parallel_size >= 4
-            and cfg.pipeline_num_layers >= 8
-            and cfg.pipeline_num_layers % self._pipeline_parallel_size == 0
-        ):
-            temp_num_layers_per_stage = cfg.pipeline_num_layers // self._pipeline_parallel_size
-            actual_pipeline_num_layers = cfg.pipeline_num_layers + min(
-                self._pipeline_parallel_size - 1, temp_num_layers_per_stage
-            )
-        else:
-            actual_pipeline_num_layers = cfg.pipeline_num_layers
-
-        num_layers_per_stage = actual_pipeline_num_layers // self._pipeline_parallel_size
-        stage_offset = actual_pipeline_num_layers % self._pipeline_parallel_size
-
-        # stage_offset can make the later stages contain more layers when pipeline_num_layers
-        # cannot be divided by pipeline_parallel_size.
-        # This can make pipeline parallel more memory efficient.
-        self._layer_stage_ids = []
-        for i in range(0, actual_pipeline_num_layers - stage_offset, num_layers_per_stage):
-            stage_id = i // num_layers_per_stage
-            if stage_id >= (self._pipeline_parallel_size - stage_offset):
-                self._layer_stage_ids.append(stage_id)
-            self._layer_stage_ids.extend([stage_id] * num_layers_per_stage)
-        self._layer_stage_ids = self._layer_stage_ids[: cfg.pipeline_num_layers]
+        self._layer_stage_ids = get_layer_stage_ids(
+            cfg.pipeline_num_layers, self._pipeline_parallel_size
+        )
         # when pipeline_parallel_size > 1, we add pipeline_stage_id infomation into cfg
         if cfg.pipeline_parallel_size > 1:
             cfg.auto_pipeline_stage_id = self._layer_stage_ids
@@ -431,6 +442,24 @@ def broadcast_py_object(obj, src: int = 0):
         return dill.loads(flow._oneflow_internal.cpu_broadcast(None, src))
 
 
+def gather_to_rank0(array):
+    """
+    Gather a host np.ndarray, which has the same shape on all ranks, to rank0.
+
+    Returns:
+        np.ndarray: the arrays of all ranks stacked along a new first dim on rank0,
+            and None on the other ranks.
+    """
+    world_size = get_world_size()
+    if world_size == 1:
+        return array[None]
+    tensor = flow.tensor(array[None], device="cpu").to_global(
+        placement=flow.placement("cpu", ranks=list(range(world_size))), sbp=flow.sbp.split(0)
+    )
+    tensor = tensor.to_global(placement=flow.placement("cpu", ranks=[0]), sbp=flow.sbp.broadcast)
+    return tensor.to_local().numpy() if is_main_process() else None
+
+
 def convert_to_distributed_default_setting(t):
     """
     Helper function to convert all eager local tensor in :attr:`nn.Module` in the model to
@@ -19,6 +19,7 @@ import datetime
 import json
 import logging
 import os
+import threading
 import time
 from collections import defaultdict
 from contextlib import contextmanager
@@ -34,12 +35,15 @@ from libai.utils.history_buffer import HistoryBuffer
 
 __all__ = [
     "get_event_storage",
+    "use_event_storage",
     "JSONWriter",
     "CommonMetricPrinter",
     "EventStorage",
 ]
 
 _CURRENT_STORAGE_STACK = []
+# storages used by the current thread only, see `use_event_storage`
+_THREAD_STORAGE = threading.local()
 
 
 def get_event_storage():
@@ -48,17 +52,41 @@ def get_event_storage():
         The :class:`EventStorage` object that's currently being used.
         Throw an error if no :class:`EventStorage` is currently enabled.
     """
+    thread_stack = getattr(_THREAD_STORAGE, "stack", None)
+    if thread_stack:
+        return thread_stack[-1]
     assert len(
         _CURRENT_STORAGE_STACK
     ), "get_event_storage() has to be called inside a 'with EventStorage(...)' context!"
     return _CURRENT_STORAGE_STACK[-1]
 
 
+@contextmanager
+def use_event_storage(storage):
+    """
+    Yields:
+        A context within which :func:`get_event_storage` returns `storage`
+        in the current thread only, e.g. a snapshot read by a background writer.
+    """
+    if not hasattr(_THREAD_STORAGE, "stack"):
+        _THREAD_STORAGE.stack = []
+    _THREAD_STORAGE.stack.append(storage)
+    try:
+        yield storage
+    finally:
+        _THREAD_STORAGE.stack.pop()
+
+
 class EventWriter:
     """
     Base class for writers that obtain events from :class:`EventStorage` and process them.
+
+    Writers whose `async_safe` is True only read the storage and do not share state
+    with the training, so they can write a snapshot of the storage in a background thread.
     """
 
+    async_safe = False
+
     def write(self):
         raise NotImplementedError
 
@@ -98,6 +126,8 @@ class JSONWriter(EventWriter):
         ...
     """
 
+    async_safe = True
+
     def __init__(self, json_file, window_size=20):
         """
         Args:
@@ -140,6 +170,8 @@ class TensorboardXWriter(EventWriter):
     Write all scalars to a tensorboard file
     """
 
+    async_safe = True
+
     def __init__(self, log_dir: str, window_size: int = 20, **kwargs):
         """
         Args:
@@ -234,7 +266,10 @@ class CommonMetricPrinter(EventWriter):
         except KeyError:
             lr = "N/A"
 
-        max_mem_mb = None
+        try:
+            max_mem_mb = storage.history("max_mem_mb").latest()
+        except KeyError:
+            max_mem_mb = None
 
         # NOTE: max_mem is parsed by grep in "dev/parse_results.sh"
         self.logger.info(
@@ -415,6 +450,24 @@ class EventStorage:
     def samples(self, val):
         self._samples = int(val)
 
+    def snapshot(self, window_size=1000):
+        """
+        Returns:
+            EventStorage: a copy of this storage, which keeps the latest `window_size`
+            values of every scalar, to be read by writers while the training goes on.
+            The images and histograms are moved to the copy.
+        """
+        snapshot = EventStorage(self._iter)
+        for name, history in self._history.items():
+            snapshot._history[name] = history.copy(window_size)
+        snapshot._smoothing_hints = dict(self._smoothing_hints)
+        snapshot._latest_scalars = dict(self._latest_scalars)
+        if hasattr(self, "_samples"):
+            snapshot._samples = self._samples
+        snapshot._vis_data, self._vis_data = self._vis_data, []
+        snapshot._histograms, self._histograms = self._histograms, []
+        return snapshot
+
     def __enter__(self):
         _CURRENT_STORAGE_STACK.append(self)
         return self
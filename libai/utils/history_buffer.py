@@ -13,8 +13,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from typing import List, Tuple
-
 import numpy as np
 
 # --------------------------------------------------------
@@ -27,6 +25,10 @@ class HistoryBuffer:
     """
     Track a series of scalar values and provide access to smoothed values over a
     window or the global average of the series.
+
+    The values are kept in a ring buffer of NumPy arrays, which grows on demand up to
+    `max_length`, together with their running sums, so that the average over a window
+    takes constant time.
     """
 
     def __init__(self, max_length: int = 1000000):
@@ -37,11 +39,28 @@ class HistoryBuffer:
                 values will be removed.
         """
         self._max_length: int = max_length
-        self._data: List[Tuple[float, float]] = []  # (value, iteration) pairs
+        self._values = np.empty(0, dtype=np.float64)
+        self._iterations = np.empty(0, dtype=np.int64)
+        # running sum of the series up to each value
+        self._sums = np.empty(0, dtype=np.float64)
+        self._size: int = 0
+        self._next: int = 0  # index of the slot of the next value
+        self._total: float = 0.0
+        # running sum of the series up to the latest removed value
+        self._removed_total: float = 0.0
         self._count: int = 0
         self._global_avg: float = 0
 
-    def update(self, value: float, iteration: float = None):
+    def _grow(self):
+        capacity = min(max(2 * len(self._values), 16), self._max_length)
+        for name in ("_values", "_iterations", "_sums"):
+            array = getattr(self, name)
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[: self._size] = array[: self._size]
+            setattr(self, name, grown)
+        self._next = self._size
+
+    def update(self, value: float, iteration: int = None):
         """
         Add a new scalar value produced at certain iteration. If the length
         of the buffer exceeds self._max_length, the oldest element will be
@@ -49,30 +68,62 @@ class HistoryBuffer:
         """
         if iteration is None:
             iteration = self._count
-        if len(self._data) == self._max_length:
-            self._data.pop(0)
-        self._data.append((value, iteration))
+        if self._size == len(self._values) and self._size < self._max_length:
+            # the buffer has never been full, so the values are stored from index 0
+            self._grow()
+        if self._size == self._max_length:
+            self._removed_total = self._sums[self._next]
+        else:
+            self._size += 1
+        self._total += value
+        self._values[self._next] = value
+        self._iterations[self._next] = iteration
+        self._sums[self._next] = self._total
+        self._next = (self._next + 1) % len(self._values)
 
         self._count += 1
         self._global_avg += (value - self._global_avg) / self._count
 
+    def _window(self, array, window_size):
+        """
+        Return the latest `window_size` elements of `array`, from the oldest one.
+        """
+        start = self._next - min(window_size, self._size)
+        if start >= 0:
+            return array[start : self._next]
+        return np.concatenate((array[start:], array[: self._next]))
+
     def latest(self):
         """
         Return the latest scalar value added to the buffer.
         """
-        return self._data[-1][0]
+        if self._size == 0:
+            raise IndexError("HistoryBuffer is empty")
+        return float(self._values[self._next - 1])
 
     def median(self, window_size: int):
         """
         Return the median of the latest `window_size` values in the buffer.
         """
-        return np.median([x[0] for x in self._data[-window_size:]])
+        return np.median(self._window(self._values, window_size))
 
     def avg(self, window_size: int):
         """
         Return the mean of the latest `window_size` values in the buffer.
         """
-        return np.mean([x[0] for x in self._data[-window_size:]])
+        window_size = min(window_size, self._size)
+        if window_size <= 0:
+            return np.mean(self._values[:0])
+        if window_size == self._size:
+            start_total = self._removed_total
+        else:
+            start_total = self._sums[self._next - window_size - 1]
+        with np.errstate(invalid="ignore"):
+            mean = (self._total - start_total) / window_size
+        if not np.isfinite(mean):
+            # the running sums stay inf or nan after such a value is added
+            mean = np.mean(self._window(self._values, window_size))
+        return mean
 
     def global_avg(self):
         """
@@ -86,4 +137,31 @@ class HistoryBuffer:
         Returns:
             list[(number, iteration)]: content of the current buffer.
         """
-        return self._data
+        return list(
+            zip(
+                self._window(self._values, self._size).tolist(),
+                self._window(self._iterations, self._size).tolist(),
+            )
+        )
+
+    def copy(self, max_length: int = None):
+        """
+        Return a copy of the buffer, which keeps the latest `max_length` values,
+        and the global average of the series.
+        """
+        max_length = self._max_length if max_length is None else max_length
+        size = min(max_length, self._size)
+        buffer = HistoryBuffer(max_length=max_length)
+        buffer._values = self._window(self._values, size).copy()
+        buffer._iterations = self._window(self._iterations, size).copy()
+        buffer._sums = self._window(self._sums, size).copy()
+        buffer._size = size
+        buffer._next = 0 if size == max_length else size
+        buffer._total = self._total
+        if size == self._size:
+            buffer._removed_total = self._removed_total
+        else:
+            buffer._removed_total = self._sums[self._next - size - 1]
+        buffer._count = self._count
+        buffer._global_avg = self._global_avg
+        return buffer
@@ -0,0 +1,403 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Memory accounting of training: the memory of the parameters, gradients, optimizer states
+and activations per layer and per pipeline stage, estimated from a model instantiated on
+cpu, and the memory used at runtime.
+"""
+
+import gc
+import resource
+
+import oneflow as flow
+
+from libai.utils.distributed import get_layer_stage_ids
+
+__all__ = [
+    "is_out_of_memory",
+    "split_on_out_of_memory",
+    "get_memory_used_mb",
+    "get_optimizer_num_states",
+    "transformer_layer_activation_bytes",
+    "estimate_memory",
+    "MemoryEstimate",
+]
+
+MB = 1024**2
+
+# number of fp32 states kept by the optimizer per parameter
+OPTIMIZER_NUM_STATES = {
+    "Adam": 2,
+    "AdamW": 2,
+    "LAMB": 2,
+    "RMSprop": 1,
+    "Adagrad": 1,
+}
+
+
+def get_optimizer_num_states(optimizer_class, momentum=0.0):
+    """
+    Returns:
+        int: the number of states per parameter of ``optimizer_class``, 2 if unknown.
+    """
+    name = getattr(optimizer_class, "__name__", str(optimizer_class)).rsplit(".", 1)[-1]
+    if name == "SGD":
+        return 1 if momentum else 0
+    return OPTIMIZER_NUM_STATES.get(name, 2)
+
+
+def is_out_of_memory(error):
+    """
+    Returns:
+        bool: whether ``error`` was raised by OneFlow when failing to allocate memory.
+    """
+    message = str(error).lower()
+    return any(
+        pattern in message
+        for pattern in ("out of memory", "cudaerrormemoryallocation", "failed to allocate")
+    )
+
+
+def split_on_out_of_memory(fn, items):
+    """
+    Run ``fn`` on the list ``items``, or on its two halves when it runs out of memory,
+    recursively down to single items.
+
+    ``fn`` must return a list with the results of ``items`` in order, and the result of an
+    item must not depend on the other items of the call, so that the results do not
+    depend on the splits.
+
+    Returns:
+        list: the concatenated results of the calls.
+    """
+    try:
+        return fn(items)
+    except Exception as e:
+        if not is_out_of_memory(e) or len(items) == 1:
+            raise
+    # retry out of the except block, so that the traceback does not hold the activations
+    gc.collect()
+    if flow.cuda.is_available():
+        flow.cuda.empty_cache()
+    half = len(items) // 2
+    return split_on_out_of_memory(fn, items[:half]) + split_on_out_of_memory(fn, items[half:])
+
+
+def get_memory_used_mb(device_type="cuda"):
+    """
+    Returns:
+        float or None: the peak memory allocated on the current cuda device, in MB, or
+            the memory used on the device when the peak is not tracked by OneFlow,
+            or the peak resident memory of the process on cpu. None if unknown.
+    """
+    if device_type == "cuda" and flow.cuda.is_available():
+        if hasattr(flow.cuda, "max_memory_allocated"):
+            return flow.cuda.max_memory_allocated() / MB
+        if hasattr(flow.cuda, "mem_get_info"):
+            free, total = flow.cuda.mem_get_info()
+            return (total - free) / MB
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _attention_bytes(layer, micro_batch_size, seq_length, bytes_per_element, tensor_parallel_size):
+    sbh = seq_length * micro_batch_size * layer.hidden_size
+    num_heads = getattr(layer, "num_attention_heads", None) or layer.num_heads
+    num_kv_heads = getattr(layer, "num_key_value_heads", None) or num_heads
+    block_size = getattr(layer, "attention_block_size", None) or seq_length
+    attn_dropout = getattr(layer, "attention_dropout_prob", 0.0) > 0
+    output_dropout = getattr(layer, "output_dropout_prob", 0.0) > 0
+
+    # inputs of the layernorm and of the qkv projection, mask of the output dropout
+    replicated = (2 * bytes_per_element + output_dropout) * sbh
+    # query, key and value, input of the output projection
+    split = (2 + 2 * num_kv_heads / num_heads) * bytes_per_element * sbh
+    # softmax output, and output and mask of the attention dropout
+    scores = num_heads * seq_length * min(block_size, seq_length) * micro_batch_size
+    split += (bytes_per_element + attn_dropout * (bytes_per_element + 1)) * scores
+    return replicated + split / tensor_parallel_size
+
+
+def _mlp_bytes(layer, micro_batch_size, seq_length, bytes_per_element, tensor_parallel_size):
+    sbh = seq_length * micro_batch_size * layer.hidden_size
+    ffn_hidden_size = (
+        getattr(layer, "ffn_hidden_size", None)
+        or getattr(layer, "intermediate_size", None)
+        or 4 * layer.hidden_size
+    )
+    output_dropout = getattr(layer, "output_dropout_prob", 0.0) > 0
+
+    # inputs of the layernorm and of the first linear, mask of the output dropout
+    replicated = (2 * bytes_per_element + output_dropout) * sbh
+    # inputs of the activation and of the second linear
+    split = 2 * bytes_per_element * seq_length * micro_batch_size * ffn_hidden_size
+    return replicated + split / tensor_parallel_size
+
+
+def transformer_layer_activation_bytes(
+    layer, micro_batch_size, seq_length, bytes_per_element=4, tensor_parallel_size=1
+):
+    """
+    Estimate the bytes of the activations kept for backward by a transformer layer,
+    following `Reducing Activation Recomputation in Large Transformer Models
+    <https://arxiv.org/abs/2205.05198>`_. For fp16 activations, dropout and
+    ``ffn_hidden_size = 4 * hidden_size``, this is
+    ``s * b * h * (10 + 24 / t + 5 * a * s / (h * t))``.
+
+    The hyperparameters are read from the attributes of ``layer``: ``hidden_size``,
+    ``num_attention_heads``, and optionally ``ffn_hidden_size`` or ``intermediate_size``,
+    ``num_key_value_heads``, ``attention_block_size``, the dropout probabilities and
+    ``is_decoder`` (which adds a cross attention over a memory of the same length).
+    """
+    args = (layer, micro_batch_size, seq_length, bytes_per_element, tensor_parallel_size)
+    num_bytes = _attention_bytes(*args) + _mlp_bytes(*args)
+    if getattr(layer, "is_decoder", False):
+        num_bytes += _attention_bytes(*args)
+    return num_bytes
+
+
+def _is_transformer_layer(module):
+    return (
+        isinstance(getattr(module, "layer_idx", None), int)
+        and hasattr(module, "hidden_size")
+        and (hasattr(module, "num_attention_heads") or hasattr(module, "num_heads"))
+    )
+
+
+class MemoryEstimate:
+    """
+    The estimated memory per rank of a model, per layer and per pipeline stage.
+    Use :func:`estimate_memory` to build it.
+
+    Attributes:
+        layers (list[dict]): rows with the ``name``, pipeline ``stage``, ``num_params``, and
+            ``params``, ``grads``, ``optimizer_states`` and ``activations`` bytes of the
+            embeddings, of every transformer layer and of the head.
+        micro_batch_size (int): the micro-batch size of the activations.
+    """
+
+    COLUMNS = ("params", "grads", "optimizer_states", "activations")
+
+    def __init__(self, layers, micro_batch_size, pipeline_parallel_size, in_flight, peak_extra):
+        self.layers = layers
+        self.micro_batch_size = micro_batch_size
+        self.pipeline_parallel_size = pipeline_parallel_size
+        # number of micro-batches whose activations are kept by every stage
+        self._in_flight = in_flight
+        # activations recomputed at once by every stage with activation checkpointing
+        self._peak_extra = peak_extra
+
+    def stages(self):
+        """
+        Returns:
+            list[dict]: the bytes of every column and the ``total`` bytes of every pipeline
+                stage, with the activations of all the micro-batches in flight in the stage.
+        """
+        stages = []
+        for stage in range(self.pipeline_parallel_size):
+            row = {"stage": stage, "num_params": 0}
+            row.update({column: 0 for column in self.COLUMNS})
+            for layer in self.layers:
+                if layer["stage"] == stage:
+                    row["num_params"] += layer["num_params"]
+                    for column in self.COLUMNS:
+                        row[column] += layer[column]
+            row["activations"] = (
+                row["activations"] * self._in_flight[stage] + self._peak_extra[stage]
+            )
+            row["total"] = sum(row[column] for column in self.COLUMNS)
+            stages.append(row)
+        return stages
+
+    def total_bytes(self):
+        """The bytes needed by the most loaded pipeline stage."""
+        return max(stage["total"] for stage in self.stages())
+
+    def largest_micro_batch(self, budget_bytes):
+        """
+        Returns:
+            int: the largest micro-batch size whose estimate fits in ``budget_bytes`` on every
+                stage, as the activations grow linearly with the micro-batch size.
+                0 if the parameters and optimizer states alone do not fit.
+        """
+        largest = None
+        for stage in self.stages():
+            static = stage["total"] - stage["activations"]
+            per_sample = stage["activations"] / self.micro_batch_size
+            if static > budget_bytes:
+                return 0
+            if per_sample > 0:
+                fits = int((budget_bytes - static) // per_sample)
+                largest = fits if largest is None else min(largest, fits)
+        return largest
+
+    def format(self):
+        """
+        Returns:
+            str: tables of the estimate per layer and per stage, in MB.
+        """
+        header = "{:<32s} {:>6s} {:>14s} {:>12s} {:>12s} {:>12s} {:>12s}"
+        row_format = "{:<32s} {:>6d} {:>14,d} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f}"
+        lines = [
+            "Memory per rank of micro-batch size {} (MB):".format(self.micro_batch_size),
+            header.format(
+                "layer", "stage", "num_params", "params", "grads", "optim", "activations"
+            ),
+        ]
+        for layer in self.layers:
+            lines.append(
+                row_format.format(
+                    layer["name"][:32],
+                    layer["stage"],
+                    layer["num_params"],
+                    *(layer[column] / MB for column in self.COLUMNS),
+                )
+            )
+        lines.append("")
+        lines.append(
+            header.format("stage", "", "num_params", "params", "grads", "optim", "activations")
+            + " {:>12s}".format("total")
+        )
+        for stage in self.stages():
+            lines.append(
+                row_format.format(
+                    "stage {}".format(stage["stage"]),
+                    stage["stage"],
+                    stage["num_params"],
+                    *(stage[column] / MB for column in self.COLUMNS),
+                )
+                + " {:>12.1f}".format(stage["total"] / MB)
+            )
+        return "\n".join(lines)
+
+
+def estimate_memory(
+    model,
+    micro_batch_size,
+    seq_length,
+    *,
+    amp=False,
+    activation_checkpoint=False,
+    optimizer_num_states=2,
+    data_parallel_size=1,
+    tensor_parallel_size=1,
+    pipeline_parallel_size=1,
+    pipeline_num_layers=None,
+    layer_stage_ids=None,
+    num_accumulation_steps=1,
+    zero_stage=0,
+):
+    """
+    Estimate the memory per rank of training ``model``, instantiated without parallelism
+    (e.g. on cpu), with the given parallel sizes.
+
+    Parameters are grouped by transformer layer, i.e. by module with an integer ``layer_idx``,
+    a ``hidden_size`` and a number of attention heads. The parameters before the first layer
+    are counted in the ``embeddings`` row on the first stage, and the other ones in the
+    ``head`` row on the last stage. The activations of the head are the logits, and the
+    fp32 probabilities of the loss, over the largest embedding table.
+
+    Tensor parallelism is assumed to split all the parameters. Parameters, gradients and
+    optimizer states are fp32, the activations are fp16 if ``amp``. With pipeline parallelism,
+    stage ``i`` keeps the activations of ``min(pipeline_parallel_size - i,
+    num_accumulation_steps)`` micro-batches, as in the 1F1B schedule. The memory of the
+    framework, of the communication buffers and of the fragmentation is not counted.
+
+    Args:
+        model (nn.Module): the model.
+        micro_batch_size (int): the micro-batch size per rank.
+        seq_length (int): the sequence length.
+        optimizer_num_states (int): the number of fp32 states per parameter of the optimizer.
+        layer_stage_ids (list[int], optional): the stage of every layer, defaults to the
+            stages assigned by LiBai for ``pipeline_num_layers``, which defaults to the
+            number of transformer layers.
+        zero_stage (int): the ZeRO stage, 0 if disabled. Optimizer states, gradients and
+            parameters are split across data parallel ranks from stages 1, 2 and 3.
+
+    Returns:
+        MemoryEstimate:
+    """
+    bytes_per_element = 2 if amp else 4
+    layers = []
+    for name, module in model.named_modules():
+        if _is_transformer_layer(module) and not any(
+            name.startswith(other["name"] + ".") for other in layers
+        ):
+            layers.append({"name": name, "module": module})
+    if layer_stage_ids is None:
+        layer_stage_ids = get_layer_stage_ids(
+            pipeline_num_layers or max(len(layers), 1), pipeline_parallel_size
+        )
+
+    embeddings = {"name": "embeddings", "stage": 0, "num_params": 0}
+    head = {"name": "head", "stage": pipeline_parallel_size - 1, "num_params": 0}
+    for layer in layers:
+        layer["num_params"] = 0
+        layer_idx = layer["module"].layer_idx
+        layer["stage"] = layer_stage_ids[min(layer_idx, len(layer_stage_ids) - 1)]
+
+    for name, param in model.named_parameters():
+        for layer in layers:
+            if name.startswith(layer["name"] + "."):
+                layer["num_params"] += param.numel()
+                break
+        else:
+            # assume that the parameters before the first layer belong to the embeddings
+            before_layers = not layers or all(layer["num_params"] == 0 for layer in layers)
+            (embeddings if before_layers else head)["num_params"] += param.numel()
+
+    params_divisor = tensor_parallel_size * (data_parallel_size if zero_stage >= 3 else 1)
+    grads_divisor = tensor_parallel_size * (data_parallel_size if zero_stage >= 2 else 1)
+    states_divisor = tensor_parallel_size * (data_parallel_size if zero_stage >= 1 else 1)
+    rows = [embeddings] + layers + [head]
+    for row in rows:
+        row["params"] = row["num_params"] * 4 / params_divisor
+        row["grads"] = row["num_params"] * 4 / grads_divisor
+        row["optimizer_states"] = row["num_params"] * 4 * optimizer_num_states / states_divisor
+        row["activations"] = 0
+
+    hidden_size = layers[0]["module"].hidden_size if layers else 0
+    peak_extra = [0] * pipeline_parallel_size
+    for layer in layers:
+        full = transformer_layer_activation_bytes(
+            layer.pop("module"),
+            micro_batch_size,
+            seq_length,
+            bytes_per_element=bytes_per_element,
+            tensor_parallel_size=tensor_parallel_size,
+        )
+        if activation_checkpoint:
+            # only the input is kept, the layer is recomputed in backward
+            layer["activations"] = bytes_per_element * seq_length * micro_batch_size * hidden_size
+            peak_extra[layer["stage"]] = max(peak_extra[layer["stage"]], full)
+        else:
+            layer["activations"] = full
+
+    embeddings["activations"] = bytes_per_element * seq_length * micro_batch_size * hidden_size
+    vocab_size = max(
+        (getattr(m, "num_embeddings", 0) for m in model.modules()),
+        default=0,
+    )
+    head["activations"] = (
+        (bytes_per_element + 4) * seq_length * micro_batch_size * vocab_size / tensor_parallel_size
+    )
+
+    in_flight = [
+        max(1, min(pipeline_parallel_size - stage, num_accumulation_steps))
+        for stage in range(pipeline_parallel_size)
+    ]
+    return MemoryEstimate(rows, micro_batch_size, pipeline_parallel_size, in_flight, peak_extra)
@@ -0,0 +1,295 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Expose training and inference metrics in the OpenMetrics text format, to be scraped
+by Prometheus from a local HTTP endpoint.
+"""
+
+import bisect
+import logging
+import math
+import re
+import resource
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libai.utils.events import EventWriter, get_event_storage
+from libai.utils.profiler import get_step_profiler
+
+__all__ = [
+    "get_metrics_registry",
+    "MetricsRegistry",
+    "OpenMetricsServer",
+    "OpenMetricsWriter",
+]
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+def _metric_name(name):
+    name = re.sub(r"[^a-zA-Z0-9_:]", "_", name)
+    return name if re.match(r"[a-zA-Z_:]", name) else "_" + name
+
+
+def _format_value(value):
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = (
+        '{}="{}"'.format(
+            _metric_name(k),
+            str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for k, v in labels
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric:
+    def __init__(self, kind, help, buckets=None):
+        self.kind = kind
+        self.help = help
+        self.buckets = buckets
+        # labels -> value of a gauge or counter, or [bucket counts, count, sum] of a histogram
+        self.samples = OrderedDict()
+
+
+class MetricsRegistry:
+    """
+    A thread-safe set of gauges, counters and histograms, rendered in the
+    OpenMetrics text format. Metrics are identified by their name and labels.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = OrderedDict()
+
+    def _get(self, name, kind, help, buckets=None):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = _Metric(kind, help, buckets)
+        assert metric.kind == kind, f"{name} is a {metric.kind}, not a {kind}"
+        return metric
+
+    def set_gauge(self, name, value, labels=None, help=""):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            self._get(name, "gauge", help).samples[key] = float(value)
+
+    def inc_counter(self, name, value=1.0, labels=None, help=""):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            metric = self._get(name, "counter", help)
+            metric.samples[key] = metric.samples.get(key, 0.0) + value
+
+    def observe(self, name, value, labels=None, buckets=DEFAULT_LATENCY_BUCKETS, help=""):
+        """
+        Add an observation, e.g. the latency of a request, to a histogram.
+        """
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            metric = self._get(name, "histogram", help, tuple(sorted(buckets)))
+            sample = metric.samples.get(key)
+            if sample is None:
+                sample = metric.samples[key] = [[0] * len(metric.buckets), 0, 0.0]
+            index = bisect.bisect_left(metric.buckets, value)
+            if index < len(metric.buckets):
+                sample[0][index] += 1
+            sample[1] += 1
+            sample[2] += value
+
+    def render(self):
+        """
+        Returns:
+            str: all the metrics in the OpenMetrics text format.
+        """
+        lines = []
+        with self._lock:
+            for name, metric in self._metrics.items():
+                lines.append(f"# TYPE {name} {metric.kind}")
+                if metric.help:
+                    lines.append(f"# HELP {name} {metric.help}")
+                for labels, value in metric.samples.items():
+                    if metric.kind == "gauge":
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                    elif metric.kind == "counter":
+                        lines.append(f"{name}_total{_format_labels(labels)} {_format_value(value)}")
+                    else:
+                        bucket_counts, count, total = value
+                        cumulative = 0
+                        for bound, bucket_count in zip(metric.buckets, bucket_counts):
+                            cumulative += bucket_count
+                            bucket_labels = labels + (("le", _format_value(bound)),)
+                            lines.append(
+                                f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                            )
+                        bucket_labels = labels + (("le", "+Inf"),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+                        lines.append(f"{name}_count{_format_labels(labels)} {count}")
+                        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+_REGISTRY = MetricsRegistry()
+
+
+def get_metrics_registry():
+    """
+    Returns:
+        The default :class:`MetricsRegistry`, which the inference pipelines report to.
+    """
+    return _REGISTRY
+
+
+class OpenMetricsServer:
+    """
+    Serve the metrics of a registry at ``http://host:port/metrics`` from a daemon thread.
+    """
+
+    def __init__(self, port=9400, host="0.0.0.0", registry=None):
+        """
+        Args:
+            port (int): the port to listen on, 0 to pick a free port.
+            host (str): the address to listen on.
+            registry (MetricsRegistry, optional): defaults to :func:`get_metrics_registry`.
+        """
+        registry = registry or get_metrics_registry()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="OpenMetricsServer", daemon=True
+        )
+        self._thread.start()
+        logger.info(f"serving OpenMetrics at http://{host}:{self.port}/metrics")
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+
+class OpenMetricsWriter(EventWriter):
+    """
+    Export the latest scalars of the storage as gauges of an OpenMetrics endpoint,
+    together with the throughput, the time of the step phases recorded by the
+    :class:`~libai.utils.profiler.StepProfiler` and the memory of the process.
+    """
+
+    def __init__(
+        self,
+        port=9400,
+        host="0.0.0.0",
+        batch_size=None,
+        tokens_per_sample=None,
+        gauges=None,
+        window_size=20,
+        registry=None,
+    ):
+        """
+        Args:
+            port (int), host (str): the address of the endpoint.
+            batch_size (int, optional): the number of samples per iteration,
+                to export the throughput in samples/s.
+            tokens_per_sample (int, optional): to export the throughput in tokens/s.
+            gauges (dict[str, callable], optional): additional gauges, e.g. the depth of the
+                data loader queue, which map names to functions returning their value.
+            window_size (int): the window size of median smoothing.
+            registry (MetricsRegistry, optional): defaults to :func:`get_metrics_registry`.
+        """
+        self._registry = registry or get_metrics_registry()
+        self._batch_size = batch_size
+        self._tokens_per_sample = tokens_per_sample
+        self._gauges = gauges or {}
+        self._window_size = window_size
+        self._server = OpenMetricsServer(port, host, self._registry)
+
+    @property
+    def port(self):
+        return self._server.port
+
+    def write(self):
+        storage = get_event_storage()
+        registry = self._registry
+        registry.set_gauge("libai_train_iteration", storage.iter)
+        for k, (v, _) in storage.latest_with_smoothing_hint(self._window_size).items():
+            registry.set_gauge("libai_train_" + _metric_name(k), v)
+
+        histories = storage.histories()
+        if "time" in histories:
+            iter_time = histories["time"].median(self._window_size)
+            if self._batch_size is not None and iter_time > 0:
+                samples_per_second = self._batch_size / iter_time
+                registry.set_gauge("libai_train_samples_per_second", samples_per_second)
+                if self._tokens_per_sample is not None:
+                    registry.set_gauge(
+                        "libai_train_tokens_per_second",
+                        samples_per_second * self._tokens_per_sample,
+                    )
+
+        profiler = get_step_profiler()
+        if profiler is not None:
+            events = profiler.events()
+            last_iter = next((e[2] for e in reversed(events) if e[1] == "step"), None)
+            for name, category, iteration, start, end in events:
+                if category == "phase" and iteration == last_iter:
+                    registry.set_gauge(
+                        "libai_train_step_phase_seconds", end - start, labels={"phase": name}
+                    )
+
+        # ru_maxrss is in kilobytes on Linux
+        registry.set_gauge(
+            "libai_process_max_resident_memory_bytes",
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        )
+        for name, gauge in self._gauges.items():
+            registry.set_gauge(_metric_name(name), gauge())
+
+    def close(self):
+        self._server.close()
@@ -0,0 +1,279 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import oneflow as flow
+
+from libai.utils import distributed as dist
+from libai.utils.events import EventWriter
+from libai.utils.file_io import PathManager
+
+__all__ = [
+    "get_step_profiler",
+    "profile_phase",
+    "StepProfiler",
+    "StepProfileWriter",
+]
+
+_CURRENT_PROFILER = None
+
+
+def get_step_profiler():
+    """
+    Returns:
+        The :class:`StepProfiler` that's currently active, or None.
+    """
+    return _CURRENT_PROFILER
+
+
+@contextmanager
+def profile_phase(name):
+    """
+    Record the time of a phase of the training step, e.g. "forward" or "backward",
+    when the active :class:`StepProfiler` is recording the current step.
+    Otherwise it does nothing.
+    """
+    profiler = _CURRENT_PROFILER
+    if profiler is None or not profiler.recording:
+        yield
+        return
+    with profiler.record(name, "phase"):
+        yield
+
+
+class StepProfiler:
+    """
+    Sample the time of the phases of training steps, and of the forward of every module.
+
+    The phases are marked by :func:`profile_phase` in the trainers. In a recorded step,
+    the device is synchronized at the boundaries of every phase and module, so that the
+    asynchronous execution is attributed to the right phase. That's why only a few steps
+    are recorded: ``num_steps`` steps every ``period`` steps, after ``warmup`` steps.
+    The forward of the modules is not recorded in static graph mode.
+    """
+
+    def __init__(self, period=1000, num_steps=3, warmup=10, model=None, max_events=100000):
+        """
+        Args:
+            period (int): the period (in steps) of the recording.
+            num_steps (int): the number of consecutive steps recorded every period.
+            warmup (int): the number of steps at the beginning not to record.
+            model (nn.Module, optional): the model whose modules to record.
+            max_events (int): the number of latest events to keep.
+        """
+        assert 0 < num_steps <= period, (num_steps, period)
+        self._period = period
+        self._num_steps = num_steps
+        self._warmup = warmup
+        self._model = model
+        self._start_iter = None
+        self._origin = time.perf_counter()
+        self._events = deque(maxlen=max_events)
+        self._module_starts = {}
+        self._hook_handles = []
+        self.recording = False
+        self.step_iter = None
+
+    def activate(self, start_iter):
+        global _CURRENT_PROFILER
+        self._start_iter = start_iter
+        if self._model is not None and len(self._hook_handles) == 0:
+            for name, module in self._model.named_modules():
+                name = name or type(module).__name__
+                self._module_starts[name] = []
+                self._hook_handles.append(
+                    module.register_forward_pre_hook(self._module_pre_hook(name))
+                )
+                self._hook_handles.append(module.register_forward_hook(self._module_hook(name)))
+        _CURRENT_PROFILER = self
+
+    def deactivate(self):
+        global _CURRENT_PROFILER
+        self.end_step()
+        # the model runs without the hooks after training, e.g. in inference
+        for handle in self._hook_handles:
+            handle.remove()
+        self._hook_handles = []
+        self._module_starts = {}
+        if _CURRENT_PROFILER is self:
+            _CURRENT_PROFILER = None
+
+    def should_record(self, iteration):
+        step = iteration - self._start_iter - self._warmup
+        return step >= 0 and step % self._period < self._num_steps
+
+    def step(self, iteration):
+        """
+        End the recording of the previous step, and start the recording of ``iteration``
+        if it's scheduled.
+        """
+        self.end_step()
+        if self.should_record(iteration):
+            self._sync()
+            self.recording = True
+            self.step_iter = iteration
+            self._step_start = self._now()
+
+    def end_step(self):
+        if not self.recording:
+            return
+        self._sync()
+        self._events.append(("step", "step", self.step_iter, self._step_start, self._now()))
+        self.recording = False
+
+    @contextmanager
+    def record(self, name, category):
+        self._sync()
+        start = self._now()
+        try:
+            yield
+        finally:
+            self._sync()
+            self._events.append((name, category, self.step_iter, start, self._now()))
+
+    def _module_pre_hook(self, name):
+        def hook(module, inputs):
+            if self.recording:
+                self._sync()
+                self._module_starts[name].append(self._now())
+
+        return hook
+
+    def _module_hook(self, name):
+        def hook(module, inputs, outputs):
+            if self.recording and len(self._module_starts[name]) > 0:
+                self._sync()
+                start = self._module_starts[name].pop()
+                self._events.append((name, "module", self.step_iter, start, self._now()))
+
+        return hook
+
+    def _now(self):
+        return time.perf_counter() - self._origin
+
+    @staticmethod
+    def _sync():
+        flow._oneflow_internal.eager.Sync()
+
+    def events(self):
+        """
+        Returns:
+            list[tuple]: the recorded events as (name, category, iteration, start, end),
+                where start and end are in seconds.
+        """
+        return list(self._events)
+
+    def chrome_trace(self):
+        """
+        Returns:
+            dict: the recorded events in the chrome trace format, which can be viewed
+                with chrome://tracing or https://ui.perfetto.dev.
+        """
+        rank = dist.get_rank()
+        tids = {"step": 0, "phase": 1, "module": 2}
+        trace_events = [
+            {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": start * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": rank,
+                "tid": tids.get(category, len(tids)),
+                "args": {"iter": iteration},
+            }
+            for name, category, iteration, start, end in self._events
+        ]
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+
+class StepProfileWriter(EventWriter):
+    """
+    Export the events of a :class:`StepProfiler` as a chrome trace json file, and print
+    a summary table of the steps recorded since the last write.
+    """
+
+    def __init__(self, profiler, trace_file, max_rows=20):
+        """
+        Args:
+            profiler (StepProfiler): the profiler to export.
+            trace_file (str): path to the chrome trace json file.
+            max_rows (int): the maximum number of modules in the summary table.
+        """
+        self._profiler = profiler
+        self._trace_file = trace_file
+        self._max_rows = max_rows
+        self._last_event = None
+        self.logger = logging.getLogger(__name__)
+
+    def write(self):
+        events = self._profiler.events()
+        if len(events) == 0 or events[-1] == self._last_event:
+            return
+        new_events = events
+        if self._last_event in events:
+            new_events = events[events.index(self._last_event) + 1 :]
+        self._last_event = events[-1]
+
+        with PathManager.open(self._trace_file, "w") as f:
+            json.dump(self._profiler.chrome_trace(), f)
+        self.logger.info(self._summary(new_events))
+
+    def _summary(self, events):
+        stats = OrderedDict()
+        for name, category, _, start, end in events:
+            stat = stats.setdefault((category, name), [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += end - start
+            stat[2] = max(stat[2], end - start)
+        steps = [iteration for _, category, iteration, _, _ in events if category == "step"]
+        step_time = sum(
+            total for (category, _), (_, total, _) in stats.items() if category == "step"
+        )
+
+        rows = [(key, value) for key, value in stats.items() if key[0] != "module"]
+        modules = sorted(
+            ((key, value) for key, value in stats.items() if key[0] == "module"),
+            key=lambda item: item[1][1],
+            reverse=True,
+        )
+        rows.extend(modules[: self._max_rows])
+
+        lines = [
+            "Profiled iterations {}:".format(steps),
+            "{:<48s} {:>8s} {:>12s} {:>12s} {:>8s}".format(
+                "name", "count", "avg (ms)", "max (ms)", "% step"
+            ),
+        ]
+        for (category, name), (count, total, maximum) in rows:
+            name = name if category != "module" else "  " + name
+            lines.append(
+                "{:<48s} {:>8d} {:>12.3f} {:>12.3f} {:>8.1f}".format(
+                    name[:48],
+                    count,
+                    total / count * 1e3,
+                    maximum * 1e3,
+                    total / step_time * 100 if step_time > 0 else 0.0,
+                )
+            )
+        return "\n".join(lines)
+
+    def close(self):
+        self.write()
@@ -0,0 +1,427 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Sharded checkpoint format, where every rank writes the shards of global tensors it holds.
+
+A checkpoint is a directory with one ``rank_XXXXX.bin`` file per rank and a
+``MANIFEST.json`` which is written last. A shard file starts with a pickled index,
+which keeps the nested structure of the saved states with a :class:`TensorMeta`
+(global shape, dtype, placement, sbp and the offset of the shard data) in place of
+every tensor, followed by the raw data of the shards. The data is memory-mapped when
+loading and every rank only reads the slices of its own layout, which may differ
+from the layout used for saving.
+"""
+
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import pickle
+import re
+import struct
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import oneflow as flow
+
+import libai.utils.distributed as dist
+
+SHARDED_CHECKPOINT_MANIFEST = "MANIFEST.json"
+SHARDED_CHECKPOINT_FORMAT = "sharded-v1"
+
+_MAGIC = b"LIBAISHD"
+_HEADER = struct.Struct("<8sQ")
+_ALIGNMENT = 64
+
+
+class ArrayRef(NamedTuple):
+    """Location of the data of a shard in a shard file, relative to the data section."""
+
+    offset: int
+    dtype: str
+    shape: Tuple[int, ...]
+
+
+class TensorMeta(NamedTuple):
+    """Metadata of a saved tensor shard."""
+
+    shape: Tuple[int, ...]
+    dtype: str
+    # placement and sbp of the saved tensor, None for local tensors
+    placement_type: Optional[str]
+    placement_ranks: Optional[list]
+    nd_sbp: Optional[List[str]]
+    # coordinate of the shard in the placement hierarchy
+    coord: Optional[Tuple[int, ...]]
+    # np.ndarray in a snapshot, ArrayRef in a file, None if the rank does not save the shard
+    data: Any
+
+
+def shard_file_name(rank: int) -> str:
+    return "rank_{:05d}.bin".format(rank)
+
+
+def is_sharded_checkpoint(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, SHARDED_CHECKPOINT_MANIFEST))
+
+
+def has_tensor(value: Any) -> bool:
+    if isinstance(value, flow.Tensor):
+        return True
+    if isinstance(value, dict):
+        return any(has_tensor(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(has_tensor(v) for v in value)
+    return False
+
+
+def _tensor_to_numpy(tensor: flow.Tensor) -> np.ndarray:
+    if tensor.dtype == flow.bfloat16:
+        # numpy has no bfloat16, the dtype is restored when loading
+        tensor = tensor.float()
+    array = tensor.numpy()
+    if not tensor.is_cuda:
+        # the array may share memory with the tensor, which keeps being updated
+        array = array.copy()
+    return np.ascontiguousarray(array)
+
+
+def snapshot_state(value: Any, rank: int) -> Any:
+    """
+    Copy the local shards of the tensors in ``value`` to host memory. A shard is
+    kept only by the ranks at coordinate 0 of every broadcast placement dimension,
+    so that each element of a tensor is written exactly once. Values other than
+    tensors are only kept by rank 0.
+    """
+    if isinstance(value, flow.Tensor):
+        value = value.detach()
+        if not value.is_global:
+            data = _tensor_to_numpy(value) if rank == 0 else None
+            return TensorMeta(tuple(value.shape), str(value.dtype), None, None, None, None, data)
+
+        if any(sbp == flow.sbp.partial_sum for sbp in value.sbp):
+            value = value.to_global(
+                sbp=[
+                    flow.sbp.broadcast if sbp == flow.sbp.partial_sum else sbp for sbp in value.sbp
+                ]
+            )
+        ranks = np.asarray(value.placement.ranks)
+        coord, data = None, None
+        if rank in ranks:
+            coord = tuple(int(i) for i in np.argwhere(ranks == rank)[0])
+            if all(c == 0 for c, sbp in zip(coord, value.sbp) if sbp == flow.sbp.broadcast):
+                data = _tensor_to_numpy(value.to_local())
+        return TensorMeta(
+            tuple(value.shape),
+            str(value.dtype),
+            value.placement.type,
+            ranks.tolist(),
+            [str(sbp) for sbp in value.sbp],
+            coord,
+            data,
+        )
+    if isinstance(value, dict):
+        return type(value)((k, snapshot_state(v, rank)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot_state(v, rank) for v in value)
+    return value if rank == 0 else None
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def write_shard(f, snapshot: Any) -> None:
+    """
+    Write a snapshot taken by :func:`snapshot_state` to the binary file object ``f``.
+    Arrays are written without being copied, so ``f`` may write them asynchronously.
+    """
+    arrays = []
+    data_size = 0
+
+    def index(value):
+        nonlocal data_size
+        if isinstance(value, TensorMeta):
+            if not isinstance(value.data, np.ndarray):
+                return value
+            ref = ArrayRef(data_size, value.data.dtype.str, value.data.shape)
+            arrays.append(value.data)
+            data_size += _aligned(value.data.nbytes)
+            return value._replace(data=ref)
+        if isinstance(value, dict):
+            return type(value)((k, index(v)) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return type(value)(index(v) for v in value)
+        return value
+
+    header = pickle.dumps(index(snapshot), protocol=pickle.HIGHEST_PROTOCOL)
+    f.write(_HEADER.pack(_MAGIC, len(header)))
+    f.write(header)
+    f.write(bytes(_aligned(_HEADER.size + len(header)) - _HEADER.size - len(header)))
+    for array in arrays:
+        f.write(array.reshape(-1).view(np.uint8))
+        f.write(bytes(_aligned(array.nbytes) - array.nbytes))
+
+
+def _split_dim(sbp: str) -> Optional[int]:
+    match = re.search(r"split\(dim=(\d+)\)", sbp)
+    return None if match is None else int(match.group(1))
+
+
+def _parse_sbp(sbp: str):
+    dim = _split_dim(sbp)
+    return flow.sbp.broadcast if dim is None else flow.sbp.split(dim)
+
+
+def _balanced_range(length: int, num_parts: int, index: int) -> Tuple[int, int]:
+    # same partition as the split sbp, the first `length % num_parts` parts have one more element
+    size, remainder = divmod(length, num_parts)
+    start = index * size + min(index, remainder)
+    return start, start + size + int(index < remainder)
+
+
+def shard_ranges(
+    shape: Tuple[int, ...], nd_sbp: List[str], hierarchy: Tuple[int, ...], coord: Tuple[int, ...]
+) -> List[Tuple[int, int]]:
+    """Range of every dimension of the global tensor held by the rank at ``coord``."""
+    ranges = [(0, dim) for dim in shape]
+    for axis, sbp in enumerate(nd_sbp):
+        dim = _split_dim(sbp)
+        if dim is None:
+            continue
+        start, end = ranges[dim]
+        part_start, part_end = _balanced_range(end - start, hierarchy[axis], coord[axis])
+        ranges[dim] = (start + part_start, start + part_end)
+    return ranges
+
+
+class ShardedCheckpointReader(object):
+    """
+    Read a sharded checkpoint into global tensors of any layout.
+
+    Only the indexes of the shard files are read when the reader is created, the
+    data is memory-mapped and every rank copies the slices of the saved shards which
+    overlap the part of each tensor it holds in the target layout.
+
+    Args:
+        path (str): directory of the checkpoint.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, SHARDED_CHECKPOINT_MANIFEST), "r") as f:
+            manifest = json.load(f)
+        self.path = path
+        self.keys = manifest["keys"]
+        self._indexes, self._buffers = [], []
+        for shard_file in manifest["shards"]:
+            shard_file = os.path.join(path, shard_file)
+            with open(shard_file, "rb") as f:
+                magic, header_size = _HEADER.unpack(f.read(_HEADER.size))
+                assert magic == _MAGIC, f"{shard_file} is not a shard of a sharded checkpoint"
+                self._indexes.append(pickle.loads(f.read(header_size)))
+            data_start = _aligned(_HEADER.size + header_size)
+            if os.path.getsize(shard_file) > data_start:
+                self._buffers.append(
+                    np.memmap(shard_file, dtype=np.uint8, mode="r", offset=data_start)
+                )
+            else:
+                self._buffers.append(None)
+
+    def _array(self, file_index: int, ref: ArrayRef) -> np.ndarray:
+        return np.ndarray(
+            ref.shape,
+            dtype=np.dtype(ref.dtype),
+            buffer=self._buffers[file_index],
+            offset=ref.offset,
+        )
+
+    def load(
+        self,
+        key: str,
+        target: Any = None,
+        device_type: Optional[str] = None,
+        num_workers: int = 4,
+    ) -> Any:
+        """
+        Load the state saved under ``key``.
+
+        Args:
+            key (str): name of the state, e.g. "model".
+            target (Any): state with the same structure, e.g. the ``state_dict()`` of the
+                module to load. A tensor is loaded with the placement and sbp of the global
+                tensor at the same position in ``target`` if it has the same shape, otherwise
+                with the saved layout. The saved layout falls back to a broadcast on all
+                ranks if it has ranks which do not exist anymore.
+            device_type (str): if given, the device type of the loaded tensors.
+            num_workers (int): number of threads copying the local slices out of the
+                shard files, which runs ahead of the placement of the tensors by at most
+                ``2 * num_workers`` tensors.
+        """
+        tasks = []
+        state = self._plan([index.get(key) for index in self._indexes], target, device_type, tasks)
+        tensors = list(self._load_tensors(tasks, num_workers))
+        return _fill(state, tensors)
+
+    def _plan(self, values: List[Any], target: Any, device_type: Optional[str], tasks: list):
+        template = values[0]
+        if isinstance(template, TensorMeta):
+            tasks.append(self._tensor_task(values, target, device_type))
+            return _Pending(len(tasks) - 1)
+        if isinstance(template, dict):
+            return type(template)(
+                (
+                    k,
+                    self._plan(
+                        [v.get(k) if isinstance(v, dict) else None for v in values],
+                        target.get(k) if isinstance(target, dict) else None,
+                        device_type,
+                        tasks,
+                    ),
+                )
+                for k in template
+            )
+        if isinstance(template, (list, tuple)):
+            return type(template)(
+                self._plan(
+                    [v[i] if isinstance(v, (list, tuple)) else None for v in values],
+                    target[i]
+                    if isinstance(target, (list, tuple)) and len(target) == len(template)
+                    else None,
+                    device_type,
+                    tasks,
+                )
+                for i in range(len(template))
+            )
+        return template
+
+    def _tensor_task(self, metas: List[TensorMeta], target: Any, device_type: Optional[str]):
+        meta = metas[0]
+        if meta.placement_type is None:
+            return _TensorTask(metas, None, None)
+        placement, nd_sbp = self._target_layout(meta, target, device_type)
+        return _TensorTask(metas, placement, nd_sbp)
+
+    def _target_layout(self, meta: TensorMeta, target: Any, device_type: Optional[str]):
+        if (
+            isinstance(target, flow.Tensor)
+            and target.is_global
+            and tuple(target.shape) == meta.shape
+        ):
+            ranks = np.asarray(target.placement.ranks).tolist()
+            placement = flow.placement(device_type or target.placement.type, ranks)
+            nd_sbp = [
+                flow.sbp.broadcast if sbp == flow.sbp.partial_sum else sbp for sbp in target.sbp
+            ]
+            return placement, nd_sbp
+
+        device_type = device_type or meta.placement_type
+        if np.max(meta.placement_ranks) < dist.get_world_size():
+            placement = flow.placement(device_type, meta.placement_ranks)
+            return placement, [_parse_sbp(sbp) for sbp in meta.nd_sbp]
+        return flow.placement(device_type, list(range(dist.get_world_size()))), [flow.sbp.broadcast]
+
+    def _load_tensors(self, tasks: list, num_workers: int):
+        """Copy local slices in a thread pool and place the tensors in order on the calling
+        thread, because the placement of global tensors is collective."""
+        tasks = iter(tasks)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            in_flight = collections.deque(
+                (task, executor.submit(self._read_local, task))
+                for task in itertools.islice(tasks, 2 * num_workers)
+            )
+            while in_flight:
+                task, future = in_flight.popleft()
+                local = future.result()
+                next_task = next(tasks, None)
+                if next_task is not None:
+                    in_flight.append((next_task, executor.submit(self._read_local, next_task)))
+                yield self._to_tensor(task, local)
+
+    def _read_local(self, task) -> Optional[np.ndarray]:
+        meta = task.metas[0]
+        if task.placement is None:
+            return np.array(self._array(0, meta.data))
+
+        ranks = np.asarray(task.placement.ranks)
+        rank = dist.get_rank()
+        if rank not in ranks:
+            return None
+        coord = tuple(int(i) for i in np.argwhere(ranks == rank)[0])
+        local_ranges = shard_ranges(
+            meta.shape, [str(sbp) for sbp in task.nd_sbp], ranks.shape, coord
+        )
+        saved_hierarchy = np.asarray(meta.placement_ranks).shape
+        local = None
+        for file_index, shard in enumerate(task.metas):
+            if shard is None or shard.data is None:
+                continue
+            saved = self._array(file_index, shard.data)
+            if local is None:
+                local = np.empty([end - start for start, end in local_ranges], dtype=saved.dtype)
+            saved_ranges = shard_ranges(meta.shape, shard.nd_sbp, saved_hierarchy, shard.coord)
+            overlap = [
+                (max(start, saved_start), min(end, saved_end))
+                for (start, end), (saved_start, saved_end) in zip(local_ranges, saved_ranges)
+            ]
+            if any(start >= end for start, end in overlap):
+                continue
+            local[
+                tuple(
+                    slice(start - local_start, end - local_start)
+                    for (start, end), (local_start, _) in zip(overlap, local_ranges)
+                )
+            ] = saved[
+                tuple(
+                    slice(start - saved_start, end - saved_start)
+                    for (start, end), (saved_start, _) in zip(overlap, saved_ranges)
+                )
+            ]
+        assert local is not None, f"no rank saved data of a tensor in {self.path}"
+        return local
+
+    def _to_tensor(self, task, local: Optional[np.ndarray]) -> flow.Tensor:
+        dtype = getattr(flow, task.metas[0].dtype.split(".")[-1])
+        if task.placement is None:
+            return flow.tensor(local).to(dtype)
+        if local is None:
+            return flow.Tensor(None).to_global(placement=task.placement, sbp=task.nd_sbp)
+        local = flow.tensor(local, device=flow.device(task.placement.type)).to(dtype)
+        return local.to_global(placement=task.placement, sbp=task.nd_sbp)
+
+
+class _TensorTask(NamedTuple):
+    metas: List[TensorMeta]
+    # target layout, None for local tensors
+    placement: Any
+    nd_sbp: Any
+
+
+class _Pending(object):
+    __slots__ = ("index",)
+
+    def __init__(self, index: int):
+        self.index = index
+
+
+def _fill(state: Any, tensors: List[flow.Tensor]) -> Any:
+    if isinstance(state, _Pending):
+        return tensors[state.index]
+    if isinstance(state, dict):
+        return type(state)((k, _fill(v, tensors)) for k, v in state.items())
+    if isinstance(state, (list, tuple)):
+        return type(state)(_fill(v, tensors) for v in state)
+    return state
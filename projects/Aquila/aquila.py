@@ -22,47 +22,19 @@ from oneflow import nn
 
 from libai.config import configurable
 from libai.inference.generator.generation_utils import Generator
-from libai.layers import Linear, RMSLayerNorm, VocabEmbedding
+from libai.layers import (
+    Linear,
+    RMSLayerNorm,
+    RotaryEmbedding,
+    VocabEmbedding,
+    apply_rotary_pos_emb,
+    fused_lm_head_cross_entropy,
+)
 from libai.layers.attention import AttnMaskType
 from libai.models.utils import init_method_normal, scaled_init_method_normal
 from libai.utils import distributed as dist
 
 
-def rotate_half(x):
-    """Rotates half the hidden dims of the input."""
-    x1 = x[..., : x.shape[-1] // 2]
-    x2 = x[..., x.shape[-1] // 2 :]
-    return flow.cat((-x2, x1), dim=-1)
-
-
-def apply_rotary_pos_emb(q, k, cos, sin, position_ids):
-    cos = cos[position_ids].unsqueeze(1)
-    sin = sin[position_ids].unsqueeze(1)
-    q_embed = (q * cos) + (rotate_half(q) * sin)
-    k_embed = (k * cos) + (rotate_half(k) * sin)
-    return q_embed, k_embed
-
-
-class RotaryEmbedding(nn.Module):
-    def __init__(self, dim, max_position_embeddings=2048):
-        super().__init__()
-
-        self.dim = dim
-        self.max_position_embeddings = max_position_embeddings
-
-    def forward(self, x, seq_len=None, cos_cached=None, sin_cached=None):
-        if seq_len > self.max_position_embeddings:
-            raise ValueError(
-                f"The maximum supported length is {self.max_position_embeddings}, "
-                f"and the current length is{seq_len}."
-            )
-
-        return (
-            cos_cached[:seq_len].to_global(placement=x.placement),
-            sin_cached[:seq_len].to_global(placement=x.placement),
-        )
-
-
 class MLP(nn.Module):
     def __init__(
         self,
@@ -160,21 +132,14 @@ class MultiheadAttention(nn.Module):
 
         self.coeff = None
 
-        rotary_dim = self.head_size
-        self.rotary_embed = RotaryEmbedding(
-            dim=rotary_dim,
-            max_position_embeddings=max_position_embeddings,
-        )
-
     def forward(
         self,
         hidden_states: flow.Tensor,
         encoder_states: flow.Tensor = None,
         attention_mask: flow.Tensor = None,
-        position_ids=None,
         past_key_value: Tuple[flow.Tensor, flow.Tensor] = None,
-        cos_cached: flow.Tensor = None,
-        sin_cached: flow.Tensor = None,
+        cos: flow.Tensor = None,
+        sin: flow.Tensor = None,
         use_cache: bool = False,
     ):
         if encoder_states is not None:
@@ -192,13 +157,9 @@ class MultiheadAttention(nn.Module):
         )  # [bsz, num_heads, src_len, 3 * head_size]
         query, key, value = flow.chunk(query_key_value, chunks=3, dim=-1)
 
-        kv_seq_len = key.shape[-2]
-        if past_key_value is not None:
-            kv_seq_len += past_key_value[0].shape[-2]
-        cos, sin = self.rotary_embed(
-            value, seq_len=kv_seq_len, cos_cached=cos_cached, sin_cached=sin_cached
-        )
-        query, key = apply_rotary_pos_emb(query, key, cos, sin, position_ids)
+        # cos, sin: [bsz, 1, tgt_len, head_size], gathered at the positions of new tokens
+        query = apply_rotary_pos_emb(query, cos, sin)
+        key = apply_rotary_pos_emb(key, cos, sin)
 
         if past_key_value is not None:
             past_key, past_value = past_key_value
@@ -333,8 +294,8 @@ class AquilaDecoderLayer(nn.Module):
         hidden_states,
         attention_mask=None,
         past_key_value=None,
-        cos_cached=None,
-        sin_cached=None,
+        cos=None,
+        sin=None,
         use_cache=False,
     ):
         hidden_states = hidden_states.to_global(placement=dist.get_layer_placement(self.layer_idx))
@@ -359,8 +320,8 @@ class AquilaDecoderLayer(nn.Module):
             layernorm_output,
             attention_mask=attention_mask,
             past_key_value=self_attn_past_key_value,
-            cos_cached=cos_cached,
-            sin_cached=sin_cached,
+            cos=cos,
+            sin=sin,
             use_cache=use_cache,
         )
 
@@ -406,6 +367,8 @@ class AquilaModel(nn.Module):
         use_scaled_init_for_output_weights=True,
         scale_mask_softmax_fusion=False,
         amp_enabled=False,
+        rope_theta=10000.0,
+        rope_scaling=None,
     ):
         super().__init__()
         init_method = init_method_normal(sigma=initializer_range)
@@ -436,35 +399,20 @@ class AquilaModel(nn.Module):
         )
         self.norm = RMSLayerNorm(hidden_size, eps=rms_norm_eps, layer_idx=-1)
 
-        self._set_cos_sin_cache(
-            rotary_dim=hidden_size // num_attention_heads,
-            seq_len=max_position_embeddings,
-            dtype=flow.float32,
+        scaling_type, scaling_factor = RotaryEmbedding.scaling_from_config(rope_scaling)
+        self.rotary_emb = RotaryEmbedding(
+            hidden_size // num_attention_heads,
+            max_position_embeddings=max_position_embeddings,
+            base=rope_theta,
+            scaling_type=scaling_type,
+            scaling_factor=scaling_factor,
             layer_idx=0,
         )
 
-    def _set_cos_sin_cache(self, rotary_dim, seq_len, base=10000, dtype=None, layer_idx=0):
-        position = flow.arange(
-            0,
-            rotary_dim,
-            2,
-            dtype=dtype,
-            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=dist.get_layer_placement(layer_idx),
-        )
-        inv_freq = 1.0 / (base ** (position / rotary_dim))
-
-        t = flow.arange(
-            seq_len,
-            dtype=inv_freq.dtype,
-            sbp=inv_freq.sbp,
-            placement=inv_freq.placement,
-        )
-
-        freqs = flow.einsum("i,j->ij", t, inv_freq)
-        emb = flow.cat((freqs, freqs), dim=-1)
-        self.register_buffer("cos_cached", emb.cos().to(dtype))
-        self.register_buffer("sin_cached", emb.sin().to(dtype))
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # the checkpoints saved before sharing the rotary embedding hold its tables
+        RotaryEmbedding.drop_legacy_cache(state_dict, prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(
         self,
@@ -479,13 +427,25 @@ class AquilaModel(nn.Module):
         input_ids = input_ids.to_global(placement=dist.get_layer_placement(0))
         hidden_states = self.embed_tokens(input_ids)
 
+        # cos/sin are gathered once and shared by all layers
+        past_length = 0 if past_key_values[0] is None else past_key_values[0][0].size(-2)
+        seq_len = past_length + input_ids.size(1)
+        position_ids = flow._C.global_arange(
+            start=past_length,
+            end=seq_len,
+            placement=input_ids.placement,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            dtype=flow.long,
+        ).unsqueeze(0)
+        cos, sin = self.rotary_emb(position_ids, seq_len=seq_len)
+
         for layer, past_key_value in zip(self.layers, past_key_values):
             hidden_states = layer(
                 hidden_states=hidden_states,
                 attention_mask=attention_mask,
                 past_key_value=past_key_value,
-                cos_cached=self.cos_cached,
-                sin_cached=self.sin_cached,
+                cos=cos,
+                sin=sin,
                 use_cache=False,
             )
             if use_cache:
@@ -541,10 +501,14 @@ class AquilaForCausalLM(nn.Module, Generator):
         use_scaled_init_for_output_weights=True,
         scale_mask_softmax_fusion=False,
         amp_enabled=False,
+        rope_theta=10000.0,
+        rope_scaling=None,
+        lm_loss_chunk_size=None,
         cfg=None,
     ):
         super().__init__()
         self.cfg = cfg
+        self.lm_loss_chunk_size = lm_loss_chunk_size
         self.model = AquilaModel(
             hidden_layers=hidden_layers,
             vocab_size=vocab_size,
@@ -557,6 +521,8 @@ class AquilaForCausalLM(nn.Module, Generator):
             use_scaled_init_for_output_weights=use_scaled_init_for_output_weights,
             scale_mask_softmax_fusion=scale_mask_softmax_fusion,
             amp_enabled=amp_enabled,
+            rope_theta=rope_theta,
+            rope_scaling=rope_scaling,
         )
         self.casual_mask = AquilaCasualMask(max_position_embeddings, layer_idx=0)
         self.lm_head = Linear(hidden_size, vocab_size, bias=False, layer_idx=-1)
@@ -598,6 +564,20 @@ class AquilaForCausalLM(nn.Module, Generator):
             set_cache=self.set_cache,
         )
 
+        if labels is not None and self.lm_loss_chunk_size is not None:
+            # fuse the LM head into the loss, so that the logits are never materialized
+            labels = labels.to_global(placement=output.placement)
+            labels = labels * (labels >= 0)
+            lm_loss = fused_lm_head_cross_entropy(
+                output,
+                self.lm_head.weight,
+                labels,
+                ignore_index=0,
+                chunk_size=self.lm_loss_chunk_size,
+            )
+            num_tokens = (labels > 0).sum().to(lm_loss.dtype)
+            return {"lm_loss": lm_loss.sum() / num_tokens}
+
         logits = self.lm_head(output)
 
         if labels is not None:
@@ -638,6 +618,9 @@ class AquilaForCausalLM(nn.Module, Generator):
             "use_scaled_init_for_output_weights": cfg.use_scaled_init_for_output_weights,
             "scale_mask_softmax_fusion": cfg.scale_mask_softmax_fusion,
             "amp_enabled": cfg.amp_enabled,
+            "rope_theta": cfg.get("rope_theta", 10000.0),
+            "rope_scaling": cfg.get("rope_scaling", None),
+            "lm_loss_chunk_size": cfg.get("lm_loss_chunk_size", None),
             "cfg": cfg,
         }
 
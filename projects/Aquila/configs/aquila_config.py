@@ -18,6 +18,7 @@ cfg = dict(
     hidden_layers=32,
     pretraining_tp=1,
     rms_norm_eps=1e-06,
+    rope_theta=10000.0,
     rope_scaling=None,
     tie_word_embeddings=False,
     vocab_size=100008,
@@ -13,10 +13,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import json
 
-import oneflow as flow
-
 from libai.models.utils.model_loader.base_loader import ModelLoaderHuggerFace, ModelLoaderLiBai
 
 
@@ -45,6 +44,13 @@ class AquilaLoaderHuggerFace(ModelLoaderHuggerFace):
         num_attention_heads = cfg.get("num_attention_heads")
         hidden_size = cfg.get("hidden_size")
         head_size = int(hidden_size // num_attention_heads)
+        # the projections are only read and fused when the model loads the fused weights
+        concat_qkv = functools.partial(
+            self._concat_qkv,
+            head_size=head_size,
+            num_heads=num_attention_heads,
+            hidden_size=hidden_size,
+        )
 
         new_key_qkv = "model.layers.{}.self_attn.query_key_value.weight"
         old_key_qkv = "model.layers.{}.self_attn.{}.weight"
@@ -52,19 +58,13 @@ class AquilaLoaderHuggerFace(ModelLoaderHuggerFace):
             query = old_key_qkv.format(layer_idx, "q_proj")
             key = old_key_qkv.format(layer_idx, "k_proj")
             value = old_key_qkv.format(layer_idx, "v_proj")
-            q = oneflow_state_dict[query]
-            k = oneflow_state_dict[key]
-            v = oneflow_state_dict[value]
-            qkv = flow.cat([q, k, v], dim=0)
-            qkv = self._fix_qkv_ordering(qkv, head_size, num_attention_heads, hidden_size)
-            oneflow_state_dict[new_key_qkv.format(layer_idx)] = qkv
-            oneflow_state_dict.pop(query)
-            oneflow_state_dict.pop(key)
-            oneflow_state_dict.pop(value)
+            self._fuse_keys(
+                oneflow_state_dict, new_key_qkv.format(layer_idx), [query, key, value], concat_qkv
+            )
 
         for k in old_keys:
             if "inv_freq" in k:
-                oneflow_state_dict.pop(k)
+                del oneflow_state_dict[k]
 
         return oneflow_state_dict
 
@@ -82,6 +82,8 @@ class AquilaLoaderHuggerFace(ModelLoaderHuggerFace):
         self._update_cfg("hidden_size", cfg_dict["hidden_size"])
         self._update_cfg("num_attention_heads", cfg_dict["num_attention_heads"])
         self._update_cfg("max_position_embeddings", cfg_dict["max_position_embeddings"])
+        self._update_cfg("rope_theta", cfg_dict.get("rope_theta", 10000.0))
+        self._update_cfg("rope_scaling", cfg_dict.get("rope_scaling", None))
         self._update_cfg("intermediate_size", cfg_dict["intermediate_size"])
         self._update_cfg("rms_norm_eps", cfg_dict["rms_norm_eps"])
         self._update_cfg("vocab_size", cfg_dict["vocab_size"])
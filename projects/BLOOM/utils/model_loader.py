@@ -47,7 +47,7 @@ class BlooMLoaderHuggerFace(ModelLoaderHuggerFace):
 
         # Convert layers.
         for key in old_keys:
-            oneflow_state_dict[prefix2 + key] = oneflow_state_dict.pop(key)
+            self._rename_key(oneflow_state_dict, key, prefix2 + key)
 
         return oneflow_state_dict
 
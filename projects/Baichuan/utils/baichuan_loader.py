@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import json
 
 from libai.models.utils.model_loader.base_loader import ModelLoaderHuggerFace, ModelLoaderLiBai
@@ -41,22 +42,29 @@ class BaichuanLoaderHuggerFace(ModelLoaderHuggerFace):
 
         # Get configs
         num_attention_heads = cfg.get("num_attention_heads")
+        num_key_value_heads = cfg.get("num_key_value_heads", num_attention_heads)
         hidden_size = cfg.get("hidden_size")
         head_size = int(hidden_size // num_attention_heads)
+        # the packed projections are only read and reordered when the model loads them
+        fix_qkv_ordering = functools.partial(
+            self._fix_qkv_ordering,
+            head_size=head_size,
+            num_heads=num_attention_heads,
+            hidden_size=hidden_size,
+            num_key_value_heads=num_key_value_heads,
+        )
 
         new_key_qkv = "model.layers.{}.self_attn.query_key_value.weight"
         old_key_qkv = "model.layers.{}.self_attn.{}.weight"
         for layer_idx in range(cfg.get("hidden_layers")):
             w_pack = old_key_qkv.format(layer_idx, "W_pack")
-
-            qkv = oneflow_state_dict[w_pack]
-            qkv = self._fix_qkv_ordering(qkv, head_size, num_attention_heads, hidden_size)
-            oneflow_state_dict[new_key_qkv.format(layer_idx)] = qkv
-            oneflow_state_dict.pop(w_pack)
+            self._fuse_keys(
+                oneflow_state_dict, new_key_qkv.format(layer_idx), [w_pack], fix_qkv_ordering
+            )
 
         for k in old_keys:
             if "inv_freq" in k:
-                oneflow_state_dict.pop(k)
+                del oneflow_state_dict[k]
 
         return oneflow_state_dict
 
@@ -73,7 +81,13 @@ class BaichuanLoaderHuggerFace(ModelLoaderHuggerFace):
         self._update_cfg("hidden_layers", cfg_dict["num_hidden_layers"])
         self._update_cfg("hidden_size", cfg_dict["hidden_size"])
         self._update_cfg("num_attention_heads", cfg_dict["num_attention_heads"])
+        self._update_cfg(
+            "num_key_value_heads",
+            cfg_dict.get("num_key_value_heads", cfg_dict["num_attention_heads"]),
+        )
         self._update_cfg("max_position_embeddings", cfg_dict["max_position_embeddings"])
+        self._update_cfg("rope_theta", cfg_dict.get("rope_theta", 10000.0))
+        self._update_cfg("rope_scaling", cfg_dict.get("rope_scaling", None))
         self._update_cfg("intermediate_size", cfg_dict["intermediate_size"])
         self._update_cfg("rms_norm_eps", cfg_dict["rms_norm_eps"])
         self._update_cfg("vocab_size", cfg_dict["vocab_size"])
@@ -10,8 +10,15 @@ from typing import Any, Dict, List, Optional, Tuple
 import oneflow as flow
 from oneflow import nn
 
+from libai.config import configurable
 from libai.inference.generator.generation_utils import Generator, LogitsProcessorList
-from libai.layers import LayerNorm, Linear, RMSLayerNorm, VocabEmbedding
+from libai.layers import (
+    LayerNorm,
+    Linear,
+    RMSLayerNorm,
+    VocabEmbedding,
+    fused_lm_head_cross_entropy,
+)
 from libai.utils import distributed as dist
 
 
@@ -786,14 +793,23 @@ class ChatGLMModel(ChatGLMPreTrainedModel):
 
 
 class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel, Generator):
-    def __init__(self, cfg):
+    @configurable
+    def __init__(self, cfg, lm_loss_chunk_size=None):
         super().__init__()
 
         self.max_sequence_length = cfg.max_length
         self.transformer = ChatGLMModel(cfg)
         self.cfg = cfg
+        self.lm_loss_chunk_size = lm_loss_chunk_size
         self.loss_fct = nn.CrossEntropyLoss()
 
+    @classmethod
+    def from_config(cls, cfg):
+        return {
+            "cfg": cfg,
+            "lm_loss_chunk_size": cfg.get("lm_loss_chunk_size", None),
+        }
+
     def _update_model_kwargs_for_generation(
         self,
         outputs: Dict,
@@ -884,6 +900,22 @@ class ChatGLMForConditionalGeneration(ChatGLMPreTrainedModel, Generator):
         )
 
         hidden_states = transformer_outputs["last_hidden_state"]
+        if labels is not None and self.lm_loss_chunk_size is not None:
+            # fuse the output layer into the loss, so that the logits are never materialized
+            shift_hidden_states = hidden_states.transpose(0, 1)[:, :-1]
+            shift_labels = labels[..., 1:]
+            loss = fused_lm_head_cross_entropy(
+                shift_hidden_states,
+                self.transformer.output_layer.weight,
+                shift_labels,
+                # the ignore index of `self.loss_fct`
+                ignore_index=-100,
+                chunk_size=self.lm_loss_chunk_size,
+            )
+            shift_labels = shift_labels.to_global(placement=loss.placement)
+            num_tokens = (shift_labels != -100).sum().to(loss.dtype)
+            return dict(loss=loss.sum() / num_tokens)
+
         if return_last_logit:
             hidden_states = hidden_states[-1:]
         lm_logits = self.transformer.output_layer(hidden_states)
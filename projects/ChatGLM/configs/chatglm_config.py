@@ -39,6 +39,7 @@ cfg = dict(
     prefix_projection=None,
     use_return_dict=True,
     amp_enabled=True,
+    lm_loss_chunk_size=None,
     # Inference
     is_encoder_decoder=False,
     max_length=1350,
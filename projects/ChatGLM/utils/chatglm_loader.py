@@ -44,7 +44,7 @@ class ChatGLMLoaderHuggerFace(ModelLoaderHuggerFace):
 
         for k in old_keys:
             if "inv_freq" in k:
-                oneflow_state_dict.pop(k)
+                del oneflow_state_dict[k]
 
         return oneflow_state_dict
 
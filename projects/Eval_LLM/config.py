@@ -17,6 +17,6 @@ eval_config = DictConfig(
         model_type="llama",
         model_weight_type="libai",  # libai or huggingface
         eval_tasks=["lambada_openai", "gsm8k"],
-        batch_size_per_gpu=1,
+        batch_size_per_gpu=1,  # or "auto" on a single device
     )
 )
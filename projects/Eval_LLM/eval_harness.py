@@ -1,8 +1,12 @@
+import collections
+import gc
+import itertools
 import json
 import os
 from pathlib import Path
 from typing import Dict, List, Optional, TypeVar
 
+import numpy as np
 import oneflow as flow
 import oneflow.nn.functional as F
 
@@ -15,6 +19,8 @@ from lm_eval.models.utils import chunks  # noqa
 from tqdm import tqdm  # noqa
 
 import libai.utils.distributed as dist  # noqa
+from libai.data.samplers import token_budget_batches  # noqa
+from libai.utils.memory import is_out_of_memory, split_on_out_of_memory  # noqa
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 T = TypeVar("T")
@@ -26,8 +32,10 @@ class EvalHarnessBase(LM):
         self.model = model
         self.tokenizer = tokenizer
         self.model_name = model_name
+        # an integer, or "auto" to detect the largest batch fitting in memory
         self.batch_size_per_gpu = batch_size
         self.cfg = cfg
+        self._detected_batch_size = None
 
     @classmethod
     def create_from_arg_string(cls, arg_string, additional_config=None):
@@ -55,6 +63,8 @@ class EvalHarnessBase(LM):
 
     @property
     def batch_size(self):
+        if self.batch_size_per_gpu == "auto":
+            return self._detected_batch_size or 1
         return self.batch_size_per_gpu * dist.get_world_size()
 
     @property
@@ -104,7 +114,6 @@ class EvalHarnessBase(LM):
 
     def loglikelihood_rolling(self, requests):
         # TODO: Implement caching once we've confirmed the perplexity implementation
-        # TODO: automatic batch size detection for vectorization
 
         loglikelihoods = []
         for (string,) in tqdm(requests):
@@ -132,110 +141,140 @@ class EvalHarnessBase(LM):
 
         return loglikelihoods
 
-    def _loglikelihood_tokens(self, requests, disable_tqdm=False):
-        res = []
-
-        def _collate(x):
-            # the negative sign on len(toks) sorts descending - this has a few advantages:
-            # - time estimates will always be over not underestimates,
-            #   which is more useful for planning
-            # - to know the size of a batch when going through the list,
-            #   you know the first one is always the batch
-            #   padded context length. this is useful to simplify
-            #   the batching logic and more importantly to make
-            #   automatic adaptive batches much much easier to implement
-            # - any OOMs will happen right away rather than near the end
-
-            toks = x[1] + x[2]
-            return -len(toks), tuple(toks)
-
-        # TODO: automatic (variable) batch size detection for vectorization
-        re_ord = utils.Reorderer(requests, _collate)
-        for chunk in chunks(tqdm(re_ord.get_reordered(), disable=disable_tqdm), self.batch_size):
-            inps = []
-            cont_toks_list = []
-            inplens = []
-
-            padding_length = None
-
-            # because vectorizing is annoying,
-            # we first convert each (context, continuation) pair to padded tensors,
-            # then we pack them together into a batch, call the model,
-            # and then pick it all apart again because vectorizing is annoying
-
-            for _, context_enc, continuation_enc in chunk:
-                # sanity check
-                assert len(context_enc) > 0
-                assert len(continuation_enc) > 0
-                assert len(continuation_enc) <= self.max_length
-
-                # how this all works:
-                #          CTX      CONT
-                # inp    0 1 2 3|4 5 6 7 8 9   <- last token is deleted by inp[:, :-1]
-                # gpt2    \               \
-                # logits   1 2 3|4 5 6 7 8 9   <- the ctx half gets tossed out by the
-                # cont_toks      4 5 6 7 8 9   [:, -len(continuation_enc):, :self.vocab_size] slice
-
-                # when too long to fit in context, truncate from the left
-                inp = torch.tensor(
-                    (context_enc + continuation_enc)[-(self.max_length + 1) :][:-1],
-                    dtype=torch.long,
-                ).to(self.device)
-                (inplen,) = inp.shape
-
-                cont = continuation_enc
-
-                # since in _collate we make sure length is descending,
-                # the longest is always the first one.
-                padding_length = padding_length if padding_length is not None else inplen
-
-                # pad length from seq to padding_length
-                inp = torch.cat(
-                    [
-                        inp,  # [seq]
-                        torch.zeros(padding_length - inplen, dtype=torch.long).to(
-                            inp.device
-                        ),  # [padding_length - seq]
-                    ],
-                    dim=0,
-                )
-
-                inps.append(inp.unsqueeze(0))  # [1, padding_length]
-                cont_toks_list.append(cont)
-                inplens.append(inplen)
-
-            batched_inps = torch.cat(inps, dim=0)  # [batch, padding_length
-            multi_logits = F.log_softmax(
-                self._model_call(batched_inps), dim=-1
-            ).cpu()  # [batch, padding_length, vocab]
-
-            for (cache_key, _, _), logits, inp, inplen, cont_toks in zip(
-                chunk, multi_logits, inps, inplens, cont_toks_list
-            ):
-
-                # Slice to original seq length
-                contlen = len(cont_toks)
-                logits = logits[inplen - contlen : inplen].unsqueeze(0)  # [1, seq, vocab]
-
-                # Check if per-token argmax is exactly equal to continuation
-                greedy_tokens = logits.argmax(dim=-1)
-                cont_toks = torch.tensor(cont_toks, dtype=torch.long).unsqueeze(0)  # [1, seq]
-                max_equal = (greedy_tokens == cont_toks).all()
-
-                # Obtain log-probs at the corresponding continuation token indices
-                # last_token_slice = logits[:, -1, :].squeeze(0).tolist()
-                logits = torch.gather(logits, 2, cont_toks.unsqueeze(-1)).squeeze(-1)  # [1, seq]
+    def _detect_batch_size(self, padding_length, max_batch_size=64):
+        # the largest batch of the longest inputs fitting in memory, halved on every OOM
+        assert dist.get_world_size() == 1, (
+            "the batch size can only be detected on a single device, "
+            "set batch_size_per_gpu to an integer"
+        )
+        batch_size = max_batch_size
+        while True:
+            try:
+                inps = torch.zeros((batch_size, padding_length), dtype=torch.long).to(self.device)
+                self._model_call(inps)
+                return batch_size
+            except Exception as e:
+                if not is_out_of_memory(e) or batch_size == 1:
+                    raise
+                batch_size //= 2
+            finally:
+                gc.collect()
+                flow.cuda.empty_cache()
+
+    def _batches(self, inps):
+        """
+        Split ``inps``, sorted by descending length, into batches padded to their first
+        length, of at most as many tokens as ``batch_size`` rows of the longest input, so
+        that the batches of shorter inputs hold more rows. With an automatic batch size,
+        the budget is the largest batch of ``max_length`` tokens fitting in memory, which
+        is detected once and holds for the inputs of every call.
+        """
+        if self.batch_size_per_gpu == "auto":
+            if self._detected_batch_size is None:
+                self._detected_batch_size = self._detect_batch_size(self.max_length)
+                print(f"Detected batch size: {self._detected_batch_size}")
+            max_tokens = self._detected_batch_size * self.max_length
+        else:
+            max_tokens = self.batch_size * len(inps[0])
+        for batch in token_budget_batches([len(inp) for inp in inps], max_tokens):
+            yield [inps[i] for i in batch]
+
+    def _score_batch(self, batch, groups):
+        """
+        Returns:
+            list[list[tuple[int, tuple[float, bool]]]]: the index and the answer of the
+                requests of every input of ``batch``.
+        """
+        padding_length = len(batch[0])
+        batched_inps = np.zeros((len(batch), padding_length), dtype=np.int64)
+        positions = []
+        cont_toks = []
+        for row, inp in enumerate(batch):
+            batched_inps[row, : len(inp)] = inp
+            for _, continuation_enc in groups[inp]:
+                start = row * padding_length + len(inp) - len(continuation_enc)
+                positions.extend(range(start, start + len(continuation_enc)))
+                cont_toks.extend(continuation_enc)
+
+        logits = self._model_call(
+            torch.tensor(batched_inps, dtype=torch.long).to(self.device)
+        )  # [batch, padding_length, vocab]
+        # keep the continuation positions only, so that log_softmax and the
+        # transfer to host do not scale with the input lengths and the vocab size
+        logits = logits.view(-1, logits.shape[-1]).index_select(
+            0, torch.tensor(positions, dtype=torch.long).to(self.device)
+        )  # [tokens, vocab]
+        cont_toks = torch.tensor(cont_toks, dtype=torch.long).to(self.device)
+        # Check if per-token argmax is exactly equal to continuation
+        greedy = (logits.argmax(dim=-1) == cont_toks).cpu().numpy()
+        # Obtain log-probs at the corresponding continuation token indices
+        logprobs = (
+            torch.gather(F.log_softmax(logits, dim=-1), 1, cont_toks.unsqueeze(-1))
+            .squeeze(-1)
+            .cpu()
+            .numpy()
+        )
 
+        answers = []
+        offset = 0
+        for inp in batch:
+            answers.append([])
+            for i, continuation_enc in groups[inp]:
+                contlen = len(continuation_enc)
                 # Answer: (log prob, is-exact-match)
-                answer = (float(logits.sum()), bool(max_equal))
+                answer = (
+                    float(logprobs[offset : offset + contlen].sum()),
+                    bool(greedy[offset : offset + contlen].all()),
+                )
+                answers[-1].append((i, answer))
+                offset += contlen
+        return answers
 
+    def _loglikelihood_tokens(self, requests, disable_tqdm=False):
+        res = [None] * len(requests)
+
+        # how this all works:
+        #          CTX      CONT
+        # inp    0 1 2 3|4 5 6 7 8 9   <- last token is deleted by inp[:, :-1]
+        # gpt2    \               \
+        # logits   1 2 3|4 5 6 7 8 9   <- the ctx half gets tossed out by the
+        # cont_toks      4 5 6 7 8 9   [:, -len(continuation_enc):, :self.vocab_size] slice
+        #
+        # The logits of a causal model only depend on the input, so the requests with the
+        # same input, e.g. the choices of a multiple-choice task with single token answers,
+        # share one forward and are scored at their continuation positions. Only identical
+        # inputs are shared: the choices of multi-token answers, as in HellaSwag or ARC,
+        # differ in their last tokens and get a forward each.
+        groups = collections.defaultdict(list)
+        for i, (_, context_enc, continuation_enc) in enumerate(requests):
+            # sanity check
+            assert len(context_enc) > 0
+            assert len(continuation_enc) > 0
+            assert len(continuation_enc) <= self.max_length
+
+            # when too long to fit in context, truncate from the left
+            inp = tuple((context_enc + continuation_enc)[-(self.max_length + 1) :][:-1])
+            groups[inp].append((i, continuation_enc))
+
+        # the descending length puts the longest inputs, and any OOMs, first and
+        # makes the first input of a batch its padded length
+        inps = sorted(groups, key=lambda inp: (-len(inp), inp))
+        pbar = tqdm(total=len(requests), disable=disable_tqdm)
+        for batch in self._batches(inps):
+            # the answer of a request only depends on its input, so the batches
+            # running out of memory are split without changing the results
+            answers = split_on_out_of_memory(lambda b: self._score_batch(b, groups), batch)
+            for i, answer in itertools.chain.from_iterable(answers):
                 # partial caching
+                cache_key = requests[i][0]
                 if cache_key is not None:
                     self.cache_hook.add_partial("loglikelihood", cache_key, answer)
 
-                res.append(answer)
+                res[i] = answer
+                pbar.update(1)
+        pbar.close()
 
-        return re_ord.get_original(res)
+        return res
 
     def generate_until(self, requests, disable_tqdm=False) -> List[str]:
         res = []
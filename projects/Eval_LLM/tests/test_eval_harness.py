@@ -0,0 +1,110 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+import oneflow as flow
+from omegaconf import DictConfig
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), *[os.path.pardir] * 3)))
+from projects.Eval_LLM.eval_harness import EvalHarnessBase  # noqa: E402
+
+VOCAB_SIZE = 13
+MAX_LENGTH = 12
+
+
+class SimulatedCausalHarness(EvalHarnessBase):
+    """A harness whose model is causal, the logits of a position being the sum of the
+    embeddings of the tokens up to it, and runs out of memory over ``max_batch_tokens``."""
+
+    def __init__(self, batch_size, max_batch_tokens=None):
+        super().__init__(
+            None,
+            None,
+            "simulated",
+            batch_size,
+            DictConfig(dict(max_position_embeddings=MAX_LENGTH, vocab_size=VOCAB_SIZE)),
+        )
+        self.embeddings = np.random.RandomState(0).normal(size=(VOCAB_SIZE, VOCAB_SIZE))
+        self.max_batch_tokens = max_batch_tokens
+        self.batch_shapes = []
+
+    @property
+    def device(self):
+        return flow.device("cpu")
+
+    def logits(self, inps):
+        return self.embeddings[inps].cumsum(axis=-2).astype(np.float32)
+
+    def _model_call(self, inps):
+        inps = inps.numpy()
+        self.batch_shapes.append(inps.shape)
+        if self.max_batch_tokens is not None and inps.size > self.max_batch_tokens:
+            raise RuntimeError("CUDA out of memory")
+        return flow.tensor(self.logits(inps))
+
+
+def _reference_answers(harness, requests):
+    # a forward per request, scoring the continuation on host
+    answers = []
+    for _, context_enc, continuation_enc in requests:
+        inp = (context_enc + continuation_enc)[-(MAX_LENGTH + 1) :][:-1]
+        logits = harness.logits(np.array(inp))[-len(continuation_enc) :].astype(np.float64)
+        logprobs = logits - np.log(np.exp(logits).sum(-1, keepdims=True))
+        target = np.array(continuation_enc)
+        answers.append(
+            (
+                logprobs[np.arange(len(target)), target].sum(),
+                bool((logits.argmax(-1) == target).all()),
+            )
+        )
+    return answers
+
+
+def _requests():
+    rng = np.random.RandomState(1)
+    requests = []
+    for question in range(20):
+        context_enc = rng.randint(1, VOCAB_SIZE, size=rng.randint(1, 15)).tolist()
+        for choice in range(4):
+            if question % 2:
+                # multi-token choices, whose inputs differ
+                continuation_enc = rng.randint(1, VOCAB_SIZE, size=rng.randint(1, 4)).tolist()
+            else:
+                # single token choices, which share the input of the context
+                continuation_enc = [choice + 1]
+            requests.append(((str(question), str(choice)), context_enc, continuation_enc))
+    return requests
+
+
+class TestEvalHarness(unittest.TestCase):
+    def _assert_answers(self, harness, requests):
+        answers = harness._loglikelihood_tokens(requests, disable_tqdm=True)
+        for answer, expected in zip(answers, _reference_answers(harness, requests)):
+            self.assertAlmostEqual(answer[0], expected[0], places=3)
+            self.assertEqual(answer[1], expected[1])
+
+    def test_shared_forwards(self):
+        requests = _requests()
+        harness = SimulatedCausalHarness(batch_size=3)
+        self._assert_answers(harness, requests)
+        # the single token choices of a question share a forward
+        num_inputs = len({(tuple(c + t)[-(MAX_LENGTH + 1) :][:-1]) for _, c, t in requests})
+        self.assertEqual(sum(shape[0] for shape in harness.batch_shapes), num_inputs)
+        self.assertLess(num_inputs, len(requests))
+
+    def test_out_of_memory_split(self):
+        harness = SimulatedCausalHarness(batch_size=8, max_batch_tokens=3 * MAX_LENGTH)
+        self._assert_answers(harness, _requests())
+
+    def test_auto_batch_size(self):
+        harness = SimulatedCausalHarness(batch_size="auto", max_batch_tokens=5 * MAX_LENGTH)
+        self._assert_answers(harness, _requests())
+        self.assertEqual(harness._detected_batch_size, 4)
+        # the batches after the detection fit in the detected token budget
+        batch_shapes = harness.batch_shapes[harness.batch_shapes.index((4, MAX_LENGTH)) + 1 :]
+        self.assertTrue(all(rows * length <= 4 * MAX_LENGTH for rows, length in batch_shapes))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -54,19 +54,21 @@ class GLMLoaderHuggerFace(ModelLoaderHuggerFace):
         # Convert Embedding layers.
         new_key = prefix2 + "embeddings.word_embeddings.weight"
         old_keys.remove(prefix1 + "word_embeddings.weight")
-        oneflow_state_dict[new_key] = oneflow_state_dict.pop(prefix1 + "word_embeddings.weight")
+        self._rename_key(oneflow_state_dict, prefix1 + "word_embeddings.weight", new_key)
 
         if cfg.get("block_position_encoding", False) is True:
             new_key = prefix2 + "embeddings.position_embeddings.weight"
             old_keys.remove(prefix1 + "transformer.position_embeddings.weight")
-            oneflow_state_dict[new_key] = oneflow_state_dict.pop(
-                prefix1 + "transformer.position_embeddings.weight"
+            self._rename_key(
+                oneflow_state_dict, prefix1 + "transformer.position_embeddings.weight", new_key
             )
 
             new_key = prefix2 + "embeddings.block_position_embeddings.weight"
             old_keys.remove(prefix1 + "transformer.block_position_embeddings.weight")
-            oneflow_state_dict[new_key] = oneflow_state_dict.pop(
-                prefix1 + "transformer.block_position_embeddings.weight"
+            self._rename_key(
+                oneflow_state_dict,
+                prefix1 + "transformer.block_position_embeddings.weight",
+                new_key,
             )
 
         # Convert other layers.
@@ -76,7 +78,7 @@ class GLMLoaderHuggerFace(ModelLoaderHuggerFace):
                 qkv = self._fix_qkv_ordering(qkv, head_size, num_heads)
                 oneflow_state_dict[prefix2 + key] = qkv
             else:
-                oneflow_state_dict[prefix2 + key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, prefix2 + key)
 
         return oneflow_state_dict
 
@@ -131,19 +133,21 @@ class GLMLoaderLiBai(ModelLoaderLiBai):
         # Convert Embedding layers.
         new_key = prefix2 + "embeddings.word_embeddings.weight"
         old_keys.remove(prefix1 + "word_embeddings.weight")
-        oneflow_state_dict[new_key] = oneflow_state_dict.pop(prefix1 + "word_embeddings.weight")
+        self._rename_key(oneflow_state_dict, prefix1 + "word_embeddings.weight", new_key)
 
         if cfg.get("block_position_encoding", False) is True:
             new_key = prefix2 + "embeddings.position_embeddings.weight"
             old_keys.remove(prefix1 + "transformer.position_embeddings.weight")
-            oneflow_state_dict[new_key] = oneflow_state_dict.pop(
-                prefix1 + "transformer.position_embeddings.weight"
+            self._rename_key(
+                oneflow_state_dict, prefix1 + "transformer.position_embeddings.weight", new_key
             )
 
             new_key = prefix2 + "embeddings.block_position_embeddings.weight"
             old_keys.remove(prefix1 + "transformer.block_position_embeddings.weight")
-            oneflow_state_dict[new_key] = oneflow_state_dict.pop(
-                prefix1 + "transformer.block_position_embeddings.weight"
+            self._rename_key(
+                oneflow_state_dict,
+                prefix1 + "transformer.block_position_embeddings.weight",
+                new_key,
             )
 
         # Convert other layers.
@@ -153,6 +157,6 @@ class GLMLoaderLiBai(ModelLoaderLiBai):
                 qkv = self._fix_qkv_ordering(qkv, head_size, num_heads)
                 oneflow_state_dict[prefix2 + key] = qkv
             else:
-                oneflow_state_dict[prefix2 + key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, prefix2 + key)
 
         return oneflow_state_dict
@@ -14,15 +14,20 @@ cfg = dict(
     intermediate_size=11008,
     max_position_embeddings=2048,
     num_attention_heads=32,
+    num_key_value_heads=32,
     hidden_layers=32,
     pretraining_tp=1,
     rms_norm_eps=1e-05,
+    rope_theta=10000.0,
     rope_scaling=None,
     tie_word_embeddings=False,
     vocab_size=32000,
     use_scaled_init_for_output_weights=False,
     scale_mask_softmax_fusion=False,
     amp_enabled=True,
+    attention_block_size=None,
+    sliding_window=None,
+    lm_loss_chunk_size=None,
     # Inference
     is_encoder_decoder=False,
     max_length=256,
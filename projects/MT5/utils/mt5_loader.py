@@ -61,25 +61,21 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
         # NOTE: Transformers' T5 has no position embedding layer.
         new_key = prefix2 + "embedding.word_embeddings.weight"
         old_keys.remove(prefix1 + "shared.weight")
-        oneflow_state_dict[new_key] = oneflow_state_dict.pop(prefix1 + "shared.weight")
+        self._rename_key(oneflow_state_dict, prefix1 + "shared.weight", new_key)
 
         # Convert T5's final_layer_norm
         new_key = prefix2 + "encoder.final_layernorm.weight"
         old_keys.remove(prefix1 + "encoder.final_layer_norm.weight")
-        oneflow_state_dict[new_key] = oneflow_state_dict.pop(
-            prefix1 + "encoder.final_layer_norm.weight"
-        )
+        self._rename_key(oneflow_state_dict, prefix1 + "encoder.final_layer_norm.weight", new_key)
         new_key = prefix2 + "decoder.final_layernorm.weight"
         old_keys.remove(prefix1 + "decoder.final_layer_norm.weight")
-        oneflow_state_dict[new_key] = oneflow_state_dict.pop(
-            prefix1 + "decoder.final_layer_norm.weight"
-        )
+        self._rename_key(oneflow_state_dict, prefix1 + "decoder.final_layer_norm.weight", new_key)
 
         # Convert MT5's lm_head
         if cfg.model_type == "mt5" and "lm_head.weight" in oneflow_state_dict:
             new_key = prefix2 + "lm_head.weight"
             old_keys.remove("lm_head.weight")
-            oneflow_state_dict[new_key] = oneflow_state_dict.pop("lm_head.weight")
+            self._rename_key(oneflow_state_dict, "lm_head.weight", new_key)
 
         # NOTE: Each layers has no bias in Transformer's T5.
         for key in old_keys:
@@ -96,7 +92,7 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
                     + keys[encoder_decoder_idx]
                     + ".layers.0.self_attention.relative_attention_bias.weight"
                 )
-                oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert T5's Encoder layers.
             if keys[encoder_decoder_idx] == "encoder":
@@ -125,11 +121,11 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
 
                     o_w = ".".join(keys[: op_idx + 1]) + ".o." + "weight"
                     new_key = prefix2 + "encoder.layers." + layer1 + ".self_attention.dense.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(o_w)
+                    self._rename_key(oneflow_state_dict, o_w, new_key)
                 elif op_name == "layer_norm":
                     if layer2 == "0":
                         new_key = prefix2 + "encoder.layers." + layer1 + ".input_layernorm.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif layer2 == "1":
                         new_key = (
                             prefix2
@@ -137,29 +133,29 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
                             + layer1
                             + ".post_attention_layernorm.weight"
                         )
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                 elif op_name == "DenseReluDense":
                     if cfg.get("model_type") == "t5":
                         if keys[op_idx + 1] == "wi":
                             new_key = (
                                 prefix2 + "encoder.layers." + layer1 + ".mlp.dense_h_to_4h.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif keys[op_idx + 1] == "wo":
                             new_key = (
                                 prefix2 + "encoder.layers." + layer1 + ".mlp.dense_4h_to_h.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                     elif cfg.get("model_type") == "mt5":
                         if keys[op_idx + 1] == "wi_0":
                             new_key = prefix2 + "encoder.layers." + layer1 + ".mlp.wi_0.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif keys[op_idx + 1] == "wi_1":
                             new_key = prefix2 + "encoder.layers." + layer1 + ".mlp.wi_1.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif keys[op_idx + 1] == "wo":
                             new_key = prefix2 + "encoder.layers." + layer1 + ".mlp.wo.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
 
             # Convert T5's decoder Layers.
             elif keys[encoder_decoder_idx] == "decoder":
@@ -189,11 +185,11 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
 
                     o_w = ".".join(keys[: op_idx + 1]) + ".o." + "weight"
                     new_key = prefix2 + "decoder.layers." + layer1 + ".self_attention.dense.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(o_w)
+                    self._rename_key(oneflow_state_dict, o_w, new_key)
                 elif op_name == "layer_norm":
                     if layer2 == "0":
                         new_key = prefix2 + "decoder.layers." + layer1 + ".input_layernorm.weight"
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif layer2 == "1":
                         new_key = (
                             prefix2
@@ -201,7 +197,7 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
                             + layer1
                             + ".post_attention_layernorm.weight"
                         )
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                     elif layer2 == "2":
                         new_key = (
                             prefix2
@@ -209,7 +205,7 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
                             + layer1
                             + ".post_cross_attention_layernorm.weight"
                         )
-                        oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                        self._rename_key(oneflow_state_dict, key, new_key)
                 elif op_name == "EncDecAttention":
                     new_key = prefix2 + "decoder.layers." + layer1 + ".cross_attention.query.weight"
                     if new_key in oneflow_state_dict.keys():
@@ -237,29 +233,29 @@ class T5LoaderHuggerFace(ModelLoaderHuggerFace):
 
                     o_w = ".".join(keys[: op_idx + 1]) + ".o." + "weight"
                     new_key = prefix2 + "decoder.layers." + layer1 + ".cross_attention.dense.weight"
-                    oneflow_state_dict[new_key] = oneflow_state_dict.pop(o_w)
+                    self._rename_key(oneflow_state_dict, o_w, new_key)
                 elif op_name == "DenseReluDense":
                     if cfg.get("model_type") == "t5":
                         if keys[op_idx + 1] == "wi":
                             new_key = (
                                 prefix2 + "decoder.layers." + layer1 + ".mlp.dense_h_to_4h.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif keys[op_idx + 1] == "wo":
                             new_key = (
                                 prefix2 + "decoder.layers." + layer1 + ".mlp.dense_4h_to_h.weight"
                             )
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                     elif cfg.get("model_type") == "mt5":
                         if keys[op_idx + 1] == "wi_0":
                             new_key = prefix2 + "decoder.layers." + layer1 + ".mlp.wi_0.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif keys[op_idx + 1] == "wi_1":
                             new_key = prefix2 + "decoder.layers." + layer1 + ".mlp.wi_1.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
                         elif keys[op_idx + 1] == "wo":
                             new_key = prefix2 + "decoder.layers." + layer1 + ".mlp.wo.weight"
-                            oneflow_state_dict[new_key] = oneflow_state_dict.pop(key)
+                            self._rename_key(oneflow_state_dict, key, new_key)
         return oneflow_state_dict
 
     def _load_config_from_json(self, config_file):
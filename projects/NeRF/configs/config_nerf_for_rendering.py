@@ -40,7 +40,9 @@ dataloader.test = [
             spheric_poses=None if dataset.dataset_type == "Blender" else False,
             val_num=None if dataset.dataset_type == "Blender" else 1,  # Number of your GPUs
         ),
-        sampler=LazyCall(SingleRoundSampler)(shuffle=False, drop_last=False),
+        sampler=LazyCall(SingleRoundSampler)(
+            shuffle=False, drop_last=False, pad_last_batch=True
+        ),
         num_workers=0,
         test_batch_size=train.test_micro_batch_size,
     )
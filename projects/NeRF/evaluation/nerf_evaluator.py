@@ -11,18 +11,18 @@ import numpy as np
 import oneflow as flow
 from PIL import Image
 
-from libai.evaluation.cls_evaluator import ClsEvaluator
+from libai.evaluation.evaluator import DatasetEvaluator
 from libai.utils import distributed as dist
 
 
-class NerfEvaluator(ClsEvaluator):
+class NerfEvaluator(DatasetEvaluator):
     def __init__(self, img_wh, image_save_path=None):
         """
         Args:
             img_wh (tuple(int)): the width and height of the images in the validation set
             image_save_path (str): location of image storage
         """
-        super().__init__(topk=(1, 5))
+        self._predictions = []
         self.img_wh = img_wh
         self.image_save_path = (
             str(os.path.dirname(os.path.realpath(__file__))) + "/../images"
@@ -33,6 +33,9 @@ class NerfEvaluator(ClsEvaluator):
             os.makedirs(self.image_save_path)
         self.toimage = T.ToPILImage()
 
+    def reset(self):
+        self._predictions = []
+
     def current_time(self):
         currentDateAndTime = datetime.now()
         currentTime = currentDateAndTime.strftime("%H_%M_%S")
@@ -18,11 +18,13 @@ cfg = dict(
     initializer_range=0.02,
     rms_norm_eps=1e-06,
     rope_theta=10000.0,
+    rope_scaling=None,
     attention_dropout=0.0,
     tie_word_embeddings=False,
     use_scaled_init_for_output_weights=False,
     scale_mask_softmax_fusion=False,
     amp_enabled=True,
+    lm_loss_chunk_size=None,
     # Inference
     is_encoder_decoder=False,
     max_length=256,
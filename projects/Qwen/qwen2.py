@@ -22,47 +22,19 @@ from oneflow import nn
 
 from libai.config import configurable
 from libai.inference.generator.generation_utils import Generator
-from libai.layers import Linear, RMSLayerNorm, VocabEmbedding
+from libai.layers import (
+    Linear,
+    RMSLayerNorm,
+    RotaryEmbedding,
+    VocabEmbedding,
+    apply_rotary_pos_emb,
+    fused_lm_head_cross_entropy,
+)
 from libai.layers.attention import AttnMaskType
 from libai.models.utils import init_method_normal, scaled_init_method_normal
 from libai.utils import distributed as dist
 
 
-def rotate_half(x):
-    """Rotates half the hidden dims of the input."""
-    x1 = x[..., : x.shape[-1] // 2]
-    x2 = x[..., x.shape[-1] // 2 :]
-    return flow.cat((-x2, x1), dim=-1)
-
-
-def apply_rotary_pos_emb(q, k, cos, sin, position_ids):
-    cos = cos[position_ids].unsqueeze(1)
-    sin = sin[position_ids].unsqueeze(1)
-    q_embed = (q * cos) + (rotate_half(q) * sin)
-    k_embed = (k * cos) + (rotate_half(k) * sin)
-    return q_embed, k_embed
-
-
-class RotaryEmbedding(nn.Module):
-    def __init__(self, dim, max_position_embeddings=2048):
-        super().__init__()
-
-        self.dim = dim
-        self.max_position_embeddings = max_position_embeddings
-
-    def forward(self, x, seq_len=None, cos_cached=None, sin_cached=None):
-        if seq_len > self.max_position_embeddings:
-            raise ValueError(
-                f"The maximum supported length is {self.max_position_embeddings}, "
-                f"and the current length is{seq_len}."
-            )
-
-        return (
-            cos_cached[:seq_len].to_global(placement=x.placement),
-            sin_cached[:seq_len].to_global(placement=x.placement),
-        )
-
-
 class MLP(nn.Module):
     def __init__(
         self,
@@ -125,6 +97,7 @@ class MultiheadAttention(nn.Module):
         scale_mask_softmax_fusion=False,
         attn_mask_type=AttnMaskType.padding,
         *,
+        num_key_value_heads=None,
         layer_idx=0,
     ):
         super().__init__()
@@ -136,13 +109,18 @@ class MultiheadAttention(nn.Module):
         self.head_size = hidden_size // num_attention_heads
         self.attn_mask_type = attn_mask_type
 
+        self.num_key_value_heads = (
+            num_attention_heads if num_key_value_heads is None else num_key_value_heads
+        )
+        self.num_key_value_groups = self.num_heads // self.num_key_value_heads
+
         self.norm_factor = 1.0 / math.sqrt(float(self.head_size))
 
         self.scale_mask_softmax_fusion = scale_mask_softmax_fusion
 
         self.query_key_value = Linear(
             self.hidden_size,
-            self.hidden_size * 3,
+            self.hidden_size + self.num_key_value_heads * self.head_size * 2,
             bias=True,
             parallel="col",
             init_method=init_method,
@@ -160,21 +138,14 @@ class MultiheadAttention(nn.Module):
 
         self.coeff = None
 
-        rotary_dim = self.head_size
-        self.rotary_emb = RotaryEmbedding(
-            dim=rotary_dim,
-            max_position_embeddings=max_position_embeddings,
-        )
-
     def forward(
         self,
         hidden_states: flow.Tensor,
         encoder_states: flow.Tensor = None,
         attention_mask: flow.Tensor = None,
-        position_ids=None,
         past_key_value: Tuple[flow.Tensor, flow.Tensor] = None,
-        cos_cached: flow.Tensor = None,
-        sin_cached: flow.Tensor = None,
+        cos: flow.Tensor = None,
+        sin: flow.Tensor = None,
         use_cache: bool = False,
     ):
         if encoder_states is not None:
@@ -186,36 +157,56 @@ class MultiheadAttention(nn.Module):
         bsz, tgt_len = hidden_states.size()[:2]
 
         query_key_value = self.query_key_value(hidden_states)
-        query_key_value = query_key_value.view(bsz, -1, self.num_heads, 3 * self.head_size)
+        query_key_value = query_key_value.view(
+            bsz, -1, self.num_key_value_heads, (self.num_key_value_groups + 2) * self.head_size
+        )
         query_key_value = query_key_value.permute(
             0, 2, 1, 3
-        )  # [bsz, num_heads, src_len, 3 * head_size]
-        query, key, value = flow.chunk(query_key_value, chunks=3, dim=-1)
-
-        kv_seq_len = key.shape[-2]
-        if past_key_value is not None:
-            kv_seq_len += past_key_value[0].shape[-2]
-        cos, sin = self.rotary_emb(
-            value, seq_len=kv_seq_len, cos_cached=cos_cached, sin_cached=sin_cached
+        )  # [bsz, num_kv_heads, src_len, (num_kv_groups + 2) * head_size]
+        query, key, value = flow.split(
+            query_key_value,
+            [self.num_key_value_groups * self.head_size, self.head_size, self.head_size],
+            dim=-1,
         )
-        query, key = apply_rotary_pos_emb(query, key, cos, sin, position_ids)
+        if self.num_key_value_groups > 1:
+            query = (
+                query.reshape(
+                    bsz, self.num_key_value_heads, -1, self.num_key_value_groups, self.head_size
+                )
+                .permute(0, 1, 3, 2, 4)
+                .reshape(bsz, self.num_heads, -1, self.head_size)
+            )
+
+        # cos, sin: [bsz, 1, tgt_len, head_size], gathered at the positions of new tokens
+        query = apply_rotary_pos_emb(query, cos, sin)
+        key = apply_rotary_pos_emb(key, cos, sin)
 
         if past_key_value is not None:
             past_key, past_value = past_key_value
             key = flow.cat((past_key.type_as(key), key), dim=2)
             value = flow.cat((past_value.type_as(value), value), dim=2)
 
-        # query, key, value: [S(0), S(1)], shape: [bsz, num_heads, seq_length, head_size]
+        # query: [S(0), S(1)], shape: [bsz, num_heads, seq_length, head_size]
+        # key, value: [S(0), S(1)], shape: [bsz, num_kv_heads, seq_length, head_size]
         if use_cache:
             past_key_value = (key, value)
 
         # [bsz, num_heads, tgt_len, src_len] with [S(0), S(1)]
+        if self.num_key_value_groups > 1:
+            # fold query heads of a group into the sequence dim to share one key/value head
+            query = query.reshape(bsz, self.num_key_value_heads, -1, self.head_size)
         attention_scores = flow.matmul(query, key, transpose_b=True, alpha=self.norm_factor)
+        attention_scores = attention_scores.view(bsz, self.num_heads, tgt_len, -1)
         attention_weights = attention_scores + attention_mask
 
         attention_weights = flow.softmax(attention_weights, dim=-1)
         # Context shape: [bsz, num_heads, tgt_len, head_size] with [S(0), S(1)]
+        if self.num_key_value_groups > 1:
+            attention_weights = attention_weights.view(
+                bsz, self.num_key_value_heads, -1, attention_weights.size(-1)
+            )
         context = flow.matmul(attention_weights, value)
+        context = context.view(bsz, self.num_heads, tgt_len, self.head_size)
 
         # Change shape: [bsz, num_heads, tgt_len, head_size] -> [bsz, tgt_len, num_heads, head_size]
         context = context.transpose(1, 2)
@@ -285,12 +276,14 @@ class DecoderLayer(nn.Module):
         scale_mask_softmax_fusion=False,
         attn_mask_type=AttnMaskType.padding,
         *,
+        num_key_value_heads=None,
         layer_idx=0,
     ):
         super().__init__()
         self.hidden_size = hidden_size
         self.intermediate_size = intermediate_size
         self.num_attention_heads = num_attention_heads
+        self.num_key_value_heads = num_key_value_heads
         self.rms_norm_eps = rms_norm_eps
         self.max_position_embeddings = max_position_embeddings
         self.attn_mask_type = attn_mask_type
@@ -327,8 +320,8 @@ class DecoderLayer(nn.Module):
         hidden_states,
         attention_mask=None,
         past_key_value=None,
-        cos_cached=None,
-        sin_cached=None,
+        cos=None,
+        sin=None,
         use_cache=False,
     ):
         hidden_states = hidden_states.to_global(placement=dist.get_layer_placement(self.layer_idx))
@@ -353,8 +346,8 @@ class DecoderLayer(nn.Module):
             layernorm_output,
             attention_mask=attention_mask,
             past_key_value=self_attn_past_key_value,
-            cos_cached=cos_cached,
-            sin_cached=sin_cached,
+            cos=cos,
+            sin=sin,
             use_cache=use_cache,
         )
 
@@ -382,6 +375,7 @@ class DecoderLayer(nn.Module):
             output_layer_init_method=self.output_layer_init_method,
             scale_mask_softmax_fusion=self.scale_mask_softmax_fusion,
             attn_mask_type=self.attn_mask_type,
+            num_key_value_heads=self.num_key_value_heads,
             layer_idx=self.layer_idx,
         )
 
@@ -394,12 +388,15 @@ class Qwen2Model(nn.Module):
         hidden_size,
         intermediate_size,
         num_attention_heads,
+        num_key_value_heads=None,
         max_position_embeddings=1024,
         rms_norm_eps=1e-5,
         initializer_range=0.02,
         use_scaled_init_for_output_weights=True,
         scale_mask_softmax_fusion=False,
         amp_enabled=False,
+        rope_theta=10000.0,
+        rope_scaling=None,
     ):
         super().__init__()
         init_method = init_method_normal(sigma=initializer_range)
@@ -423,6 +420,7 @@ class Qwen2Model(nn.Module):
                     output_layer_init_method=output_layer_init_method,
                     scale_mask_softmax_fusion=scale_mask_softmax_fusion,
                     attn_mask_type=AttnMaskType.causal,
+                    num_key_value_heads=num_key_value_heads,
                     layer_idx=i,
                 )
                 for i in range(hidden_layers)
@@ -430,35 +428,20 @@ class Qwen2Model(nn.Module):
         )
         self.norm = RMSLayerNorm(hidden_size, eps=rms_norm_eps, layer_idx=-1)
 
-        self._set_cos_sin_cache(
-            rotary_dim=hidden_size // num_attention_heads,
-            seq_len=max_position_embeddings,
-            dtype=flow.float32,
+        scaling_type, scaling_factor = RotaryEmbedding.scaling_from_config(rope_scaling)
+        self.rotary_emb = RotaryEmbedding(
+            hidden_size // num_attention_heads,
+            max_position_embeddings=max_position_embeddings,
+            base=rope_theta,
+            scaling_type=scaling_type,
+            scaling_factor=scaling_factor,
             layer_idx=0,
         )
 
-    def _set_cos_sin_cache(self, rotary_dim, seq_len, base=10000, dtype=None, layer_idx=0):
-        position = flow.arange(
-            0,
-            rotary_dim,
-            2,
-            dtype=dtype,
-            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
-            placement=dist.get_layer_placement(layer_idx),
-        )
-        inv_freq = 1.0 / (base ** (position / rotary_dim))
-
-        t = flow.arange(
-            seq_len,
-            dtype=inv_freq.dtype,
-            sbp=inv_freq.sbp,
-            placement=inv_freq.placement,
-        )
-
-        freqs = flow.einsum("i,j->ij", t, inv_freq)
-        emb = flow.cat((freqs, freqs), dim=-1)
-        self.register_buffer("cos_cached", emb.cos().to(dtype))
-        self.register_buffer("sin_cached", emb.sin().to(dtype))
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # the checkpoints saved before sharing the rotary embedding hold its tables
+        RotaryEmbedding.drop_legacy_cache(state_dict, prefix)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(
         self,
@@ -473,13 +456,25 @@ class Qwen2Model(nn.Module):
         input_ids = input_ids.to_global(placement=dist.get_layer_placement(0))
         hidden_states = self.embed_tokens(input_ids)
 
+        # cos/sin are gathered once and shared by all layers
+        past_length = 0 if past_key_values[0] is None else past_key_values[0][0].size(-2)
+        seq_len = past_length + input_ids.size(1)
+        position_ids = flow._C.global_arange(
+            start=past_length,
+            end=seq_len,
+            placement=input_ids.placement,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            dtype=flow.long,
+        ).unsqueeze(0)
+        cos, sin = self.rotary_emb(position_ids, seq_len=seq_len)
+
         for layer, past_key_value in zip(self.layers, past_key_values):
             hidden_states = layer(
                 hidden_states=hidden_states,
                 attention_mask=attention_mask,
                 past_key_value=past_key_value,
-                cos_cached=self.cos_cached,
-                sin_cached=self.sin_cached,
+                cos=cos,
+                sin=sin,
                 use_cache=False,
             )
             if use_cache:
@@ -529,28 +524,36 @@ class Qwen2ForCausalLM(nn.Module, Generator):
         hidden_size,
         intermediate_size,
         num_attention_heads,
+        num_key_value_heads=None,
         max_position_embeddings=1024,
         rms_norm_eps=1e-5,
         initializer_range=0.02,
         use_scaled_init_for_output_weights=True,
         scale_mask_softmax_fusion=False,
         amp_enabled=False,
+        rope_theta=10000.0,
+        rope_scaling=None,
+        lm_loss_chunk_size=None,
         cfg=None,
     ):
         super().__init__()
         self.cfg = cfg
+        self.lm_loss_chunk_size = lm_loss_chunk_size
         self.model = Qwen2Model(
             hidden_layers=hidden_layers,
             vocab_size=vocab_size,
             hidden_size=hidden_size,
             intermediate_size=intermediate_size,
             num_attention_heads=num_attention_heads,
+            num_key_value_heads=num_key_value_heads,
             max_position_embeddings=max_position_embeddings,
             rms_norm_eps=rms_norm_eps,
             initializer_range=initializer_range,
             use_scaled_init_for_output_weights=use_scaled_init_for_output_weights,
             scale_mask_softmax_fusion=scale_mask_softmax_fusion,
             amp_enabled=amp_enabled,
+            rope_theta=rope_theta,
+            rope_scaling=rope_scaling,
         )
         self.casual_mask = CasualMask(max_position_embeddings, layer_idx=0)
         self.lm_head = Linear(hidden_size, vocab_size, bias=False, layer_idx=-1)
@@ -592,6 +595,20 @@ class Qwen2ForCausalLM(nn.Module, Generator):
             set_cache=self.set_cache,
         )
 
+        if labels is not None and self.lm_loss_chunk_size is not None:
+            # fuse the LM head into the loss, so that the logits are never materialized
+            labels = labels.to_global(placement=output.placement)
+            labels = labels * (labels >= 0)
+            lm_loss = fused_lm_head_cross_entropy(
+                output,
+                self.lm_head.weight,
+                labels,
+                ignore_index=0,
+                chunk_size=self.lm_loss_chunk_size,
+            )
+            num_tokens = (labels > 0).sum().to(lm_loss.dtype)
+            return {"lm_loss": lm_loss.sum() / num_tokens}
+
         logits = self.lm_head(output)
 
         if labels is not None:
@@ -626,12 +643,16 @@ class Qwen2ForCausalLM(nn.Module, Generator):
             "hidden_size": cfg.hidden_size,
             "intermediate_size": cfg.intermediate_size,
             "num_attention_heads": cfg.num_attention_heads,
+            "num_key_value_heads": cfg.get("num_key_value_heads", None),
             "max_position_embeddings": cfg.max_position_embeddings,
             "rms_norm_eps": cfg.rms_norm_eps,
             "initializer_range": cfg.initializer_range,
             "use_scaled_init_for_output_weights": cfg.use_scaled_init_for_output_weights,
             "scale_mask_softmax_fusion": cfg.scale_mask_softmax_fusion,
             "amp_enabled": cfg.amp_enabled,
+            "rope_theta": cfg.get("rope_theta", 10000.0),
+            "rope_scaling": cfg.get("rope_scaling", None),
+            "lm_loss_chunk_size": cfg.get("lm_loss_chunk_size", None),
             "cfg": cfg,
         }
 
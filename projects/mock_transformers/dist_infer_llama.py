@@ -40,14 +40,14 @@ class LiBaiLlamaAttention(temp_class):
         )
         self.k_proj = Linear(
             self.hidden_size,
-            self.num_heads * self.head_dim,
+            self.num_key_value_heads * self.head_dim,
             bias=False,
             parallel="col",
             dtype=flow.float16,
         )
         self.v_proj = Linear(
             self.hidden_size,
-            self.num_heads * self.head_dim,
+            self.num_key_value_heads * self.head_dim,
             bias=False,
             parallel="col",
             dtype=flow.float16,
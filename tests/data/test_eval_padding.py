@@ -0,0 +1,132 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import oneflow as flow
+import oneflow.unittest
+from oneflow.utils.data import Dataset
+
+from libai.config import LazyCall
+from libai.data import DistTensorData, Instance
+from libai.data.build import (
+    VALID_MASK_FIELD,
+    ValidMaskDataset,
+    build_nlp_test_loader,
+    trivial_batch_collator,
+)
+from libai.data.samplers import PaddingIndex, SingleRoundSampler
+from libai.engine import DefaultTrainer
+from libai.evaluation import DatasetEvaluator, inference_on_dataset
+from libai.utils import distributed as dist
+from tests.fixtures.utils import setup_cpu_dist
+
+
+class RangeDataset(Dataset):
+    def __init__(self, size):
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, idx):
+        return Instance(x=DistTensorData(flow.tensor([float(idx)])))
+
+
+class SampleCollector(DatasetEvaluator):
+    def reset(self):
+        self.samples = []
+
+    def process(self, inputs, outputs):
+        self.samples.extend(inputs["x"].flatten().tolist())
+
+    def evaluate(self):
+        return {"samples": sorted(self.samples)}
+
+
+class TestEvalPadding(unittest.TestCase):
+    def test_single_round_sampler(self):
+        samplers = [
+            SingleRoundSampler(
+                list(range(9)),
+                micro_batch_size=2,
+                data_parallel_rank=rank,
+                data_parallel_size=2,
+                pad_last_batch=True,
+            )
+            for rank in range(2)
+        ]
+        rank_batches = [list(sampler) for sampler in samplers]
+        self.assertEqual(rank_batches[0], [[0, 1], [2, 3], [4, 0]])
+        self.assertEqual(rank_batches[1], [[5, 6], [7, 8], [0, 0]])
+        # every rank completes its last batch
+        self.assertIsInstance(rank_batches[0][-1][1], PaddingIndex)
+        self.assertTrue(all(isinstance(idx, PaddingIndex) for idx in rank_batches[1][-1]))
+        self.assertEqual(len(samplers[0]), 3)
+
+        sampler = SingleRoundSampler(list(range(9)), micro_batch_size=2, drop_last=True)
+        self.assertEqual(list(sampler)[-1], [6, 7])
+
+        # without a consumer of the mask, the last batches are left short for `pad_batch`
+        rank_batches = [
+            list(
+                SingleRoundSampler(
+                    list(range(9)),
+                    micro_batch_size=2,
+                    data_parallel_rank=rank,
+                    data_parallel_size=2,
+                )
+            )
+            for rank in range(2)
+        ]
+        self.assertEqual(rank_batches[0][-1], [4])
+        self.assertEqual(rank_batches[1][-1], [0])
+        self.assertFalse(any(isinstance(idx, PaddingIndex) for idx in rank_batches[1][-1]))
+
+    def test_valid_mask_dataset(self):
+        dataset = ValidMaskDataset(
+            [Instance(x=DistTensorData(flow.tensor([float(i)]))) for i in range(3)]
+        )
+        batch = trivial_batch_collator([dataset[idx] for idx in [2, 0, PaddingIndex(0)]])
+        self.assertEqual(batch.get("x").tensor.tolist(), [[2.0], [0.0], [0.0]])
+        self.assertEqual(batch.get(VALID_MASK_FIELD).tensor.tolist(), [True, True, False])
+
+    @flow.unittest.skip_unless_1n2d()
+    def test_inference_without_pad_last_batch(self):
+        setup_cpu_dist(data_parallel_size=2)
+        # the last batches are [4] and [0], sample 0 only completing the one of rank 1
+        loader = build_nlp_test_loader(
+            RangeDataset(9),
+            test_batch_size=2,
+            sampler=LazyCall(SingleRoundSampler)(shuffle=False, drop_last=False),
+            num_workers=0,
+        )
+        batch_sizes = []
+
+        def model(x):
+            batch_sizes.append(x.shape[0])
+            return {"y": x}
+
+        results = inference_on_dataset(
+            model, loader, 4, 100, DefaultTrainer.get_batch, "cpu", SampleCollector()
+        )
+        # the short last batch is padded to the global batch size
+        self.assertEqual(batch_sizes, [4, 4, 4])
+        if dist.is_main_process():
+            self.assertEqual(results["samples"], [float(i) for i in range(9)])
+
+
+if __name__ == "__main__":
+    unittest.main()
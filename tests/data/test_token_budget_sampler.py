@@ -0,0 +1,55 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from libai.data.samplers import PaddingIndex, TokenBudgetSampler, token_budget_batches
+
+lengths = [3, 10, 5, 10, 2, 8, 5, 1, 7]
+
+
+class TestTokenBudgetSampler(unittest.TestCase):
+    def test_token_budget_batches(self):
+        batches = token_budget_batches(lengths, 20)
+        self.assertEqual(batches, [[1, 3], [5, 8], [2, 6, 0, 4], [7]])
+        for batch in batches:
+            self.assertLessEqual(len(batch) * lengths[batch[0]], 20)
+
+        # a batch holds at least `multiple_of` samples
+        batches = token_budget_batches(lengths, 20, multiple_of=4)
+        self.assertEqual(batches, [[1, 3, 5, 8], [2, 6, 0, 4], [7]])
+
+    def test_data_parallel(self):
+        samplers = [
+            TokenBudgetSampler(
+                lengths, 10, lengths=lengths, data_parallel_rank=rank, data_parallel_size=2
+            )
+            for rank in range(2)
+        ]
+        rank_batches = [list(sampler) for sampler in samplers]
+        self.assertEqual(len(samplers[0]), 4)
+        for batch0, batch1 in zip(*rank_batches):
+            self.assertEqual(len(batch0), len(batch1))
+
+        # the last batch is completed with sample 0, after all the samples
+        self.assertEqual(rank_batches[0][-1] + rank_batches[1][-1], [7, 0])
+        self.assertIsInstance(rank_batches[1][-1][0], PaddingIndex)
+        samples = [idx for batches in zip(*rank_batches) for batch in batches for idx in batch]
+        self.assertEqual(sorted(samples[: len(lengths)]), list(range(len(lengths))))
+        self.assertEqual(samplers[0].num_samples(len(samplers[0])), len(lengths))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,6 @@
+from omegaconf import DictConfig
+
+from libai.utils import distributed as dist
 from libai.utils.download import download
 
 fixtrue_urls = {
@@ -14,3 +17,17 @@ def get_fixtures(fixture_dir):
     if fixture_name not in fixtrue_urls:
         raise RuntimeError("{} not available in LiBai tests fixtrues!".format(fixture_name))
     return download(fixtrue_urls[fixture_name], BASE_DIR)
+
+
+def setup_cpu_dist(data_parallel_size=1):
+    """Set up the distributed environment of the tests running on cpu."""
+    dist.setup_dist_util(
+        DictConfig(
+            dict(
+                data_parallel_size=data_parallel_size,
+                tensor_parallel_size=1,
+                pipeline_parallel_size=1,
+                device_type="cpu",
+            )
+        )
+    )
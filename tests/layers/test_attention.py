@@ -0,0 +1,203 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+import oneflow.unittest
+
+from libai.layers import MultiheadAttention, SlidingWindowAttentionMask, blockwise_attention
+from libai.layers.attention import AttnMaskType
+from libai.utils import distributed as dist
+from tests.fixtures.utils import setup_cpu_dist
+
+hidden_size = 16
+num_heads = 4
+num_kv_heads = 2
+head_size = hidden_size // num_heads
+
+
+def _expand_grouped_qkv(weight):
+    """Convert fused grouped-query qkv rows into the multi-head layout by repeating
+    every key/value head for the query heads of its group."""
+    groups = num_heads // num_kv_heads
+    grouped = weight.reshape(num_kv_heads, groups + 2, head_size, -1)
+    rows = []
+    for head in range(num_heads):
+        kv_head, idx = divmod(head, groups)
+        rows.extend([grouped[kv_head, idx], grouped[kv_head, groups], grouped[kv_head, groups + 1]])
+    return np.concatenate(rows, axis=0)
+
+
+class TestMultiheadAttention(flow.unittest.TestCase):
+    def _build_pair(self):
+        gqa = MultiheadAttention(hidden_size, num_heads, num_key_value_heads=num_kv_heads)
+        mha = MultiheadAttention(hidden_size, num_heads)
+
+        qkv_weight = gqa.query_key_value.weight.to_local().numpy()
+        qkv_bias = gqa.query_key_value.bias.to_local().numpy()
+        self.assertEqual(
+            qkv_weight.shape, (hidden_size + 2 * num_kv_heads * head_size, hidden_size)
+        )
+
+        mha.query_key_value.weight.data.copy_(
+            flow.tensor(_expand_grouped_qkv(qkv_weight)).to_global(
+                placement=mha.query_key_value.weight.placement,
+                sbp=mha.query_key_value.weight.sbp,
+            )
+        )
+        mha.query_key_value.bias.data.copy_(
+            flow.tensor(_expand_grouped_qkv(qkv_bias[:, None])[:, 0]).to_global(
+                placement=mha.query_key_value.bias.placement,
+                sbp=mha.query_key_value.bias.sbp,
+            )
+        )
+        mha.dense.weight.data.copy_(gqa.dense.weight)
+        mha.dense.bias.data.copy_(gqa.dense.bias)
+        return gqa, mha
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_grouped_query_attention(self):
+        setup_cpu_dist()
+        gqa, mha = self._build_pair()
+
+        inputs = flow.rand(
+            2,
+            5,
+            hidden_size,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=dist.get_layer_placement(0),
+        )
+        mask = flow.tril(flow.ones(5, 5)).expand(2, 1, 5, 5)
+        mask = mask.to_global(placement=inputs.placement, sbp=inputs.sbp)
+
+        gqa_output = gqa(inputs, attention_mask=mask)
+        mha_output = mha(inputs, attention_mask=mask)
+        self.assertTrue(np.allclose(dist.tton(gqa_output), dist.tton(mha_output), 1e-5, 1e-5))
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_grouped_query_attention_cache(self):
+        setup_cpu_dist()
+        gqa, mha = self._build_pair()
+
+        inputs = flow.rand(
+            2,
+            3,
+            hidden_size,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=dist.get_layer_placement(0),
+        )
+        gqa_output, gqa_cache = gqa(inputs, use_cache=True)
+        mha_output, mha_cache = mha(inputs, use_cache=True)
+        # kv cache only stores key/value heads
+        self.assertEqual(tuple(gqa_cache[0].shape), (2, num_kv_heads, 3, head_size))
+        self.assertEqual(tuple(mha_cache[0].shape), (2, num_heads, 3, head_size))
+
+        step = inputs[:, -1:]
+        gqa_output, _ = gqa(step, past_key_value=gqa_cache, use_cache=True)
+        mha_output, _ = mha(step, past_key_value=mha_cache, use_cache=True)
+        self.assertTrue(np.allclose(dist.tton(gqa_output), dist.tton(mha_output), 1e-5, 1e-5))
+
+    def _check_blockwise(self, attn_mask_type, dense_mask, blockwise_mask):
+        dense = MultiheadAttention(
+            hidden_size, num_heads, attn_mask_type=attn_mask_type, num_key_value_heads=num_kv_heads
+        )
+        blockwise = MultiheadAttention(
+            hidden_size,
+            num_heads,
+            attn_mask_type=attn_mask_type,
+            num_key_value_heads=num_kv_heads,
+            attention_block_size=3,
+        )
+        blockwise.load_state_dict(dense.state_dict())
+
+        inputs = flow.rand(
+            2,
+            7,
+            hidden_size,
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=dist.get_layer_placement(0),
+        )
+        dense_inputs = inputs.clone().requires_grad_()
+        blockwise_inputs = inputs.clone().requires_grad_()
+
+        dense_output = dense(dense_inputs, attention_mask=dense_mask)
+        blockwise_output = blockwise(blockwise_inputs, attention_mask=blockwise_mask)
+        self.assertTrue(
+            np.allclose(dist.tton(dense_output), dist.tton(blockwise_output), 1e-5, 1e-5)
+        )
+
+        dense_output.sum().backward()
+        blockwise_output.sum().backward()
+        self.assertTrue(
+            np.allclose(dist.tton(dense_inputs.grad), dist.tton(blockwise_inputs.grad), 1e-4, 1e-4)
+        )
+        self.assertTrue(
+            np.allclose(
+                dist.tton(dense.query_key_value.weight.grad),
+                dist.tton(blockwise.query_key_value.weight.grad),
+                1e-4,
+                1e-4,
+            )
+        )
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_blockwise_attention_padding(self):
+        setup_cpu_dist()
+        mask = flow.ones(2, 1, 7, 7)
+        mask[0, :, :, 5:] = 0
+        mask = mask.to_global(
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=dist.get_layer_placement(0),
+        )
+        self._check_blockwise(AttnMaskType.padding, mask, mask)
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_blockwise_attention_causal(self):
+        setup_cpu_dist()
+        mask = flow.tril(flow.ones(7, 7)).expand(2, 1, 7, 7)
+        mask = mask.to_global(
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            placement=dist.get_layer_placement(0),
+        )
+        # causal blocks are built on the fly when no mask is given
+        self._check_blockwise(AttnMaskType.causal, mask, None)
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_sliding_window_attention_mask(self):
+        setup_cpu_dist()
+        sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+        placement = dist.get_layer_placement(0)
+        query = flow.rand(2, num_heads, 7, head_size, sbp=sbp, placement=placement)
+        key = flow.rand(2, num_kv_heads, 7, head_size, sbp=sbp, placement=placement)
+        value = flow.rand(2, num_kv_heads, 7, head_size, sbp=sbp, placement=placement)
+        padding = flow.ones(2, 7)
+        padding[0, 5:] = 0
+        padding = padding.to_global(sbp=sbp, placement=placement)
+
+        mask = SlidingWindowAttentionMask(3, key_padding_mask=padding)
+        self.assertTrue(mask.is_block_empty(4, 6, 0, 2))
+        # blocks out of the window are skipped
+        sparse_output = blockwise_attention(query, key, value, attention_mask=mask, block_size=2)
+        dense_output = blockwise_attention(
+            query, key, value, attention_mask=mask.to_dense(7, 7, query), block_size=7
+        )
+        self.assertTrue(np.allclose(dist.tton(sparse_output), dist.tton(dense_output), 1e-5, 1e-5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+import oneflow.unittest
+
+from libai.layers import fused_lm_head_cross_entropy
+from libai.utils import distributed as dist
+from tests.fixtures.utils import setup_cpu_dist
+
+
+class TestFusedLMHeadCrossEntropy(flow.unittest.TestCase):
+    @flow.unittest.skip_unless_1n1d()
+    def test_fused_lm_head_cross_entropy(self):
+        setup_cpu_dist()
+        sbp = dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast])
+        placement = dist.get_layer_placement(0)
+        hidden_states = flow.randn(2, 7, 8, sbp=sbp, placement=placement)
+        weight = flow.randn(11, 8, sbp=sbp, placement=placement)
+        bias = flow.randn(11, sbp=sbp, placement=placement)
+        target = flow.randint(0, 11, (2, 7), sbp=sbp, placement=placement)
+        target[0, 5:] = -100
+
+        inputs = [t.clone().requires_grad_() for t in (hidden_states, weight, bias)]
+        logits = flow.matmul(inputs[0], inputs[1], transpose_b=True) + inputs[2]
+        expected = flow.nn.functional.cross_entropy(
+            logits.view(-1, 11), target.view(-1), ignore_index=-100, reduction="none"
+        ).view(2, 7)
+        expected.sum().backward()
+
+        fused_inputs = [t.clone().requires_grad_() for t in (hidden_states, weight, bias)]
+        # chunks of 3 positions, the last chunk is shorter
+        loss = fused_lm_head_cross_entropy(
+            fused_inputs[0], fused_inputs[1], target, bias=fused_inputs[2], chunk_size=3
+        )
+        loss.sum().backward()
+
+        self.assertTrue(np.allclose(dist.tton(loss), dist.tton(expected), 1e-5, 1e-5))
+        for fused_input, dense_input in zip(fused_inputs, inputs):
+            self.assertTrue(
+                np.allclose(dist.tton(fused_input.grad), dist.tton(dense_input.grad), 1e-4, 1e-4)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import numpy as np
+import oneflow as flow
+import oneflow.unittest
+
+from libai.layers import Linear, RotaryEmbedding, apply_rotary_pos_emb
+from libai.utils import distributed as dist
+from tests.fixtures.utils import setup_cpu_dist
+
+
+def _rotary_reference(x, positions, base=10000.0):
+    dim = x.shape[-1]
+    inv_freq = 1.0 / (base ** (np.arange(0, dim, 2) / dim))
+    freqs = np.outer(positions, inv_freq)
+    emb = np.concatenate([freqs, freqs], axis=-1)
+    rotated = np.concatenate([-x[..., dim // 2 :], x[..., : dim // 2]], axis=-1)
+    return x * np.cos(emb) + rotated * np.sin(emb)
+
+
+class TestRotaryEmbedding(flow.unittest.TestCase):
+    def _positions(self, start, end):
+        return flow._C.global_arange(
+            start=start,
+            end=end,
+            placement=dist.get_layer_placement(0),
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+            dtype=flow.long,
+        ).unsqueeze(0)
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_rotary_embedding(self):
+        setup_cpu_dist()
+        rotary = RotaryEmbedding(8, max_position_embeddings=4)
+        x = flow.rand(
+            2,
+            3,
+            5,
+            8,
+            placement=dist.get_layer_placement(0),
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        )
+        # positions of a decoding step with 2 cached tokens, longer than the initial table
+        cos, sin = rotary(self._positions(2, 7), seq_len=7)
+        self.assertGreaterEqual(rotary.cached_seq_len, 7)
+
+        output = apply_rotary_pos_emb(x, cos, sin)
+        expected = _rotary_reference(x.to_local().numpy(), np.arange(2, 7))
+        self.assertTrue(np.allclose(dist.tton(output), expected, 1e-5, 1e-5))
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_linear_scaling(self):
+        setup_cpu_dist()
+        rotary = RotaryEmbedding(8, scaling_type="linear", scaling_factor=2.0)
+        x = flow.rand(
+            1,
+            2,
+            4,
+            8,
+            placement=dist.get_layer_placement(0),
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        )
+        cos, sin = rotary(self._positions(0, 4), seq_len=4)
+        output = apply_rotary_pos_emb(x, cos, sin)
+        expected = _rotary_reference(x.to_local().numpy(), np.arange(4) / 2.0)
+        self.assertTrue(np.allclose(dist.tton(output), expected, 1e-5, 1e-5))
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_dynamic_scaling(self):
+        setup_cpu_dist()
+        rotary = RotaryEmbedding(8, max_position_embeddings=4, scaling_type="dynamic")
+        x = flow.rand(
+            1,
+            2,
+            6,
+            8,
+            placement=dist.get_layer_placement(0),
+            sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+        )
+        # the base is scaled for the length of the sequence, not of a larger table
+        cos, sin = rotary(self._positions(0, 6), seq_len=6)
+        self.assertEqual(rotary.cached_seq_len, 6)
+        output = apply_rotary_pos_emb(x, cos, sin)
+        base = 10000.0 * (6 / 4) ** (8 / 6)
+        expected = _rotary_reference(x.to_local().numpy(), np.arange(6), base=base)
+        self.assertTrue(np.allclose(dist.tton(output), expected, 1e-5, 1e-5))
+
+        rotary(self._positions(0, 3), seq_len=3)
+        self.assertEqual(rotary.cached_seq_len, 4)
+
+    def test_scaling_from_config(self):
+        self.assertEqual(RotaryEmbedding.scaling_from_config(None), (None, 1.0))
+        self.assertEqual(
+            RotaryEmbedding.scaling_from_config({"type": "linear", "factor": 2.0}), ("linear", 2.0)
+        )
+        self.assertEqual(
+            RotaryEmbedding.scaling_from_config({"rope_type": "dynamic", "factor": 4.0}),
+            ("dynamic", 4.0),
+        )
+        # unsupported types are not scaled
+        self.assertEqual(
+            RotaryEmbedding.scaling_from_config({"rope_type": "yarn", "factor": 4.0}), (None, 1.0)
+        )
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_drop_legacy_cache(self):
+        setup_cpu_dist()
+
+        class Model(flow.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.proj = Linear(8, 8)
+                self.rotary_emb = RotaryEmbedding(8, max_position_embeddings=4)
+
+            def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+                RotaryEmbedding.drop_legacy_cache(state_dict, prefix)
+                super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+        model = Model()
+        # the tables are not saved
+        state_dict = model.state_dict()
+        self.assertEqual(sorted(state_dict.keys()), ["proj.bias", "proj.weight"])
+
+        # an old checkpoint with the tables as persistent buffers of the model
+        state_dict["cos_cached"] = model.rotary_emb.cos_cached
+        state_dict["sin_cached"] = model.rotary_emb.sin_cached
+        incompatible = model.load_state_dict(state_dict, strict=False)
+        self.assertEqual(incompatible.unexpected_keys, [])
+        self.assertEqual(incompatible.missing_keys, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
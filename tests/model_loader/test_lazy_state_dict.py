@@ -0,0 +1,152 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import contextlib
+import functools
+import unittest
+
+import numpy as np
+import oneflow as flow
+
+from libai.models.utils.model_loader.base_loader import LazyStateDict, ModelLoaderHuggerFace
+
+
+class TestLazyStateDict(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.arrays = {
+            "layers.0.norm.gamma": rng.rand(4).astype(np.float32),
+            "layers.0.q_proj.weight": rng.rand(4, 4).astype(np.float32),
+            "layers.0.k_proj.weight": rng.rand(2, 4).astype(np.float32),
+            "layers.0.v_proj.weight": rng.rand(2, 4).astype(np.float32),
+            "layers.0.rotary_emb.inv_freq": rng.rand(2).astype(np.float32),
+        }
+        self.reads = collections.Counter()
+
+        def read(key):
+            self.reads[key] += 1
+            return self.arrays[key]
+
+        self.state_dict = LazyStateDict({key: functools.partial(read, key) for key in self.arrays})
+        for key in self.arrays:
+            self.state_dict.map_lazy(key, flow.Tensor)
+        self.loader = ModelLoaderHuggerFace(None, {}, "")
+
+    def _convert(self):
+        state_dict = self.loader._fix_key(self.state_dict)
+        self.loader._fuse_keys(
+            state_dict,
+            "layers.0.query_key_value.weight",
+            ["layers.0.q_proj.weight", "layers.0.k_proj.weight", "layers.0.v_proj.weight"],
+            functools.partial(
+                self.loader._concat_qkv,
+                head_size=2,
+                num_heads=2,
+                hidden_size=4,
+                num_key_value_heads=1,
+            ),
+        )
+        del state_dict["layers.0.rotary_emb.inv_freq"]
+        return state_dict
+
+    def _expected_qkv(self):
+        q, k, v = (
+            flow.Tensor(self.arrays["layers.0.{}_proj.weight".format(name)])
+            for name in ("q", "k", "v")
+        )
+        return self.loader._concat_qkv(
+            q, k, v, head_size=2, num_heads=2, hidden_size=4, num_key_value_heads=1
+        )
+
+    def test_convert_reads_every_tensor_once(self):
+        state_dict = self._convert()
+        # renaming, fusing and dropping entries read nothing
+        self.assertEqual(sum(self.reads.values()), 0)
+        self.assertEqual(
+            list(state_dict.keys()),
+            ["layers.0.norm.weight", "layers.0.query_key_value.weight"],
+        )
+
+        values = {key: state_dict[key] for key in state_dict.keys()}
+        self.assertEqual(
+            self.reads,
+            {
+                "layers.0.norm.gamma": 1,
+                "layers.0.q_proj.weight": 1,
+                "layers.0.k_proj.weight": 1,
+                "layers.0.v_proj.weight": 1,
+            },
+        )
+        self.assertTrue(
+            np.array_equal(
+                values["layers.0.norm.weight"].numpy(), self.arrays["layers.0.norm.gamma"]
+            )
+        )
+        self.assertTrue(
+            np.array_equal(
+                values["layers.0.query_key_value.weight"].numpy(), self._expected_qkv().numpy()
+            )
+        )
+
+    def test_prefetch_reads_every_tensor_once(self):
+        state_dict = self._convert()
+        keys = list(state_dict.keys())
+        state_dict.prefetch(keys, num_workers=2, max_in_flight=1)
+        for key in keys:
+            state_dict[key]
+        self.assertEqual(set(self.reads.values()), {1})
+        self.assertEqual(len(self.reads), 4)
+
+    def test_prefetch_bound(self):
+        keys = list(self.arrays.keys())
+        self.state_dict.prefetch(keys, num_workers=2, max_in_flight=2)
+        prefetcher = self.state_dict._prefetcher
+        self.assertEqual(list(prefetcher._in_flight), keys[:2])
+
+        # removed entries release their slots without being accessed
+        del self.state_dict[keys[0]]
+        self.state_dict.rename(keys[1], "renamed")
+        self.assertEqual(list(prefetcher._in_flight), keys[2:4])
+        self.state_dict.pop(keys[2])
+        self.assertEqual(list(prefetcher._in_flight), keys[3:5])
+        self.state_dict[keys[3]]
+        self.assertLessEqual(len(prefetcher._in_flight), 2)
+
+        self.state_dict.close()
+        self.assertEqual(len(prefetcher._in_flight), 0)
+        self.assertIsNone(self.state_dict._prefetcher)
+        self.assertTrue(all(count == 1 for count in self.reads.values() if count))
+
+    def test_close_files(self):
+        closed = []
+
+        @contextlib.contextmanager
+        def open_file(name):
+            yield name
+            closed.append(name)
+
+        self.assertEqual(self.state_dict.enter_context(open_file("shard-1")), "shard-1")
+        self.state_dict.enter_context(open_file("shard-2"))
+        state_dict = self._convert()
+        state_dict["layers.0.norm.weight"]
+        self.assertEqual(closed, [])
+        # the converted copy closes the files of the checkpoint once consumed
+        state_dict.close()
+        self.assertEqual(closed, ["shard-2", "shard-1"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from libai.models.utils.model_loader.weights_cache import weights_cache_key
+
+
+class TestWeightsCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, "cache")
+        self.model_file = os.path.join(self.tmp_dir, "pytorch_model.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def _write(self, content):
+        with open(self.model_file, "wb") as f:
+            f.write(content)
+
+    def _key(self):
+        return weights_cache_key([self.model_file], "Loader", {"hidden_size": 8}, self.cache_dir)
+
+    def test_rewritten_file_misses(self):
+        # larger than the chunks at both ends of the file
+        content = bytearray(20 << 20)
+        self._write(content)
+        key = self._key()
+        self.assertEqual(self._key(), key)
+
+        # same size, only the middle of the file changes
+        stat = os.stat(self.model_file)
+        content[10 << 20] = 1
+        self._write(content)
+        os.utime(self.model_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(os.path.getsize(self.model_file), stat.st_size)
+        self.assertNotEqual(self._key(), key)
+
+
+if __name__ == "__main__":
+    unittest.main()
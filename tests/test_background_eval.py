@@ -0,0 +1,82 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import tempfile
+import unittest
+
+from libai.engine.background_eval import (
+    TRAINING_DONE_FILE,
+    clear_stale_files,
+    committed_snapshots,
+    read_results,
+    remove_results,
+    snapshot_name,
+    write_results,
+)
+from libai.utils.sharded_checkpoint import SHARDED_CHECKPOINT_MANIFEST
+
+
+class TestBackgroundEval(unittest.TestCase):
+    def test_committed_snapshots(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            for iteration in (1999, 999, 2999):
+                os.makedirs(os.path.join(snapshot_dir, snapshot_name(iteration)))
+            # the snapshot of iteration 2999 is still being written
+            for iteration in (999, 1999):
+                path = os.path.join(snapshot_dir, snapshot_name(iteration))
+                open(os.path.join(path, SHARDED_CHECKPOINT_MANIFEST), "w").close()
+            os.makedirs(os.path.join(snapshot_dir, "model_best"))
+
+            self.assertEqual(
+                committed_snapshots(snapshot_dir),
+                [(999, "model_0000999"), (1999, "model_0001999")],
+            )
+
+    def test_results(self):
+        with tempfile.TemporaryDirectory() as results_dir:
+            write_results(results_dir, snapshot_name(1999), 1999, {"Acc@1": 0.5})
+            write_results(results_dir, snapshot_name(999), 999, {"Acc@1": 0.25})
+            self.assertEqual(
+                read_results(results_dir),
+                [
+                    ("model_0000999", 999, {"Acc@1": 0.25}),
+                    ("model_0001999", 1999, {"Acc@1": 0.5}),
+                ],
+            )
+            self.assertEqual(len(os.listdir(results_dir)), 2)
+
+            remove_results(results_dir, snapshot_name(999))
+            self.assertEqual(read_results(results_dir), [("model_0001999", 1999, {"Acc@1": 0.5})])
+
+    def test_clear_stale_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            snapshot_dir = os.path.join(tmp_dir, "snapshots")
+            results_dir = os.path.join(tmp_dir, "results")
+            path = os.path.join(snapshot_dir, snapshot_name(999))
+            os.makedirs(path)
+            open(os.path.join(path, SHARDED_CHECKPOINT_MANIFEST), "w").close()
+            os.makedirs(os.path.join(snapshot_dir, "model_best"))
+            open(os.path.join(snapshot_dir, TRAINING_DONE_FILE), "w").close()
+            write_results(results_dir, snapshot_name(999), 999, {"Acc@1": 0.25})
+
+            # the files of an earlier run are removed, the other ones are kept
+            clear_stale_files(snapshot_dir, results_dir)
+            self.assertEqual(os.listdir(snapshot_dir), ["model_best"])
+            self.assertEqual(os.listdir(results_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
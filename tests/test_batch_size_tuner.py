@@ -0,0 +1,65 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+from libai.engine.batch_size_tuner import BatchSizeTuner, is_out_of_memory
+
+
+class SimulatedTuner(BatchSizeTuner):
+    """Step times of a device running out of memory above 16 samples."""
+
+    def __init__(self, global_batch_size, data_parallel_size=1, **kwargs):
+        super().__init__(
+            None, None, None, None, None, global_batch_size, data_parallel_size, **kwargs
+        )
+        self.tried = []
+
+    def trial(self, micro_batch_size):
+        self.tried.append(micro_batch_size)
+        if micro_batch_size > 16:
+            return None
+        # a fixed overhead per step, so that larger micro-batches are faster until 8
+        seconds = 0.1 + 0.01 * micro_batch_size
+        if micro_batch_size == 16:
+            seconds *= 3
+        return seconds
+
+
+class TestBatchSizeTuner(unittest.TestCase):
+    def test_candidates(self):
+        tuner = SimulatedTuner(96, data_parallel_size=2, max_micro_batch_size=16)
+        self.assertEqual(tuner.candidates(), [1, 2, 3, 4, 6, 8, 12, 16])
+
+    def test_tune(self):
+        tuner = SimulatedTuner(128, data_parallel_size=2)
+        micro_batch_size, num_accumulation_steps, results = tuner.tune()
+        # 32 runs out of memory and ends the search, 16 is slower than 8
+        self.assertEqual(tuner.tried, [1, 2, 4, 8, 16, 32])
+        self.assertEqual((micro_batch_size, num_accumulation_steps), (8, 8))
+        self.assertIsNone(results[-1]["samples_per_second"])
+        self.assertAlmostEqual(results[0]["samples_per_second"], 2 / 0.11)
+
+    def test_out_of_memory(self):
+        tuner = SimulatedTuner(64)
+        tuner.trial = lambda micro_batch_size: None
+        with self.assertRaises(RuntimeError):
+            tuner.tune()
+        self.assertTrue(is_out_of_memory(RuntimeError("CUDA out of memory. Tried to allocate")))
+        self.assertFalse(is_out_of_memory(RuntimeError("shape mismatch")))
+
+
+if __name__ == "__main__":
+    unittest.main()
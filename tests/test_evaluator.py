@@ -0,0 +1,110 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import math
+import unittest
+
+import oneflow as flow
+import oneflow.unittest
+
+from libai.evaluation import BLEUEvaluator, ClsEvaluator, PPLEvaluator
+from libai.evaluation.bleu_evaluator import bleu_from_statistics, corpus_bleu_statistics
+from libai.evaluation.utils import valid_sample_mask
+from libai.utils import distributed as dist
+from tests.fixtures.utils import setup_cpu_dist
+
+
+def _to_global(x):
+    return x.to_global(
+        sbp=dist.get_nd_sbp([flow.sbp.split(0), flow.sbp.broadcast]),
+        placement=dist.get_layer_placement(0),
+    )
+
+
+class TestStreamingEvaluators(flow.unittest.TestCase):
+    @flow.unittest.skip_unless_1n1d()
+    def test_cls_evaluator(self):
+        setup_cpu_dist()
+        evaluator = ClsEvaluator(topk=(1, 2))
+        evaluator.reset()
+        logits = flow.tensor([[0.1, 0.7, 0.2], [0.5, 0.1, 0.4], [0.3, 0.2, 0.5], [0.9, 0.0, 0.1]])
+        labels = flow.tensor([1, 2, 1, 1])
+        # the last sample pads the batch
+        inputs = {"labels": _to_global(labels)}
+        outputs = {"prediction_scores": _to_global(logits)}
+        evaluator.process(inputs, outputs, valid_sample_mask(inputs["labels"], 3))
+        evaluator.process(inputs, outputs, valid_sample_mask(inputs["labels"], 4))
+
+        results = evaluator.evaluate()
+        # top-1: 1 correct of 3, then 1 of 4; top-2: 2 of 3, then 2 of 4
+        self.assertAlmostEqual(results["Acc@1"], 2 / 7 * 100)
+        self.assertAlmostEqual(results["Acc@2"], 4 / 7 * 100)
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_ppl_evaluator(self):
+        setup_cpu_dist()
+        evaluator = PPLEvaluator()
+        evaluator.reset()
+        valid = valid_sample_mask(_to_global(flow.zeros(2)), 2)
+        for loss in (1.0, 30.0):
+            evaluator.process({}, {"lm_loss": _to_global(flow.tensor([loss])).sum()}, valid)
+
+        results = evaluator.evaluate()
+        # the loss is clipped to 20
+        self.assertAlmostEqual(results["lm_loss_PPL"], (math.exp(1.0) + math.exp(20)) / 2)
+
+    def test_corpus_bleu(self):
+        hyp1 = "It is a guide to action which ensures that the military always obeys the commands of the party".split()  # noqa: E501
+        ref1a = "It is a guide to action that ensures that the military will forever heed Party commands".split()  # noqa: E501
+        ref1b = "It is the guiding principle which guarantees the military forces always being under the command of the Party".split()  # noqa: E501
+        ref1c = "It is the practical guide for the army always to heed the directions of the party".split()  # noqa: E501
+        hyp2 = "he read the book because he was interested in world history".split()
+        ref2a = "he was interested in world history because he read the book".split()
+
+        statistics = corpus_bleu_statistics([[ref1a, ref1b, ref1c]], [hyp1])
+        statistics += corpus_bleu_statistics([[ref2a]], [hyp2])
+        self.assertEqual(statistics.tolist(), [29, 29, 28, 19, 13, 8, 29, 27, 25, 23])
+        # nltk.translate.bleu_score.corpus_bleu([[ref1a, ref1b, ref1c], [ref2a]], [hyp1, hyp2])
+        self.assertEqual(bleu_from_statistics(statistics), 0.5920778868801042)
+        # no 4-gram match
+        statistics = corpus_bleu_statistics([[[1, 2, 3, 4]]], [[1, 2, 3, 5]])
+        self.assertAlmostEqual(bleu_from_statistics(statistics), 0.0)
+        self.assertEqual(bleu_from_statistics(corpus_bleu_statistics([[[1, 2]]], [[3]])), 0)
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_bleu_evaluator(self):
+        setup_cpu_dist()
+        evaluator = BLEUEvaluator(pad_token_id=0)
+        evaluator.reset()
+        candidate = flow.tensor([[1, 2, 3, 4, 0], [5, 6, 7, 0, 0], [1, 1, 1, 1, 1]])
+        # two references for the first sample, one for the second one
+        reference = flow.tensor(
+            [[[1, 2, 3, 4, 5], [1, 2, 3, 0, 0]], [[5, 6, 7, 8, 0], [0, 0, 0, 0, 0]], [[2] * 5] * 2]
+        )
+        # the last sample pads the batch
+        inputs = {"reference": _to_global(reference)}
+        outputs = {"candidate": _to_global(candidate)}
+        evaluator.process(inputs, outputs, valid_sample_mask(inputs["reference"], 2))
+
+        expected = bleu_from_statistics(
+            corpus_bleu_statistics(
+                [[[1, 2, 3, 4, 5], [1, 2, 3]], [[5, 6, 7, 8]]], [[1, 2, 3, 4], [5, 6, 7]]
+            )
+        )
+        self.assertEqual(evaluator.evaluate()["bleu_score"], expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
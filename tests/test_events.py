@@ -0,0 +1,114 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import types
+import unittest
+
+import numpy as np
+
+from libai.engine.hooks import PeriodicWriter
+from libai.utils.events import EventStorage, EventWriter, get_event_storage, use_event_storage
+
+
+class _FailingWriter(EventWriter):
+    async_safe = True
+
+    def __init__(self):
+        self.num_writes = 0
+
+    def write(self):
+        self.num_writes += 1
+        raise RuntimeError("write failed")
+
+
+class TestEventStorage(unittest.TestCase):
+    def test_snapshot(self):
+        storage = EventStorage()
+        for i in range(30):
+            storage.iter = i
+            storage.put_scalar("loss", float(i))
+            storage.put_scalar("lr", 0.1, smoothing_hint=False)
+        storage.put_image("image", np.zeros((3, 2, 2)))
+        storage._histograms.append({"tag": "weights"})
+
+        snapshot = storage.snapshot(window_size=10)
+        self.assertEqual(snapshot.iter, 29)
+        # the latest window of every scalar is kept
+        self.assertEqual([it for _, it in snapshot.history("loss").values()], list(range(20, 30)))
+        self.assertEqual(snapshot.latest(), storage.latest())
+        self.assertEqual(snapshot.smoothing_hints(), {"loss": True, "lr": False})
+        # the pending images and histograms are moved to the snapshot
+        self.assertEqual([name for name, _, _ in snapshot._vis_data], ["image"])
+        self.assertEqual(snapshot._histograms, [{"tag": "weights"}])
+        self.assertEqual(storage._vis_data, [])
+        self.assertEqual(storage._histograms, [])
+
+        # the snapshot does not follow the storage
+        storage.iter = 30
+        storage.put_scalar("loss", 30.0)
+        self.assertEqual(snapshot.history("loss").latest(), 29.0)
+
+    def test_use_event_storage(self):
+        with EventStorage() as storage:
+            snapshot = storage.snapshot()
+            entered, release = threading.Event(), threading.Event()
+            seen = {}
+
+            def read():
+                with use_event_storage(snapshot):
+                    seen["inside"] = get_event_storage()
+                    entered.set()
+                    release.wait()
+                seen["outside"] = get_event_storage()
+
+            thread = threading.Thread(target=read)
+            thread.start()
+            entered.wait()
+            # the snapshot is only used by the writer thread
+            self.assertIs(get_event_storage(), storage)
+            release.set()
+            thread.join()
+
+        self.assertIs(seen["inside"], snapshot)
+        self.assertIs(seen["outside"], storage)
+
+
+class TestPeriodicWriter(unittest.TestCase):
+    def _writer_hook(self, writer):
+        hook = PeriodicWriter([writer], period=1, async_write=True)
+        hook.trainer = types.SimpleNamespace(iter=0, max_iter=10, storage=EventStorage())
+        return hook
+
+    def test_async_write_error_after_step(self):
+        writer = _FailingWriter()
+        hook = self._writer_hook(writer)
+        hook.after_step()
+        # the error of the background write is raised by the next write
+        hook.trainer.iter = 1
+        with self.assertRaisesRegex(RuntimeError, "write failed"):
+            hook.after_step()
+        self.assertEqual(writer.num_writes, 1)
+        hook.after_train()
+
+    def test_async_write_error_after_train(self):
+        hook = self._writer_hook(_FailingWriter())
+        hook.after_step()
+        with self.assertRaisesRegex(RuntimeError, "write failed"):
+            hook.after_train()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import numpy as np
+
+from libai.utils.history_buffer import HistoryBuffer
+
+
+class TestHistoryBuffer(unittest.TestCase):
+    def test_windows(self):
+        max_length = 50
+        buffer = HistoryBuffer(max_length=max_length)
+        values = np.random.rand(137)
+        for i, value in enumerate(values):
+            buffer.update(value, i)
+            kept = values[max(0, i + 1 - max_length) : i + 1]
+            for window_size in (1, 7, 20, max_length, 2 * max_length):
+                self.assertAlmostEqual(buffer.avg(window_size), np.mean(kept[-window_size:]))
+                self.assertAlmostEqual(buffer.median(window_size), np.median(kept[-window_size:]))
+            self.assertEqual(buffer.latest(), value)
+
+        self.assertEqual([it for _, it in buffer.values()], list(range(87, 137)))
+        self.assertAlmostEqual(buffer.global_avg(), np.mean(values))
+
+    def test_non_finite_values(self):
+        buffer = HistoryBuffer(max_length=4)
+        for value in (1.0, float("inf"), 2.0, 3.0, 4.0, 5.0):
+            buffer.update(value)
+        # the inf is out of the window
+        self.assertEqual(buffer.avg(4), 3.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+
+import oneflow as flow
+import oneflow.unittest
+from oneflow import nn
+
+from libai.layers import LayerNorm, TransformerLayer, VocabEmbedding
+from libai.utils.memory import estimate_memory, transformer_layer_activation_bytes
+from tests.fixtures.utils import setup_cpu_dist
+
+hidden_size = 64
+num_heads = 4
+vocab_size = 100
+
+
+class TinyModel(nn.Module):
+    def __init__(self, num_layers=4):
+        super().__init__()
+        self.embeddings = VocabEmbedding(vocab_size, hidden_size)
+        self.layers = nn.ModuleList(
+            [
+                TransformerLayer(
+                    hidden_size,
+                    4 * hidden_size,
+                    num_heads,
+                    attention_dropout_prob=0.1,
+                    output_dropout_prob=0.1,
+                    layer_idx=i,
+                )
+                for i in range(num_layers)
+            ]
+        )
+        self.layernorm = LayerNorm(hidden_size, layer_idx=-1)
+
+
+class TestMemoryEstimate(flow.unittest.TestCase):
+    @flow.unittest.skip_unless_1n1d()
+    def test_transformer_layer_activations(self):
+        setup_cpu_dist()
+        layer = TransformerLayer(
+            hidden_size,
+            4 * hidden_size,
+            num_heads,
+            attention_dropout_prob=0.1,
+            output_dropout_prob=0.1,
+        )
+        s, b, h, a = 128, 2, hidden_size, num_heads
+        for t in (1, 2):
+            # sbh * (10 + 24 / t + 5as / (ht)) for fp16 activations
+            expected = s * b * h * (10 + 24 / t + 5 * a * s / (h * t))
+            self.assertAlmostEqual(
+                transformer_layer_activation_bytes(
+                    layer, b, s, bytes_per_element=2, tensor_parallel_size=t
+                ),
+                expected,
+            )
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_estimate_memory(self):
+        setup_cpu_dist()
+        model = TinyModel()
+        num_params = sum(p.numel() for p in model.parameters())
+        estimate = estimate_memory(model, 2, 32, pipeline_parallel_size=2)
+
+        self.assertEqual(
+            [layer["name"] for layer in estimate.layers],
+            ["embeddings", "layers.0", "layers.1", "layers.2", "layers.3", "head"],
+        )
+        self.assertEqual([layer["stage"] for layer in estimate.layers], [0, 0, 0, 1, 1, 1])
+        self.assertEqual(sum(layer["num_params"] for layer in estimate.layers), num_params)
+        self.assertEqual(estimate.layers[0]["num_params"], vocab_size * hidden_size)
+
+        stages = estimate.stages()
+        self.assertEqual(sum(stage["params"] for stage in stages), num_params * 4)
+        # AdamW keeps 2 states per parameter
+        self.assertEqual(sum(stage["optimizer_states"] for stage in stages), num_params * 8)
+
+        # the activations grow linearly with the micro-batch size
+        budget = estimate.total_bytes() * 2
+        largest = estimate.largest_micro_batch(budget)
+        self.assertGreaterEqual(largest, 2)
+        larger = estimate_memory(model, largest + 1, 32, pipeline_parallel_size=2)
+        self.assertGreater(larger.total_bytes(), budget)
+
+        # checkpointing keeps the inputs of the layers only
+        checkpointed = estimate_memory(
+            model, 2, 32, pipeline_parallel_size=2, activation_checkpoint=True
+        )
+        self.assertLess(checkpointed.total_bytes(), estimate.total_bytes())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import unittest
+import urllib.request
+
+from libai.utils.events import EventStorage
+from libai.utils.open_metrics import MetricsRegistry, OpenMetricsWriter
+
+
+def _scrape(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=10) as response:
+        return response.headers["Content-Type"], response.read().decode("utf-8")
+
+
+class TestOpenMetrics(unittest.TestCase):
+    def test_writer(self):
+        registry = MetricsRegistry()
+        writer = OpenMetricsWriter(
+            port=0, host="127.0.0.1", batch_size=8, tokens_per_sample=16, registry=registry
+        )
+        try:
+            with EventStorage() as storage:
+                for i in range(4):
+                    storage.iter = i
+                    storage.put_scalars(total_loss=1.0, time=0.5)
+                    storage.put_scalar("hook_time/PeriodicWriter", 0.01)
+                writer.write()
+            registry.observe("latency_seconds", 0.2, labels={"pipeline": "Test"}, buckets=(0.1, 1))
+            registry.observe("latency_seconds", 3.0, labels={"pipeline": "Test"}, buckets=(0.1, 1))
+
+            content_type, text = _scrape(writer.port)
+        finally:
+            writer.close()
+
+        self.assertTrue(content_type.startswith("application/openmetrics-text"))
+        lines = text.splitlines()
+        self.assertEqual(lines[-1], "# EOF")
+        self.assertIn("libai_train_iteration 3.0", lines)
+        self.assertIn("libai_train_total_loss 1.0", lines)
+        self.assertIn("libai_train_hook_time_PeriodicWriter 0.01", lines)
+        self.assertIn("libai_train_samples_per_second 16.0", lines)
+        self.assertIn("libai_train_tokens_per_second 256.0", lines)
+        self.assertIn("# TYPE latency_seconds histogram", lines)
+        self.assertIn('latency_seconds_bucket{pipeline="Test",le="0.1"} 0', lines)
+        self.assertIn('latency_seconds_bucket{pipeline="Test",le="1.0"} 1', lines)
+        self.assertIn('latency_seconds_bucket{pipeline="Test",le="+Inf"} 2', lines)
+        self.assertIn('latency_seconds_count{pipeline="Test"} 2', lines)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+
+import oneflow as flow
+from oneflow import nn
+
+from libai.utils.profiler import StepProfiler, StepProfileWriter, profile_phase
+
+
+class TestStepProfiler(unittest.TestCase):
+    def setUp(self):
+        self.model = nn.Sequential(nn.Linear(4, 4), nn.ReLU())
+        self.inputs = flow.randn(2, 4)
+
+    def _train(self, profiler, start_iter, max_iter):
+        profiler.activate(start_iter)
+        for iteration in range(start_iter, max_iter):
+            profiler.step(iteration)
+            with profile_phase("forward"):
+                self.model(self.inputs)
+        profiler.deactivate()
+
+    def test_chrome_trace_export(self):
+        profiler = StepProfiler(period=2, num_steps=1, warmup=1, model=self.model)
+        self._train(profiler, 0, 5)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            trace_file = os.path.join(tmp_dir, "trace.json")
+            StepProfileWriter(profiler, trace_file).write()
+            with open(trace_file) as f:
+                trace = json.load(f)
+
+        events = trace["traceEvents"]
+        # iterations 1 and 3 are recorded, with their phase and the forward of every module
+        self.assertEqual(
+            [event["args"]["iter"] for event in events if event["cat"] == "step"], [1, 3]
+        )
+        names = {(event["cat"], event["name"]) for event in events}
+        self.assertEqual(
+            names,
+            {
+                ("step", "step"),
+                ("phase", "forward"),
+                ("module", "Sequential"),
+                ("module", "0"),
+                ("module", "1"),
+            },
+        )
+        self.assertEqual(len(events), 2 * len(names))
+        for event in events:
+            self.assertEqual(event["ph"], "X")
+            self.assertGreaterEqual(event["dur"], 0)
+            self.assertEqual(event["tid"], {"step": 0, "phase": 1, "module": 2}[event["cat"]])
+
+        # the events of a step are within the step
+        steps = {e["args"]["iter"]: e for e in events if e["cat"] == "step"}
+        for event in events:
+            step = steps[event["args"]["iter"]]
+            self.assertGreaterEqual(event["ts"], step["ts"])
+            self.assertLessEqual(event["ts"] + event["dur"], step["ts"] + step["dur"] + 1e-3)
+
+    def test_hooks_removed(self):
+        profiler = StepProfiler(period=1, num_steps=1, warmup=0, model=self.model)
+        self._train(profiler, 0, 1)
+        self.assertEqual(profiler._hook_handles, [])
+        num_events = len(profiler.events())
+
+        # the forward out of the training is not recorded
+        profiler.recording = True
+        self.model(self.inputs)
+        profiler.recording = False
+        self.assertEqual(len(profiler.events()), num_events)
+
+        # activating again registers the hooks once
+        self._train(profiler, 1, 2)
+        modules = [e for e in profiler.events() if e[1] == "module" and e[2] == 1]
+        self.assertEqual(len(modules), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
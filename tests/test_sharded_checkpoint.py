@@ -0,0 +1,137 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import oneflow as flow
+import oneflow.unittest
+
+from libai.layers import Linear
+from libai.utils import distributed as dist
+from libai.utils.checkpoint import Checkpointer
+from libai.utils.sharded_checkpoint import (
+    SHARDED_CHECKPOINT_FORMAT,
+    SHARDED_CHECKPOINT_MANIFEST,
+    ShardedCheckpointReader,
+    TensorMeta,
+    is_sharded_checkpoint,
+    shard_file_name,
+    write_shard,
+)
+from tests.fixtures.utils import setup_cpu_dist
+
+
+class TestShardedCheckpoint(flow.unittest.TestCase):
+    @flow.unittest.skip_unless_1n1d()
+    def test_reshard_on_load(self):
+        setup_cpu_dist()
+        weight = np.random.randn(5, 3).astype(np.float32)
+        with tempfile.TemporaryDirectory() as save_dir:
+            # a checkpoint saved by 2 ranks with the weight split along dim 0, 3 + 2 rows
+            for rank, rows in enumerate([slice(0, 3), slice(3, 5)]):
+                meta = TensorMeta(
+                    (5, 3),
+                    "oneflow.float32",
+                    "cpu",
+                    [0, 1],
+                    ["oneflow.sbp.split(dim=0)"],
+                    (rank,),
+                    weight[rows].copy(),
+                )
+                state = {"model": {"weight": meta}}
+                if rank == 0:
+                    state["scheduler"] = {"last_step": 9}
+                with open(os.path.join(save_dir, shard_file_name(rank)), "wb") as f:
+                    write_shard(f, state)
+            with open(os.path.join(save_dir, SHARDED_CHECKPOINT_MANIFEST), "w") as f:
+                manifest = {
+                    "format": SHARDED_CHECKPOINT_FORMAT,
+                    "world_size": 2,
+                    "keys": ["model", "scheduler"],
+                    "shards": [shard_file_name(0), shard_file_name(1)],
+                }
+                json.dump(manifest, f)
+
+            reader = ShardedCheckpointReader(save_dir)
+            target = flow.zeros(
+                5,
+                3,
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+                placement=dist.get_layer_placement(0),
+            )
+            state_dict = reader.load("model", {"weight": target})
+            self.assertEqual(state_dict["weight"].sbp, target.sbp)
+            self.assertTrue(np.array_equal(dist.tton(state_dict["weight"]), weight))
+            self.assertEqual(reader.load("scheduler"), {"last_step": 9})
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_async_save(self):
+        setup_cpu_dist()
+        model = Linear(4, 3, layer_idx=0)
+        with tempfile.TemporaryDirectory() as root_dir:
+            checkpointer = Checkpointer(model, root_dir, async_save=True)
+            save_dir = os.path.join(root_dir, "model_best")
+            # the leftovers of a previous save to the same directory
+            os.makedirs(save_dir)
+            for stale_file in [SHARDED_CHECKPOINT_MANIFEST, shard_file_name(0) + ".done"]:
+                with open(os.path.join(save_dir, stale_file), "w") as f:
+                    f.write("{}")
+
+            checkpointer.save("model_best", iteration=9)
+            self.assertIsNotNone(checkpointer.pending_save)
+            state = checkpointer.wait()
+            self.assertTrue(state.done())
+            self.assertIsNone(state.error)
+            self.assertIsNone(checkpointer.pending_save)
+
+            # the manifest is committed once the shard is written, and the markers are removed
+            self.assertTrue(is_sharded_checkpoint(save_dir))
+            with open(os.path.join(save_dir, SHARDED_CHECKPOINT_MANIFEST)) as f:
+                manifest = json.load(f)
+            self.assertEqual(manifest["keys"], ["model"])
+            self.assertEqual(manifest["shards"], [shard_file_name(0)])
+            self.assertFalse(any(name.endswith(".done") for name in os.listdir(save_dir)))
+
+            restored = Linear(4, 3, layer_idx=0)
+            Checkpointer(restored).load(save_dir)
+            for key, value in model.state_dict().items():
+                self.assertTrue(
+                    np.array_equal(dist.tton(value), dist.tton(restored.state_dict()[key]))
+                )
+
+    @flow.unittest.skip_unless_1n1d()
+    def test_async_save_failure(self):
+        setup_cpu_dist()
+        with tempfile.TemporaryDirectory() as root_dir:
+            checkpointer = Checkpointer(Linear(4, 3, layer_idx=0), root_dir, async_save=True)
+            with mock.patch.object(
+                checkpointer, "_commit_manifest", side_effect=OSError("disk full")
+            ):
+                checkpointer.save("model_0000009")
+                state = checkpointer.wait()
+            # the error of the background commit is reported by `wait`
+            self.assertTrue(state.done())
+            self.assertIsInstance(state.error, OSError)
+            self.assertFalse(is_sharded_checkpoint(os.path.join(root_dir, "model_0000009")))
+            self.assertFalse(checkpointer.has_checkpoint())
+
+
+if __name__ == "__main__":
+    unittest.main()
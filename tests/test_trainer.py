@@ -14,16 +14,20 @@
 # limitations under the License.
 
 import sys
+import unittest
 
 import oneflow as flow
-from omegaconf import OmegaConf
+from omegaconf import DictConfig, OmegaConf
 from oneflow.utils.data import DataLoader, TensorDataset
 
 sys.path.append(".")
 from libai.config import LazyCall, default_argument_parser
 from libai.engine import DefaultTrainer, default_setup
+from libai.engine.trainer import HookBase, TrainerBase
 from libai.optim import get_default_optimizer_params
 from libai.scheduler import WarmupMultiStepLR
+from libai.utils import distributed as dist
+from tests.fixtures.utils import setup_cpu_dist
 from tests.layers.test_trainer_model import build_graph, build_model
 
 
@@ -128,6 +132,65 @@ class DemoTrainer(DefaultTrainer):
         return []
 
 
+class MetricsTrainer(TrainerBase):
+    """A trainer writing known metrics in every step, flushed every `metrics_flush_period`."""
+
+    def __init__(self, metrics_flush_period):
+        super().__init__()
+        self.cfg = DictConfig(dict(train=dict(global_batch_size=1)))
+        self.metrics_flush_period = metrics_flush_period
+        self.written = {}
+
+    def run_step(self):
+        metrics = {"lm_loss": 0.5 * self.iter, "aux_loss": 0.25, "acc": 0.1 * self.iter}
+        data_time = 0.01 * (self.iter + 1)
+        self.written[self.iter] = dict(metrics, data_time=data_time)
+        loss_dict = {
+            k: flow.tensor(
+                v,
+                sbp=dist.get_nd_sbp([flow.sbp.broadcast, flow.sbp.broadcast]),
+                placement=dist.get_layer_placement(0),
+            )
+            for k, v in metrics.items()
+        }
+        self.write_metrics(loss_dict, data_time)
+
+
+class FlushRecorder(HookBase):
+    """Record the latest iteration of `total_loss` in the storage after every step."""
+
+    def __init__(self):
+        self.latest_iters = []
+
+    def after_step(self):
+        self.latest_iters.append(self.trainer.storage.latest().get("total_loss", (None, None))[1])
+
+
+class TestTrainerMetrics(unittest.TestCase):
+    def setUp(self):
+        setup_cpu_dist()
+
+    def test_flush_metrics(self):
+        trainer = MetricsTrainer(metrics_flush_period=3)
+        recorder = FlushRecorder()
+        trainer.register_hooks([recorder])
+        trainer.train(0, 7)
+
+        # the metrics are written at the end of every period, and at the last iteration
+        self.assertEqual(recorder.latest_iters, [None, None, 2, 2, 2, 5, 6])
+        self.assertEqual(trainer._metrics_buffer, [])
+
+        # every iteration is written to the storage at its own iteration
+        storage = trainer.storage
+        for name in ("lm_loss", "aux_loss", "acc", "data_time"):
+            values = storage.history(name).values()
+            self.assertEqual([it for _, it in values], list(range(7)))
+            for value, it in values:
+                self.assertAlmostEqual(value, trainer.written[it][name], places=5)
+        for value, it in storage.history("total_loss").values():
+            self.assertAlmostEqual(value, 0.5 * it + 0.25, places=5)
+
+
 def main(args):
     cfg = setup(args)
 
@@ -0,0 +1,153 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Estimate the training memory per rank of a config, per layer and per pipeline stage,
+and the largest micro-batch size fitting in a memory budget, e.g.
+
+    python tools/estimate_memory.py --config-file configs/bert_large_pretrain.py \\
+        --budget-gb 32 train.dist.tensor_parallel_size=2
+
+The model is instantiated on cpu in a single process, with the parallel sizes of the
+config only used for the estimate, so the host needs the memory of the parameters.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+from omegaconf import DictConfig
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from libai.config import LazyConfig, instantiate, try_get_key  # noqa: E402
+from libai.utils import distributed as dist  # noqa: E402
+from libai.utils.logger import setup_logger  # noqa: E402
+from libai.utils.memory import MB, estimate_memory, get_optimizer_num_states  # noqa: E402
+
+logger = logging.getLogger("libai." + __name__)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Estimate the training memory of a config")
+    parser.add_argument("--config-file", required=True, metavar="FILE", help="path to config file")
+    parser.add_argument(
+        "--micro-batch-size",
+        type=int,
+        default=None,
+        help="defaults to train.train_micro_batch_size",
+    )
+    parser.add_argument(
+        "--seq-length",
+        type=int,
+        default=None,
+        help="defaults to the max_seq_length or max_position_embeddings of the model cfg",
+    )
+    parser.add_argument(
+        "--budget-gb", type=float, default=None, help="device memory to fit the micro-batch in"
+    )
+    parser.add_argument(
+        "--reserve-gb",
+        type=float,
+        default=1.0,
+        help="memory of the budget kept for the framework and the communication buffers",
+    )
+    parser.add_argument(
+        "opts",
+        default=None,
+        nargs=argparse.REMAINDER,
+        help="Modify config options at the end of the command, as in tools/train_net.py",
+    )
+    return parser.parse_args()
+
+
+def main(args):
+    setup_logger(name="libai")
+    cfg = LazyConfig.load(args.config_file)
+    cfg = LazyConfig.apply_overrides(cfg, args.opts)
+
+    micro_batch_size = args.micro_batch_size or cfg.train.train_micro_batch_size
+    seq_length = args.seq_length
+    for key in ("model.cfg.max_seq_length", "model.cfg.max_position_embeddings"):
+        seq_length = seq_length or try_get_key(cfg, key)
+    assert seq_length is not None, "could not find the sequence length, set --seq-length"
+
+    parallel = cfg.train.dist
+    pipeline_parallel_size = parallel.pipeline_parallel_size
+    zero_stage = 0
+    if try_get_key(cfg, "train.zero_optimization.enabled", default=False):
+        zero_stage = cfg.train.zero_optimization.stage
+
+    # instantiate the whole model in this process, the parallel sizes are only estimated
+    dist.setup_dist_util(
+        DictConfig(
+            dict(
+                data_parallel_size=1,
+                tensor_parallel_size=1,
+                pipeline_parallel_size=1,
+                device_type="cpu",
+            )
+        )
+    )
+    model = instantiate(cfg.model)
+
+    estimate = estimate_memory(
+        model,
+        micro_batch_size,
+        seq_length,
+        amp=try_get_key(cfg, "train.amp.enabled", default=False),
+        activation_checkpoint=try_get_key(
+            cfg, "train.activation_checkpoint.enabled", default=False
+        ),
+        optimizer_num_states=get_optimizer_num_states(
+            cfg.optim._target_, try_get_key(cfg, "optim.momentum", default=0.0)
+        ),
+        data_parallel_size=parallel.data_parallel_size,
+        tensor_parallel_size=parallel.tensor_parallel_size,
+        pipeline_parallel_size=pipeline_parallel_size,
+        pipeline_num_layers=try_get_key(parallel, "pipeline_num_layers"),
+        layer_stage_ids=try_get_key(parallel, "custom_pipeline_stage_id"),
+        num_accumulation_steps=try_get_key(cfg, "train.num_accumulation_steps") or 1,
+        zero_stage=zero_stage,
+    )
+    logger.info(
+        "Sequence length {}, parallel sizes (data, tensor, pipeline) {}, ZeRO stage {}\n{}".format(
+            seq_length,
+            (parallel.data_parallel_size, parallel.tensor_parallel_size, pipeline_parallel_size),
+            zero_stage,
+            estimate.format(),
+        )
+    )
+    logger.info("Estimated peak memory per rank: {:.1f} MB".format(estimate.total_bytes() / MB))
+
+    if args.budget_gb is not None:
+        budget = (args.budget_gb - args.reserve_gb) * 1024 * MB
+        largest = estimate.largest_micro_batch(budget)
+        if largest == 0:
+            logger.info(
+                "The parameters, gradients and optimizer states do not fit in {} GB".format(
+                    args.budget_gb
+                )
+            )
+        else:
+            logger.info(
+                "Largest micro-batch size fitting in {} GB ({} GB reserved): {}".format(
+                    args.budget_gb, args.reserve_gb, largest
+                )
+            )
+
+
+if __name__ == "__main__":
+    main(get_args())
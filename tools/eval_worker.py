@@ -0,0 +1,78 @@
+# coding=utf-8
+# Copyright 2021 The OneFlow Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Evaluate the snapshots of a training run with ``train.evaluation.background.enabled=True``
+while it trains, on devices or nodes it does not use, e.g.
+
+    CUDA_VISIBLE_DEVICES=7 python tools/eval_worker.py \\
+        --config-file configs/bert_large_pretrain.py train.dist.data_parallel_size=1
+
+with the config of the training run, whose parallel sizes can be overridden to fit the
+devices of the worker. ``train.output_dir`` must be on a filesystem shared with the training
+run. The worker exits once the training is done and all its snapshots are evaluated.
+"""
+
+import logging
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+from libai.config import LazyConfig, default_argument_parser, try_get_key  # noqa: E402
+from libai.engine import DefaultTrainer, default_setup  # noqa: E402
+from libai.engine.background_eval import BackgroundEvaluator  # noqa: E402
+from libai.evaluation import flatten_results_dict  # noqa: E402
+from libai.utils.checkpoint import Checkpointer  # noqa: E402
+
+logger = logging.getLogger("libai." + __name__)
+
+
+def main(args):
+    cfg = LazyConfig.load(args.config_file)
+    cfg = LazyConfig.apply_overrides(cfg, args.opts)
+    snapshot_dir, results_dir = DefaultTrainer.background_eval_dirs(cfg)
+    # keep the logs and the config of the worker apart from the ones of the training run
+    cfg.train.output_dir = os.path.join(cfg.train.output_dir, "eval_worker")
+    default_setup(cfg, args)
+
+    tokenizer = None
+    if try_get_key(cfg, "tokenization") is not None:
+        tokenizer = DefaultTrainer.build_tokenizer(cfg)
+    model = DefaultTrainer.build_model(cfg)
+    eval_model = model
+    if try_get_key(cfg, "graph.enabled", default=False):
+        eval_model = DefaultTrainer.build_graph(cfg, model, is_train=False)
+    test_loader = DefaultTrainer.build_test_loader(cfg, tokenizer)
+    assert len(test_loader) > 0, "No dataset in dataloader.test to evaluate the snapshots on"
+
+    def evaluate():
+        results = DefaultTrainer.test(cfg, test_loader, eval_model)
+        return {k: float(v) for k, v in flatten_results_dict(results).items()}
+
+    BackgroundEvaluator(
+        Checkpointer(model),
+        evaluate,
+        snapshot_dir,
+        results_dir,
+        poll_seconds=args.poll_seconds,
+    ).run()
+
+
+if __name__ == "__main__":
+    parser = default_argument_parser()
+    parser.add_argument(
+        "--poll-seconds", type=float, default=10, help="seconds between two checks for snapshots"
+    )
+    main(parser.parse_args())